@@ -1,9 +1,13 @@
 from datetime import datetime, timezone, timedelta
-from jose import jwt, JWTError
 from app.config import settings
 from app.utils import TokenExpiredException, IncorrectTokenFormatException
 
+# python-jose (с бэкендом cryptography) импортируется при первом обращении: это заметная доля
+# времени импорта приложения, а токены нужны только при обработке запросов
+
 def create_access_token(user: str) -> str:
+    from jose import jwt
+
     payload = {
         "sub": user,
         "exp": datetime.now(timezone.utc) + timedelta(minutes=settings.auth.ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -12,6 +16,8 @@ def create_access_token(user: str) -> str:
     return token
 
 def verify_access_token(token: str) -> dict:
+    from jose import jwt, JWTError
+
     try:
         data = jwt.decode(token, settings.auth.SECRET_KEY, algorithms=[settings.auth.ALGORITHM])
         return data
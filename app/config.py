@@ -1,6 +1,7 @@
 import os
 from decimal import Decimal
 from functools import lru_cache
+from typing import Optional
 from pydantic import BaseModel
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -13,8 +14,56 @@ class AppSettings(BaseModel):
     PORT: int = 8000
     DEBUG: bool = False
     MODE: str = "DEV"
+    # Число процессов uvicorn; для WORKERS > 1 consumer результатов запускается отдельно (app.consumer_main)
+    WORKERS: int = 1
+    # Запускать ли consumer результатов внутри процесса API (false — режим "только HTTP")
+    RESULTS_CONSUMER_ENABLED: bool = True
+    # Создание таблиц и сидинг при старте (защищены advisory-блокировкой PostgreSQL)
+    INIT_DB: bool = True
+    # Бюджет времени запуска (сек): при превышении в лог пишется предупреждение.
+    # Отчет о времени импорта модулей: python -m common.import_report app.main
+    STARTUP_BUDGET: float = 10.0
     MAX_REPLENISH_AMOUNT: Decimal = Decimal("50000.0")
     DEFAULT_REQUEST_COST: Decimal = Decimal("10.0")
+    MODEL_CACHE_TTL: int = 300
+    EVENTS_KEEPALIVE: int = 15
+    IDEMPOTENCY_TTL_HOURS: int = 24
+    PREDICTION_CACHE_SIZE: int = 1024
+    PREDICTION_CACHE_TTL: int = 3600
+    # Потоковые выгрузки: строк на одно чтение из курсора и размер отдаваемого куска (байт)
+    EXPORT_BATCH_SIZE: int = 1000
+    EXPORT_CHUNK_SIZE: int = 64 * 1024
+    # Фоновый сбор состояния для /health: период, минимальный интервал принудительного обновления, таймаут проверки
+    HEALTH_INTERVAL: float = 10.0
+    HEALTH_MIN_REFRESH: float = 1.0
+    HEALTH_CHECK_TIMEOUT: float = 5.0
+    # Контроль допуска: целевое время ожидания в очереди задач, предел глубины очереди
+    # (если скорость разбора еще неизвестна), лимит незавершенных запросов пользователя, Retry-After (сек)
+    QUEUE_SLA_SECONDS: float = 900.0
+    # Окно оценки пропускной способности воркеров очереди (учитываются только интервалы с непустой очередью)
+    ADMISSION_DRAIN_WINDOW: float = 300.0
+    ADMISSION_MAX_QUEUE_DEPTH: int = 10000
+    MAX_PENDING_PER_USER: int = 50
+    ADMISSION_RETRY_AFTER: int = 30
+    ADMISSION_MAX_RETRY_AFTER: int = 3600
+    # Блокировки средств (шарды) для параллельных запросов одного аккаунта:
+    # число шардов по умолчанию и максимум, срок действия, период возврата истекших на баланс
+    HOLD_SHARDS: int = 8
+    HOLD_MAX_SHARDS: int = 64
+    HOLD_TTL_SECONDS: int = 3600
+    HOLD_SETTLE_INTERVAL: float = 60.0
+    HOLD_SETTLE_BATCH_SIZE: int = 500
+    # Шарды строк агрегатов аналитики на интервал, модель и пользователя: параллельные запросы
+    # одного аккаунта обновляют разные строки (чтение суммирует шарды)
+    ROLLUP_SHARDS: int = 8
+    # Отставание границы пересчета агрегатов от текущего момента (сек): больше длительности
+    # транзакций записи, чтобы пересчет не затер приращения транзакций, начатых до границы
+    ROLLUP_REBUILD_SETTLE: int = 600
+    # Загрузка файлов с признаками: строк в одной задаче, предельный размер файла (байт),
+    # объем, до которого файл держится в памяти перед сбросом на диск (байт)
+    INGEST_CHUNK_ROWS: int = 100
+    INGEST_MAX_BYTES: int = 50 * 1024 * 1024
+    INGEST_SPOOL_MEMORY: int = 1024 * 1024
 
 
 class AuthSettings(BaseModel):
@@ -28,6 +77,33 @@ class AuthSettings(BaseModel):
 class LoggingSettings(BaseModel):
     LEVEL: str = "INFO"
     FORMAT: str = "JSON"
+    # Доля записываемых INFO/DEBUG-записей по префиксу логгера, например {"aio_pika": 0.1}
+    SAMPLING: dict[str, float] = {}
+    MAX_MESSAGE_LENGTH: int = 2000
+    QUEUE_SIZE: int = 10000
+
+
+class TracingSettings(BaseModel):
+    SERVICE_NAME: str = "ml-api"
+    # "file:/path/spans.jsonl", "otlp:http://collector:4318" или пусто (без экспорта)
+    EXPORTER: str = ""
+    # Доля записываемых трасс; решение наследуется воркерами через traceparent
+    SAMPLE_RATIO: float = 1.0
+    QUEUE_SIZE: int = 10000
+    # Максимальная длина SQL в спанах запросов к БД
+    MAX_STATEMENT_LENGTH: int = 500
+
+
+class MetricsSettings(BaseModel):
+    # Эндпоинт /internal/metrics и сбор метрик HTTP/БД
+    ENABLED: bool = True
+    LOOP_LAG_INTERVAL: float = 0.5
+    # Задержка event loop, при которой пишется предупреждение (сек)
+    LOOP_LAG_WARNING: float = 0.5
+    # Общий каталог снимков метрик процессов uvicorn (при APP__WORKERS > 1 опрос отдает их сумму)
+    MULTIPROCESS_DIR: Optional[str] = None
+    # Интервал записи снимка метрик процесса (сек)
+    SNAPSHOT_INTERVAL: float = 5.0
 
 
 class CORSSettings(BaseModel):
@@ -40,11 +116,20 @@ class DbSettings(BaseModel):
     USER: str = "pema"
     PASSWORD: str = "password"
     NAME: str = "ml_service"
-    ECHO: bool = True
+    # Полный URL подключения вместо HOST/PORT/USER/PASSWORD/NAME (например, SQLite для нагрузочного стенда)
+    URL: Optional[str] = None
+    ECHO: bool = False
     POOL_SIZE: int = 5
     MAX_OVERFLOW: int = 10
     POOL_RECYCLE: int = 3600
     POOL_PRE_PING: bool = True
+    # Помесячные партиции ml_request и transaction: на сколько месяцев вперед создавать,
+    # через сколько месяцев переводить в архив, табличное пространство архива (на сжатом хранилище)
+    # и период фонового обслуживания (сек)
+    PARTITION_MONTHS_AHEAD: int = 3
+    ARCHIVE_AFTER_MONTHS: int = 6
+    ARCHIVE_TABLESPACE: Optional[str] = None
+    PARTITION_MAINTENANCE_INTERVAL: float = 6 * 3600
 
     @property
     def url_psycopg(self) -> str:
@@ -56,14 +141,18 @@ class DbSettings(BaseModel):
 
     def get_engine_kwargs(self) -> dict:
         """Формирует параметры для создания движка SQLAlchemy."""
-        return {
-            "url": self.url_psycopg,
+        kwargs = {
+            "url": self.URL or self.url_psycopg,
             "echo": self.ECHO,
             "pool_size": self.POOL_SIZE,
             "max_overflow": self.MAX_OVERFLOW,
             "pool_recycle": self.POOL_RECYCLE,
             "pool_pre_ping": self.POOL_PRE_PING
         }
+        if kwargs["url"].startswith("sqlite"):
+            # Соединения пула используются из разных потоков (asyncio.to_thread), запись ждет блокировку файла
+            kwargs["connect_args"] = {"check_same_thread": False, "timeout": 30}
+        return kwargs
 
 
 class MQSettings(BaseModel):
@@ -80,6 +169,36 @@ class MQSettings(BaseModel):
     RESULTS_EXCHANGE_NAME: str = "ml_results_exchange"
     RESULTS_QUEUE_NAME: str = "ml_results_queue"
     RESULTS_ROUTING_KEY: str = "ml_results_queue"
+    # Пакетная обработка результатов (prefetch должен быть не меньше размера пачки)
+    RESULTS_PREFETCH_COUNT: int = 100
+    RESULTS_BATCH_SIZE: int = 50
+    RESULTS_BATCH_TIMEOUT: float = 0.2
+    # Число независимых consumer'ов (каждый со своим соединением и каналом) в app.consumer_main
+    RESULTS_CONSUMERS: int = 1
+    # Fanout-обменник для рассылки событий о статусах задач всем репликам API
+    EVENTS_EXCHANGE_NAME: str = "ml_events_exchange"
+    # Transactional outbox: размер пачки публикации и интервал опроса таблицы
+    OUTBOX_BATCH_SIZE: int = 100
+    OUTBOX_POLL_INTERVAL: float = 0.5
+    # Аренда задачи на время публикации (после сбоя relay задачу заберет другой) и предел попыток,
+    # после которого задача переносится в dead letter, а запрос завершается ошибкой с возвратом средств
+    OUTBOX_LEASE_SECONDS: float = 60.0
+    OUTBOX_MAX_ATTEMPTS: int = 10
+    # Топология публикации: соединений в пуле, каналов в пуле издателя,
+    # максимум публикаций, ожидающих подтверждения брокера
+    CONNECTION_POOL_SIZE: int = 2
+    CHANNEL_POOL_SIZE: int = 10
+    PUBLISH_CONFIRM_WINDOW: int = 256
+    # RPC: каналов в клиенте (вызовы распределяются по кругу) и ответы через amq.rabbitmq.reply-to
+    RPC_CHANNEL_POOL_SIZE: int = 4
+    RPC_DIRECT_REPLY_TO: bool = True
+    # Адаптивный дедлайн RPC: начальная оценка задержки на строку (сек), сглаживание,
+    # запас к ожидаемому времени и границы; дольше RPC_MAX_DEADLINE — перевод в фоновую очередь
+    RPC_ROW_LATENCY: float = 0.2
+    RPC_LATENCY_ALPHA: float = 0.2
+    RPC_DEADLINE_FACTOR: float = 2.0
+    RPC_MIN_DEADLINE: float = 5.0
+    RPC_MAX_DEADLINE: float = 30.0
     # Ретрай и соединение
     RETRY_ATTEMPTS: int = 3
     RETRY_MULTIPLIER: float = 0.5
@@ -108,6 +227,8 @@ class Settings(BaseSettings):
     auth: AuthSettings
     mq: MQSettings = MQSettings()
     logging: LoggingSettings = LoggingSettings()
+    tracing: TracingSettings = TracingSettings()
+    metrics: MetricsSettings = MetricsSettings()
     cors: CORSSettings = CORSSettings()
 
     model_config = SettingsConfigDict(
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import signal
+import sys
+
+from app.config import settings
+from app.database.database import engine
+from app.services.mq_consumer import ResultsConsumer
+from app.services.mq_publisher import create_connection_pool
+from app.services.task_events import TaskEventsBridge, task_events
+from app.utils import setup_logging, setup_tracing
+
+# Подключаем логирование
+setup_logging()
+setup_tracing(engine)
+logger = logging.getLogger(__name__)
+
+
+async def main() -> int:
+    """
+    Отдельный процесс сохранения результатов ML. Позволяет запускать API в несколько процессов
+    (APP__RESULTS_CONSUMER_ENABLED=false) и масштабировать прием результатов независимо.
+    """
+    loop = asyncio.get_running_loop()
+    # События о завершении задач уходят репликам API через мост (локальных подписчиков здесь нет)
+    task_events.bind_loop(loop)
+    connection_pool = create_connection_pool(max_size=1)
+    bridge = None
+    try:
+        bridge = TaskEventsBridge(connection_pool, task_events)
+        await bridge.start()
+    except Exception as e:
+        logger.warning(f"Task events bridge is not available, events will not reach API replicas: {e}")
+        bridge = None
+
+    consumers = [ResultsConsumer() for _ in range(settings.mq.RESULTS_CONSUMERS)]
+    logger.info(f"Старт consumer'ов результатов: {len(consumers)}")
+
+    async def stop() -> None:
+        for consumer in consumers:
+            await consumer.stop()
+
+    # Обработка сигналов для корректного завершения
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, lambda: asyncio.create_task(stop()))
+
+    try:
+        await asyncio.gather(*(consumer.run() for consumer in consumers))
+    except asyncio.CancelledError:
+        logger.info("Работа consumer'ов результатов прервана.")
+    except Exception as e:
+        logger.error(f"Критический сбой consumer'ов результатов: {e}")
+        return 1
+    finally:
+        if bridge:
+            await bridge.close()
+        await connection_pool.close()
+        logger.info("Consumer'ы результатов завершили работу.")
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(asyncio.run(main()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,143 @@
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+from sqlalchemy import and_, case, delete, func, insert, or_, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+from app.models import MLRequest, RequestRollup, RollupGranularity
+
+ROLLUP_COUNTERS = ("requests", "rows_scored", "revenue", "succeeded", "failed", "refunds", "queue_completed")
+ROLLUP_KEY = ("granularity", "bucket_start", "model_id", "user_id")
+# Уникальный ключ строки: интервал и шард
+ROLLUP_SHARD_KEY = ROLLUP_KEY + ("shard",)
+
+_UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def upsert_increments(session: Session, rows: List[Dict[str, Any]]) -> None:
+    """
+    Прибавить приращения счетчиков к строкам агрегатов одним INSERT ... ON CONFLICT DO UPDATE.
+    Каждый словарь содержит ключ интервала, шард и все счетчики. Строки сортируются по ключу,
+    чтобы параллельные транзакции блокировали их в одном порядке.
+    """
+    if not rows:
+        return
+    dialect_insert = _UPSERT_DIALECTS[session.get_bind().dialect.name]
+    stmt = dialect_insert(RequestRollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(ROLLUP_SHARD_KEY),
+        set_={name: getattr(RequestRollup, name) + getattr(stmt.excluded, name) for name in ROLLUP_COUNTERS},
+    )
+    session.execute(stmt, sorted(rows, key=lambda row: tuple(row[k] for k in ROLLUP_SHARD_KEY)))
+
+
+def get_buckets(
+    session: Session,
+    granularity: RollupGranularity,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user_id: Optional[int] = None,
+    group_by: Optional[str] = None,
+) -> List[Row]:
+    """
+    Суммы счетчиков по интервалам. group_by: "model", "user" или None (итог по интервалу).
+    """
+    group_columns = {
+        "model": [RequestRollup.model_id],
+        "user": [RequestRollup.user_id],
+        None: [],
+    }[group_by]
+    query = (
+        select(
+            RequestRollup.bucket_start,
+            *group_columns,
+            *(func.sum(getattr(RequestRollup, name)).label(name) for name in ROLLUP_COUNTERS),
+        )
+        .where(RequestRollup.granularity == granularity)
+        .group_by(RequestRollup.bucket_start, *group_columns)
+        .order_by(RequestRollup.bucket_start, *group_columns)
+    )
+    if since is not None:
+        query = query.where(RequestRollup.bucket_start >= since)
+    if until is not None:
+        query = query.where(RequestRollup.bucket_start < until)
+    if user_id is not None:
+        query = query.where(RequestRollup.user_id == user_id)
+    return list(session.execute(query).all())
+
+
+def get_totals(session: Session, user_id: Optional[int] = None) -> Row:
+    """Итоговые суммы счетчиков (по дневным агрегатам)."""
+    query = (
+        select(*(func.coalesce(func.sum(getattr(RequestRollup, name)), 0).label(name) for name in ROLLUP_COUNTERS))
+        .where(RequestRollup.granularity == RollupGranularity.day)
+    )
+    if user_id is not None:
+        query = query.where(RequestRollup.user_id == user_id)
+    return session.execute(query).one()
+
+
+def count_completed_since(session: Session, since: datetime) -> int:
+    """Количество запросов, завершенных воркерами очереди задач, в часовых агрегатах начиная с since."""
+    query = (
+        select(func.coalesce(func.sum(RequestRollup.queue_completed), 0))
+        .where(RequestRollup.granularity == RollupGranularity.hour, RequestRollup.bucket_start >= since)
+    )
+    return int(session.execute(query).scalar_one())
+
+
+def _input_rows(dialect: str):
+    """Число строк входных данных запроса, вычисленное СУБД (не список — одна строка)."""
+    json_type = func.json_typeof if dialect == "postgresql" else func.json_type
+    return case(
+        (json_type(MLRequest.input_data) == "array", func.json_array_length(MLRequest.input_data)),
+        else_=1,
+    )
+
+
+def iter_request_facts(session: Session, batch_size: int, until: Optional[datetime] = None) -> Iterator[Row]:
+    """
+    Построчно читает поля ML-запросов, нужные для пересчета агрегатов (входные данные не читаются,
+    вместо них — число строк rows). until ограничивает выборку запросами, созданными раньше.
+    """
+    query = select(
+        MLRequest.model_id,
+        MLRequest.user_id,
+        MLRequest.status,
+        MLRequest.cost,
+        _input_rows(session.get_bind().dialect.name).label("rows"),
+        MLRequest.created_at,
+        MLRequest.completed_at,
+        MLRequest.is_published,
+    ).execution_options(yield_per=batch_size)
+    if until is not None:
+        query = query.where(MLRequest.created_at < until)
+    yield from session.execute(query)
+
+
+def lock_for_rebuild(session: Session) -> None:
+    """
+    Заблокировать таблицу агрегатов от записи до конца транзакции (чтение не блокируется).
+    Инкременты живых транзакций ждут коммита пересчета, а уже начатые — пересчет ждет их коммита,
+    поэтому ни одно приращение не теряется и не учитывается дважды. В SQLite запись и так
+    сериализована блокировкой базы.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(text(f"LOCK TABLE {RequestRollup.__tablename__} IN EXCLUSIVE MODE"))
+
+
+def replace_all(session: Session, rows: List[Dict[str, Any]]) -> None:
+    """Полностью заменить содержимое таблицы агрегатов (строки без шарда пишутся в шард 0)."""
+    session.execute(delete(RequestRollup))
+    if rows:
+        session.execute(insert(RequestRollup), rows)
+
+
+def replace_before(session: Session, boundaries: Dict[RollupGranularity, datetime], rows: List[Dict[str, Any]]) -> None:
+    """Заменить строки агрегатов интервалов, начавшихся раньше границы своей гранулярности."""
+    session.execute(delete(RequestRollup).where(or_(*(
+        and_(RequestRollup.granularity == granularity, RequestRollup.bucket_start < boundary)
+        for granularity, boundary in boundaries.items()
+    ))))
+    if rows:
+        session.execute(insert(RequestRollup), rows)
@@ -1,8 +1,12 @@
+from datetime import datetime
 from decimal import Decimal
-from typing import List, Optional
-from sqlalchemy import select, update
+from typing import Any, Dict, List, Optional
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
-from app.models import Transaction, User, TransactionType, TransactionStatus
+from app.models import BalanceHold, MLRequest, Transaction, User, TransactionType, TransactionStatus
+
+_UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
 
 def create_transaction(session: Session, transaction: Transaction) -> Transaction:
     """Создать запись в журнале транзакций."""
@@ -46,6 +50,31 @@ def update_user_balance(session: Session, user_id: int, amount: Decimal) -> bool
     return result.rowcount > 0
 
 
+def bulk_credit_balances(session: Session, amounts: Dict[int, Decimal]) -> None:
+    """
+    Пакетное пополнение балансов: один UPDATE (executemany) на всех пользователей.
+    Пользователи обрабатываются по возрастанию id, чтобы избежать взаимных блокировок.
+    """
+    if not amounts:
+        return
+    user_table = User.__table__
+    stmt = (
+        update(user_table)
+        .where(user_table.c.id == bindparam("target_id"))
+        .values(balance=user_table.c.balance + bindparam("delta"))
+    )
+    session.connection().execute(
+        stmt,
+        [{"target_id": user_id, "delta": amounts[user_id]} for user_id in sorted(amounts)]
+    )
+
+
+def bulk_create_transaction_records(session: Session, records: List[Dict[str, Any]]) -> None:
+    """Пакетная вставка записей в журнал транзакций."""
+    if records:
+        session.execute(insert(Transaction), records)
+
+
 def create_transaction_record(
     session: Session,
     user_id: int,
@@ -53,7 +82,7 @@ def create_transaction_record(
     type: TransactionType,
     status: TransactionStatus,
     description: str,
-    ml_request_id: Optional[int] = None
+    ml_request: Optional[MLRequest] = None
 ) -> Transaction:
     transaction_record = Transaction(
         user_id=user_id,
@@ -61,8 +90,137 @@ def create_transaction_record(
         type=type,
         status=status,
         description=description,
-        ml_request_id=ml_request_id
+        ml_request_id=ml_request.id if ml_request else None,
+        ml_request_created_at=ml_request.created_at if ml_request else None,
     )
     session.add(transaction_record)
     session.flush()
     return transaction_record
+
+
+def add_to_holds(session: Session, user_id: int, amounts: Dict[int, Decimal], expires_at: datetime) -> None:
+    """Прибавить суммы к шардам блокировки пользователя (шард -> сумма) и продлить их срок."""
+    if not amounts:
+        return
+    dialect_insert = _UPSERT_DIALECTS[session.get_bind().dialect.name]
+    stmt = dialect_insert(BalanceHold)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "shard"],
+        set_={"amount": BalanceHold.amount + stmt.excluded.amount, "expires_at": stmt.excluded.expires_at},
+    )
+    session.execute(stmt, [
+        {"user_id": user_id, "shard": shard, "amount": amounts[shard], "expires_at": expires_at}
+        for shard in sorted(amounts)
+    ])
+
+
+def debit_hold(session: Session, user_id: int, amount: Decimal, now: datetime) -> bool:
+    """
+    Списать сумму из любого действующего шарда, в котором ее хватает.
+    Шард выбирается случайно среди незаблокированных (SKIP LOCKED): параллельные списания
+    одного пользователя не ждут друг друга. Возвращает False, если подходящего шарда нет.
+    """
+    hold_id = session.execute(
+        select(BalanceHold.id)
+        .where(BalanceHold.user_id == user_id, BalanceHold.amount >= amount, BalanceHold.expires_at > now)
+        .order_by(func.random())
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).scalar_one_or_none()
+    if hold_id is None:
+        return False
+    session.execute(
+        update(BalanceHold)
+        .where(BalanceHold.id == hold_id)
+        .values(amount=BalanceHold.amount - amount)
+        .execution_options(synchronize_session=False)
+    )
+    return True
+
+
+def debit_holds_split(session: Session, user_id: int, amount: Decimal, now: datetime) -> bool:
+    """
+    Списать сумму по частям из нескольких действующих шардов пользователя.
+    Медленный путь для случая, когда свободного шарда с достаточной суммой нет: шарды
+    блокируются с ожиданием (в порядке id, без взаимных блокировок), поэтому занятые
+    параллельными списаниями шарды тоже учитываются. Возвращает False, если суммы всех
+    шардов не хватает.
+    """
+    holds = session.execute(
+        select(BalanceHold.id, BalanceHold.amount)
+        .where(BalanceHold.user_id == user_id, BalanceHold.amount > 0, BalanceHold.expires_at > now)
+        .order_by(BalanceHold.id)
+        .with_for_update()
+    ).all()
+    if sum((hold.amount for hold in holds), Decimal("0.00")) < amount:
+        return False
+    remaining = amount
+    for hold in holds:
+        part = min(hold.amount, remaining)
+        session.execute(
+            update(BalanceHold)
+            .where(BalanceHold.id == hold.id)
+            .values(amount=BalanceHold.amount - part)
+            .execution_options(synchronize_session=False)
+        )
+        remaining -= part
+        if remaining <= 0:
+            break
+    return True
+
+
+def credit_hold(session: Session, user_id: int, amount: Decimal) -> bool:
+    """Вернуть сумму в случайный шард пользователя. Возвращает False, если шардов нет."""
+    hold_id = (
+        select(BalanceHold.id)
+        .where(BalanceHold.user_id == user_id)
+        .order_by(func.random())
+        .limit(1)
+        .scalar_subquery()
+    )
+    result = session.execute(
+        update(BalanceHold)
+        .where(BalanceHold.id == hold_id)
+        .values(amount=BalanceHold.amount + amount)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount > 0
+
+
+def users_with_holds(session: Session, user_ids: List[int]) -> set:
+    """Пользователи из списка, у которых есть шарды блокировки."""
+    query = select(BalanceHold.user_id).where(BalanceHold.user_id.in_(user_ids)).distinct()
+    return set(session.execute(query).scalars().all())
+
+
+def get_holds(session: Session, user_id: int) -> List[BalanceHold]:
+    """Шарды блокировки пользователя по номеру шарда."""
+    query = select(BalanceHold).where(BalanceHold.user_id == user_id).order_by(BalanceHold.shard)
+    return list(session.execute(query).scalars().all())
+
+
+def lock_holds(
+    session: Session,
+    user_id: Optional[int] = None,
+    expired_before: Optional[datetime] = None,
+    limit: Optional[int] = None,
+    skip_locked: bool = True,
+) -> List[BalanceHold]:
+    """
+    Заблокировать шарды для возврата на баланс: все шарды пользователя или истекшие.
+    При skip_locked шарды, занятые списаниями, пропускаются (фоновая сверка вернет их в следующий
+    раз); иначе — ожидается завершение списаний (возврат по запросу пользователя).
+    """
+    query = select(BalanceHold).order_by(BalanceHold.id).with_for_update(skip_locked=skip_locked)
+    if user_id is not None:
+        query = query.where(BalanceHold.user_id == user_id)
+    if expired_before is not None:
+        query = query.where(BalanceHold.expires_at <= expired_before)
+    if limit is not None:
+        query = query.limit(limit)
+    return list(session.execute(query).scalars().all())
+
+
+def delete_holds(session: Session, hold_ids: List[int]) -> None:
+    if hold_ids:
+        session.execute(delete(BalanceHold).where(BalanceHold.id.in_(hold_ids)))
@@ -0,0 +1,101 @@
+from typing import Callable, Iterator, Optional
+from sqlalchemy import Select, select
+from sqlalchemy.engine import RowMapping
+from sqlalchemy.orm import Session
+from app.models import IngestReject, MLModel, MLRequest, Transaction
+
+# Колонки выгрузок: только плоские значения, без загрузки ORM-объектов
+REQUEST_EXPORT_COLUMNS = (
+    "id", "user_id", "model", "model_version", "status", "cost",
+    "input_data", "prediction", "errors", "created_at", "completed_at",
+)
+TRANSACTION_EXPORT_COLUMNS = (
+    "id", "user_id", "amount", "type", "status", "description", "ml_request_id", "created_at",
+)
+
+
+def _stream(session_factory: Callable[[], Session], query: Select) -> Iterator[RowMapping]:
+    # Сессия живет столько же, сколько генератор: тело потокового ответа читается уже после
+    # возврата из обработчика, когда сессия запроса может быть закрыта
+    with session_factory() as session:
+        yield from session.execute(query).mappings()
+
+
+def iter_requests(
+    session_factory: Callable[[], Session],
+    batch_size: int,
+    user_id: Optional[int] = None,
+) -> Iterator[RowMapping]:
+    """
+    Построчно читает ML-запросы через серверный курсор (yield_per) в отдельной сессии:
+    в памяти одновременно находится не больше batch_size строк.
+    """
+    query = (
+        select(
+            MLRequest.id,
+            MLRequest.user_id,
+            MLModel.code_name.label("model"),
+            MLModel.version.label("model_version"),
+            MLRequest.status,
+            MLRequest.cost,
+            MLRequest.input_data,
+            MLRequest.prediction,
+            MLRequest.errors,
+            MLRequest.created_at,
+            MLRequest.completed_at,
+        )
+        .join(MLModel, MLModel.id == MLRequest.model_id)
+        .order_by(MLRequest.created_at.desc(), MLRequest.id.desc())
+        .execution_options(yield_per=batch_size)
+    )
+    if user_id is not None:
+        query = query.where(MLRequest.user_id == user_id)
+    return _stream(session_factory, query)
+
+
+def iter_transactions(
+    session_factory: Callable[[], Session],
+    batch_size: int,
+    user_id: Optional[int] = None,
+) -> Iterator[RowMapping]:
+    """Построчно читает транзакции через серверный курсор (yield_per)."""
+    query = (
+        select(*(getattr(Transaction, column) for column in TRANSACTION_EXPORT_COLUMNS))
+        .order_by(Transaction.created_at.desc(), Transaction.id.desc())
+        .execution_options(yield_per=batch_size)
+    )
+    if user_id is not None:
+        query = query.where(Transaction.user_id == user_id)
+    return _stream(session_factory, query)
+
+
+def iter_request_results(
+    session_factory: Callable[[], Session],
+    batch_size: int,
+    user_id: int,
+    request_id: Optional[int] = None,
+    ingest_job_id: Optional[int] = None,
+) -> Iterator[RowMapping]:
+    """Построчно читает входные данные и результаты запросов пользователя (одного запроса или загрузки)."""
+    query = (
+        select(MLRequest.id, MLRequest.status, MLRequest.input_data, MLRequest.prediction)
+        .where(MLRequest.user_id == user_id)
+        .order_by(MLRequest.id)
+        .execution_options(yield_per=batch_size)
+    )
+    if request_id is not None:
+        query = query.where(MLRequest.id == request_id)
+    if ingest_job_id is not None:
+        query = query.where(MLRequest.ingest_job_id == ingest_job_id)
+    return _stream(session_factory, query)
+
+
+def iter_rejects(session_factory: Callable[[], Session], batch_size: int, ingest_job_id: int) -> Iterator[RowMapping]:
+    """Построчно читает отклоненные строки загрузки в порядке строк файла."""
+    query = (
+        select(IngestReject.row_number.label("row"), IngestReject.errors, IngestReject.features)
+        .where(IngestReject.ingest_job_id == ingest_job_id)
+        .order_by(IngestReject.row_number)
+        .execution_options(yield_per=batch_size)
+    )
+    return _stream(session_factory, query)
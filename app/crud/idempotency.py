@@ -0,0 +1,62 @@
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session, joinedload
+from app.models import IdempotencyKey, IdempotencyScope, MLRequest
+
+
+def get_active_key(session: Session, user_id: int, key: str, now: datetime) -> Optional[IdempotencyKey]:
+    """Получить действующий (не истекший) ключ идемпотентности вместе с запросом."""
+    query = (
+        select(IdempotencyKey)
+        .options(joinedload(IdempotencyKey.ml_request))
+        .where(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.key == key,
+            IdempotencyKey.expires_at > now,
+        )
+    )
+    return session.execute(query).scalar_one_or_none()
+
+
+def delete_key(session: Session, user_id: int, key: str) -> None:
+    """Удалить ключ пользователя (например, истекший или по завершившемуся ошибкой запросу)."""
+    session.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+    )
+    session.flush()
+
+
+def create_key(
+    session: Session,
+    user_id: int,
+    key: str,
+    scope: IdempotencyScope,
+    ml_request: MLRequest,
+    expires_at: datetime,
+    payload_hash: Optional[str] = None,
+) -> IdempotencyKey:
+    """Создать запись ключ -> запрос (без коммита)."""
+    record = IdempotencyKey(
+        user_id=user_id,
+        key=key,
+        scope=scope,
+        ml_request_id=ml_request.id,
+        ml_request_created_at=ml_request.created_at,
+        expires_at=expires_at,
+        payload_hash=payload_hash,
+    )
+    session.add(record)
+    session.flush()
+    return record
+
+
+def delete_expired_key(session: Session, user_id: int, key: str, now: datetime) -> None:
+    """Удалить ключ пользователя, только если его срок действия истек."""
+    session.execute(
+        delete(IdempotencyKey).where(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.key == key,
+            IdempotencyKey.expires_at <= now,
+        )
+    )
@@ -0,0 +1,36 @@
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from app.models import IngestJob, IngestJobStatus, IngestReject
+
+
+def create_job(session: Session, user_id: int, filename: Optional[str], fmt: str) -> IngestJob:
+    """Создать запись загрузки файла (без коммита)."""
+    job = IngestJob(user_id=user_id, filename=filename, format=fmt, status=IngestJobStatus.processing)
+    session.add(job)
+    session.flush()
+    return job
+
+
+def get_job(session: Session, job_id: int, user_id: Optional[int] = None) -> Optional[IngestJob]:
+    """Загрузка по ID; если указан user_id, только принадлежащая пользователю."""
+    query = select(IngestJob).where(IngestJob.id == job_id)
+    if user_id is not None:
+        query = query.where(IngestJob.user_id == user_id)
+    return session.execute(query).scalars().first()
+
+
+def update_job(session: Session, job: IngestJob, **kwargs: Any) -> IngestJob:
+    """Обновить поля загрузки."""
+    for key, value in kwargs.items():
+        setattr(job, key, value)
+    session.flush()
+    return job
+
+
+def add_rejects(session: Session, rows: List[Dict[str, Any]]) -> None:
+    """Записать отклоненные строки одним INSERT (без коммита)."""
+    if rows:
+        session.execute(insert(IngestReject), rows)
@@ -1,6 +1,7 @@
+from datetime import datetime
 from decimal import Decimal
-from typing import List, Optional, Any
-from sqlalchemy import select
+from typing import List, Optional, Any, Dict
+from sqlalchemy import distinct, func, select, update, Row
 from sqlalchemy.orm import Session, joinedload
 from app.models import MLModel, MLRequest, MLRequestStatus
 
@@ -49,18 +50,61 @@ def update_request(session: Session, request_id: int, **kwargs: Any) -> Optional
         session.flush()
     return db_request
 
-def get_history(session: Session, user_id: int) -> List[MLRequest]:
-    """История всех запросов пользователя, с подгруженной моделью, по убыванию даты."""
+def lock_pending_requests(session: Session, request_ids: List[int]) -> List[Row]:
+    """
+    Блокирует (FOR UPDATE) ожидающие запросы из списка и возвращает их (id, user_id, model_id, cost).
+    Уже обработанные и несуществующие запросы в результат не попадают.
+    """
+    query = (
+        select(MLRequest.id, MLRequest.user_id, MLRequest.model_id, MLRequest.cost)
+        .where(MLRequest.id.in_(request_ids), MLRequest.status == MLRequestStatus.pending)
+        .order_by(MLRequest.id)
+        .with_for_update()
+    )
+    return list(session.execute(query).all())
+
+
+def bulk_update_requests(session: Session, rows: List[Dict[str, Any]]) -> None:
+    """Пакетное обновление ML-запросов по первичному ключу (каждый словарь содержит id)."""
+    if rows:
+        session.execute(update(MLRequest), rows)
+
+def count_pending_requests(session: Session, user_id: int) -> int:
+    """
+    Количество незавершенных запросов пользователя. Части одной загрузки файла считаются
+    одним запросом: загрузка допускается целиком и не упирается в лимит собственными частями.
+    """
+    query = (
+        select(
+            func.count(MLRequest.id).filter(MLRequest.ingest_job_id.is_(None))
+            + func.count(distinct(MLRequest.ingest_job_id))
+        )
+        .where(MLRequest.user_id == user_id, MLRequest.status == MLRequestStatus.pending)
+    )
+    return session.execute(query).scalar_one()
+
+def get_history(session: Session, user_id: int, since: Optional[datetime] = None) -> List[MLRequest]:
+    """
+    История запросов пользователя, с подгруженной моделью, по убыванию даты.
+    Фильтр since ограничивает чтение партициями последних месяцев.
+    """
     query = (
         select(MLRequest)
         .options(joinedload(MLRequest.ml_model))
         .where(MLRequest.user_id == user_id)
         .order_by(MLRequest.created_at.desc())
     )
+    if since is not None:
+        query = query.where(MLRequest.created_at >= since)
     result = session.execute(query)
     return list(result.scalars().all())
 
 
+def get_request_status(session: Session, request_id: int, user_id: int) -> Optional[MLRequestStatus]:
+    """Статус запроса пользователя без загрузки входных данных и результата (None, если запроса нет)."""
+    query = select(MLRequest.status).where(MLRequest.id == request_id, MLRequest.user_id == user_id)
+    return session.execute(query).scalar_one_or_none()
+
 def get_request_by_id(session: Session, request_id: int, user_id: Optional[int] = None) -> Optional[MLRequest]:
     """Получить запрос из истории, опционально проверяя принадлежность пользователю."""
     query = select(MLRequest).options(joinedload(MLRequest.ml_model)).where(MLRequest.id == request_id)
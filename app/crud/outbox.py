@@ -0,0 +1,110 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import Row, case, delete, or_, select, update
+from sqlalchemy.orm import Session
+from app.models import MLRequest, OutboxMessage
+from app.schemas.ml_task_schemas import MLTask
+
+
+def enqueue_task(
+    session: Session,
+    ml_request: MLRequest,
+    task: MLTask,
+    hold_until: Optional[datetime] = None,
+) -> OutboxMessage:
+    """
+    Записать задачу в outbox в текущей транзакции (без коммита).
+    С hold_until задача не публикуется до этого времени (как арендованная).
+    """
+    message = OutboxMessage(
+        ml_request_id=ml_request.id,
+        ml_request_created_at=ml_request.created_at,
+        payload=task.model_dump_json(),
+        claimed_until=hold_until,
+    )
+    session.add(message)
+    session.flush()
+    return message
+
+
+def claim_batch(session: Session, limit: int, now: datetime, lease_until: datetime) -> List[Row]:
+    """
+    Арендовать пачку неопубликованных задач до lease_until и вернуть их (id, ml_request_id, payload).
+    Блокировка строк держится только до коммита аренды; SKIP LOCKED позволяет нескольким
+    репликам API разбирать outbox параллельно. Задачи с истекшей арендой (relay упал
+    во время публикации) выбираются снова.
+    """
+    query = (
+        select(OutboxMessage.id, OutboxMessage.ml_request_id, OutboxMessage.payload)
+        .where(
+            OutboxMessage.dead_at.is_(None),
+            or_(OutboxMessage.claimed_until.is_(None), OutboxMessage.claimed_until < now),
+        )
+        .order_by(OutboxMessage.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    rows = list(session.execute(query).all())
+    if rows:
+        session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_([row.id for row in rows]))
+            .values(claimed_until=lease_until)
+            .execution_options(synchronize_session=False)
+        )
+    return rows
+
+
+def release(session: Session, ml_request_id: int) -> None:
+    """Снять отсрочку с задачи запроса: relay опубликует ее в ближайшем проходе."""
+    session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.ml_request_id == ml_request_id, OutboxMessage.dead_at.is_(None))
+        .values(claimed_until=None)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def discard(session: Session, ml_request_id: int) -> None:
+    """Удалить задачи запроса, который завершился без очереди."""
+    session.execute(delete(OutboxMessage).where(OutboxMessage.ml_request_id == ml_request_id))
+
+
+def complete(session: Session, message_ids: List[int], ml_request_ids: List[int]) -> None:
+    """Удалить опубликованные задачи и отметить запросы как опубликованные."""
+    if not message_ids:
+        return
+    session.execute(delete(OutboxMessage).where(OutboxMessage.id.in_(message_ids)))
+    session.execute(
+        update(MLRequest)
+        .where(MLRequest.id.in_(ml_request_ids))
+        .values(is_published=True)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def record_failures(session: Session, errors: Dict[int, str], max_attempts: int, now: datetime) -> List[int]:
+    """
+    Увеличить счетчик попыток для задач, которые не удалось опубликовать, и снять аренду.
+    Задачи, исчерпавшие max_attempts, помечаются dead_at и больше не выбираются.
+    Возвращает ml_request_id задач, перенесенных в dead letter.
+    """
+    if not errors:
+        return []
+    for message_id, error in errors.items():
+        session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id == message_id)
+            .values(
+                attempts=OutboxMessage.attempts + 1,
+                last_error=error[:500],
+                claimed_until=None,
+                dead_at=case((OutboxMessage.attempts + 1 >= max_attempts, now), else_=None),
+            )
+            .execution_options(synchronize_session=False)
+        )
+    query = select(OutboxMessage.ml_request_id).where(
+        OutboxMessage.id.in_(list(errors)),
+        OutboxMessage.dead_at.is_not(None),
+    )
+    return list(session.execute(query).scalars().all())
@@ -2,6 +2,7 @@ from app.database.database import (
     engine,
     session_maker,
     get_session,
+    get_session_factory,
     init_db,
     get_database_engine
 )
@@ -1,5 +1,7 @@
 import logging
-from typing import Generator
+from datetime import datetime, timezone
+from typing import Callable, Generator, Iterator
+from contextlib import contextmanager
 from sqlalchemy import create_engine, select, func
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, Session
@@ -7,6 +9,8 @@ from tenacity import retry, stop_after_attempt, wait_exponential
 
 from app.config import settings
 from app.models import Base, User
+from app.database.migrations import apply_migrations
+from app.database.partitions import ensure_partitions
 from app.database.seed import seed_db
 
 logger = logging.getLogger(__name__)
@@ -30,6 +34,34 @@ def get_session() -> Generator[Session, None, None]:
         yield session
 
 
+# Фабрика сессий для потоковых ответов: генератор ответа открывает свою сессию,
+# потому что сессия зависимости может быть закрыта до начала отправки тела
+def get_session_factory() -> Callable[[], Session]:
+    return session_maker
+
+
+# Ключ advisory-блокировки инициализации схемы и сидинга (общий для всех процессов API)
+INIT_DB_LOCK_KEY = 0x6D6C5F696E6974
+
+
+@contextmanager
+def init_db_lock() -> Iterator[None]:
+    """
+    Сериализует инициализацию БД между процессами: одновременно стартующие воркеры API
+    ждут, пока первый создаст таблицы и наполнит базу. Вне PostgreSQL блокировка не берется.
+    """
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    # AUTOCOMMIT: сессионная блокировка без открытой транзакции, которую ждал бы CREATE INDEX CONCURRENTLY
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(select(func.pg_advisory_lock(INIT_DB_LOCK_KEY)))
+        try:
+            yield
+        finally:
+            connection.execute(select(func.pg_advisory_unlock(INIT_DB_LOCK_KEY)))
+
+
 # Инциализация БД
 @retry(
     stop=stop_after_attempt(5),
@@ -38,20 +70,27 @@ def get_session() -> Generator[Session, None, None]:
 )
 def init_db(drop_all: bool = False) -> None:
     try:
-        if drop_all:
-            Base.metadata.drop_all(engine)
-        Base.metadata.create_all(engine)
-        logger.info("Таблицы базы данных успешно инициализированы.")
-
-        # Наполнение начальными данными
-        with session_maker() as session:
-            # Проверим, есть ли уже пользователи в базе
-            user_count = session.execute(select(func.count(User.id))).scalar()
-            if user_count == 0:
-                logger.info("База данных пуста. Запуск наполнения начальными данными (seed)...")
-                seed_db(session)
-            else:
-                logger.info(f"В базе уже есть данные ({user_count} пользователей). Пропуск сидинга.")
+        with init_db_lock():
+            if drop_all:
+                Base.metadata.drop_all(engine)
+            Base.metadata.create_all(engine)
+            # Изменения существующих таблиц (индексы и т.п.)
+            apply_migrations(engine)
+            if engine.dialect.name == "postgresql":
+                # Партиции текущего и ближайших месяцев нужны до первой вставки
+                with engine.begin() as connection:
+                    ensure_partitions(connection, datetime.now(timezone.utc).date(), settings.db.PARTITION_MONTHS_AHEAD)
+            logger.info("Таблицы базы данных успешно инициализированы.")
+
+            # Наполнение начальными данными
+            with session_maker() as session:
+                # Проверим, есть ли уже пользователи в базе
+                user_count = session.execute(select(func.count(User.id))).scalar()
+                if user_count == 0:
+                    logger.info("База данных пуста. Запуск наполнения начальными данными (seed)...")
+                    seed_db(session)
+                else:
+                    logger.info(f"В базе уже есть данные ({user_count} пользователей). Пропуск сидинга.")
 
     except Exception as e:
         logger.error(f"Ошибка при инициализации базы данных: {e}")
@@ -0,0 +1,305 @@
+"""
+Версионные миграции схемы.
+
+create_all создает только отсутствующие таблицы, поэтому изменения существующих таблиц
+(новые индексы и т.п.) оформляются миграциями. Примененные версии хранятся в таблице
+schema_migration; каждая миграция выполняется в отдельной транзакции. Миграции с
+transactional=False выполняются вне транзакции (AUTOCOMMIT): так строятся индексы на горячих
+таблицах (CREATE INDEX CONCURRENTLY в PostgreSQL), не блокируя запись. Инструкции пишутся
+идемпотентно (IF [NOT] EXISTS): на новой базе create_all уже создает схему последней версии,
+и миграции лишь фиксируются как примененные; прерванная нетранзакционная миграция при повторе
+продолжается с того места, где остановилась. Изменения, которые нельзя записать одной
+идемпотентной инструкцией для всех диалектов (новые столбцы, индексы), задаются функциями от соединения.
+
+Запуск вручную: python -m app.database.migrations [upgrade|status]
+"""
+import logging
+import sys
+from datetime import datetime, timezone
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, insert, select, text
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+
+Statement = Union[str, Callable[[Connection], None]]
+
+
+def shard_rollup_constraint(connection: Connection) -> None:
+    """
+    Заменяет уникальный ключ агрегатов на ключ с шардом. Только PostgreSQL: в SQLite
+    (тесты) таблицы создаются заново по текущей схеме, а ограничения не изменяются через ALTER.
+    """
+    if connection.dialect.name != "postgresql":
+        return
+    names = {c["name"] for c in inspect(connection).get_unique_constraints("request_rollup")}
+    if "uq_request_rollup_bucket" in names:
+        connection.execute(text("ALTER TABLE request_rollup DROP CONSTRAINT uq_request_rollup_bucket"))
+    if "uq_request_rollup_bucket_shard" not in names:
+        connection.execute(text(
+            "ALTER TABLE request_rollup ADD CONSTRAINT uq_request_rollup_bucket_shard "
+            "UNIQUE (granularity, bucket_start, model_id, user_id, shard)"
+        ))
+
+
+# Таблицы со ссылкой на ml_request и действие при удалении запроса
+REQUEST_REFERENCES = (("transaction", None), ("idempotency_key", "CASCADE"), ("outbox_message", "CASCADE"))
+
+
+def reference_partitioned_requests(connection: Connection) -> None:
+    """
+    Заполняет ml_request_created_at по запросу и, если ml_request партиционирована (PostgreSQL),
+    добавляет составные внешние ключи (ml_request_id, ml_request_created_at) -> ml_request (id, created_at).
+    """
+    from app.database.partitions import is_partitioned
+
+    for table, ondelete in REQUEST_REFERENCES:
+        connection.execute(text(
+            f'UPDATE "{table}" SET ml_request_created_at = '
+            f'(SELECT r.created_at FROM ml_request r WHERE r.id = "{table}".ml_request_id) '
+            "WHERE ml_request_id IS NOT NULL AND ml_request_created_at IS NULL"
+        ))
+    if connection.dialect.name != "postgresql" or not is_partitioned(connection, "ml_request"):
+        return
+    for table, ondelete in REQUEST_REFERENCES:
+        keys = [fk["constrained_columns"] for fk in inspect(connection).get_foreign_keys(table)]
+        if ["ml_request_id", "ml_request_created_at"] in keys:
+            continue
+        connection.execute(text(
+            f'ALTER TABLE "{table}" ADD FOREIGN KEY (ml_request_id, ml_request_created_at) '
+            "REFERENCES ml_request (id, created_at)" + (f" ON DELETE {ondelete}" if ondelete else "")
+        ))
+
+
+def partition_existing_tables(connection: Connection) -> None:
+    """
+    Переводит ml_request и transaction прежней схемы (обычные таблицы) в партиционированные.
+    Только PostgreSQL; на новой базе create_all уже создал партиционированные таблицы.
+    """
+    if connection.dialect.name != "postgresql":
+        return
+    from app.database.partitions import PARTITIONED_TABLES, partition_existing_table
+
+    today = datetime.now(timezone.utc).date()
+    for table in PARTITIONED_TABLES:
+        partition_existing_table(connection, table, today)
+
+
+def backfill_rollups(connection: Connection) -> None:
+    """Заполняет агрегаты аналитики по всей истории запросов."""
+    from sqlalchemy.orm import Session
+
+    from app.services.analytics_service import rebuild_rollups
+
+    with Session(bind=connection) as session:
+        rebuild_rollups(session)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    statements: Tuple[Statement, ...]
+    # False: инструкции выполняются вне транзакции (CREATE INDEX CONCURRENTLY)
+    transactional: bool = True
+
+
+def add_column(table: str, column: str, ddl: str) -> Callable[[Connection], None]:
+    """Добавляет столбец, если его нет (SQLite не поддерживает ADD COLUMN IF NOT EXISTS)."""
+    def apply(connection: Connection) -> None:
+        if column not in {c["name"] for c in inspect(connection).get_columns(table)}:
+            connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+    return apply
+
+
+def _index_state(connection: Connection, name: str) -> Optional[Tuple[str, bool]]:
+    """Определение индекса и признак готовности (False — недостроенный CONCURRENTLY) или None."""
+    if connection.dialect.name == "postgresql":
+        row = connection.execute(text(
+            "SELECT pg_get_indexdef(indexrelid), indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"
+        ), {"name": name}).first()
+    else:
+        row = connection.execute(text(
+            "SELECT sql, 1 FROM sqlite_master WHERE type = 'index' AND name = :name"
+        ), {"name": name}).first()
+    return (row[0] or "", bool(row[1])) if row else None
+
+
+def _drop_index(connection: Connection, name: str) -> None:
+    if connection.dialect.name != "postgresql":
+        connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        return
+    # Индекс партиционированной таблицы (relkind 'I') удаляется только без CONCURRENTLY
+    kind = connection.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"), {"name": name}).scalar()
+    concurrently = "" if kind == "I" else " CONCURRENTLY"
+    connection.execute(text(f"DROP INDEX{concurrently} IF EXISTS {name}"))
+
+
+def drop_index(name: str) -> Callable[[Connection], None]:
+    """Удаляет индекс (в PostgreSQL — DROP INDEX CONCURRENTLY, где это возможно)."""
+    def apply(connection: Connection) -> None:
+        _drop_index(connection, name)
+    return apply
+
+
+def create_index(name: str, table: str, columns: str, where: Optional[str] = None) -> Callable[[Connection], None]:
+    """
+    Создает индекс, не блокируя запись в таблицу (миграция должна быть transactional=False).
+    В PostgreSQL индекс строится CONCURRENTLY; для партиционированной таблицы — ON ONLY на
+    родителе, затем CONCURRENTLY на каждой партиции с ATTACH PARTITION (индекс родителя становится
+    действительным, когда присоединены все партиции). Индекс без условия where (старая схема)
+    пересоздается; существующий индекс с условием не трогается.
+    """
+    predicate = f" WHERE {where}" if where else ""
+
+    def apply(connection: Connection) -> None:
+        state = _index_state(connection, name)
+        if state is not None and where and "WHERE" not in state[0].upper():
+            _drop_index(connection, name)
+            state = None
+        if state is not None and state[1]:
+            return
+        if connection.dialect.name != "postgresql":
+            connection.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({columns}){predicate}'))
+            return
+
+        from app.database.partitions import is_partitioned, partitions_of
+
+        if not is_partitioned(connection, table):
+            if state is not None:
+                # Остаток прерванного CREATE INDEX CONCURRENTLY
+                _drop_index(connection, name)
+            connection.execute(text(f'CREATE INDEX CONCURRENTLY {name} ON "{table}" ({columns}){predicate}'))
+            return
+        connection.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON ONLY "{table}" ({columns}){predicate}'))
+        for partition in partitions_of(connection, table):
+            child = f"{name}_{partition}"[:63]
+            attached = connection.execute(text(
+                "SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(:child) AND inhparent = to_regclass(:name)"
+            ), {"child": child, "name": name}).first()
+            if attached:
+                continue
+            child_state = _index_state(connection, child)
+            if child_state is not None and not child_state[1]:
+                _drop_index(connection, child)
+                child_state = None
+            if child_state is None:
+                connection.execute(text(
+                    f'CREATE INDEX CONCURRENTLY {child} ON "{partition}" ({columns}){predicate}'
+                ))
+            connection.execute(text(f"ALTER INDEX {name} ATTACH PARTITION {child}"))
+    return apply
+
+
+MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(1, "hot_query_indexes", (
+        # История пользователя: user_id + created_at (обратный проход индекса дает сортировку DESC)
+        create_index("ix_ml_request_user_id_created_at", "ml_request", "user_id, created_at"),
+        drop_index("ix_ml_request_user_id"),
+        # Незавершенные запросы пользователя (контроль допуска)
+        create_index("ix_ml_request_pending_user_id", "ml_request", "user_id", where="status = 'pending'"),
+        create_index("ix_transaction_user_id_created_at", "transaction", "user_id, created_at"),
+        drop_index("ix_transaction_user_id"),
+        # Списания по запросам: пополнения (ml_request_id IS NULL) в индекс не попадают
+        create_index("ix_transaction_ml_request_id", "transaction", "ml_request_id", where="ml_request_id IS NOT NULL"),
+    ), transactional=False),
+    Migration(2, "idempotency_payload_hash", (
+        # Ключи, созданные до миграции, остаются без хеша и сверяются только по типу запроса
+        add_column("idempotency_key", "payload_hash", "VARCHAR"),
+    )),
+    Migration(3, "outbox_lease_and_dead_letter", (
+        add_column("outbox_message", "claimed_until", "TIMESTAMP"),
+        add_column("outbox_message", "dead_at", "TIMESTAMP"),
+    )),
+    Migration(4, "rollup_queue_completed", (
+        add_column("request_rollup", "queue_completed", "INTEGER NOT NULL DEFAULT 0"),
+    )),
+    Migration(5, "shard_request_rollups", (
+        add_column("request_rollup", "shard", "INTEGER NOT NULL DEFAULT 0"),
+        shard_rollup_constraint,
+    )),
+    Migration(6, "backfill_request_rollups", (
+        # Статистика читается только из агрегатов: история до их появления заполняется один раз
+        backfill_rollups,
+    )),
+    Migration(7, "ml_request_partition_references", (
+        *(add_column(table, "ml_request_created_at", "TIMESTAMP") for table, _ in REQUEST_REFERENCES),
+        reference_partitioned_requests,
+    )),
+    Migration(8, "partition_existing_tables", (
+        # Ссылки на ml_request по одному id снимаются при переводе и заменяются составными
+        partition_existing_tables,
+        reference_partitioned_requests,
+    )),
+)
+
+_metadata = MetaData()
+schema_migration = Table(
+    "schema_migration",
+    _metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime(timezone=True), nullable=False),
+)
+
+
+def applied_versions(engine: Engine) -> List[int]:
+    with engine.begin() as connection:
+        schema_migration.create(connection, checkfirst=True)
+        return list(connection.execute(select(schema_migration.c.version)).scalars().all())
+
+
+def _execute(connection: Connection, statements: Sequence[Statement]) -> None:
+    for statement in statements:
+        if callable(statement):
+            statement(connection)
+        else:
+            connection.execute(text(statement))
+
+
+def apply_migrations(engine: Engine, migrations: Sequence[Migration] = MIGRATIONS) -> List[int]:
+    """Применяет неприменённые миграции по порядку версий. Возвращает примененные версии."""
+    done = set(applied_versions(engine))
+    applied: List[int] = []
+    for migration in sorted(migrations, key=lambda m: m.version):
+        if migration.version in done:
+            continue
+        if not migration.transactional:
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                _execute(connection, migration.statements)
+        with engine.begin() as connection:
+            if migration.transactional:
+                _execute(connection, migration.statements)
+            connection.execute(insert(schema_migration).values(
+                version=migration.version,
+                name=migration.name,
+                applied_at=datetime.now(timezone.utc),
+            ))
+        logger.info(f"Применена миграция {migration.version:04d}_{migration.name}")
+        applied.append(migration.version)
+    return applied
+
+
+def main(argv: List[str]) -> int:
+    from app.database.database import engine, init_db_lock
+
+    command = argv[0] if argv else "upgrade"
+    if command == "status":
+        done = set(applied_versions(engine))
+        for migration in MIGRATIONS:
+            mark = "x" if migration.version in done else " "
+            print(f"[{mark}] {migration.version:04d}_{migration.name}")
+        return 0
+    if command == "upgrade":
+        with init_db_lock():
+            applied = apply_migrations(engine)
+        print(f"Применено миграций: {len(applied)}")
+        return 0
+    print("Использование: python -m app.database.migrations [upgrade|status]", file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
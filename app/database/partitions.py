@@ -0,0 +1,197 @@
+"""
+Помесячные партиции ml_request и transaction (только PostgreSQL).
+
+Родительские таблицы создаются с PARTITION BY RANGE (created_at), партиции на ближайшие месяцы
+создаются заранее, а строки вне созданных диапазонов попадают в DEFAULT-партицию. Старые партиции
+архивируются: замораживаются (VACUUM FREEZE), исключаются из автовакуума и при необходимости
+переносятся в отдельное табличное пространство на сжатом хранилище. Из родительской таблицы
+они остаются доступны для чтения истории.
+
+Обычные таблицы прежней схемы переводятся миграцией (см. partition_existing_table): старая таблица
+становится исторической партицией новой родительской таблицы, поэтому данные не копируются.
+"""
+import logging
+import re
+from datetime import date
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLES = ("ml_request", "transaction")
+
+# Ключ advisory-блокировки обслуживания партиций (одна реплика API за раз)
+PARTITION_LOCK_KEY = 0x6D6C5F70617274
+
+# Суффикс исторической партиции, которой становится прежняя обычная таблица
+HISTORY_PARTITION_SUFFIX = "_p0000_history"
+
+
+def month_start(day: date, offset: int = 0) -> date:
+    """Первое число месяца, отстоящего от месяца day на offset месяцев."""
+    index = day.year * 12 + day.month - 1 + offset
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+def is_partitioned(connection: Connection, table: str) -> bool:
+    """Партиционирована ли таблица (обычные таблицы прежней схемы переводит миграция partition_existing_tables)."""
+    query = text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)")
+    return connection.execute(query, {"table": f'"{table}"'}).first() is not None
+
+
+def partitions_of(connection: Connection, table: str) -> List[str]:
+    """Имена партиций таблицы (включая DEFAULT)."""
+    query = text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname"
+    )
+    return list(connection.execute(query, {"table": f'"{table}"'}).scalars().all())
+
+
+def _create_partitions(connection: Connection, table: str, today: date, months_ahead: int) -> List[str]:
+    connection.execute(text(f'CREATE TABLE IF NOT EXISTS "{table}_default" PARTITION OF "{table}" DEFAULT'))
+    created: List[str] = []
+    for offset in range(months_ahead + 1):
+        start, end = month_start(today, offset), month_start(today, offset + 1)
+        name = partition_name(table, start)
+        if connection.execute(text("SELECT to_regclass(:name)"), {"name": f'"{name}"'}).scalar() is not None:
+            continue
+        connection.execute(text(
+            f'CREATE TABLE "{name}" PARTITION OF "{table}" '
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        ))
+        created.append(name)
+    return created
+
+
+def ensure_partitions(connection: Connection, today: date, months_ahead: int) -> List[str]:
+    """
+    Создает DEFAULT-партицию и партиции с текущего месяца на months_ahead месяцев вперед.
+    Возвращает имена созданных партиций. Непартиционированная таблица (миграции не применены)
+    — ошибка запуска: без партиций новые строки не попадут в помесячное хранение и архив.
+    """
+    created: List[str] = []
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(connection, table):
+            raise RuntimeError(
+                f"Таблица {table} не партиционирована: примените миграции (python -m app.database.migrations)"
+            )
+        created.extend(_create_partitions(connection, table, today, months_ahead))
+    if created:
+        logger.info(f"Созданы партиции: {', '.join(created)}")
+    return created
+
+
+def partition_existing_table(connection: Connection, table: str, today: date) -> bool:
+    """
+    Переводит обычную таблицу прежней схемы в партиционированную под исключительной блокировкой
+    (в транзакции миграции). Таблица переименовывается и присоединяется к новой родительской таблице
+    как историческая партиция FROM (MINVALUE) TO (начало текущего месяца); в партицию текущего месяца
+    переносятся только его строки. Родительская таблица получает столбцы, индексы и внешние ключи
+    прежней; внешние ключи на таблицу по одному id снимаются (составные добавляет миграция).
+    Возвращает False, если таблица уже партиционирована.
+    """
+    if is_partitioned(connection, table):
+        return False
+    history = f"{table}{HISTORY_PARTITION_SUFFIX}"
+    bound = month_start(today)
+    params = {"table": f'"{table}"'}
+    connection.execute(text(f'LOCK TABLE "{table}" IN ACCESS EXCLUSIVE MODE'))
+
+    references = connection.execute(text(
+        "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+        "WHERE contype = 'f' AND confrelid = to_regclass(:table)"
+    ), params).all()
+    for referencing, name in references:
+        connection.execute(text(f'ALTER TABLE {referencing} DROP CONSTRAINT "{name}"'))
+    # Уникальные индексы без ключа партиции на родительской таблице невозможны и остаются у партиции
+    indexes = connection.execute(text(
+        "SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE i.indrelid = to_regclass(:table) AND NOT i.indisunique"
+    ), params).all()
+    foreign_keys = connection.execute(text(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE contype = 'f' AND conrelid = to_regclass(:table)"
+    ), params).all()
+    sequence = connection.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), params).scalar()
+
+    connection.execute(text(f'ALTER TABLE "{table}" RENAME TO "{history}"'))
+    for name, _ in indexes:
+        connection.execute(text(f'ALTER INDEX "{name}" RENAME TO "{f"{name}_{history}"[:63]}"'))
+    connection.execute(text(
+        f'CREATE TABLE "{table}" (LIKE "{history}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        "PARTITION BY RANGE (created_at)"
+    ))
+    connection.execute(text(f'ALTER TABLE "{table}" ADD CONSTRAINT "uq_{table}_id_created_at" UNIQUE (id, created_at)'))
+    for _, definition in indexes:
+        connection.execute(text(re.sub(r" ON \S+ USING ", f' ON "{table}" USING ', definition, count=1)))
+    for name, definition in foreign_keys:
+        connection.execute(text(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {definition}'))
+    if sequence:
+        connection.execute(text(f'ALTER SEQUENCE {sequence} OWNED BY "{table}".id'))
+
+    _create_partitions(connection, table, today, 0)
+    connection.execute(text(f'INSERT INTO "{table}" SELECT * FROM "{history}" WHERE created_at >= :bound'), {"bound": bound})
+    connection.execute(text(f'DELETE FROM "{history}" WHERE created_at >= :bound'), {"bound": bound})
+    connection.execute(text(
+        f'ALTER TABLE "{table}" ATTACH PARTITION "{history}" '
+        f"FOR VALUES FROM (MINVALUE) TO ('{bound.isoformat()}')"
+    ))
+    logger.info(f"Таблица {table} переведена на партиционирование, история — в партиции {history}")
+    return True
+
+
+def _partitions_to_archive(connection: Connection, table: str, before: date) -> List[str]:
+    """Месячные партиции таблицы старше before, еще не переведенные в архив."""
+    query = text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table) "
+        "AND NOT coalesce('autovacuum_enabled=false' = ANY(c.reloptions), false) "
+        "ORDER BY c.relname"
+    )
+    names = connection.execute(query, {"table": f'"{table}"'}).scalars().all()
+    prefix = f"{table}_p"
+    return [
+        name for name in names
+        if name.startswith(prefix) and name < partition_name(table, before)
+    ]
+
+
+def archive_partitions(
+    connection: Connection,
+    today: date,
+    after_months: int,
+    tablespace: Optional[str] = None,
+) -> List[str]:
+    """
+    Переводит в архив партиции старше after_months месяцев. VACUUM не выполняется внутри
+    транзакции, поэтому соединение должно работать в режиме AUTOCOMMIT.
+    Возвращает имена заархивированных партиций.
+    """
+    before = month_start(today, -after_months)
+    archived: List[str] = []
+    for table in PARTITIONED_TABLES:
+        for name in _partitions_to_archive(connection, table, before):
+            # Заморозка: по неизменяемой партиции больше не нужны проходы вакуума
+            connection.execute(text(f'VACUUM (FREEZE, ANALYZE) "{name}"'))
+            if tablespace:
+                connection.execute(text(f'ALTER TABLE "{name}" SET TABLESPACE "{tablespace}"'))
+                indexes = connection.execute(
+                    text("SELECT indexname FROM pg_indexes WHERE tablename = :name"), {"name": name}
+                ).scalars().all()
+                for index in indexes:
+                    connection.execute(text(f'ALTER INDEX "{index}" SET TABLESPACE "{tablespace}"'))
+            connection.execute(text(
+                f'ALTER TABLE "{name}" SET (autovacuum_enabled = false, toast.autovacuum_enabled = false)'
+            ))
+            archived.append(name)
+    if archived:
+        logger.info(f"Партиции переведены в архив: {', '.join(archived)}")
+    return archived
@@ -116,7 +116,8 @@ def seed_db(session: Session):
                         type=TransactionType.payment,
                         status=TransactionStatus.approved,
                         description=f"Оплата ML-запроса №{test_request.id}",
-                        ml_request_id=test_request.id
+                        ml_request_id=test_request.id,
+                        ml_request_created_at=test_request.created_at
                     ))
                     new_user.balance -= log_reg.cost
 
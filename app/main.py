@@ -1,60 +1,156 @@
 import logging
 import uvicorn
-import aio_pika
 import asyncio
+import time
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.config import settings
-from app.database.database import init_db
-from app.services.mq_publisher import MLTaskPublisher, RPCPublisher
+from app.database.database import engine, init_db
+from app.services.mq_publisher import MLTaskPublisher, RPCPublisher, create_connection_pool
+from app.services.health_service import HealthCollector
+from app.services.hold_settlement import HoldSettler
+from app.services.loop_monitor import EventLoopLagMonitor
+from app.services.metrics_snapshot import MetricsSnapshotWriter
 from app.services.mq_consumer import ResultsConsumer
-from aio_pika.pool import Pool
+from app.services.partition_maintenance import PartitionMaintainer
+from app.services.outbox_relay import OutboxRelay, outbox_relays
+from app.services.task_events import TaskEventsBridge, task_events
 from app.routes.transaction_router import router as transaction_router
 from app.routes.ml_router import router as ml_router
 from app.routes.user_router import router as user_router
 from app.routes.admin_router import router as admin_router
 from app.routes.home_router import router as home_router
-from app.utils import setup_exception_handlers, setup_logging
+from app.routes.metrics_router import router as metrics_router
+from app.utils import (
+    MetricsMiddleware,
+    TracingMiddleware,
+    instrument_engine_metrics,
+    metrics_registry,
+    track_rpc_pending,
+    setup_exception_handlers,
+    setup_logging,
+    setup_tracing,
+)
 
 # Подключаем логирование
 setup_logging()
+# Трассировка запросов (включая запросы к БД); экспорт задается TRACING__EXPORTER
+setup_tracing(engine)
+if settings.metrics.ENABLED:
+    # Время и число SQL-запросов, ожидание пула БД (для /internal/metrics)
+    instrument_engine_metrics(engine)
+    if settings.metrics.MULTIPROCESS_DIR:
+        # Несколько процессов uvicorn: опрос отдает сумму снимков всех процессов
+        metrics_registry.enable_multiprocess(settings.metrics.MULTIPROCESS_DIR)
 logger = logging.getLogger(__name__)
 
 
+async def _init_database() -> None:
+    if not settings.app.INIT_DB:
+        return
+    logger.info("Initializing database...")
+    try:
+        # Инициализация синхронная, поэтому выполняется в потоке, не блокируя event loop
+        await asyncio.to_thread(init_db)
+        logger.info("Database initialized successfully")
+    except Exception as e:
+        logger.error(f"Database initialization failed: {e}")
+
+
+async def _connect_broker(application: FastAPI) -> None:
+    logger.info("Connecting to RabbitMQ...")
+    try:
+        connection_pool = create_connection_pool()
+        application.state.mq_service = MLTaskPublisher(connection_pool)
+        application.state.rpc_client = RPCPublisher(connection_pool)
+        if settings.metrics.ENABLED:
+            track_rpc_pending(application.state.rpc_client)
+        logger.info("RabbitMQ services initialized with pooling")
+    except Exception as e:
+        logger.error(f"Failed to initialize RabbitMQ service: {e}")
+        application.state.mq_service = None
+        return
+
+    # Мост событий между репликами API (fanout-обменник); без него события доставляются только локально.
+    # Заодно открывает первое соединение пула
+    try:
+        bridge = TaskEventsBridge(application.state.mq_service.connection_pool, task_events)
+        await bridge.start()
+        application.state.events_bridge = bridge
+    except Exception as e:
+        logger.warning(f"Task events bridge is not available, using local delivery only: {e}")
+
+
 #Создадим контекстный менеджер для управления жизненным циклом app
 @asynccontextmanager
 async def lifespan(application: FastAPI):
+    started = time.perf_counter()
+    # События о статусах задач доставляются подписчикам в event loop приложения
+    task_events.bind_loop(asyncio.get_running_loop())
+    application.state.events_bridge = None
+    application.state.outbox_relay = None
+    application.state.results_consumer = None
+    application.state.hold_settler = None
+    application.state.partition_maintainer = None
+    application.state.loop_monitor = None
+    application.state.metrics_writer = None
+
     if settings.app.MODE != "TEST":
-        logger.info("Initializing database...")
-        try:
-            init_db()
-            logger.info("Database initialized successfully")
-        except Exception as e:
-            logger.error(f"Database initialization failed: {e}")
-
-        logger.info("Connecting to RabbitMQ...")
-        try:
-            async def get_connection():
-                return await aio_pika.connect_robust(
-                    settings.mq.amqp_url,
-                    timeout=settings.mq.TIMEOUT
-                )
-
-            connection_pool = Pool(get_connection, max_size=2)
-            application.state.mq_service = MLTaskPublisher(connection_pool)
-            application.state.rpc_client = RPCPublisher(connection_pool)
+        # Инициализация БД и подключение к брокеру независимы, поэтому выполняются параллельно
+        await asyncio.gather(_init_database(), _connect_broker(application))
+
+        if application.state.mq_service and settings.app.RESULTS_CONSUMER_ENABLED:
             # Запускаем consumer результатов как фонового работника
             application.state.results_consumer = ResultsConsumer()
             application.state.results_consumer_task = asyncio.create_task(
                 application.state.results_consumer.run()
             )
-            logger.info("RabbitMQ services initialized with pooling and results consumer started")
-        except Exception as e:
-            logger.error(f"Failed to initialize RabbitMQ service: {e}")
-            application.state.mq_service = None
+            logger.info("Results consumer started")
+        elif application.state.mq_service:
+            # Результаты сохраняет отдельный процесс app.consumer_main
+            logger.info("Results consumer runs externally")
+
+        if application.state.mq_service:
+            # Публикация задач из outbox пачками; будится после коммита новых задач
+            relay = OutboxRelay(application.state.mq_service)
+            outbox_relays.append(relay)
+            application.state.outbox_relay = relay
+            application.state.outbox_relay_task = asyncio.create_task(relay.run())
+
+        # Возврат истекших блокировок средств на баланс
+        application.state.hold_settler = HoldSettler()
+        application.state.hold_settler_task = asyncio.create_task(application.state.hold_settler.run())
+
+        if engine.dialect.name == "postgresql":
+            # Партиции на будущие месяцы и архивация старых
+            application.state.partition_maintainer = PartitionMaintainer()
+            application.state.partition_maintainer_task = asyncio.create_task(
+                application.state.partition_maintainer.run()
+            )
+
+        if settings.metrics.ENABLED:
+            # Задержка event loop: признак блокирующего кода в async-обработчиках
+            application.state.loop_monitor = EventLoopLagMonitor()
+            application.state.loop_monitor_task = asyncio.create_task(application.state.loop_monitor.run())
+            if metrics_registry.multiprocess:
+                application.state.metrics_writer = MetricsSnapshotWriter()
+                application.state.metrics_writer_task = asyncio.create_task(application.state.metrics_writer.run())
+
+        # Состояние сервиса собирается в фоне; /health отдает готовый снимок
+        application.state.health_collector = HealthCollector(
+            mq_service=application.state.mq_service,
+            results_consumer=application.state.results_consumer,
+        )
+        application.state.health_collector_task = asyncio.create_task(application.state.health_collector.run())
+
+        elapsed = time.perf_counter() - started
+        if elapsed > settings.app.STARTUP_BUDGET:
+            logger.warning(f"Startup took {elapsed:.2f}s, over the budget of {settings.app.STARTUP_BUDGET:.2f}s")
+        else:
+            logger.info(f"Startup completed in {elapsed:.2f}s")
     else:
         logger.info("Running in TEST mode, skipping global initializations")
         application.state.mq_service = None
@@ -63,9 +159,29 @@ async def lifespan(application: FastAPI):
     yield
 
     logger.info("Application shutting down...")
+    if getattr(application.state, "health_collector", None):
+        await application.state.health_collector.stop()
+    if application.state.loop_monitor:
+        await application.state.loop_monitor.stop()
+        await application.state.loop_monitor_task
+    if application.state.metrics_writer:
+        await application.state.metrics_writer.stop()
+        await application.state.metrics_writer_task
+    if application.state.hold_settler:
+        await application.state.hold_settler.stop()
+        await application.state.hold_settler_task
+    if application.state.partition_maintainer:
+        await application.state.partition_maintainer.stop()
+        await application.state.partition_maintainer_task
     # Останавливаем consumer результатов
-    if hasattr(application.state, "results_consumer") and application.state.results_consumer:
+    if application.state.results_consumer:
         await application.state.results_consumer.stop()
+    if application.state.outbox_relay:
+        await application.state.outbox_relay.stop()
+        await application.state.outbox_relay_task
+        outbox_relays.remove(application.state.outbox_relay)
+    if application.state.events_bridge:
+        await application.state.events_bridge.close()
     if application.state.mq_service:
         await application.state.mq_service.close()
         await application.state.mq_service.connection_pool.close()
@@ -97,7 +213,11 @@ def create_application() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Trace-Id"],
     )
+    application.add_middleware(TracingMiddleware)
+    if settings.metrics.ENABLED:
+        application.add_middleware(MetricsMiddleware)
 
     # Подключаем роутеры
     application.include_router(home_router, tags=["Home"])
@@ -105,6 +225,9 @@ def create_application() -> FastAPI:
     application.include_router(transaction_router, prefix="/api/v1/balance", tags=["Transactions"])
     application.include_router(ml_router, prefix="/api/v1/requests", tags=["Requests"])
     application.include_router(admin_router, prefix="/api/v1/admin", tags=["Admin"])
+    if settings.metrics.ENABLED:
+        # Внутренний эндпоинт для сборщика метрик (снаружи закрыт на nginx)
+        application.include_router(metrics_router, prefix="/internal", tags=["Internal"])
 
     return application
 
@@ -119,6 +242,8 @@ if __name__ == '__main__':
         host=settings.app.HOST,
         port=settings.app.PORT,
         reload=settings.app.DEBUG,
+        # При reload uvicorn игнорирует workers
+        workers=settings.app.WORKERS,
         log_level="debug" if settings.app.DEBUG else "info"
     )
 
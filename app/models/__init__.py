@@ -3,3 +3,8 @@ from app.models.user_model import User, UserRole
 from app.models.ml_model import MLModel
 from app.models.ml_request_model import MLRequest, MLRequestStatus
 from app.models.transaction_model import Transaction, TransactionStatus, TransactionType
+from app.models.idempotency_model import IdempotencyKey, IdempotencyScope
+from app.models.outbox_model import OutboxMessage
+from app.models.analytics_model import RequestRollup, RollupGranularity
+from app.models.hold_model import BalanceHold
+from app.models.ingest_model import IngestJob, IngestJobStatus, IngestReject
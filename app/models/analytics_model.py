@@ -0,0 +1,45 @@
+from datetime import datetime
+from decimal import Decimal
+from enum import Enum
+
+from sqlalchemy import ForeignKey, Numeric, UniqueConstraint, text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.models.base_model import Base, int_pk
+
+
+class RollupGranularity(str, Enum):
+    hour = "hour"
+    day = "day"
+
+
+class RequestRollup(Base):
+    """
+    Предагрегированные счетчики ML-запросов по интервалам времени, модели и пользователю.
+    Обновляются инкрементально в тех же транзакциях, что и сами запросы. Каждая транзакция
+    пишет в случайный шард интервала (как списания — в шарды блокировок), поэтому параллельные
+    запросы одного аккаунта не ждут друг друга на одной строке; при чтении шарды суммируются.
+    """
+    __tablename__ = "request_rollup"
+    __table_args__ = (
+        UniqueConstraint(
+            "granularity", "bucket_start", "model_id", "user_id", "shard", name="uq_request_rollup_bucket_shard"
+        ),
+    )
+
+    id: Mapped[int_pk]
+    granularity: Mapped[RollupGranularity] = mapped_column(nullable=False)
+    bucket_start: Mapped[datetime] = mapped_column(nullable=False, index=True)
+    model_id: Mapped[int] = mapped_column(ForeignKey("ml_model.id", ondelete="CASCADE"), nullable=False)
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id", ondelete="CASCADE"), nullable=False, index=True)
+    shard: Mapped[int] = mapped_column(default=0, server_default=text('0'), nullable=False)
+    # Создано запросов и строк признаков, списано кредитов (по времени создания запроса)
+    requests: Mapped[int] = mapped_column(default=0, server_default=text('0'), nullable=False)
+    rows_scored: Mapped[int] = mapped_column(default=0, server_default=text('0'), nullable=False)
+    revenue: Mapped[Decimal] = mapped_column(Numeric(14, 2), default=0, server_default=text('0'), nullable=False)
+    # Завершено успешно/с ошибкой и возвращено кредитов (по времени завершения)
+    succeeded: Mapped[int] = mapped_column(default=0, server_default=text('0'), nullable=False)
+    failed: Mapped[int] = mapped_column(default=0, server_default=text('0'), nullable=False)
+    refunds: Mapped[Decimal] = mapped_column(Numeric(14, 2), default=0, server_default=text('0'), nullable=False)
+    # Из них завершено воркерами очереди задач (без RPC и кеша): по ним оценивается скорость разбора очереди
+    queue_completed: Mapped[int] = mapped_column(default=0, server_default=text('0'), nullable=False)
@@ -1,5 +1,8 @@
+from sqlalchemy import Constraint, ForeignKeyConstraint
 from sqlalchemy.orm import DeclarativeBase, mapped_column
-from typing import Annotated
+from typing import Annotated, Any, Optional, TypeVar
+
+C = TypeVar("C", bound=Constraint)
 
 # Базовый класс для моделей
 class Base(DeclarativeBase):
@@ -12,3 +15,34 @@ class Base(DeclarativeBase):
 int_pk = Annotated[int, mapped_column(primary_key=True)]
 str_uniq = Annotated[str, mapped_column(unique=True, nullable=False)]
 str_null_true = Annotated[str, mapped_column(nullable=True)]
+
+
+# Помесячное партиционирование больших таблиц в PostgreSQL (партиции создает app.database.partitions)
+PARTITIONED_BY_MONTH = {"postgresql_partition_by": "RANGE (created_at)"}
+
+
+def _is_unpartitioned_dialect(ddl: Any, target: Any, bind: Any, *, dialect: Any, **kw: Any) -> bool:
+    return dialect.name != "postgresql"
+
+
+def unless_partitioned(constraint: C) -> C:
+    """
+    Ограничение создается только там, где таблицы не партиционированы (не в PostgreSQL).
+    Уникальный ключ партиционированной таблицы обязан включать created_at, поэтому первичный
+    ключ по id и внешние ключи по одному id в PostgreSQL не создаются (в ORM они остаются);
+    ссылки на партиционированные таблицы там проверяются составными ключами (см. partitioned_reference).
+    """
+    return constraint.ddl_if(callable_=_is_unpartitioned_dialect)
+
+
+def partitioned_reference(table: str, ondelete: Optional[str] = None) -> ForeignKeyConstraint:
+    """
+    Внешний ключ (ml_request_id, ml_request_created_at) -> table(id, created_at) для PostgreSQL,
+    где на партиционированную таблицу можно сослаться только по ключу с created_at.
+    В ORM связи строятся по простому ключу, поэтому relationship указывают foreign_keys.
+    """
+    return ForeignKeyConstraint(
+        [f"{table}_id", f"{table}_created_at"],
+        [f"{table}.id", f"{table}.created_at"],
+        ondelete=ondelete,
+    ).ddl_if(dialect="postgresql")
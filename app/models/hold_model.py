@@ -0,0 +1,27 @@
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import ForeignKey, Numeric, UniqueConstraint, text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.models.base_model import Base, int_pk
+
+
+class BalanceHold(Base):
+    """
+    Шард заранее авторизованных средств пользователя (перенесены с User.balance).
+    Списания за запросы идут из шардов, поэтому параллельные запросы одного аккаунта
+    блокируют разные строки, а не одну строку пользователя. По истечении expires_at
+    остаток возвращается на баланс фоновой сверкой.
+    """
+    __tablename__ = "balance_hold"
+    __table_args__ = (
+        UniqueConstraint("user_id", "shard", name="uq_balance_hold_shard"),
+    )
+
+    id: Mapped[int_pk]
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id", ondelete="CASCADE"), nullable=False, index=True)
+    shard: Mapped[int] = mapped_column(nullable=False)
+    amount: Mapped[Decimal] = mapped_column(Numeric(10, 2), default=0, server_default=text('0'), nullable=False)
+    # Время в UTC без tzinfo
+    expires_at: Mapped[datetime] = mapped_column(nullable=False, index=True)
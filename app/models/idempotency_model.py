@@ -0,0 +1,43 @@
+from datetime import datetime, timezone
+from enum import Enum
+from typing import TYPE_CHECKING, Optional
+
+from sqlalchemy import ForeignKey, ForeignKeyConstraint, UniqueConstraint, text
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+
+from app.models.base_model import Base, int_pk, partitioned_reference, unless_partitioned
+
+if TYPE_CHECKING:
+    from app.models import MLRequest
+
+
+class IdempotencyScope(str, Enum):
+    send_task = "send_task"
+    predict = "predict"
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_key"
+    __table_args__ = (
+        UniqueConstraint("user_id", "key", name="uq_idempotency_key_user_key"),
+        unless_partitioned(ForeignKeyConstraint(["ml_request_id"], ["ml_request.id"], ondelete="CASCADE")),
+        partitioned_reference("ml_request", ondelete="CASCADE"),
+    )
+
+    id: Mapped[int_pk]
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    key: Mapped[str] = mapped_column(nullable=False)
+    scope: Mapped[IdempotencyScope] = mapped_column(nullable=False)
+    ml_request_id: Mapped[int] = mapped_column(nullable=False)
+    ml_request_created_at: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+    # Хеш тела исходного запроса: повтор ключа с другим телом отклоняется (NULL у ключей до миграции 0002)
+    payload_hash: Mapped[Optional[str]] = mapped_column(nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        default=lambda: datetime.now(timezone.utc),
+        server_default=text('now()'),
+        nullable=False
+    )
+    expires_at: Mapped[datetime] = mapped_column(nullable=False, index=True)
+
+    # Связи с другими таблицами
+    ml_request: Mapped["MLRequest"] = relationship(foreign_keys=[ml_request_id])
@@ -0,0 +1,55 @@
+from datetime import datetime, timezone
+from enum import Enum
+from typing import Any, Optional
+
+from sqlalchemy import JSON, ForeignKey, Text, text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.models.base_model import Base, int_pk
+
+
+class IngestJobStatus(str, Enum):
+    processing = "processing"
+    completed = "completed"
+    failed = "failed"
+
+
+class IngestJob(Base):
+    """
+    Загрузка файла с признаками: родительская запись для ML-запросов, созданных по частям файла.
+    Отклоненные при проверке строки хранятся в IngestReject.
+    """
+    __tablename__ = "ingest_job"
+
+    id: Mapped[int_pk]
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id", ondelete="CASCADE"), nullable=False, index=True)
+    filename: Mapped[Optional[str]] = mapped_column(nullable=True)
+    format: Mapped[str] = mapped_column(nullable=False)
+    status: Mapped[IngestJobStatus] = mapped_column(nullable=False)
+    rows_total: Mapped[int] = mapped_column(default=0, server_default=text('0'), nullable=False)
+    rows_accepted: Mapped[int] = mapped_column(default=0, server_default=text('0'), nullable=False)
+    rows_rejected: Mapped[int] = mapped_column(default=0, server_default=text('0'), nullable=False)
+    requests_created: Mapped[int] = mapped_column(default=0, server_default=text('0'), nullable=False)
+    error: Mapped[Optional[str]] = mapped_column(nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        default=lambda: datetime.now(timezone.utc),
+        server_default=text('now()'),
+        nullable=False
+    )
+    completed_at: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+
+
+class IngestReject(Base):
+    """
+    Отклоненная строка загрузки: номер строки данных (с 1), причины и значения признаков.
+    Записывается в транзакции своей части файла, выгружается потоково в CSV.
+    """
+    __tablename__ = "ingest_reject"
+
+    id: Mapped[int_pk]
+    ingest_job_id: Mapped[int] = mapped_column(
+        ForeignKey("ingest_job.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    row_number: Mapped[int] = mapped_column(nullable=False)
+    errors: Mapped[str] = mapped_column(Text, nullable=False)
+    features: Mapped[Any] = mapped_column(JSON, nullable=False)
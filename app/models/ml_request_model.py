@@ -3,10 +3,10 @@ from datetime import datetime, timezone
 from enum import Enum
 from typing import Optional, TYPE_CHECKING, Any
 
-from sqlalchemy import JSON, ForeignKey, text, Numeric
+from sqlalchemy import JSON, ForeignKey, Index, PrimaryKeyConstraint, UniqueConstraint, text, Numeric
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
-from app.models.base_model import Base, int_pk
+from app.models.base_model import PARTITIONED_BY_MONTH, Base, int_pk, unless_partitioned
 
 if TYPE_CHECKING:
     from app.models import Transaction, User, MLModel
@@ -20,9 +20,22 @@ class MLRequestStatus(str, Enum):
 
 class MLRequest(Base):
     __tablename__ = "ml_request"
+    __table_args__ = (
+        unless_partitioned(PrimaryKeyConstraint("id", name="ml_request_pkey")),
+        UniqueConstraint("id", "created_at", name="uq_ml_request_id_created_at").ddl_if(dialect="postgresql"),
+        # Индексы горячих запросов (в существующие базы добавляются миграциями app.database.migrations)
+        Index("ix_ml_request_user_id_created_at", "user_id", "created_at"),
+        Index(
+            "ix_ml_request_pending_user_id",
+            "user_id",
+            postgresql_where=text("status = 'pending'"),
+            sqlite_where=text("status = 'pending'"),
+        ),
+        PARTITIONED_BY_MONTH,
+    )
 
     id: Mapped[int_pk]
-    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False)
     model_id: Mapped[int] = mapped_column(ForeignKey("ml_model.id"), nullable=False, index=True)
     input_data: Mapped[Any] = mapped_column(JSON, nullable=False)
     prediction: Mapped[Any] = mapped_column(JSON, nullable=True)
@@ -38,6 +51,10 @@ class MLRequest(Base):
     completed_at: Mapped[Optional[datetime]] = mapped_column(nullable=True)
     is_published: Mapped[bool] = mapped_column(default=False, server_default=text('false'), nullable=False)
     message: Mapped[Optional[str]] = mapped_column(nullable=True)
+    # Загрузка файла, частью которой является запрос
+    ingest_job_id: Mapped[Optional[int]] = mapped_column(
+        ForeignKey("ingest_job.id", ondelete="SET NULL"), nullable=True, index=True
+    )
 
     # Связи с другими таблицами
     user: Mapped["User"] = relationship(back_populates="ml_requests")
@@ -45,4 +62,5 @@ class MLRequest(Base):
     transaction: Mapped[Optional["Transaction"]] = relationship(
         back_populates="ml_request",
         uselist=False,
+        foreign_keys="Transaction.ml_request_id",
     )
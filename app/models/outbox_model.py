@@ -0,0 +1,34 @@
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import ForeignKeyConstraint, Text, text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.models.base_model import Base, int_pk, partitioned_reference, unless_partitioned
+
+
+class OutboxMessage(Base):
+    """
+    Задача, ожидающая публикации в RabbitMQ (transactional outbox).
+    Relay арендует задачу до claimed_until и публикует ее без открытой транзакции;
+    после исчерпания попыток задача остается в таблице с dead_at, а запрос завершается ошибкой.
+    """
+    __tablename__ = "outbox_message"
+    __table_args__ = (
+        unless_partitioned(ForeignKeyConstraint(["ml_request_id"], ["ml_request.id"], ondelete="CASCADE")),
+        partitioned_reference("ml_request", ondelete="CASCADE"),
+    )
+
+    id: Mapped[int_pk]
+    ml_request_id: Mapped[int] = mapped_column(nullable=False, index=True)
+    ml_request_created_at: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+    payload: Mapped[str] = mapped_column(Text, nullable=False)
+    attempts: Mapped[int] = mapped_column(default=0, server_default=text('0'), nullable=False)
+    last_error: Mapped[Optional[str]] = mapped_column(nullable=True)
+    claimed_until: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+    dead_at: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        default=lambda: datetime.now(timezone.utc),
+        server_default=text('now()'),
+        nullable=False
+    )
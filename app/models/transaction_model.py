@@ -3,10 +3,10 @@ from datetime import datetime, timezone
 from enum import Enum
 from typing import Optional, TYPE_CHECKING
 
-from sqlalchemy import ForeignKey, text, Numeric
+from sqlalchemy import ForeignKey, ForeignKeyConstraint, Index, PrimaryKeyConstraint, UniqueConstraint, text, Numeric
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
-from app.models.base_model import Base, int_pk
+from app.models.base_model import PARTITIONED_BY_MONTH, Base, int_pk, partitioned_reference, unless_partitioned
 
 if TYPE_CHECKING:
     from app.models import MLRequest, User
@@ -25,9 +25,24 @@ class TransactionType(str, Enum):
 
 class Transaction(Base):
     __tablename__ = "transaction"
+    __table_args__ = (
+        unless_partitioned(PrimaryKeyConstraint("id", name="transaction_pkey")),
+        UniqueConstraint("id", "created_at", name="uq_transaction_id_created_at").ddl_if(dialect="postgresql"),
+        unless_partitioned(ForeignKeyConstraint(["ml_request_id"], ["ml_request.id"])),
+        partitioned_reference("ml_request"),
+        # Индексы горячих запросов (в существующие базы добавляются миграциями app.database.migrations)
+        Index("ix_transaction_user_id_created_at", "user_id", "created_at"),
+        Index(
+            "ix_transaction_ml_request_id",
+            "ml_request_id",
+            postgresql_where=text("ml_request_id IS NOT NULL"),
+            sqlite_where=text("ml_request_id IS NOT NULL"),
+        ),
+        PARTITIONED_BY_MONTH,
+    )
 
     id: Mapped[int_pk]
-    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False)
     amount: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False)
     type: Mapped[TransactionType] = mapped_column(nullable=False)
     status: Mapped[TransactionStatus] = mapped_column(
@@ -36,7 +51,9 @@ class Transaction(Base):
         nullable=False
     )
     description: Mapped[Optional[str]]
-    ml_request_id: Mapped[Optional[int]] = mapped_column(ForeignKey("ml_request.id"), nullable=True, index=True)
+    ml_request_id: Mapped[Optional[int]] = mapped_column(nullable=True)
+    # Ключ партиции запроса: часть внешнего ключа на партиционированную ml_request
+    ml_request_created_at: Mapped[Optional[datetime]] = mapped_column(nullable=True)
     created_at: Mapped[datetime] = mapped_column(
         default=lambda: datetime.now(timezone.utc),
         server_default=text('now()'),
@@ -48,4 +65,5 @@ class Transaction(Base):
     user: Mapped["User"] = relationship(back_populates="transactions")
     ml_request: Mapped[Optional["MLRequest"]] = relationship(
         back_populates="transaction",
+        foreign_keys=[ml_request_id],
     )
@@ -1,12 +1,21 @@
-from typing import List
+from datetime import datetime
+from typing import List, Literal, Optional
 from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
 
-from app.models import User
-from app.routes.dependencies import get_current_admin_user, get_admin_service, get_ml_request_service
+from app.models import RollupGranularity, User
+from app.routes.dependencies import (
+    get_current_admin_user,
+    get_admin_service,
+    get_analytics_service,
+    get_ml_request_service,
+)
 from app.schemas.user_schemas import SUser, SUserAdminUpdate
 from app.schemas.transaction_schemas import STransaction, STransactionCreate
 from app.schemas.ml_request_schemas import SMLRequestHistory
-from app.services import AdminService, MLRequestService, admin_service
+from app.schemas.analytics_schemas import SRollupBucket, SRollupCounters
+from app.services import AdminService, AnalyticsService, MLRequestService, admin_service
+from app.services.export_service import ExportFormat, export_response
 
 router = APIRouter()
 
@@ -48,6 +57,19 @@ async def get_all_transactions(
 ) -> List[STransaction]:
     return admin_service.get_all_transactions()
 
+@router.get(
+    "/transactions/export",
+    summary="Выгрузка всех транзакций (Админ)",
+    description="Потоковая выгрузка всех транзакций в формате NDJSON или CSV. Только для администраторов.",
+    response_class=StreamingResponse,
+)
+async def export_all_transactions(
+    format: ExportFormat = ExportFormat.ndjson,
+    admin_user: User = Depends(get_current_admin_user),
+    admin_service: AdminService = Depends(get_admin_service)
+) -> StreamingResponse:
+    return export_response(admin_service.export_transactions(format), format, "transactions")
+
 @router.post(
     "/transactions/replenish/{user_id}",
     response_model=STransaction,
@@ -88,6 +110,19 @@ async def get_all_ml_requests(
 ) -> List[SMLRequestHistory]:
     return admin_service.get_all_requests()
 
+@router.get(
+    "/ml-requests/export",
+    summary="Выгрузка всех ML-запросов (Админ)",
+    description="Потоковая выгрузка всех ML-запросов в формате NDJSON или CSV. Только для администраторов.",
+    response_class=StreamingResponse,
+)
+async def export_all_ml_requests(
+    format: ExportFormat = ExportFormat.ndjson,
+    admin_user: User = Depends(get_current_admin_user),
+    admin_service: AdminService = Depends(get_admin_service)
+) -> StreamingResponse:
+    return export_response(admin_service.export_requests(format), format, "ml_requests")
+
 @router.get(
     "/users/{user_id}/transactions",
     response_model=List[STransaction],
@@ -100,3 +135,44 @@ async def get_user_transactions(
     admin_service: AdminService = Depends(get_admin_service)
 ) -> List[STransaction]:
     return admin_service.get_user_transactions(user_id)
+
+@router.get(
+    "/analytics",
+    response_model=List[SRollupBucket],
+    summary="Аналитика по интервалам (Админ)",
+    description="Запросы, строки, выручка, возвраты и доля ошибок по часам или дням из предагрегированных "
+                "счетчиков. Группировка по модели или пользователю. Только для администраторов.",
+)
+async def get_analytics(
+    granularity: RollupGranularity = RollupGranularity.day,
+    group_by: Optional[Literal["model", "user"]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    admin_user: User = Depends(get_current_admin_user),
+    analytics_service: AnalyticsService = Depends(get_analytics_service)
+) -> List[SRollupBucket]:
+    return analytics_service.get_buckets(granularity, since=since, until=until, group_by=group_by)
+
+@router.get(
+    "/analytics/summary",
+    response_model=SRollupCounters,
+    summary="Итоговая аналитика (Админ)",
+    description="Итоговые счетчики по всей системе. Только для администраторов.",
+)
+async def get_analytics_summary(
+    admin_user: User = Depends(get_current_admin_user),
+    analytics_service: AnalyticsService = Depends(get_analytics_service)
+) -> SRollupCounters:
+    return analytics_service.get_totals()
+
+@router.post(
+    "/analytics/rebuild",
+    summary="Пересчитать агрегаты аналитики (Админ)",
+    description="Пересчитывает агрегаты закрытых интервалов по истории запросов (сверка). Запись "
+                "агрегатов блокируется только на замену пересчитанных строк. Только для администраторов.",
+)
+async def rebuild_analytics(
+    admin_user: User = Depends(get_current_admin_user),
+    analytics_service: AnalyticsService = Depends(get_analytics_service)
+):
+    return {"rows": analytics_service.rebuild()}
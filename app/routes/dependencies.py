@@ -1,15 +1,27 @@
+from typing import Callable
+
 from fastapi import Depends
 from sqlalchemy.orm import Session
 
-from app.database.database import get_session
+from app.database.database import get_session, get_session_factory
 from app.models import User, UserRole
 from app.utils import UserIsNotPresentException, ForbiddenException
 from app.auth.authenticate import authenticate
-from app.services import MLRequestService, BillingService, UserService, AdminService
+from app.services import (
+    MLRequestService,
+    BillingService,
+    UserService,
+    AdminService,
+    AnalyticsService,
+    IngestService,
+)
 
 
-def get_ml_request_service(session: Session = Depends(get_session)) -> MLRequestService:
-    return MLRequestService(session)
+def get_ml_request_service(
+    session: Session = Depends(get_session),
+    session_factory: Callable[[], Session] = Depends(get_session_factory),
+) -> MLRequestService:
+    return MLRequestService(session, session_factory)
 
 
 def get_billing_service(session: Session = Depends(get_session)) -> BillingService:
@@ -20,8 +32,22 @@ def get_user_service(session: Session = Depends(get_session)) -> UserService:
     return UserService(session)
 
 
-def get_admin_service(session: Session = Depends(get_session)) -> AdminService:
-    return AdminService(session)
+def get_admin_service(
+    session: Session = Depends(get_session),
+    session_factory: Callable[[], Session] = Depends(get_session_factory),
+) -> AdminService:
+    return AdminService(session, session_factory)
+
+
+def get_analytics_service(session: Session = Depends(get_session)) -> AnalyticsService:
+    return AnalyticsService(session)
+
+
+def get_ingest_service(
+    session: Session = Depends(get_session),
+    session_factory: Callable[[], Session] = Depends(get_session_factory),
+) -> IngestService:
+    return IngestService(session, session_factory)
 
 
 async def get_current_user(
@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Request, Response
+
+from app.utils.metrics import RPC_PENDING, metrics_registry
+from common.metrics import CONTENT_TYPE
+
+router = APIRouter()
+
+
+@router.get(
+    "/metrics",
+    summary="Метрики в формате Prometheus",
+    description="Внутренний эндпоинт для сборщика метрик; снаружи закрыт на nginx.",
+    include_in_schema=False,
+)
+async def metrics(request: Request) -> Response:
+    rpc_client = getattr(request.app.state, "rpc_client", None)
+    RPC_PENDING.set(len(rpc_client.futures) if rpc_client is not None else 0)
+    return Response(metrics_registry.render(), media_type=CONTENT_TYPE)
@@ -1,19 +1,32 @@
+import asyncio
 import logging
-from typing import List, Dict, Any
+from datetime import datetime
+from typing import List, Dict, Any, Optional
 
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Header, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 
 from app.config import settings
-from app.models import User
-from app.routes.dependencies import get_current_user, get_ml_request_service
+from app.models import User, IdempotencyScope, MLRequest, RollupGranularity
+from app.routes.dependencies import (
+    get_current_user,
+    get_analytics_service,
+    get_ingest_service,
+    get_ml_request_service,
+)
 from app.schemas.ml_task_schemas import MLResult
 from app.schemas.ml_request_schemas import (
     SMLPredictionRequest,
     SMLPredictionResponse,
     SMLRequestHistory
 )
-from app.services import MLRequestService
-from app.services.mq_publisher import MLTaskPublisher, RPCPublisher, get_mq_service, get_rpc_client
+from app.schemas.analytics_schemas import SRollupBucket, SRollupCounters
+from app.schemas.ingest_schemas import SIngestJob
+from app.services import AnalyticsService, IngestService, MLRequestService
+from app.services.export_service import ExportFormat, ResultsFormat, export_response
+from app.services.ingest_service import IngestFormat, detect_format, spool_upload
+from app.services.mq_publisher import RPCPublisher, get_rpc_client
+from app.services.task_events import task_events, sse_stream
 from app.utils import setup_logging
 
 router = APIRouter()
@@ -21,24 +34,49 @@ router = APIRouter()
 setup_logging()
 logger = logging.getLogger(__name__)
 
+# Повторы клиента с тем же ключом возвращают исходный запрос без повторного списания
+IDEMPOTENCY_KEY_HEADER = Header(
+    None,
+    alias="Idempotency-Key",
+    max_length=255,
+    description="Уникальный ключ запроса для безопасных повторов"
+)
+
 
 @router.post(
     "/send_task",
     response_model=SMLPredictionResponse,
     summary="Отправить задачу в очередь на выполнение",
-    description="Отправляет задачу в очередь RabbitMQ и возвращает информацию о запросе.",
-    status_code=status.HTTP_202_ACCEPTED
+    description="Отправляет задачу в очередь RabbitMQ и возвращает информацию о запросе. "
+                "Если очередь не успеет обработать задачу в срок или у пользователя слишком много "
+                "незавершенных запросов, возвращается 429 с заголовком Retry-After.",
+    status_code=status.HTTP_202_ACCEPTED,
+    responses={429: {"description": "Перегрузка: повторить после Retry-After секунд"}},
 )
 async def send_task(
     request: SMLPredictionRequest,
+    response: Response,
     current_user: User = Depends(get_current_user),
-    mq_service: MLTaskPublisher = Depends(get_mq_service),
-    ml_service: MLRequestService = Depends(get_ml_request_service)
+    ml_service: MLRequestService = Depends(get_ml_request_service),
+    idempotency_key: Optional[str] = IDEMPOTENCY_KEY_HEADER,
 ) -> Dict[str, Any]:
-    db_request = await ml_service.create_and_send_task(
+    if idempotency_key:
+        replay = ml_service.find_replay(
+            current_user.id, idempotency_key, IdempotencyScope.send_task, request.data
+        )
+        if replay:
+            response.headers["Idempotent-Replayed"] = "true"
+            return {
+                "request_id": replay.id,
+                "status": replay.status,
+                "message": "Запрос с этим ключом уже был принят ранее"
+            }
+
+    ml_service.check_admission(current_user)
+    db_request = ml_service.create_and_send_task(
         user=current_user,
         input_data=request.data,
-        mq_service=mq_service
+        idempotency_key=idempotency_key
     )
     return {
         "request_id": db_request.id,
@@ -47,6 +85,87 @@ async def send_task(
     }
 
 
+@router.post(
+    "/ingest",
+    response_model=SIngestJob,
+    summary="Загрузить файл с признаками",
+    description="Принимает CSV, XLSX или Parquet телом запроса (без multipart) и читает его частями. "
+                "Колонки сопоставляются по синонимам, строки проверяются, каждая часть файла "
+                "(до INGEST_CHUNK_ROWS строк) ставится в очередь отдельным ML-запросом. "
+                "Отклоненные строки доступны в /ingest/{job_id}/rejects.",
+    status_code=status.HTTP_202_ACCEPTED,
+    responses={
+        413: {"description": "Файл превышает допустимый размер"},
+        415: {"description": "Формат файла не поддерживается"},
+        422: {"description": "Файл не удалось прочитать"},
+        429: {"description": "Перегрузка: повторить после Retry-After секунд"},
+    },
+)
+async def ingest_file(
+    request: Request,
+    format: Optional[IngestFormat] = Query(None, description="Формат файла; по умолчанию по имени или Content-Type"),
+    filename: Optional[str] = Query(None, max_length=255, description="Имя исходного файла"),
+    current_user: User = Depends(get_current_user),
+    ml_service: MLRequestService = Depends(get_ml_request_service),
+    ingest_service: IngestService = Depends(get_ingest_service),
+) -> SIngestJob:
+    ml_service.check_admission(current_user)
+    fmt = format or detect_format(filename, request.headers.get("content-type"))
+    upload = await spool_upload(request.stream())
+    try:
+        # Разбор файла не блокирует цикл событий
+        return await asyncio.to_thread(ingest_service.ingest, current_user, upload, fmt, filename)
+    finally:
+        upload.close()
+
+
+@router.get(
+    "/ingest/{job_id}",
+    response_model=SIngestJob,
+    summary="Статус загрузки файла",
+    description="Счетчики прочитанных, принятых и отклоненных строк загрузки.",
+)
+async def get_ingest_job(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    ingest_service: IngestService = Depends(get_ingest_service),
+) -> SIngestJob:
+    return ingest_service.get_job(job_id, current_user.id)
+
+
+@router.get(
+    "/ingest/{job_id}/rejects",
+    summary="Отклоненные строки загрузки",
+    description="CSV с номерами отклоненных строк (с 1, без заголовка), причинами и значениями признаков.",
+    response_class=StreamingResponse,
+)
+async def get_ingest_rejects(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    ingest_service: IngestService = Depends(get_ingest_service),
+) -> StreamingResponse:
+    rejects = ingest_service.get_rejects(job_id, current_user.id)
+    return export_response(rejects, ExportFormat.csv, f"ingest_{job_id}_rejects")
+
+
+@router.get(
+    "/ingest/{job_id}/results",
+    summary="Результаты загрузки файла",
+    description="Потоковая выгрузка строк всех запросов загрузки с предсказаниями в CSV или Parquet. "
+                "Параметр columns (повторяемый или через запятую) ограничивает набор колонок.",
+    response_class=StreamingResponse,
+)
+async def export_ingest_results(
+    job_id: int,
+    format: ResultsFormat = ResultsFormat.csv,
+    columns: Optional[List[str]] = Query(None, description="Колонки выгрузки; по умолчанию все"),
+    current_user: User = Depends(get_current_user),
+    ingest_service: IngestService = Depends(get_ingest_service),
+) -> StreamingResponse:
+    chunks = ingest_service.export_results(job_id, current_user.id, format, columns)
+    return export_response(chunks, format, f"ingest_{job_id}_results")
+
+
 @router.post("/post_result",
              summary="Передать и опубликовать результат",
              description="Для task_worker: передаёт результаты выполненной задачи через RabbitMQ")
@@ -60,20 +179,44 @@ async def post_result(
 @router.post(
     "/predict",
     summary="Выполнить предсказание (синхронно/RPC)",
-    description="Отправляет запрос через RPC и ожидает результат немедленно.",
-    status_code=status.HTTP_200_OK
+    description="Отправляет запрос через RPC и ожидает результат немедленно. "
+                "Если ответ не успевает к дедлайну (по наблюдаемой задержке воркеров и очереди), "
+                "запрос передается в фоновую очередь и возвращается 202 с request_id.",
+    status_code=status.HTTP_200_OK,
+    responses={202: {"model": SMLPredictionResponse, "description": "Запрос передан в фоновую очередь"}},
 )
 async def predict(
     request: SMLPredictionRequest,
+    response: Response,
     current_user: User = Depends(get_current_user),
     rpc_client: RPCPublisher = Depends(get_rpc_client),
-    ml_service: MLRequestService = Depends(get_ml_request_service)
+    ml_service: MLRequestService = Depends(get_ml_request_service),
+    idempotency_key: Optional[str] = IDEMPOTENCY_KEY_HEADER,
 ) -> Any:
+    if idempotency_key:
+        replay = ml_service.find_replay(
+            current_user.id, idempotency_key, IdempotencyScope.predict, request.data
+        )
+        if replay:
+            response.headers["Idempotent-Replayed"] = "true"
+            return {"prediction": replay.prediction}
+
+    # Очередь задач не проверяется: RPC обслуживают отдельные воркеры
+    ml_service.check_admission(current_user, queued=False)
     raw = await ml_service.execute_rpc_predict(
         user=current_user,
         input_data=request.data,
-        rpc_client=rpc_client
+        rpc_client=rpc_client,
+        idempotency_key=idempotency_key
     )
+    if isinstance(raw, MLRequest):
+        # Результат придет через историю запросов и поток событий
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {
+            "request_id": raw.id,
+            "status": raw.status,
+            "message": raw.message
+        }
     return {"prediction": raw}
 
 
@@ -81,14 +224,60 @@ async def predict(
     "/history",
     response_model=List[SMLRequestHistory],
     summary="История запросов",
-    description="Возвращает историю всех ML-запросов текущего пользователя.",
+    description="Возвращает историю ML-запросов текущего пользователя, начиная с since (по умолчанию — всю).",
     response_description="История запросов пользователя"
 )
 async def get_history(
+    since: Optional[datetime] = None,
     current_user: User = Depends(get_current_user),
     ml_service: MLRequestService = Depends(get_ml_request_service)
 ) -> List[SMLRequestHistory]:
-    return ml_service.get_all_history(current_user.id)
+    return ml_service.get_all_history(current_user.id, since)
+
+
+@router.get(
+    "/history/export",
+    summary="Выгрузка истории запросов",
+    description="Потоковая выгрузка истории ML-запросов текущего пользователя в формате NDJSON или CSV.",
+    response_class=StreamingResponse,
+)
+async def export_history(
+    format: ExportFormat = ExportFormat.ndjson,
+    current_user: User = Depends(get_current_user),
+    ml_service: MLRequestService = Depends(get_ml_request_service)
+) -> StreamingResponse:
+    return export_response(ml_service.export_history(current_user.id, format), format, "history")
+
+
+@router.get(
+    "/stats",
+    response_model=SRollupCounters,
+    summary="Статистика запросов",
+    description="Итоговые счетчики ML-запросов текущего пользователя: количество, строки, траты, возвраты и доля ошибок.",
+)
+async def get_stats(
+    current_user: User = Depends(get_current_user),
+    analytics_service: AnalyticsService = Depends(get_analytics_service)
+) -> SRollupCounters:
+    return analytics_service.get_totals(current_user.id)
+
+
+@router.get(
+    "/analytics",
+    response_model=List[SRollupBucket],
+    summary="Статистика запросов по интервалам",
+    description="Счетчики ML-запросов текущего пользователя по часам или дням в разрезе моделей.",
+)
+async def get_analytics(
+    granularity: RollupGranularity = RollupGranularity.day,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_user: User = Depends(get_current_user),
+    analytics_service: AnalyticsService = Depends(get_analytics_service)
+) -> List[SRollupBucket]:
+    return analytics_service.get_buckets(
+        granularity, since=since, until=until, user_id=current_user.id, group_by="model"
+    )
 
 
 @router.get(
@@ -104,3 +293,53 @@ async def get_request_details(
     ml_service: MLRequestService = Depends(get_ml_request_service)
 ) -> SMLRequestHistory:
     return ml_service.get_history_by_id(request_id, current_user.id)
+
+
+@router.get(
+    "/history/{request_id}/results",
+    summary="Результаты запроса",
+    description="Потоковая выгрузка входных строк завершенного запроса вместе с предсказаниями в CSV или Parquet. "
+                "Параметр columns (повторяемый или через запятую) ограничивает набор колонок.",
+    response_class=StreamingResponse,
+    responses={409: {"description": "Запрос еще выполняется"}},
+)
+async def export_request_results(
+    request_id: int,
+    format: ResultsFormat = ResultsFormat.csv,
+    columns: Optional[List[str]] = Query(None, description="Колонки выгрузки; по умолчанию все"),
+    current_user: User = Depends(get_current_user),
+    ml_service: MLRequestService = Depends(get_ml_request_service),
+) -> StreamingResponse:
+    chunks = ml_service.export_results(request_id, current_user.id, format, columns)
+    return export_response(chunks, format, f"request_{request_id}_results")
+
+
+@router.get(
+    "/events",
+    summary="Поток событий о статусах запросов (SSE)",
+    description="Server-Sent Events: сообщает о завершении ML-запросов текущего пользователя сразу после "
+                "сохранения результата. С параметром request_id поток закрывается после события по этому запросу.",
+    response_class=StreamingResponse,
+)
+async def stream_events(
+    request: Request,
+    request_id: Optional[int] = None,
+    current_user: User = Depends(get_current_user),
+    ml_service: MLRequestService = Depends(get_ml_request_service)
+) -> StreamingResponse:
+    # Подписываемся до проверки статуса, чтобы не пропустить результат между ними
+    queue = task_events.subscribe(current_user.id)
+    try:
+        initial = ml_service.get_final_event(request_id, current_user.id) if request_id is not None else None
+    except Exception:
+        task_events.unsubscribe(current_user.id, queue)
+        raise
+    finally:
+        # Не держим соединение из пула на всё время жизни потока
+        ml_service.session.close()
+
+    return StreamingResponse(
+        sse_stream(request, current_user.id, queue, request_id, initial),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -3,7 +3,7 @@ from fastapi import APIRouter, Depends
 
 from app.models import User
 from app.routes.dependencies import get_current_user, get_billing_service
-from app.schemas.transaction_schemas import STransaction, STransactionCreate
+from app.schemas.transaction_schemas import SBalanceHoldCreate, SBalanceHolds, STransaction, STransactionCreate
 from app.services import BillingService
 
 router = APIRouter()
@@ -47,3 +47,44 @@ async def get_history(
 ) -> List[STransaction]:
     return billing_service.get_transactions_history(current_user.id)
 
+
+@router.get(
+    "/holds",
+    response_model=SBalanceHolds,
+    summary="Авторизованные средства",
+    description="Остаток средств, заранее перенесенных с баланса в шарды для параллельных запросов.",
+)
+async def get_holds(
+    current_user: User = Depends(get_current_user),
+    billing_service: BillingService = Depends(get_billing_service)
+) -> SBalanceHolds:
+    return billing_service.get_holds_summary(current_user.id)
+
+
+@router.post(
+    "/holds",
+    response_model=SBalanceHolds,
+    summary="Авторизовать средства",
+    description="Переносит сумму с баланса в шарды блокировки. Оплата запросов списывается из шардов, "
+                "поэтому параллельные запросы одного аккаунта не ждут друг друга на строке баланса. "
+                "Остаток возвращается на баланс по истечении срока или по запросу.",
+)
+async def authorize_hold(
+    hold_data: SBalanceHoldCreate,
+    current_user: User = Depends(get_current_user),
+    billing_service: BillingService = Depends(get_billing_service)
+) -> SBalanceHolds:
+    return billing_service.authorize_hold(current_user, hold_data.amount, hold_data.shards)
+
+
+@router.delete(
+    "/holds",
+    response_model=SBalanceHolds,
+    summary="Вернуть авторизованные средства",
+    description="Досрочно возвращает остаток авторизованных средств на баланс.",
+)
+async def release_holds(
+    current_user: User = Depends(get_current_user),
+    billing_service: BillingService = Depends(get_billing_service)
+) -> SBalanceHolds:
+    return billing_service.release_holds(current_user)
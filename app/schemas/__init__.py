@@ -6,5 +6,7 @@ from app.schemas.ml_request_schemas import (
     SMLPredictionRequest,
     SMLPredictionResponse,
     SMLRequestHistory,
+    STaskEvent,
 )
 from app.schemas.transaction_schemas import STransactionCreate, STransaction
+from app.schemas.analytics_schemas import SRollupCounters, SRollupBucket
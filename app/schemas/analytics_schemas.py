@@ -0,0 +1,29 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+from pydantic import Field, computed_field
+
+from app.schemas.base_schema import SBase
+
+
+class SRollupCounters(SBase):
+    requests: int = Field(..., description="Создано запросов")
+    rows_scored: int = Field(..., description="Строк признаков отправлено на инференс")
+    revenue: Decimal = Field(..., description="Списано кредитов")
+    succeeded: int = Field(..., description="Завершено успешно")
+    failed: int = Field(..., description="Завершено с ошибкой")
+    refunds: Decimal = Field(..., description="Возвращено кредитов")
+    queue_completed: int = Field(..., description="Завершено воркерами очереди задач")
+
+    @computed_field(description="Доля ошибок среди завершенных запросов")
+    @property
+    def failure_rate(self) -> float:
+        completed = self.succeeded + self.failed
+        return self.failed / completed if completed else 0.0
+
+
+class SRollupBucket(SRollupCounters):
+    bucket_start: datetime = Field(..., description="Начало интервала (UTC)")
+    model_id: Optional[int] = Field(None, description="ID модели (при группировке по модели)")
+    user_id: Optional[int] = Field(None, description="ID пользователя (при группировке по пользователю)")
@@ -0,0 +1,21 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import Field
+
+from app.models import IngestJobStatus
+from app.schemas.base_schema import SBase
+
+
+class SIngestJob(SBase):
+    id: int = Field(..., description="ID загрузки")
+    status: IngestJobStatus = Field(..., description="Статус обработки файла")
+    filename: Optional[str] = Field(None, description="Имя загруженного файла")
+    format: str = Field(..., description="Формат файла")
+    rows_total: int = Field(..., description="Прочитано строк")
+    rows_accepted: int = Field(..., description="Строк отправлено на инференс")
+    rows_rejected: int = Field(..., description="Строк отклонено (см. файл отклоненных строк)")
+    requests_created: int = Field(..., description="Создано ML-запросов (по одному на часть файла)")
+    error: Optional[str] = Field(None, description="Причина прерывания обработки")
+    created_at: datetime
+    completed_at: Optional[datetime] = None
@@ -57,3 +57,10 @@ class SMLRequestHistory(SBase):
     cost: Decimal
     created_at: datetime
     ml_model: Optional[SMLModel] = None
+
+
+class STaskEvent(SBase):
+    request_id: int = Field(..., description="ID ML-запроса")
+    user_id: int = Field(..., description="ID владельца запроса")
+    status: MLRequestStatus = Field(..., description="Новый статус запроса")
+    completed_at: Optional[datetime] = Field(None, description="Время завершения")
@@ -9,6 +9,8 @@ class MLTask(BaseModel):
     model: str
     user_id: int
     timestamp: datetime = Field(default_factory=datetime.now)
+    # traceparent запроса, создавшего задачу: хранится в outbox и уходит в заголовки сообщения
+    trace_context: Optional[str] = None
 
 class MLResult(BaseModel):
     task_id: str
@@ -28,3 +28,20 @@ class STransaction(SBase):
     description: Optional[str]
     ml_request_id: Optional[int]
     created_at: datetime
+
+
+class SBalanceHoldCreate(SBase):
+    amount: Decimal = Field(..., gt=0, description="Сумма, переносимая с баланса в блокировку")
+    shards: Optional[int] = Field(
+        None,
+        ge=1,
+        le=settings.app.HOLD_MAX_SHARDS,
+        description="Число шардов (параллельных списаний без ожидания); каждый шард должен покрывать стоимость запроса"
+    )
+
+
+class SBalanceHolds(SBase):
+    balance: Decimal = Field(..., description="Свободный баланс")
+    held: Decimal = Field(..., description="Остаток авторизованных средств во всех шардах")
+    shards: int
+    expires_at: Optional[datetime] = Field(None, description="Когда остаток вернется на баланс (UTC)")
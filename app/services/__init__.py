@@ -2,3 +2,5 @@ from app.services.user_service import UserService
 from app.services.ml_service import MLRequestService
 from app.services.billing_service import BillingService
 from app.services.admin_service import AdminService
+from app.services.analytics_service import AnalyticsService
+from app.services.ingest_service import IngestService
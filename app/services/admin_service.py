@@ -1,21 +1,26 @@
 from decimal import Decimal
-from typing import List
+from typing import Callable, Iterator, List
 import logging
 
 from sqlalchemy.orm import Session
+from app.config import settings
 from app.crud import user as user_crud
 from app.crud import billing as billing_crud
 from app.crud import admin as admin_crud
+from app.crud import export as export_crud
 from app.crud import ml as ml_crud
+from app.database.database import session_maker
 from app.models import Transaction, TransactionStatus, TransactionType, User, MLRequest
 from app.schemas.user_schemas import SUserAdminUpdate
+from app.services.export_service import ExportFormat, stream_rows
 from app.utils import TransactionNotFoundException, UserIsNotPresentException, transactional
 
 logger = logging.getLogger(__name__)
 
 class AdminService:
-    def __init__(self, session: Session) -> None:
+    def __init__(self, session: Session, session_factory: Callable[[], Session] = session_maker) -> None:
         self.session = session
+        self.session_factory = session_factory
 
     def get_all_users(self) -> List[User]:
         return admin_crud.get_all_users(self.session)
@@ -26,6 +31,16 @@ class AdminService:
     def get_all_requests(self) -> List[MLRequest]:
         return admin_crud.get_all_requests(self.session)
 
+    def export_transactions(self, fmt: ExportFormat) -> Iterator[str]:
+        """Потоковая выгрузка всех транзакций."""
+        rows = export_crud.iter_transactions(self.session_factory, settings.app.EXPORT_BATCH_SIZE)
+        return stream_rows(rows, export_crud.TRANSACTION_EXPORT_COLUMNS, fmt)
+
+    def export_requests(self, fmt: ExportFormat) -> Iterator[str]:
+        """Потоковая выгрузка всех ML-запросов."""
+        rows = export_crud.iter_requests(self.session_factory, settings.app.EXPORT_BATCH_SIZE)
+        return stream_rows(rows, export_crud.REQUEST_EXPORT_COLUMNS, fmt)
+
     @transactional
     def admin_replenish(self, user_id: int, amount: Decimal) -> Transaction:
         ok = billing_crud.update_user_balance(self.session, user_id, amount)
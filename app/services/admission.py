@@ -0,0 +1,110 @@
+import logging
+import math
+from collections import deque
+from datetime import datetime
+from time import monotonic
+from typing import Any, Deque, Dict, NamedTuple, Optional
+
+from app.config import settings
+from app.utils import QueueOverloadedException, TooManyPendingRequestsException
+
+logger = logging.getLogger(__name__)
+
+
+class DrainSample(NamedTuple):
+    at: float
+    depth: Optional[int]
+    # Начало окна счетчика завершений: разность двух замеров имеет смысл только при одинаковом since
+    since: datetime
+    completed: int
+
+
+class AdmissionController:
+    """
+    Контроль допуска фоновых задач по состоянию очереди.
+    Глубина очереди задач берется из снимка /health. Пропускная способность воркеров оценивается
+    по приросту завершений из очереди между соседними замерами за ADMISSION_DRAIN_WINDOW, причем
+    только на интервалах, когда очередь была непустой: после простоя спрос мал, но воркеры свободны,
+    и такие интервалы оценку не занижают. Проверки выполняются до любых записей в БД: если задача
+    не успеет выполниться за QUEUE_SLA_SECONDS и очередь при этом растет, запрос отклоняется
+    с 429 и Retry-After.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.queue_depth: Optional[int] = None
+        self.drain_rate: float = 0.0
+        self._samples: Deque[DrainSample] = deque()
+
+    def observe_queue(self, queue_info: Optional[Dict[str, Any]]) -> None:
+        if not queue_info or "error" in queue_info:
+            return
+        self.queue_depth = int(queue_info.get("messages") or 0)
+
+    def observe_drain(self, since: datetime, completed: int) -> None:
+        """
+        Замер счетчика завершений из очереди (с момента since) при текущей глубине очереди.
+        Пересчитывает скорость разбора, запросов в секунду, по интервалам с непустой очередью.
+        """
+        now = monotonic()
+        self._samples.append(DrainSample(now, self.queue_depth, since, completed))
+        while self._samples and self._samples[0].at < now - settings.app.ADMISSION_DRAIN_WINDOW:
+            self._samples.popleft()
+        busy, drained = 0.0, 0
+        for previous, current in zip(self._samples, list(self._samples)[1:]):
+            if previous.since != current.since or not previous.depth:
+                continue
+            busy += current.at - previous.at
+            drained += current.completed - previous.completed
+        self.drain_rate = drained / busy if busy > 0 and drained > 0 else 0.0
+
+    def backlog_growing(self) -> bool:
+        """Очередь глубже, чем в начале окна наблюдения (или данных для сравнения нет)."""
+        depths = [sample.depth for sample in self._samples if sample.depth is not None]
+        if self.queue_depth is None or not depths:
+            return True
+        return self.queue_depth > depths[0]
+
+    def expected_wait(self) -> Optional[float]:
+        """Ожидаемое время ожидания новой задачи в очереди (None, если скорость разбора неизвестна)."""
+        if self.queue_depth is None or self.drain_rate <= 0:
+            return None
+        return self.queue_depth / self.drain_rate
+
+    @staticmethod
+    def _bounded(seconds: float) -> int:
+        return min(max(math.ceil(seconds), 1), settings.app.ADMISSION_MAX_RETRY_AFTER)
+
+    def check_queue(self) -> None:
+        """Отклоняет задачу, если очередь не будет разобрана в пределах SLA."""
+        if self.queue_depth is None:
+            return
+        wait = self.expected_wait()
+        if wait is None:
+            # Скорость разбора еще неизвестна: ограничиваем только абсолютную глубину
+            if self.queue_depth > settings.app.ADMISSION_MAX_QUEUE_DEPTH:
+                logger.warning(f"Задача отклонена: глубина очереди {self.queue_depth}")
+                raise QueueOverloadedException(retry_after=settings.app.ADMISSION_RETRY_AFTER)
+            return
+        if wait > settings.app.QUEUE_SLA_SECONDS and self.backlog_growing():
+            # Повторить, когда очередь сократится до уровня, укладывающегося в SLA
+            retry_after = self._bounded(wait - settings.app.QUEUE_SLA_SECONDS)
+            logger.warning(f"Задача отклонена: ожидание в очереди {wait:.0f}с, Retry-After {retry_after}с")
+            raise QueueOverloadedException(retry_after=retry_after)
+
+    def check_user(self, pending: int) -> None:
+        """Отклоняет запрос, если у пользователя слишком много незавершенных запросов."""
+        limit = settings.app.MAX_PENDING_PER_USER
+        if pending < limit:
+            return
+        excess = pending - limit + 1
+        if self.drain_rate > 0:
+            retry_after = self._bounded(excess / self.drain_rate)
+        else:
+            retry_after = settings.app.ADMISSION_RETRY_AFTER
+        raise TooManyPendingRequestsException(retry_after=retry_after)
+
+
+admission_control = AdmissionController()
@@ -0,0 +1,175 @@
+import logging
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.crud import analytics as analytics_crud
+from app.models import MLRequestStatus, RollupGranularity
+from app.utils import transactional
+
+logger = logging.getLogger(__name__)
+
+# (model_id, user_id) -> приращения счетчиков
+Deltas = Dict[Tuple[int, int], Dict[str, Any]]
+
+
+def _as_utc_naive(at: datetime) -> datetime:
+    """Агрегаты хранят время в UTC без tzinfo."""
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    return at
+
+
+def bucket_start(at: datetime, granularity: RollupGranularity) -> datetime:
+    """Начало часового/дневного интервала, в который попадает момент времени."""
+    at = _as_utc_naive(at).replace(minute=0, second=0, microsecond=0)
+    if granularity == RollupGranularity.day:
+        at = at.replace(hour=0)
+    return at
+
+
+def _empty_counters() -> Dict[str, Any]:
+    return {name: 0 for name in analytics_crud.ROLLUP_COUNTERS}
+
+
+def _apply(session: Session, deltas: Deltas, at: Optional[datetime] = None) -> None:
+    at = at or datetime.now(timezone.utc)
+    # Один шард на транзакцию: часовая и дневная строки берутся в одном порядке
+    shard = random.randrange(max(settings.app.ROLLUP_SHARDS, 1))
+    rows: List[Dict[str, Any]] = []
+    for granularity in RollupGranularity:
+        start = bucket_start(at, granularity)
+        for (model_id, user_id), counters in deltas.items():
+            rows.append({
+                "granularity": granularity,
+                "bucket_start": start,
+                "model_id": model_id,
+                "user_id": user_id,
+                "shard": shard,
+                **{name: counters.get(name, 0) for name in analytics_crud.ROLLUP_COUNTERS},
+            })
+    analytics_crud.upsert_increments(session, rows)
+
+
+def record_created(session: Session, model_id: int, user_id: int, rows: int, cost: Decimal) -> None:
+    """Учесть созданный запрос в агрегатах (в текущей транзакции)."""
+    _apply(session, {(model_id, user_id): {"requests": 1, "rows_scored": rows, "revenue": cost}})
+
+
+def record_completed(
+    session: Session,
+    completions: Iterable[Tuple[int, int, MLRequestStatus, Decimal]],
+    queued: bool = False,
+) -> None:
+    """
+    Учесть завершение запросов в агрегатах (в текущей транзакции).
+    completions: кортежи (model_id, user_id, status, cost); queued — результаты воркеров очереди задач.
+    """
+    deltas: Deltas = defaultdict(_empty_counters)
+    for model_id, user_id, status, cost in completions:
+        counters = deltas[(model_id, user_id)]
+        if queued:
+            counters["queue_completed"] += 1
+        if status == MLRequestStatus.success:
+            counters["succeeded"] += 1
+        else:
+            counters["failed"] += 1
+            counters["refunds"] += cost
+    _apply(session, deltas)
+
+
+class AnalyticsService:
+    def __init__(self, session: Session) -> None:
+        self.session = session
+
+    def get_buckets(
+        self,
+        granularity: RollupGranularity,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        user_id: Optional[int] = None,
+        group_by: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        rows = analytics_crud.get_buckets(
+            self.session,
+            granularity,
+            since=_as_utc_naive(since) if since else None,
+            until=_as_utc_naive(until) if until else None,
+            user_id=user_id,
+            group_by=group_by,
+        )
+        return [dict(row._mapping) for row in rows]
+
+    def get_totals(self, user_id: Optional[int] = None) -> Dict[str, Any]:
+        return dict(analytics_crud.get_totals(self.session, user_id)._mapping)
+
+    @transactional
+    def rebuild(self) -> int:
+        """
+        Пересчитывает агрегаты закрытых интервалов по истории запросов (сверка), не останавливая
+        запись текущих. Возвращает количество пересчитанных строк агрегатов.
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.app.ROLLUP_REBUILD_SETTLE)
+        return rebuild_rollups(self.session, cutoff)
+
+
+def rebuild_rollups(session: Session, cutoff: Optional[datetime] = None) -> int:
+    """
+    Пересчитывает агрегаты по истории запросов в текущей транзакции. Возвращает количество
+    пересчитанных строк агрегатов.
+
+    С cutoff пересчитываются только интервалы, начавшиеся раньше интервала, в который попадает
+    cutoff: живые инкременты пишутся в текущие интервалы и этих строк не касаются. История читается
+    без блокировок, таблица агрегатов блокируется только на замену пересчитанных строк.
+    Без cutoff (первичное заполнение миграцией) пересчитывается вся история под блокировкой
+    таблицы агрегатов на все время пересчета.
+    """
+    boundaries: Optional[Dict[RollupGranularity, datetime]] = None
+    until: Optional[datetime] = None
+    if cutoff is None:
+        analytics_crud.lock_for_rebuild(session)
+    else:
+        boundaries = {granularity: bucket_start(cutoff, granularity) for granularity in RollupGranularity}
+        until = boundaries[RollupGranularity.hour]
+    buckets: Dict[Tuple[Any, ...], Dict[str, Any]] = defaultdict(_empty_counters)
+
+    def bucket(at: datetime, granularity: RollupGranularity, fact: Any) -> Optional[Dict[str, Any]]:
+        start = bucket_start(at, granularity)
+        if boundaries is not None and start >= boundaries[granularity]:
+            return None
+        return buckets[(granularity, start, fact.model_id, fact.user_id)]
+
+    for fact in analytics_crud.iter_request_facts(session, settings.app.EXPORT_BATCH_SIZE, until):
+        for granularity in RollupGranularity:
+            created = bucket(fact.created_at, granularity, fact)
+            if created is not None:
+                created["requests"] += 1
+                created["rows_scored"] += fact.rows
+                created["revenue"] += fact.cost
+            if fact.status == MLRequestStatus.pending:
+                continue
+            completed = bucket(fact.completed_at or fact.created_at, granularity, fact)
+            if completed is None:
+                continue
+            # Опубликованные в очередь задач запросы завершены ее воркерами
+            if fact.is_published:
+                completed["queue_completed"] += 1
+            if fact.status == MLRequestStatus.success:
+                completed["succeeded"] += 1
+            else:
+                completed["failed"] += 1
+                completed["refunds"] += fact.cost
+
+    rows = [dict(zip(analytics_crud.ROLLUP_KEY, key), **counters) for key, counters in buckets.items()]
+    if boundaries is None:
+        analytics_crud.replace_all(session, rows)
+    else:
+        analytics_crud.lock_for_rebuild(session)
+        analytics_crud.replace_before(session, boundaries, rows)
+    logger.info(f"Агрегаты аналитики пересчитаны: {len(rows)} строк")
+    return len(rows)
@@ -1,6 +1,7 @@
-from decimal import Decimal
+from datetime import datetime, timedelta, timezone
+from decimal import ROUND_DOWN, Decimal
 import logging
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple
 
 from sqlalchemy import select
 from sqlalchemy.orm import Session
@@ -8,6 +9,7 @@ from app.crud import billing as billing_crud
 
 from app.config import settings
 from app.models import (
+    MLRequest,
     Transaction,
     TransactionStatus,
     TransactionType,
@@ -70,9 +72,17 @@ class BillingService:
         cost: Decimal,
     ) -> None:
         """
-        Атомарно списывает средства с баланса пользователя.
-
+        Атомарно списывает средства: из свободного шарда заранее авторизованных средств,
+        если такой есть; иначе по частям из всех шардов (с ожиданием занятых); иначе с баланса
+        пользователя. Ни шард, ни баланс не уходят в минус.
         """
+        now = _utcnow()
+        if billing_crud.debit_hold(self.session, user.id, cost, now):
+            return
+        # Все шарды заняты параллельными списаниями или ни в одном не хватает суммы целиком:
+        # средства уже перенесены с баланса в шарды, поэтому без этого шага был бы ложный 402
+        if billing_crud.debit_holds_split(self.session, user.id, cost, now):
+            return
         ok = billing_crud.update_user_balance(self.session, user.id, amount=-cost)
         if not ok:
             logger.error(f"Пользователь {user.id}: Недостаточно средств для списания {cost}")
@@ -83,7 +93,7 @@ class BillingService:
         user_id: int,
         cost: Decimal,
         description: str,
-        ml_request_id: int,
+        ml_request: MLRequest,
         status: TransactionStatus = TransactionStatus.approved,
     ) -> Transaction:
         """
@@ -97,7 +107,7 @@ class BillingService:
             type=TransactionType.payment,
             status=status,
             description=description,
-            ml_request_id=ml_request_id,
+            ml_request=ml_request,
         )
 
     def refund_funds(
@@ -106,7 +116,9 @@ class BillingService:
         cost: Decimal,
         reason: str = "Возврат средств"
     ) -> None:
-        billing_crud.update_user_balance(self.session, user.id, amount=cost)
+        # Пользователю с авторизованными средствами возврат идет в шард, не задевая строку пользователя
+        if not billing_crud.credit_hold(self.session, user.id, cost):
+            billing_crud.update_user_balance(self.session, user.id, amount=cost)
 
         # Создаем транзакцию возврата для аудита
         billing_crud.create_transaction_record(
@@ -119,5 +131,95 @@ class BillingService:
         )
         logger.info(f"Средства {cost} подготовлены к возврату пользователю {user.id}. Причина: {reason}")
 
+    def refund_batch(self, refunds: List[Tuple[int, Decimal, str]]) -> None:
+        """
+        Пакетный возврат средств: (user_id, сумма, причина) для каждого запроса.
+        Балансы обновляются одним UPDATE на пачку, аудит пишется одной вставкой.
+        """
+        if not refunds:
+            return
+        totals: Dict[int, Decimal] = {}
+        for user_id, cost, _ in refunds:
+            totals[user_id] = totals.get(user_id, Decimal("0.0")) + cost
+
+        to_balance = dict(totals)
+        for user_id in sorted(billing_crud.users_with_holds(self.session, list(totals))):
+            if billing_crud.credit_hold(self.session, user_id, totals[user_id]):
+                del to_balance[user_id]
+        billing_crud.bulk_credit_balances(self.session, to_balance)
+        billing_crud.bulk_create_transaction_records(self.session, [
+            {
+                "user_id": user_id,
+                "amount": cost,
+                "type": TransactionType.replenish,
+                "status": TransactionStatus.approved,
+                "description": reason,
+            }
+            for user_id, cost, reason in refunds
+        ])
+        logger.info(f"Пакетный возврат средств: {len(refunds)} запросов, {len(totals)} пользователей")
+
     def get_transactions_history(self, user_id: int) -> List[Transaction]:
         return billing_crud.get_by_user_id(self.session, user_id)
+
+    @transactional
+    def authorize_hold(self, user: User, amount: Decimal, shards: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Переносит сумму с баланса в шарды блокировки (одно списание со строки пользователя).
+        Дальнейшие оплаты запросов идут из шардов до истечения HOLD_TTL_SECONDS.
+        Перенос внутренний: общая сумма средств и журнал транзакций не меняются.
+        """
+        shards = shards or settings.app.HOLD_SHARDS
+        if not billing_crud.update_user_balance(self.session, user.id, amount=-amount):
+            logger.error(f"Пользователь {user.id}: Недостаточно средств для блокировки {amount}")
+            raise InsufficientFundsException
+
+        share = (amount / shards).quantize(Decimal("0.01"), rounding=ROUND_DOWN)
+        amounts = {shard: share for shard in range(shards)}
+        amounts[0] += amount - share * shards
+        expires_at = _utcnow() + timedelta(seconds=settings.app.HOLD_TTL_SECONDS)
+        billing_crud.add_to_holds(self.session, user.id, amounts, expires_at)
+        logger.info(f"Пользователь {user.id}: авторизовано {amount} в {shards} шардах до {expires_at}")
+        return self.get_holds_summary(user.id)
+
+    def get_holds_summary(self, user_id: int) -> Dict[str, Any]:
+        holds = billing_crud.get_holds(self.session, user_id)
+        return {
+            "balance": self.get_user_balance(user_id),
+            "held": sum((hold.amount for hold in holds), Decimal("0.00")),
+            "shards": len(holds),
+            "expires_at": max((hold.expires_at for hold in holds), default=None),
+        }
+
+    @transactional
+    def release_holds(self, user: User) -> Dict[str, Any]:
+        """
+        Досрочно возвращает остаток авторизованных средств на баланс.
+        Шарды, занятые списаниями, ожидаются: возвращается весь остаток, а не его часть.
+        """
+        holds = billing_crud.lock_holds(self.session, user_id=user.id, skip_locked=False)
+        billing_crud.delete_holds(self.session, [hold.id for hold in holds])
+        billing_crud.update_user_balance(self.session, user.id, sum((hold.amount for hold in holds), Decimal("0.00")))
+        return self.get_holds_summary(user.id)
+
+    @transactional
+    def settle_expired_holds(self) -> int:
+        """Возвращает на баланс остатки истекших шардов. Возвращает количество закрытых шардов."""
+        holds = billing_crud.lock_holds(
+            self.session,
+            expired_before=_utcnow(),
+            limit=settings.app.HOLD_SETTLE_BATCH_SIZE,
+        )
+        totals: Dict[int, Decimal] = {}
+        for hold in holds:
+            totals[hold.user_id] = totals.get(hold.user_id, Decimal("0.00")) + hold.amount
+        billing_crud.delete_holds(self.session, [hold.id for hold in holds])
+        billing_crud.bulk_credit_balances(self.session, totals)
+        if holds:
+            logger.info(f"Возврат блокировок на баланс: {len(holds)} шардов, {len(totals)} пользователей")
+        return len(holds)
+
+
+def _utcnow() -> datetime:
+    """Сроки блокировок хранятся в UTC без tzinfo."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
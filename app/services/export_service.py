@@ -0,0 +1,189 @@
+import csv
+import io
+import json
+from datetime import datetime
+from decimal import Decimal
+from enum import Enum
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Union
+
+from fastapi.responses import StreamingResponse
+
+from app.config import settings
+from app.utils import UnknownResultColumnsException
+from common.feature_columns import AGE_COLUMN, PATIENT_COLUMN, REQUIRED_ALIAS_ORDER
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+class ResultsFormat(str, Enum):
+    csv = "csv"
+    parquet = "parquet"
+
+
+_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Колонки выгрузки результатов: номер запроса, номер строки в нем, признаки, предсказание, статус запроса
+RESULT_COLUMN = "Результат"
+RESULT_COLUMNS = ("request_id", "row", *REQUIRED_ALIAS_ORDER, RESULT_COLUMN, "status")
+_RESULT_TYPES = {
+    "request_id": "int64",
+    "row": "int64",
+    PATIENT_COLUMN: "string",
+    AGE_COLUMN: "float64",
+    RESULT_COLUMN: "string",
+    "status": "string",
+}
+
+
+def _to_json_value(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется в JSON")
+
+
+def _to_csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=_to_json_value)
+    return value
+
+
+def stream_rows(rows: Iterable[Mapping[str, Any]], columns: Sequence[str], fmt: ExportFormat) -> Iterator[str]:
+    """
+    Сериализует строки в NDJSON или CSV по мере чтения из БД.
+    Строки накапливаются в небольшом буфере (EXPORT_CHUNK_SIZE байт) и отдаются кусками,
+    поэтому память не зависит от размера выгрузки.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == ExportFormat.csv else None
+    if writer is not None:
+        writer.writerow(columns)
+
+    for row in rows:
+        if writer is not None:
+            writer.writerow([_to_csv_value(row[column]) for column in columns])
+        else:
+            buffer.write(json.dumps({column: row[column] for column in columns}, ensure_ascii=False, default=_to_json_value))
+            buffer.write("\n")
+
+        if buffer.tell() >= settings.app.EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def resolve_result_columns(columns: Optional[Sequence[str]]) -> List[str]:
+    """Выбранные колонки результатов (через повтор параметра или запятую); по умолчанию все."""
+    selected = [name.strip() for value in columns or () for name in value.split(",") if name.strip()]
+    if not selected:
+        return list(RESULT_COLUMNS)
+    unknown = [name for name in selected if name not in RESULT_COLUMNS]
+    if unknown:
+        raise UnknownResultColumnsException(unknown, list(RESULT_COLUMNS))
+    return list(dict.fromkeys(selected))
+
+
+def _as_text(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _row_predictions(prediction: Any, count: int) -> List[Optional[str]]:
+    """Предсказания по строкам запроса: список по одному на строку или одно значение на все строки."""
+    if isinstance(prediction, list) and len(prediction) == count:
+        return [_as_text(value) for value in prediction]
+    if isinstance(prediction, list) and len(prediction) == 1:
+        return [_as_text(prediction[0])] * count
+    return [_as_text(prediction)] * count
+
+
+def expand_results(requests: Iterable[Mapping[str, Any]], columns: Sequence[str]) -> Iterator[Dict[str, Any]]:
+    """Разворачивает запросы в строки «признаки + предсказание» (по одной на строку входных данных)."""
+    for request in requests:
+        items = request["input_data"] if isinstance(request["input_data"], list) else [request["input_data"]]
+        status = getattr(request["status"], "value", request["status"])
+        for row, (features, prediction) in enumerate(zip(items, _row_predictions(request["prediction"], len(items))), 1):
+            values = {"request_id": request["id"], "row": row, RESULT_COLUMN: prediction, "status": status}
+            yield {column: values[column] if column in values else features.get(column) for column in columns}
+
+
+class _ChunkSink(io.RawIOBase):
+    """Файл для ParquetWriter, который отдает записанные байты кусками и помнит общую позицию."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _parquet_chunks(rows: Iterable[Mapping[str, Any]], columns: Sequence[str]) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(column, pa.type_for_alias(_RESULT_TYPES.get(column, "int64"))) for column in columns])
+    sink = _ChunkSink()
+    rows = iter(rows)
+    # Каждая пачка строк — отдельная row group: в памяти одновременно не больше EXPORT_BATCH_SIZE строк
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        while batch := list(islice(rows, settings.app.EXPORT_BATCH_SIZE)):
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def stream_results(rows: Iterable[Mapping[str, Any]], columns: Sequence[str], fmt: ResultsFormat) -> Iterator[Union[str, bytes]]:
+    """Потоковая выгрузка строк результатов в CSV или Parquet."""
+    if fmt == ResultsFormat.parquet:
+        return _parquet_chunks(rows, columns)
+    return stream_rows(rows, columns, ExportFormat.csv)
+
+
+def export_response(
+    chunks: Iterator[Union[str, bytes]],
+    fmt: Union[ExportFormat, ResultsFormat],
+    filename: str,
+) -> StreamingResponse:
+    """Потоковый ответ с выгрузкой в виде файла."""
+    return StreamingResponse(
+        chunks,
+        media_type=_MEDIA_TYPES[fmt.value],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt.value}"'},
+    )
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from time import monotonic
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import Request
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database.database import session_maker
+from app.crud import analytics as analytics_crud
+from app.models import RollupGranularity
+from app.services.admission import admission_control
+from app.services.analytics_service import bucket_start
+from app.services.rpc_deadline import rpc_deadlines
+from app.utils import ServiceUnavailableException
+
+logger = logging.getLogger(__name__)
+
+
+class HealthCollector:
+    """
+    Фоновый сбор состояния сервиса (БД, RabbitMQ, очереди, consumer результатов).
+    /health отдает последний снимок и не занимает соединения с БД и каналы брокера на каждый запрос.
+    Принудительное обновление (max_age) выполняется не чаще HEALTH_MIN_REFRESH и одно на все запросы.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = session_maker,
+        mq_service: Optional[Any] = None,
+        results_consumer: Optional[Any] = None,
+    ) -> None:
+        self.session_factory = session_factory
+        self.mq_service = mq_service
+        self.results_consumer = results_consumer
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._collected_at: float = 0.0
+        self._lock = asyncio.Lock()
+        self._stop_event = asyncio.Event()
+
+    def _check_db(self) -> None:
+        with self.session_factory() as session:
+            session.execute(text("SELECT 1"))
+
+    def _sample_drain(self) -> None:
+        """
+        Замер счетчика запросов, завершенных воркерами очереди задач за текущий и предыдущий час.
+        Скорость разбора считается по приросту счетчика между замерами (см. AdmissionController).
+        """
+        since = bucket_start(datetime.now(timezone.utc) - timedelta(hours=1), RollupGranularity.hour)
+        with self.session_factory() as session:
+            completed = analytics_crud.count_completed_since(session, since)
+        admission_control.observe_drain(since, completed)
+
+    async def _queues_info(self) -> Dict[str, Any]:
+        queues_info: Dict[str, Any] = {}
+        async with self.mq_service.channel_pool.acquire() as channel:
+            async def q_info(name: str) -> Dict[str, Any]:
+                try:
+                    q = await channel.declare_queue(name, durable=True, passive=True)
+                    dr = getattr(q, "declaration_result", None)
+                    msg = getattr(dr, "message_count", None) if dr else None
+                    cons = getattr(dr, "consumer_count", None) if dr else None
+                    return {"messages": msg, "consumers": cons}
+                except Exception as qe:
+                    return {"error": str(qe)}
+
+            queues_info["tasks_queue"] = await q_info(settings.mq.QUEUE_NAME)
+            queues_info["rpc_queue"] = await q_info(settings.mq.RPC_QUEUE_NAME)
+            queues_info["results_queue"] = await q_info(settings.mq.RESULTS_QUEUE_NAME)
+        return queues_info
+
+    async def collect(self) -> Dict[str, Any]:
+        """Выполняет все проверки и сохраняет снимок.
+        Статусы:
+        - ok: всё в порядке
+        - degraded: ядро доступно, но часть компонентов ограничена (нет воркеров/consumer'ов, consumer результатов остановлен)
+        - error: критический сбой (БД или RabbitMQ недоступны)
+        """
+        timeout = settings.app.HEALTH_CHECK_TIMEOUT
+        result: Dict[str, Any] = {
+            "status": "ok",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            # для обратной совместимости с существующими проверками
+            "database": "connected",
+            "rabbitmq": "connected",
+            # подробности
+            "workers": {},
+            "results_consumer": "unknown",
+            "details": {}
+        }
+
+        # 1) База данных (в отдельном потоке, чтобы не блокировать event loop)
+        try:
+            await asyncio.wait_for(asyncio.to_thread(self._check_db), timeout=timeout)
+        except Exception as e:
+            logger.error(f"Health check failed: database error: {e!r}")
+            result["database"] = "disconnected"
+            result["status"] = "error"
+            result["details"]["database_error"] = str(e) or type(e).__name__
+
+        # 2) RabbitMQ + очереди и consumers
+        queues_info: Dict[str, Any] = {}
+        if result["status"] != "error":  # продолжаем проверку MQ только если БД ок
+            try:
+                if self.mq_service is None:
+                    raise ConnectionError("RabbitMQ service is not initialized")
+                queues_info = await asyncio.wait_for(self._queues_info(), timeout=timeout)
+            except Exception as e:
+                logger.error(f"Health check failed: rabbitmq error: {e!r}")
+                result["rabbitmq"] = "disconnected"
+                result["status"] = "error"
+                result["details"]["rabbitmq_error"] = str(e) or type(e).__name__
+
+        result["workers"] = queues_info
+        # Глубина очередей нужна для адаптивных дедлайнов /predict и контроля допуска задач
+        rpc_deadlines.observe_queue(queues_info.get("rpc_queue"))
+        admission_control.observe_queue(queues_info.get("tasks_queue"))
+        if result["status"] != "error":
+            try:
+                await asyncio.wait_for(asyncio.to_thread(self._sample_drain), timeout=timeout)
+            except Exception as e:
+                logger.warning(f"Не удалось оценить скорость разбора очереди: {e!r}")
+
+        # 3) ResultsConsumer: фоновая задача FastAPI или отдельный процесс (app.consumer_main)
+        rc = self.results_consumer
+        if not settings.app.RESULTS_CONSUMER_ENABLED:
+            # Внешний consumer виден только как подписчик очереди результатов
+            results_queue = queues_info.get("results_queue") or {}
+            rc_ok = bool(results_queue.get("consumers"))
+            result["results_consumer"] = "external" if rc_ok else "disconnected"
+        else:
+            rc_ok = False
+            if rc is not None:
+                conn_ok = bool(rc.connection and not rc.connection.is_closed)
+                ch_ok = bool(rc.channel and not rc.channel.is_closed)
+                rc_ok = conn_ok and ch_ok
+            result["results_consumer"] = "connected" if rc_ok else "disconnected"
+
+        # 4) Итоговый статус (degraded, если ядро ок, но нет воркеров/consumer'ов или consumer результатов упал)
+        if result["status"] != "error":
+            def _consumers(d: Dict[str, Any]) -> int:
+                try:
+                    v = d.get("consumers")
+                    return int(v) if v is not None else 0
+                except Exception:
+                    return 0
+            total_consumers = sum(_consumers(v) for v in queues_info.values() if isinstance(v, dict))
+            degraded_reasons: list[str] = []
+            if total_consumers == 0:
+                degraded_reasons.append("no_workers")
+            if result["results_consumer"] == "disconnected":
+                degraded_reasons.append("results_consumer_down")
+            result["workers"]["total_consumers"] = total_consumers
+            if degraded_reasons:
+                result["status"] = "degraded"
+                result["details"]["degraded_reasons"] = degraded_reasons
+
+        self._snapshot = result
+        self._collected_at = monotonic()
+        return result
+
+    def age(self) -> float:
+        return monotonic() - self._collected_at
+
+    async def get_snapshot(self, max_age: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Последний снимок с его возрастом в секундах. Снимок пересобирается, если его нет
+        или он старше max_age (но не чаще HEALTH_MIN_REFRESH).
+        """
+        max_age = max(max_age, settings.app.HEALTH_MIN_REFRESH) if max_age is not None else None
+        if self._snapshot is None or (max_age is not None and self.age() > max_age):
+            async with self._lock:
+                # Пока ждали блокировку, снимок мог обновить другой запрос
+                if self._snapshot is None or (max_age is not None and self.age() > max_age):
+                    await self.collect()
+        return {**self._snapshot, "age_seconds": round(self.age(), 3)}
+
+    async def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                async with self._lock:
+                    await self.collect()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Ошибка сбора состояния сервиса: {e}")
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=settings.app.HEALTH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self) -> None:
+        self._stop_event.set()
+
+
+def get_health_collector(request: Request) -> HealthCollector:
+    """Зависимость для получения сборщика состояния из состояния приложения."""
+    collector = getattr(request.app.state, "health_collector", None)
+    if collector is None:
+        raise ServiceUnavailableException
+    return collector
@@ -0,0 +1,46 @@
+import asyncio
+import logging
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database.database import session_maker
+from app.services.billing_service import BillingService
+
+logger = logging.getLogger(__name__)
+
+
+class HoldSettler:
+    """
+    Фоновая сверка блокировок: остатки истекших шардов возвращаются на User.balance.
+    Шарды блокируются с SKIP LOCKED, поэтому сверку можно запускать в каждой реплике API.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = session_maker) -> None:
+        self.session_factory = session_factory
+        self._stop_event = asyncio.Event()
+
+    def settle_once(self) -> int:
+        with self.session_factory() as session:
+            return BillingService(session).settle_expired_holds()
+
+    async def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                # Работа с БД синхронная, поэтому выносим её из event loop
+                settled = await asyncio.to_thread(self.settle_once)
+                if settled >= settings.app.HOLD_SETTLE_BATCH_SIZE:
+                    # Истекших шардов больше пачки — сразу берем следующую
+                    continue
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Ошибка возврата блокировок на баланс: {e}")
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=settings.app.HOLD_SETTLE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self) -> None:
+        self._stop_event.set()
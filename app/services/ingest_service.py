@@ -0,0 +1,426 @@
+import csv
+import logging
+import tempfile
+from datetime import datetime, timezone
+from enum import Enum
+from itertools import chain
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.crud import export as export_crud
+from app.crud import ingest as ingest_crud
+from app.database.database import session_maker
+from app.models import IngestJob, IngestJobStatus, User
+from app.schemas.ml_model_schemas import SMLModel
+from app.services.admission import admission_control
+from app.services.billing_service import BillingService
+from app.services.export_service import (
+    ExportFormat,
+    ResultsFormat,
+    expand_results,
+    resolve_result_columns,
+    stream_results,
+    stream_rows,
+)
+from app.services.ml_service_helpers import build_ml_task, create_pending_request, resolve_active_model
+from app.services.outbox_relay import enqueue_outbox_task
+from app.utils import (
+    AppException,
+    IngestFileInvalidException,
+    IngestFileTooLargeException,
+    IngestFormatNotSupportedException,
+    IngestJobNotFoundException,
+    InsufficientFundsException,
+    RequestRejectedException,
+    transactional,
+)
+from common.feature_columns import (
+    AGE_COLUMN,
+    BINARY_COLUMNS,
+    MAX_AGE,
+    MIN_AGE,
+    NEGATIVE_STATUSES,
+    PATIENT_COLUMN,
+    POSITIVE_STATUSES,
+    REQUIRED_ALIAS_ORDER,
+    resolve_columns,
+)
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class IngestFormat(str, Enum):
+    csv = "csv"
+    xlsx = "xlsx"
+    parquet = "parquet"
+
+
+_CONTENT_TYPES = {
+    "text/csv": IngestFormat.csv,
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": IngestFormat.xlsx,
+    "application/vnd.apache.parquet": IngestFormat.parquet,
+    "application/x-parquet": IngestFormat.parquet,
+}
+
+REJECT_COLUMNS = ["row", "errors"]
+
+
+def detect_format(filename: Optional[str], content_type: Optional[str]) -> IngestFormat:
+    """Формат файла по расширению имени, иначе по Content-Type."""
+    if filename and "." in filename:
+        extension = filename.rsplit(".", 1)[1].lower()
+        try:
+            return IngestFormat(extension)
+        except ValueError:
+            pass
+    if content_type:
+        fmt = _CONTENT_TYPES.get(content_type.split(";", 1)[0].strip().lower())
+        if fmt:
+            return fmt
+    raise IngestFormatNotSupportedException
+
+
+async def spool_upload(chunks: AsyncIterator[bytes]) -> IO[bytes]:
+    """
+    Сохраняет тело запроса во временный файл по мере получения.
+    До INGEST_SPOOL_MEMORY байт файл держится в памяти, дальше сбрасывается на диск;
+    загрузка прерывается, как только размер превысит INGEST_MAX_BYTES.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.app.INGEST_SPOOL_MEMORY)
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > settings.app.INGEST_MAX_BYTES:
+                raise IngestFileTooLargeException
+            spool.write(chunk)
+        if size == 0:
+            raise IngestFileInvalidException("Файл пуст")
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def _sniff_delimiter(file: IO[bytes]) -> str:
+    sample = file.read(64 * 1024).decode("utf-8-sig", errors="replace")
+    file.seek(0)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",;\t").delimiter
+    except csv.Error:
+        return ","
+
+
+def _csv_chunks(file: IO[bytes], rows: int) -> Iterator["pd.DataFrame"]:
+    import pandas as pd
+
+    reader = pd.read_csv(
+        file,
+        sep=_sniff_delimiter(file),
+        dtype=str,
+        encoding="utf-8-sig",
+        skipinitialspace=True,
+        chunksize=rows,
+    )
+    with reader:
+        yield from reader
+
+
+def _xlsx_chunks(file: IO[bytes], rows: int) -> Iterator["pd.DataFrame"]:
+    import pandas as pd
+    from openpyxl import load_workbook
+
+    # read_only: строки листа читаются из архива по одной, без загрузки всей книги
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        values = workbook.active.iter_rows(values_only=True)
+        header = next(values, None)
+        if header is None:
+            return
+        columns = ["" if name is None else str(name) for name in header]
+        width = len(columns)
+        batch: List[Tuple[Any, ...]] = []
+        for row in values:
+            batch.append(tuple(row[:width]) + (None,) * (width - len(row)))
+            if len(batch) >= rows:
+                yield pd.DataFrame(batch, columns=columns, dtype=object)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns, dtype=object)
+    finally:
+        workbook.close()
+
+
+def _parquet_chunks(file: IO[bytes], rows: int) -> Iterator["pd.DataFrame"]:
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(file).iter_batches(batch_size=rows):
+        yield batch.to_pandas()
+
+
+_READERS = {
+    IngestFormat.csv: _csv_chunks,
+    IngestFormat.xlsx: _xlsx_chunks,
+    IngestFormat.parquet: _parquet_chunks,
+}
+
+
+def read_chunks(file: IO[bytes], fmt: IngestFormat, rows: int) -> Iterator["pd.DataFrame"]:
+    """Читает файл частями по rows строк; ошибки разбора превращаются в 422."""
+    try:
+        yield from _READERS[fmt](file, rows)
+    except AppException:
+        raise
+    except ImportError as e:
+        logger.error(f"Чтение формата {fmt.value} недоступно: {e}")
+        raise IngestFormatNotSupportedException
+    except Exception as e:
+        raise IngestFileInvalidException(str(e)) from e
+
+
+def _reject_rows(values: "pd.DataFrame", reasons: "pd.Series") -> "pd.DataFrame":
+    """Отклоненные строки: номер строки данных (с 1), причины и значения признаков."""
+    rejects = values.reindex(columns=REQUIRED_ALIAS_ORDER)
+    rejects.insert(0, "errors", reasons)
+    rejects.insert(0, "row", values.index + 1)
+    return rejects
+
+
+def _reject_records(job_id: int, rejects: "pd.DataFrame") -> List[Dict[str, Any]]:
+    """Отклоненные строки части файла в виде строк таблицы ingest_reject."""
+    values = rejects[REQUIRED_ALIAS_ORDER].astype(object)
+    values = values.where(values.notna(), None).to_dict("records")
+    return [
+        {"ingest_job_id": job_id, "row_number": int(row), "errors": errors, "features": features}
+        for row, errors, features in zip(rejects["row"], rejects["errors"], values)
+    ]
+
+
+def _flatten_rejects(rows: Iterator[Mapping[str, Any]]) -> Iterator[Dict[str, Any]]:
+    for row in rows:
+        yield {"row": row["row"], "errors": row["errors"], **row["features"]}
+
+
+def validate_chunk(frame: "pd.DataFrame", first_row: int) -> Tuple["pd.DataFrame", "pd.DataFrame"]:
+    """
+    Векторная проверка части файла по тем же правилам, что и SMLFeatureItem.
+    Заголовки сопоставляются с признаками по синонимам, отсутствующие бинарные признаки
+    и пустые значения считаются 0. Возвращает принятые признаки (индекс — номер строки данных с 0)
+    и отклоненные строки с причинами.
+    """
+    import numpy as np
+    import pandas as pd
+
+    mapping = resolve_columns(frame.columns)
+    raw = frame[list(mapping)].rename(columns=mapping).reindex(columns=REQUIRED_ALIAS_ORDER)
+    raw.index = pd.RangeIndex(first_row, first_row + len(raw))
+    present = raw.notna()
+    text = raw.where(present, "").astype(str).apply(lambda column: column.str.strip())
+    present &= text.ne("")
+
+    problems: List[Tuple["pd.Series", str]] = []
+    age = pd.to_numeric(text[AGE_COLUMN].str.replace(",", ".", regex=False), errors="coerce")
+    problems.append((~present[AGE_COLUMN], f"{AGE_COLUMN}: значение обязательно"))
+    problems.append((present[AGE_COLUMN] & age.isna(), f"{AGE_COLUMN}: ожидается число"))
+    problems.append((
+        age.notna() & ~age.between(MIN_AGE, MAX_AGE),
+        f"{AGE_COLUMN}: значение должно быть в диапазоне {MIN_AGE}..{MAX_AGE}",
+    ))
+
+    features = pd.DataFrame(
+        {
+            PATIENT_COLUMN: text[PATIENT_COLUMN].where(present[PATIENT_COLUMN], None),
+            AGE_COLUMN: age,
+        },
+        index=raw.index,
+    )
+    for column in BINARY_COLUMNS:
+        lower = text[column].str.lower()
+        positive = lower.isin(POSITIVE_STATUSES)
+        negative = lower.isin(NEGATIVE_STATUSES) | ~present[column]
+        problems.append((~(positive | negative), f"{column}: допустимы 0/1 или статусы (да/нет)"))
+        features[column] = np.where(positive, 1, 0)
+
+    reasons = pd.Series("", index=raw.index)
+    for mask, message in problems:
+        reasons = reasons.mask(mask, reasons + message + "; ")
+    rejected = reasons.ne("")
+
+    return features.loc[~rejected], _reject_rows(text.loc[rejected], reasons.loc[rejected].str.rstrip("; "))
+
+
+def _to_records(features: "pd.DataFrame") -> List[Dict[str, Any]]:
+    """Строки признаков в виде JSON-совместимых словарей с алиасами (как в MLTask.features)."""
+    records = features[REQUIRED_ALIAS_ORDER].astype(object)
+    return records.where(records.notna(), None).to_dict("records")
+
+
+class IngestService:
+    """
+    Загрузка файлов с признаками: потоковое чтение частями, векторная проверка и постановка
+    задач в очередь. Каждая часть файла — отдельный ML-запрос со своим списанием и задачей в outbox,
+    все они ссылаются на одну запись IngestJob.
+    """
+
+    def __init__(self, session: Session, session_factory: Callable[[], Session] = session_maker) -> None:
+        self.session = session
+        self.session_factory = session_factory
+        self.billing_service = BillingService(session)
+
+    def ingest(self, user: User, file: IO[bytes], fmt: IngestFormat, filename: Optional[str] = None) -> IngestJob:
+        import pandas as pd
+
+        chunks = read_chunks(file, fmt, settings.app.INGEST_CHUNK_ROWS)
+        # Первую часть читаем до создания записи: файл без колонки возраста отклоняется целиком (422)
+        first = next(chunks, None)
+        if first is None:
+            raise IngestFileInvalidException("В файле нет строк с данными")
+        if AGE_COLUMN not in resolve_columns(first.columns).values():
+            raise IngestFileInvalidException(f"Не найдена колонка «{AGE_COLUMN}»")
+
+        model = resolve_active_model(self.session)
+        job = self._create_job(user, filename, fmt)
+        logger.info(f"Загрузка №{job.id}: файл {filename or '-'} ({fmt.value}) от пользователя {user.id}")
+
+        first_row = 0
+        # Причина, по которой части файла перестали отправляться (нет средств, перегрузка)
+        stop_reason: Optional[str] = None
+        try:
+            for frame in chain([first], chunks):
+                accepted, rejected = validate_chunk(frame, first_row)
+                first_row += len(frame)
+                submitted = False
+                if not accepted.empty and stop_reason is None:
+                    stop_reason = self._submit_chunk(job, user, accepted, len(frame), rejected, model)
+                    submitted = stop_reason is None
+                if not submitted:
+                    if not accepted.empty:
+                        # Оставшиеся строки отдаются в файле отклоненных
+                        unsent = _reject_rows(accepted, pd.Series(stop_reason, index=accepted.index))
+                        rejected = pd.concat([part for part in (rejected, unsent) if not part.empty])
+                    self._record_chunk(job, len(frame), rejected)
+        except IngestFileInvalidException as e:
+            logger.warning(f"Загрузка №{job.id} прервана на строке {first_row + 1}: {e.detail}")
+            return self._finish_job(job, IngestJobStatus.failed, error=str(e.detail))
+        return self._finish_job(job, IngestJobStatus.completed)
+
+    @transactional
+    def _create_job(self, user: User, filename: Optional[str], fmt: IngestFormat) -> IngestJob:
+        return ingest_crud.create_job(self.session, user.id, filename, fmt.value)
+
+    @transactional
+    def _submit_chunk(
+        self,
+        job: IngestJob,
+        user: User,
+        accepted: "pd.DataFrame",
+        rows: int,
+        rejected: "pd.DataFrame",
+        model: SMLModel,
+    ) -> Optional[str]:
+        """
+        Создает ML-запрос по принятым строкам части файла, ставит задачу в outbox
+        и записывает отклоненные строки части.
+        Лимит незавершенных запросов пользователя проверяется один раз для всей загрузки
+        (загрузка в нем — одна единица), а SLA очереди — для каждой части: каждая часть — отдельная
+        задача. Возвращает причину, если часть не отправлена (списание не выполняется,
+        записей не остается), иначе None.
+        """
+        try:
+            admission_control.check_queue()
+        except RequestRejectedException as e:
+            return e.detail
+        features = _to_records(accepted)
+        try:
+            db_request = create_pending_request(self.session, self.billing_service, user, features, model)
+        except InsufficientFundsException:
+            return "Недостаточно средств на балансе"
+        db_request.ingest_job_id = job.id
+        db_request.message = f"Часть загрузки №{job.id}"
+        enqueue_outbox_task(self.session, db_request, build_ml_task(db_request, features, user.id, model))
+        ingest_crud.add_rejects(self.session, _reject_records(job.id, rejected))
+        ingest_crud.update_job(
+            self.session,
+            job,
+            rows_total=job.rows_total + rows,
+            rows_accepted=job.rows_accepted + len(features),
+            rows_rejected=job.rows_rejected + len(rejected),
+            requests_created=job.requests_created + 1,
+        )
+        return None
+
+    @transactional
+    def _record_chunk(self, job: IngestJob, rows: int, rejected: "pd.DataFrame") -> IngestJob:
+        """Учитывает часть файла, по которой запрос не создавался, и записывает ее отклоненные строки."""
+        ingest_crud.add_rejects(self.session, _reject_records(job.id, rejected))
+        return ingest_crud.update_job(
+            self.session,
+            job,
+            rows_total=job.rows_total + rows,
+            rows_rejected=job.rows_rejected + len(rejected),
+        )
+
+    @transactional
+    def _finish_job(
+        self,
+        job: IngestJob,
+        status: IngestJobStatus,
+        error: Optional[str] = None,
+    ) -> IngestJob:
+        return ingest_crud.update_job(
+            self.session,
+            job,
+            status=status,
+            error=error,
+            completed_at=datetime.now(timezone.utc),
+        )
+
+    def get_job(self, job_id: int, user_id: int) -> IngestJob:
+        job = ingest_crud.get_job(self.session, job_id, user_id)
+        if not job:
+            raise IngestJobNotFoundException
+        return job
+
+    def get_rejects(self, job_id: int, user_id: int) -> Iterator[str]:
+        """Потоковая выгрузка отклоненных строк загрузки в CSV (только заголовок, если отклоненных нет)."""
+        self.get_job(job_id, user_id)
+        rows = export_crud.iter_rejects(self.session_factory, settings.app.EXPORT_BATCH_SIZE, job_id)
+        return stream_rows(_flatten_rejects(rows), REJECT_COLUMNS + REQUIRED_ALIAS_ORDER, ExportFormat.csv)
+
+    def export_results(
+        self,
+        job_id: int,
+        user_id: int,
+        fmt: ResultsFormat,
+        columns: Optional[Sequence[str]] = None,
+    ) -> Iterator[Union[str, bytes]]:
+        """
+        Потоковая выгрузка строк всех запросов загрузки с предсказаниями.
+        Для запросов, которые еще выполняются, результат пустой, статус — pending.
+        """
+        selected = resolve_result_columns(columns)
+        self.get_job(job_id, user_id)
+        rows = export_crud.iter_request_results(
+            self.session_factory, settings.app.EXPORT_BATCH_SIZE, user_id, ingest_job_id=job_id
+        )
+        return stream_results(expand_results(rows, selected), selected, fmt)
@@ -0,0 +1,37 @@
+import asyncio
+import logging
+
+from app.config import settings
+from app.utils.metrics import EVENT_LOOP_LAG
+
+logger = logging.getLogger(__name__)
+
+
+class EventLoopLagMonitor:
+    """
+    Замер задержки event loop: таймер на interval секунд срабатывает позже на время,
+    пока loop был занят синхронным кодом (сериализация, блокирующие вызовы в async-обработчиках).
+    """
+
+    def __init__(self, interval: float = settings.metrics.LOOP_LAG_INTERVAL) -> None:
+        self.interval = interval
+        self._stop_event = asyncio.Event()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while not self._stop_event.is_set():
+            started = loop.time()
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                break
+            lag = loop.time() - started - self.interval
+            if not self._stop_event.is_set():
+                EVENT_LOOP_LAG.observe(max(lag, 0.0))
+            if lag > settings.metrics.LOOP_LAG_WARNING:
+                logger.warning(f"Event loop был заблокирован {lag:.3f} сек")
+
+    async def stop(self) -> None:
+        self._stop_event.set()
@@ -0,0 +1,40 @@
+import asyncio
+import logging
+
+from app.config import settings
+from app.utils.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsSnapshotWriter:
+    """
+    Периодическая запись снимка метрик процесса в общий каталог (многопроцессный режим реестра):
+    опрос, попавший в другой процесс uvicorn, отдает и значения этого процесса.
+    """
+
+    def __init__(self, interval: float = settings.metrics.SNAPSHOT_INTERVAL) -> None:
+        self.interval = interval
+        self._stop_event = asyncio.Event()
+
+    async def _write(self) -> None:
+        try:
+            # Запись файла синхронная, поэтому выносим её из event loop
+            await asyncio.to_thread(metrics_registry.write_snapshot)
+        except Exception as e:
+            logger.error(f"Ошибка записи снимка метрик: {e}")
+
+    async def run(self) -> None:
+        while not self._stop_event.is_set():
+            await self._write()
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                break
+        # Итоговые значения остаются в сумме после остановки процесса
+        await self._write()
+
+    async def stop(self) -> None:
+        self._stop_event.set()
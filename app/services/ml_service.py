@@ -1,25 +1,56 @@
+import json
 import logging
-from typing import List, Dict, Any, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterator, List, Dict, Any, Optional, Sequence, Union
 
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from app.config import settings
+from app.crud import export as export_crud
+from app.crud import idempotency as idempotency_crud
 from app.crud import ml as ml_crud
+from app.crud import outbox as outbox_crud
+from app.database.database import session_maker
 from app.models import (
     User,
     MLRequest,
     MLRequestStatus,
+    IdempotencyScope,
 )
+from app.schemas.ml_model_schemas import SMLModel
+from app.schemas.ml_request_schemas import STaskEvent
 from app.schemas.ml_task_schemas import MLResult
+from app.services.admission import admission_control
+from app.services.analytics_service import record_completed
 from app.services.billing_service import BillingService
+from app.services.export_service import (
+    ExportFormat,
+    ResultsFormat,
+    expand_results,
+    resolve_result_columns,
+    stream_results,
+    stream_rows,
+)
 from app.services.ml_service_helpers import (
     prepare_input_data,
     build_ml_task,
     create_pending_request,
+    payload_hash,
+    resolve_active_model,
     update_request_result
 )
-from app.services.mq_publisher import MLTaskPublisher, RPCPublisher
+from app.services.model_cache import active_model_cache
+from app.services.prediction_cache import prediction_cache
+from app.services.outbox_relay import enqueue_outbox_task, release_outbox_task
+from app.services.task_events import enqueue_task_event
+from app.services.mq_publisher import RPCPublisher
+from app.services.rpc_deadline import rpc_deadlines
 from app.utils import (
+    IdempotencyKeyInProgressException,
+    IdempotencyKeyMismatchException,
+    MLInferenceException,
+    MLRequestNotCompletedException,
     MLRequestNotFoundException,
     MQServiceException,
     transactional,
@@ -30,35 +61,63 @@ logger = logging.getLogger(__name__)
 
 
 class MLRequestService:
-    def __init__(self, session: Session):
+    def __init__(self, session: Session, session_factory: Callable[[], Session] = session_maker):
         self.session = session
+        # Сессии для потоковых выгрузок (открываются внутри генератора ответа)
+        self.session_factory = session_factory
         self.billing_service = BillingService(session)
 
-    #Подготовка и отправка таски в RabbitMQ
+    #Контроль допуска: вызывается до создания запроса, поэтому отказ не требует отката и возврата средств
+    def check_admission(self, user: User, queued: bool = True) -> None:
+        """
+        Отклоняет запрос с 429, если у пользователя слишком много незавершенных запросов
+        или (для фоновых задач) очередь не будет разобрана в пределах SLA.
+        """
+        if queued:
+            admission_control.check_queue()
+        admission_control.check_user(ml_crud.count_pending_requests(self.session, user.id))
+
+    #Подготовка таски и запись в outbox (публикацию в RabbitMQ выполняет OutboxRelay после коммита)
     @transactional
-    async def create_and_send_task(
+    def create_and_send_task(
         self,
         user: User,
         input_data: Any,
-        mq_service: MLTaskPublisher,
+        idempotency_key: Optional[str] = None,
     ) -> MLRequest:
 
         # 1. Подготавливаем данные
         prepared_data = prepare_input_data(input_data)
 
-        # 2. Создаём запрос
-        db_request = create_pending_request(self.session, self.billing_service, user, prepared_data)
+        # 2. Создаём запрос (метаданные модели берём из кеша)
+        model = resolve_active_model(self.session)
+        db_request = create_pending_request(self.session, self.billing_service, user, prepared_data, model)
+        if idempotency_key:
+            self._store_idempotency_key(
+                user.id, idempotency_key, IdempotencyScope.send_task, db_request, payload_hash(prepared_data)
+            )
 
-        # 3. Формируем MLтаску из запроса
-        task = build_ml_task(db_request, prepared_data, user.id)
+        # 3. Идентичный запрос уже считался: отдаём результат из кеша, минуя брокер
+        cached = prediction_cache.get(prediction_cache.make_key(prepared_data, model))
+        if cached is not None:
+            update_request_result(
+                session=self.session,
+                billing_service=self.billing_service,
+                request_id=db_request.id,
+                status=MLRequestStatus.success,
+                prediction=cached
+            )
+            db_request.message = "Результат получен из кеша предсказаний"
+            return db_request
 
-        # 4. Отправляем в очередь
-        await mq_service.send_task(task)
+        # 4. Формируем MLтаску из запроса
+        task = build_ml_task(db_request, prepared_data, user.id, model)
 
-        # 5. Оповещаем пользователя
-        self.session.refresh(db_request)
+        # 5. Сохраняем таску в outbox в той же транзакции, что и списание:
+        # задача не потеряется при недоступности брокера и не уйдет при откате
+        enqueue_outbox_task(self.session, db_request, task)
 
-        db_request.is_published = True
+        # 6. Оповещаем пользователя
         db_request.message = "Запрос принят и находится в обработке"
         return db_request
 
@@ -84,61 +143,287 @@ class MLRequestService:
             request_id=request_id,
             status=status_enum,
             prediction=result.prediction,
-            errors=errors
+            errors=errors,
+            queued=True,
         )
         return {"message": "Результат успешно сохранен"}
 
-    #Выполнение rpc предсказания
+    #Пакетное сохранение результатов из очереди
     @transactional
+    def apply_results_batch(self, results: List[MLResult], queued: bool = True) -> int:
+        """
+        Сохраняет пачку результатов одной транзакцией: блокирует ожидающие запросы,
+        обновляет их одним пакетным UPDATE и оформляет возвраты по ошибкам одной пачкой.
+        Дубликаты, уже обработанные и неизвестные запросы пропускаются.
+        queued=False — результаты получены не от воркеров очереди (не учитываются в скорости ее разбора).
+        Возвращает количество обновленных запросов.
+        """
+        by_id: Dict[int, MLResult] = {}
+        for result in results:
+            try:
+                request_id = int(result.task_id)
+            except ValueError:
+                logger.error(f"Некорректный task_id: {result.task_id}")
+                continue
+            by_id.setdefault(request_id, result)
+
+        if not by_id:
+            return 0
+
+        pending = ml_crud.lock_pending_requests(self.session, list(by_id))
+        skipped = set(by_id) - {row.id for row in pending}
+        if skipped:
+            logger.warning(f"Пропущены уже обработанные или отсутствующие запросы: {sorted(skipped)}")
+
+        completed_at = datetime.now(timezone.utc)
+        updates: List[Dict[str, Any]] = []
+        refunds = []
+        completions = []
+        for row in pending:
+            result = by_id[row.id]
+            status_enum = MLRequestStatus.success if result.status == "success" else MLRequestStatus.fail
+            updates.append({
+                "id": row.id,
+                "status": status_enum,
+                "prediction": result.prediction,
+                "errors": [{"error": result.error}] if result.error else None,
+                "completed_at": completed_at,
+            })
+            if status_enum == MLRequestStatus.fail:
+                refunds.append((row.user_id, row.cost, f"Ошибка выполнения запроса №{row.id}"))
+            completions.append((row.model_id, row.user_id, status_enum, row.cost))
+            enqueue_task_event(self.session, STaskEvent(
+                request_id=row.id,
+                user_id=row.user_id,
+                status=status_enum,
+                completed_at=completed_at,
+            ))
+
+        ml_crud.bulk_update_requests(self.session, updates)
+        self.billing_service.refund_batch(refunds)
+        record_completed(self.session, completions, queued=queued)
+        return len(updates)
+
+    #Выполнение rpc предсказания (в две фазы, без открытой транзакции во время ожидания ответа)
     async def execute_rpc_predict(
         self,
         user: User,
         input_data: Any,
         rpc_client: RPCPublisher,
+        idempotency_key: Optional[str] = None,
     ) -> Any:
-        import json
         # 1. Подготавливаем данные
         prepared_data = prepare_input_data(input_data)
         num_rows = len(prepared_data) if isinstance(prepared_data, list) else 1
 
-        # 2. Создаем запрос и резервируем средства
-        db_request = create_pending_request(self.session, self.billing_service, user, prepared_data)
-        self.session.flush()
+        # 2. Фаза резервирования: создаем запрос, списываем средства и коммитим вместе с отложенной
+        # задачей в outbox: если процесс не доживет до завершения, запрос досчитает фоновый воркер.
+        # Запись в истории и оплата создаются и при попадании в кеш предсказаний
+        model = resolve_active_model(self.session)
+        cache_key = prediction_cache.make_key(prepared_data, model)
+        db_request = self._reserve_request(user, prepared_data, idempotency_key, model)
+
+        cached = prediction_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"RPC-запрос №{db_request.id}: результат получен из кеша предсказаний")
+            self._finalize_request(db_request.id, MLRequestStatus.success, prediction=cached)
+            return cached
 
-        # 3. Вычисляем динамический таймаут
-        dynamic_timeout = max(15.0, 10.0 + (num_rows * 0.2))
-        logger.info(f"Выполнение RPC-запроса №{db_request.id} для {num_rows} строк. Таймаут: {dynamic_timeout}с")
+        # 3. Дедлайн по наблюдаемой задержке воркеров и глубине очереди.
+        # Если ответ заведомо не успеет, задача сразу уходит в фоновую очередь
+        if rpc_deadlines.should_defer(num_rows):
+            logger.info(f"RPC-запрос №{db_request.id} переведен в фоновую очередь: "
+                        f"ожидаемое время {rpc_deadlines.expected(num_rows):.1f}с")
+            return self._defer_to_queue(db_request)
+        deadline = rpc_deadlines.deadline(num_rows)
+        logger.info(f"Выполнение RPC-запроса №{db_request.id} для {num_rows} строк. Дедлайн: {deadline:.1f}с")
 
-        # 4. Делаем RPC вызов
+        # 4. Делаем RPC вызов (соединение с БД в это время не удерживается).
+        # Одновременные идентичные запросы разделяют один вызов воркера
         payload = json.dumps(prepared_data).encode()
+
+        async def call_worker() -> Any:
+            with rpc_deadlines.track(num_rows):
+                response_bytes = await rpc_client.call(
+                    payload,
+                    routing_key=settings.mq.RPC_QUEUE_NAME,
+                    timeout=deadline
+                )
+            return json.loads(response_bytes)
+
         try:
-            response_bytes = await rpc_client.call(
-                payload,
-                routing_key=settings.mq.RPC_QUEUE_NAME,
-                timeout=dynamic_timeout
+            prediction = await prediction_cache.singleflight(cache_key, call_worker)
+        except MQServiceException:
+            # Дедлайн истек или RPC недоступен: запрос (уже оплаченный) досчитает фоновый воркер
+            logger.warning(f"RPC-запрос №{db_request.id} не выполнен за {deadline:.1f}с, перевод в фоновую очередь")
+            return self._defer_to_queue(db_request)
+        except Exception as e:
+            self._finalize_request(db_request.id, MLRequestStatus.fail, errors=[{"error": str(e)}])
+            raise e
+        except BaseException:
+            # Отмена (разрыв соединения клиента, остановка процесса): оплаченный запрос уходит в очередь
+            logger.warning(f"RPC-запрос №{db_request.id} прерван, перевод в фоновую очередь")
+            self._defer_to_queue(db_request)
+            raise
+
+        # 5. Фаза завершения: сохраняем результат или возвращаем средства
+        if isinstance(prediction, dict) and "error" in prediction:
+            logger.error(f"RPC-запрос №{db_request.id} завершился ошибкой воркера: {prediction['error']}")
+            self._finalize_request(db_request.id, MLRequestStatus.fail, errors=[prediction])
+            raise MLInferenceException
+
+        prediction_cache.put(cache_key, prediction)
+        self._finalize_request(db_request.id, MLRequestStatus.success, prediction=prediction)
+        return prediction
+
+    @transactional
+    def _defer_to_queue(self, db_request: MLRequest) -> MLRequest:
+        """Отправляет зарезервированный RPC-запрос фоновому воркеру: снимает отсрочку с его задачи в outbox."""
+        release_outbox_task(self.session, db_request.id)
+        db_request.message = "Ответ не успевает в срок: запрос передан в очередь на обработку"
+        return db_request
+
+    @transactional
+    def _reserve_request(
+        self,
+        user: User,
+        prepared_data: Any,
+        idempotency_key: Optional[str] = None,
+        model: Optional[SMLModel] = None
+    ) -> MLRequest:
+        db_request = create_pending_request(self.session, self.billing_service, user, prepared_data, model)
+        if idempotency_key:
+            self._store_idempotency_key(
+                user.id, idempotency_key, IdempotencyScope.predict, db_request, payload_hash(prepared_data)
             )
-            prediction = json.loads(response_bytes)
+        # Задача публикуется, только если запрос не будет завершен или переведен в очередь
+        # до истечения самого долгого RPC-дедлайна (процесс упал, перезапущен)
+        hold_until = datetime.now(timezone.utc) + timedelta(
+            seconds=settings.mq.RPC_MAX_DEADLINE + settings.mq.OUTBOX_LEASE_SECONDS
+        )
+        task = build_ml_task(db_request, prepared_data, user.id, model)
+        enqueue_outbox_task(self.session, db_request, task, hold_until=hold_until)
+        return db_request
 
-            # 5. Обновляем результат (в той же транзакции)
-            update_request_result(
-                session=self.session,
-                billing_service=self.billing_service,
-                request_id=db_request.id,
-                status=MLRequestStatus.success,
-                prediction=prediction
+    def find_replay(
+        self,
+        user_id: int,
+        key: str,
+        scope: IdempotencyScope,
+        input_data: Any = None,
+    ) -> Optional[MLRequest]:
+        """
+        Ищет запрос, ранее созданный с тем же ключом идемпотентности.
+        Ключ, использованный для другого эндпоинта или с другим телом запроса -> 422.
+        Для RPC: выполняющийся запрос -> 409, завершившийся ошибкой (средства уже возвращены)
+        освобождает ключ для повторной попытки.
+        """
+        record = idempotency_crud.get_active_key(self.session, user_id, key, datetime.now(timezone.utc))
+        if record is None:
+            return None
+        if record.scope != scope:
+            raise IdempotencyKeyMismatchException
+        if record.payload_hash is not None and record.payload_hash != payload_hash(input_data):
+            raise IdempotencyKeyMismatchException
+
+        db_request = record.ml_request
+        if scope == IdempotencyScope.predict:
+            if db_request.status == MLRequestStatus.pending:
+                raise IdempotencyKeyInProgressException
+            if db_request.status == MLRequestStatus.fail:
+                idempotency_crud.delete_key(self.session, user_id, key)
+                return None
+
+        logger.info(f"Повтор запроса с ключом идемпотентности: возвращен запрос №{db_request.id}")
+        return db_request
+
+    def _store_idempotency_key(
+        self,
+        user_id: int,
+        key: str,
+        scope: IdempotencyScope,
+        db_request: MLRequest,
+        request_hash: str,
+    ) -> None:
+        now = datetime.now(timezone.utc)
+        idempotency_crud.delete_expired_key(self.session, user_id, key, now)
+        try:
+            idempotency_crud.create_key(
+                self.session,
+                user_id=user_id,
+                key=key,
+                scope=scope,
+                ml_request=db_request,
+                expires_at=now + timedelta(hours=settings.app.IDEMPOTENCY_TTL_HOURS),
+                payload_hash=request_hash,
             )
-            return prediction
-        except MQServiceException as e:
-            e.request_id = str(db_request.id)
-            raise e
-        except Exception as e:
-            raise e
+        except IntegrityError:
+            # Параллельный запрос с тем же ключом успел создать запись раньше
+            raise IdempotencyKeyInProgressException
+
+    @transactional
+    def _finalize_request(
+        self,
+        request_id: int,
+        status: MLRequestStatus,
+        prediction: Any = None,
+        errors: Any = None
+    ) -> MLRequest:
+        # Запрос завершен по RPC: отложенная задача в очереди больше не нужна
+        outbox_crud.discard(self.session, request_id)
+        return update_request_result(
+            session=self.session,
+            billing_service=self.billing_service,
+            request_id=request_id,
+            status=status,
+            prediction=prediction,
+            errors=errors
+        )
 
-    def get_all_history(self, user_id: int) -> List[MLRequest]:
-        return ml_crud.get_history(self.session, user_id)
+    def list_active_models(self) -> List[SMLModel]:
+        return active_model_cache.list_active(self.session)
+
+    def get_all_history(self, user_id: int, since: Optional[datetime] = None) -> List[MLRequest]:
+        return ml_crud.get_history(self.session, user_id, since)
+
+    def export_history(self, user_id: int, fmt: ExportFormat) -> Iterator[str]:
+        """Потоковая выгрузка истории запросов пользователя."""
+        rows = export_crud.iter_requests(self.session_factory, settings.app.EXPORT_BATCH_SIZE, user_id=user_id)
+        return stream_rows(rows, export_crud.REQUEST_EXPORT_COLUMNS, fmt)
+
+    def export_results(
+        self,
+        request_id: int,
+        user_id: int,
+        fmt: ResultsFormat,
+        columns: Optional[Sequence[str]] = None,
+    ) -> Iterator[Union[str, bytes]]:
+        """Потоковая выгрузка входных строк завершенного запроса вместе с предсказаниями."""
+        selected = resolve_result_columns(columns)
+        request_status = ml_crud.get_request_status(self.session, request_id, user_id)
+        if request_status is None:
+            raise MLRequestNotFoundException
+        if request_status == MLRequestStatus.pending:
+            raise MLRequestNotCompletedException
+        rows = export_crud.iter_request_results(
+            self.session_factory, settings.app.EXPORT_BATCH_SIZE, user_id, request_id=request_id
+        )
+        return stream_results(expand_results(rows, selected), selected, fmt)
 
     def get_history_by_id(self, request_id: int, user_id: int) -> MLRequest:
         db_request = ml_crud.get_request_by_id(self.session, request_id, user_id)
         if not db_request:
             raise MLRequestNotFoundException
         return db_request
+
+    def get_final_event(self, request_id: int, user_id: int) -> Optional[STaskEvent]:
+        """Событие о завершении запроса, если он уже обработан (иначе None)."""
+        db_request = self.get_history_by_id(request_id, user_id)
+        if db_request.status == MLRequestStatus.pending:
+            return None
+        return STaskEvent(
+            request_id=db_request.id,
+            user_id=db_request.user_id,
+            status=db_request.status,
+            completed_at=db_request.completed_at,
+        )
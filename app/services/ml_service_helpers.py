@@ -1,6 +1,8 @@
+import hashlib
+import json
 import logging
 from datetime import datetime, timezone
-from typing import Any, List, Dict
+from typing import Any, List, Dict, Optional
 
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
@@ -8,8 +10,14 @@ from sqlalchemy.orm import Session
 from app.config import settings
 from app.crud import ml as ml_crud
 from app.models import User, MLRequest, MLRequestStatus
+from app.schemas.ml_model_schemas import SMLModel
+from app.schemas.ml_request_schemas import STaskEvent
 from app.schemas.ml_task_schemas import MLTask
+from app.services.analytics_service import record_completed, record_created
 from app.services.billing_service import BillingService
+from app.services.model_cache import active_model_cache
+from app.services.task_events import enqueue_task_event
+from common.tracing import current_traceparent
 from app.utils import (
     MLModelNotFoundException,
     MLRequestNotFoundException
@@ -28,23 +36,52 @@ def prepare_input_data(input_data: Any) -> Any:
     return input_data
 
 
-def build_ml_task(db_request: MLRequest, features: Any, user_id: int) -> MLTask:
+def payload_hash(input_data: Any) -> str:
+    """Канонический хеш тела запроса: ключ идемпотентности привязывается к нему."""
+    canonical = json.dumps(
+        prepare_input_data(input_data),
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def build_ml_task(
+    db_request: MLRequest,
+    features: Any,
+    user_id: int,
+    model: Optional[SMLModel] = None
+) -> MLTask:
     """
     Формирует MLTask на основе записи MLRequest и переданных признаков.
+    Если метаданные модели уже известны (из кеша), связь ml_model не подгружается.
     """
+    code_name = model.code_name if model else db_request.ml_model.code_name
     return MLTask(
         task_id=str(db_request.id),
         features=features,
-        model=db_request.ml_model.code_name,
+        model=code_name,
         user_id=user_id,
+        trace_context=current_traceparent(),
     )
 
 
+def resolve_active_model(session: Session) -> SMLModel:
+    """Возвращает метаданные активной модели из кеша или поднимает исключение."""
+    model = active_model_cache.get_active(session)
+    if not model:
+        raise MLModelNotFoundException
+    return model
+
+
 def create_pending_request(
     session: Session,
     billing_service: BillingService,
     user: User,
-    input_data: List[Dict[str, Any]]
+    input_data: List[Dict[str, Any]],
+    model: Optional[SMLModel] = None
 ) -> MLRequest:
     """
     Создает запрос в статусе ожидания: выбор активной модели, резервирование средств,
@@ -52,9 +89,8 @@ def create_pending_request(
     """
     logger.info(f"Создание запроса для пользователя {user.id}")
 
-    model = ml_crud.get_active_model(session)
-    if not model:
-        raise MLModelNotFoundException
+    if model is None:
+        model = resolve_active_model(session)
 
     # todo: ??
     num_items = len(input_data) if isinstance(input_data, list) else 1
@@ -76,8 +112,9 @@ def create_pending_request(
         user_id=user.id,
         cost=total_cost,
         description=f"Оплата ML-запроса №{new_request.id} (ожидание)",
-        ml_request_id=new_request.id
+        ml_request=new_request
     )
+    record_created(session, model.id, user.id, num_items, total_cost)
 
     return new_request
 
@@ -88,10 +125,12 @@ def update_request_result(
     request_id: int,
     status: MLRequestStatus,
     prediction: Any = None,
-    errors: Any = None
+    errors: Any = None,
+    queued: bool = False,
 ) -> MLRequest:
     """
     Обновляет результат запроса в БД. При ошибке выполнения инициирует возврат средств.
+    queued — результат получен от воркера очереди задач.
     """
     db_request = ml_crud.update_request(
         session,
@@ -114,4 +153,14 @@ def update_request_result(
                 reason=f"Ошибка выполнения запроса №{request_id}"
             )
 
+    record_completed(session, [(db_request.model_id, db_request.user_id, status, db_request.cost)], queued=queued)
+
+    # Подписчики получат событие только после коммита транзакции
+    enqueue_task_event(session, STaskEvent(
+        request_id=db_request.id,
+        user_id=db_request.user_id,
+        status=status,
+        completed_at=db_request.completed_at,
+    ))
+
     return db_request
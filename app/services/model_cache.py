@@ -0,0 +1,91 @@
+import logging
+import threading
+from time import monotonic
+from typing import List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from app.config import settings
+from app.crud import ml as ml_crud
+from app.models import MLModel
+from app.schemas.ml_model_schemas import SMLModel
+
+logger = logging.getLogger(__name__)
+
+
+class ActiveModelCache:
+    """
+    Внутрипроцессный кеш метаданных активных ML-моделей (id, code_name, version, cost).
+    Активная модель меняется только при деплое, поэтому список загружается один раз
+    и обновляется по истечении TTL или при изменении строк ml_model (после коммита транзакции).
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._models: Optional[List[SMLModel]] = None
+        self._loaded_at: float = 0.0
+        # Номер сброса: список, прочитанный до сброса, не сохраняется поверх него
+        self._generation: int = 0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self) -> bool:
+        return self._models is not None and monotonic() - self._loaded_at < self.ttl
+
+    def list_active(self, session: Session) -> List[SMLModel]:
+        """Список активных моделей из кеша (при необходимости перечитывается из БД)."""
+        if self._is_fresh():
+            return self._models
+        with self._lock:
+            if self._is_fresh():
+                return self._models
+            generation = self._generation
+        models = [SMLModel.model_validate(model) for model in ml_crud.list_active_models(session)]
+        with self._lock:
+            if generation == self._generation:
+                self._models = models
+                self._loaded_at = monotonic()
+                logger.info(f"Кеш активных моделей обновлен: {[m.code_name for m in models]}")
+        return models
+
+    def get_active(self, session: Session) -> Optional[SMLModel]:
+        """Первая активная модель или None."""
+        models = self.list_active(session)
+        return models[0] if models else None
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._models = None
+            self._loaded_at = 0.0
+
+
+active_model_cache = ActiveModelCache(ttl=settings.app.MODEL_CACHE_TTL)
+
+
+_SESSION_KEY = "active_models_changed"
+
+
+# Изменения моделей отмечаются в сессии при flush, а кеш сбрасывается только после коммита:
+# иначе параллельная загрузка между flush и коммитом закеширует старую модель на весь TTL.
+# В остальных процессах устаревание ограничено TTL
+@event.listens_for(MLModel, "after_insert")
+@event.listens_for(MLModel, "after_update")
+@event.listens_for(MLModel, "after_delete")
+def _mark_changed(mapper, connection, target) -> None:
+    session = object_session(target)
+    if session is not None:
+        session.info[_SESSION_KEY] = True
+    else:
+        active_model_cache.invalidate()
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session: Session) -> None:
+    if session.info.pop(_SESSION_KEY, False):
+        active_model_cache.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_change_flag(session: Session) -> None:
+    session.info.pop(_SESSION_KEY, None)
@@ -1,16 +1,15 @@
 import asyncio
 import json
 import logging
-from typing import Optional
+from typing import List, Optional, Tuple
 
 import aio_pika
-from sqlalchemy import select
 
 from app.config import settings
 from app.database.database import session_maker
-from app.models import MLRequest, MLRequestStatus
 from app.schemas.ml_task_schemas import MLResult
 from app.services.ml_service import MLRequestService
+from common import tracing
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +17,7 @@ logger = logging.getLogger(__name__)
 class ResultsConsumer:
     """
     Потребитель результатов из RabbitMQ. Получает сообщения с результатами ML,
-    сохраняет их через MLRequestService.process_task_result.
+    копит их в пачки и сохраняет одной транзакцией через MLRequestService.apply_results_batch.
     Работает как фоновая задача FastAPI-приложения.
     """
 
@@ -28,6 +27,8 @@ class ResultsConsumer:
         self.channel: Optional[aio_pika.RobustChannel] = None
         self.queue: Optional[aio_pika.abc.AbstractRobustQueue] = None
         self._stop_event = asyncio.Event()
+        self._inbox: asyncio.Queue[aio_pika.abc.AbstractIncomingMessage] = asyncio.Queue()
+        self._batch_task: Optional[asyncio.Task] = None
 
     async def start(self) -> None:
         retry_interval = 5
@@ -36,7 +37,7 @@ class ResultsConsumer:
                 logger.info("[ResultsConsumer] Подключение к RabbitMQ...")
                 self.connection = await aio_pika.connect_robust(self.amqp_url)
                 self.channel = await self.connection.channel()
-                await self.channel.set_qos(prefetch_count=10)
+                await self.channel.set_qos(prefetch_count=settings.mq.RESULTS_PREFETCH_COUNT)
 
                 # Объявляем обменник и очередь результатов
                 exchange = await self.channel.declare_exchange(
@@ -50,6 +51,8 @@ class ResultsConsumer:
                 )
                 await self.queue.bind(exchange, routing_key=settings.mq.RESULTS_ROUTING_KEY)
 
+                if self._batch_task is None or self._batch_task.done():
+                    self._batch_task = asyncio.create_task(self._batch_loop())
                 await self.queue.consume(self._on_message)
                 logger.info(
                     f"[ResultsConsumer] Запущен. Очередь: {settings.mq.RESULTS_QUEUE_NAME}, обменник: {settings.mq.RESULTS_EXCHANGE_NAME}"
@@ -59,45 +62,97 @@ class ResultsConsumer:
                 logger.error(f"[ResultsConsumer] Ошибка при старте: {e}. Повтор через {retry_interval} сек...")
                 await asyncio.sleep(retry_interval)
 
-    async def _on_message(self, message: aio_pika.IncomingMessage) -> None:
-        async with message.process():
+    async def _on_message(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        # Подтверждение откладывается до сохранения всей пачки
+        await self._inbox.put(message)
+
+    async def _collect_batch(self) -> List[aio_pika.abc.AbstractIncomingMessage]:
+        """Ждёт первое сообщение и добирает пачку до размера или таймаута."""
+        loop = asyncio.get_running_loop()
+        batch = [await self._inbox.get()]
+        deadline = loop.time() + settings.mq.RESULTS_BATCH_TIMEOUT
+        while len(batch) < settings.mq.RESULTS_BATCH_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
             try:
-                payload = json.loads(message.body.decode())
-                result = MLResult(**payload)
-                logger.info(f"[ResultsConsumer] Получен результат для task_id={result.task_id}")
-
-                with session_maker() as session:
-                    # Валидация ID задачи
-                    try:
-                        request_id = int(result.task_id)
-                    except ValueError:
-                        logger.error(f"[ResultsConsumer] Некорректный task_id: {result.task_id}")
-                        return
-
-                    # Проверяем, был ли запрос уже обработан
-                    existing = session.execute(
-                        select(MLRequest).where(MLRequest.id == request_id)
-                    ).scalar_one_or_none()
-
-                    if not existing:
-                        logger.error(f"[ResultsConsumer] Запрос {request_id} не найден в базе")
-                        return
-
-                    if existing.status != MLRequestStatus.pending:
-                        logger.warning(f"[ResultsConsumer] Запрос {request_id} уже обработан (статус: {existing.status})")
-                        return
-
-                    # Обрабатываем результат
-                    service = MLRequestService(session)
-                    await service.process_and_post_result(result)
+                batch.append(await asyncio.wait_for(self._inbox.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
 
+    async def _batch_loop(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                batch = await self._collect_batch()
+                await self._process_batch(batch)
+            except asyncio.CancelledError:
+                break
             except Exception as e:
-                logger.error(f"[ResultsConsumer] Ошибка обработки сообщения: {e}")
-                raise
+                logger.error(f"[ResultsConsumer] Ошибка в цикле обработки пачек: {e}")
+
+    async def _process_batch(self, batch: List[aio_pika.abc.AbstractIncomingMessage]) -> None:
+        parsed: List[Tuple[aio_pika.abc.AbstractIncomingMessage, MLResult]] = []
+        for message in batch:
+            try:
+                payload = json.loads(message.body.decode())
+                parsed.append((message, MLResult(**payload)))
+            except Exception as e:
+                logger.error(f"[ResultsConsumer] Некорректное сообщение с результатом: {e}")
+                await message.reject(requeue=False)
+
+        if not parsed:
+            return
+
+        results = [result for _, result in parsed]
+        # Сохранение отмечается спаном в трассе каждой задачи, а запросы к БД пишутся
+        # в общую трассу пачки: ее идентификатор хранится в атрибуте results.batch_trace_id
+        save_spans = [
+            tracing.start_span("results.save", parent=tracing.extract(message.headers), kind=tracing.CONSUMER,
+                               attributes={"messaging.message.id": result.task_id})
+            for message, result in parsed
+        ]
+        try:
+            with tracing.span("results.batch", attributes={"messaging.batch.message_count": len(parsed)}) as batch:
+                for span in save_spans:
+                    span.set_attribute("results.batch_trace_id", batch.context.trace_id)
+                # Работа с БД синхронная, поэтому выносим её из event loop
+                updated = await asyncio.to_thread(self._apply, results)
+        except Exception as e:
+            for span in save_spans:
+                span.record_error(e)
+            logger.error(f"[ResultsConsumer] Ошибка сохранения пачки из {len(parsed)} результатов: {e}. "
+                         f"Обработка по одному...")
+            await self._process_one_by_one(parsed)
+            return
+        finally:
+            for span in save_spans:
+                span.end()
+
+        # Все сообщения пачки подтверждаются одним basic.ack с multiple=True
+        await parsed[-1][0].ack(multiple=True)
+        logger.info(f"[ResultsConsumer] Сохранена пачка: получено {len(parsed)}, обновлено {updated}")
+
+    async def _process_one_by_one(self, parsed: List[Tuple[aio_pika.abc.AbstractIncomingMessage, MLResult]]) -> None:
+        """Запасной путь: изолирует сообщение, из-за которого не сохранилась пачка."""
+        for message, result in parsed:
+            try:
+                await asyncio.to_thread(self._apply, [result])
+                await message.ack()
+            except Exception as e:
+                logger.error(f"[ResultsConsumer] Ошибка обработки результата task_id={result.task_id}: {e}")
+                await message.reject(requeue=False)
+
+    @staticmethod
+    def _apply(results: List[MLResult]) -> int:
+        with session_maker() as session:
+            return MLRequestService(session).apply_results_batch(results)
 
     async def stop(self) -> None:
         logger.info("[ResultsConsumer] Остановка...")
         self._stop_event.set()
+        if self._batch_task:
+            self._batch_task.cancel()
         try:
             if self.channel and not self.channel.is_closed:
                 await self.channel.close()
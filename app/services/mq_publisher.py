@@ -1,26 +1,52 @@
 import logging
 import aio_pika
 import asyncio
+import time
 import uuid
-from time import time
-from typing import Optional, Dict, Tuple
+import weakref
+from typing import ContextManager, Optional, Dict, List, Tuple
 from tenacity import retry, stop_after_attempt, wait_exponential
 from fastapi import Request
 from aio_pika.pool import Pool
 from app.config import settings
 from app.schemas.ml_task_schemas import MLTask
 from app.utils import MQServiceException
+from app.utils.metrics import RPC_CALLS
+from common import tracing
 
 logger = logging.getLogger(__name__)
 
+
+def create_connection_pool(max_size: int = settings.mq.CONNECTION_POOL_SIZE) -> Pool[aio_pika.RobustConnection]:
+    """Пул устойчивых соединений с RabbitMQ (соединения открываются лениво)."""
+    async def get_connection() -> aio_pika.RobustConnection:
+        return await aio_pika.connect_robust(
+            settings.mq.amqp_url,
+            timeout=settings.mq.TIMEOUT
+        )
+
+    return Pool(get_connection, max_size=max_size)
+
+
 class MLTaskPublisher:
+    """
+    Публикация задач с подтверждениями брокера.
+    Подтверждения ожидаются параллельно: на каждом канале может быть несколько публикаций
+    «в полете», общее их число ограничено окном PUBLISH_CONFIRM_WINDOW.
+    """
+
     def __init__(self, connection_pool: Pool[aio_pika.RobustConnection]) -> None:
         self.connection_pool = connection_pool
         self.channel_pool: Pool[aio_pika.RobustChannel] = Pool(
             self._get_channel,
-            max_size=10
+            max_size=settings.mq.CHANNEL_POOL_SIZE
         )
         self._infrastructure_ready: bool = False
+        # Хэндлы обменника по каналам: без пассивного declare на каждое сообщение
+        self._exchanges: "weakref.WeakKeyDictionary[aio_pika.abc.AbstractChannel, aio_pika.abc.AbstractExchange]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._confirm_window = asyncio.Semaphore(settings.mq.PUBLISH_CONFIRM_WINDOW)
 
     async def _get_channel(self) -> aio_pika.RobustChannel:
         async with self.connection_pool.acquire() as connection:
@@ -59,28 +85,86 @@ class MLTaskPublisher:
     )
     async def _publish_with_retry(self, message: aio_pika.Message) -> None:
         async with self.channel_pool.acquire() as channel:
-            exchange = await channel.get_exchange(settings.mq.EXCHANGE_NAME)
+            await self._publish(channel, message)
+
+    async def _get_exchange(self, channel: aio_pika.abc.AbstractChannel) -> aio_pika.abc.AbstractExchange:
+        exchange = self._exchanges.get(channel)
+        if exchange is None:
+            # Обменник уже объявлен в ensure_infrastructure, проверка существования не нужна
+            exchange = await channel.get_exchange(settings.mq.EXCHANGE_NAME, ensure=False)
+            self._exchanges[channel] = exchange
+        return exchange
+
+    async def _publish(self, channel: aio_pika.abc.AbstractChannel, message: aio_pika.Message) -> None:
+        exchange = await self._get_exchange(channel)
+        async with self._confirm_window:
             await exchange.publish(
                 message,
                 routing_key=settings.mq.QUEUE_NAME,
                 mandatory=True
             )
 
+    @staticmethod
+    def _build_message(task: MLTask) -> aio_pika.Message:
+        # Контекст трассы передается заголовком traceparent текущего спана публикации
+        return aio_pika.Message(
+            body=task.model_dump_json(exclude={"trace_context"}).encode(),
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            content_type="application/json",
+            message_id=task.task_id,
+            app_id=settings.app.NAME,
+            timestamp=task.timestamp,
+            headers=tracing.inject({"user_id": task.user_id})
+        )
+
+    @staticmethod
+    def _publish_span(task: MLTask) -> ContextManager[tracing.Span]:
+        """Спан публикации задачи — продолжение трассы HTTP-запроса, создавшего задачу."""
+        return tracing.span(
+            f"publish {settings.mq.QUEUE_NAME}",
+            parent=tracing.parse_traceparent(task.trace_context),
+            kind=tracing.PRODUCER,
+            attributes={"messaging.destination": settings.mq.QUEUE_NAME, "messaging.message.id": task.task_id},
+        )
+
+    async def _publish_task(self, channel: aio_pika.abc.AbstractChannel, task: MLTask) -> None:
+        with self._publish_span(task):
+            await self._publish(channel, self._build_message(task))
+
+    async def send_tasks(self, tasks: List[MLTask]) -> List[Optional[Exception]]:
+        """
+        Публикует пачку задач, распределяя ее по каналам пула; на каждом канале
+        подтверждения ожидаются параллельно.
+        Возвращает список ошибок по позициям (None — задача подтверждена).
+        """
+        if not tasks:
+            return []
+        await self.ensure_infrastructure()
+
+        chunk_size = -(-len(tasks) // settings.mq.CHANNEL_POOL_SIZE)
+        chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+
+        async def publish_chunk(chunk: List[MLTask]) -> List[Optional[Exception]]:
+            try:
+                async with self.channel_pool.acquire() as channel:
+                    results = await asyncio.gather(
+                        *(self._publish_task(channel, task) for task in chunk),
+                        return_exceptions=True
+                    )
+            except Exception as e:
+                return [e] * len(chunk)
+            return [r if isinstance(r, Exception) else None for r in results]
+
+        chunk_results = await asyncio.gather(*(publish_chunk(chunk) for chunk in chunks))
+        return [result for results in chunk_results for result in results]
+
     async def send_task(self, task: MLTask) -> None:
         try:
             await self.ensure_infrastructure()
 
-            message = aio_pika.Message(
-                body=task.model_dump_json().encode(),
-                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
-                content_type="application/json",
-                message_id=task.task_id,
-                app_id=settings.app.NAME,
-                timestamp=task.timestamp,
-                headers={"user_id": task.user_id}
-            )
-
-            await self._publish_with_retry(message)
+            with self._publish_span(task):
+                message = self._build_message(task)
+                await self._publish_with_retry(message)
             logger.info(f"Задача {task.task_id} успешно отправлена в RabbitMQ")
 
         except aio_pika.exceptions.AMQPError as e:
@@ -91,54 +175,54 @@ class MLTaskPublisher:
     async def close(self) -> None:
         await self.channel_pool.close()
 
+# Псевдо-очередь RabbitMQ для ответов без объявления callback-очереди
+DIRECT_REPLY_TO = "amq.rabbitmq.reply-to"
+# Срок ответа RPC-вызова (unix time): воркер не считает запрос, который API уже не ждет
+RPC_DEADLINE_HEADER = "x-deadline"
+
+
 class RPCPublisher:
+    """
+    RPC-клиент поверх нескольких каналов: вызовы распределяются по каналам по кругу,
+    ответы принимаются через direct reply-to (или эксклюзивную callback-очередь канала).
+    Ответ direct reply-to приходит только на канал, с которого опубликован запрос,
+    поэтому каждый канал потребляет собственные ответы.
+    Таймаут отслеживается для каждого вызова отдельно.
+    """
+
     def __init__(self, connection_pool: Pool[aio_pika.RobustConnection]) -> None:
         self.connection_pool = connection_pool
-        self.futures: Dict[str, Tuple[asyncio.Future, float]] = {}
-        self._callback_queue: Optional[aio_pika.abc.AbstractRobustQueue] = None
-        self._channel: Optional[aio_pika.RobustChannel] = None
-        self._loop = asyncio.get_event_loop()
-        self._cleanup_task: Optional[asyncio.Task] = None
+        self.futures: Dict[str, asyncio.Future] = {}
+        self._lanes: List[Tuple[aio_pika.RobustChannel, str]] = []
+        self._next_lane: int = 0
+        self._ready_lock = asyncio.Lock()
 
-    async def _get_channel(self) -> aio_pika.RobustChannel:
+    async def _open_lane(self) -> Tuple[aio_pika.RobustChannel, str]:
         async with self.connection_pool.acquire() as connection:
-            return await connection.channel()
+            channel = await connection.channel()
+        if settings.mq.RPC_DIRECT_REPLY_TO:
+            callback_queue = await channel.declare_queue(DIRECT_REPLY_TO, passive=True)
+        else:
+            callback_queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+        # Для direct reply-to потребление обязано быть в режиме no_ack
+        await callback_queue.consume(self.on_response, no_ack=True)
+        return channel, callback_queue.name
 
     async def ensure_ready(self) -> None:
-        if self._channel and not self._channel.is_closed:
+        if self._lanes and all(not channel.is_closed for channel, _ in self._lanes):
             return
 
-        async with self.connection_pool.acquire() as connection:
-            self._channel = await connection.channel()
-            self._callback_queue = await self._channel.declare_queue(
-                exclusive=True,
-                auto_delete=True
-            )
-            await self._callback_queue.consume(self.on_response, no_ack=True)
-            logger.info(f"RPC Client ready, callback queue: {self._callback_queue.name}")
-
-        # Запускаем задачу очистки устаревших фьючерсов
-        if not self._cleanup_task or self._cleanup_task.done():
-            self._cleanup_task = asyncio.create_task(self._cleanup_stale_futures())
+        async with self._ready_lock:
+            lanes = [lane for lane in self._lanes if not lane[0].is_closed]
+            while len(lanes) < settings.mq.RPC_CHANNEL_POOL_SIZE:
+                lanes.append(await self._open_lane())
+            self._lanes = lanes
+            logger.info(f"RPC Client ready: {len(lanes)} channels, reply-to: {lanes[0][1]}")
 
-    async def _cleanup_stale_futures(self) -> None:
-        """Удаляет фьючерсы старше 5 минут каждую минуту."""
-        while True:
-            try:
-                await asyncio.sleep(60)
-                now = time()
-                stale_ids = [
-                    cid for cid, (_, ts) in self.futures.items()
-                    if now - ts > 300
-                ]
-                for cid in stale_ids:
-                    logger.warning(f"Удаление устаревшей RPC future: {cid}")
-                    self.futures.pop(cid, None)
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                logger.error(f"Ошибка в задаче очистки RPC фьючерсов: {e}")
-                await asyncio.sleep(10)
+    def _lane(self) -> Tuple[aio_pika.RobustChannel, str]:
+        lane = self._lanes[self._next_lane % len(self._lanes)]
+        self._next_lane += 1
+        return lane
 
     async def on_response(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
         """Обработчик ответов из callback очереди."""
@@ -146,47 +230,71 @@ class RPCPublisher:
             logger.warning(f"Получено сообщение без correlation_id: {message!r}")
             return
 
-        item = self.futures.pop(message.correlation_id, None)
-        if item:
-            future, _ = item
-            if not future.done():
-                future.set_result(message.body)
+        future = self.futures.pop(message.correlation_id, None)
+        if future and not future.done():
+            future.set_result(message.body)
+
+    def _expire(self, correlation_id: str) -> None:
+        future = self.futures.pop(correlation_id, None)
+        if future and not future.done():
+            future.set_exception(asyncio.TimeoutError())
 
     async def call(self, payload: bytes, routing_key: str, timeout: float = 10.0) -> bytes:
-        """Выполняет RPC запрос."""
+        """
+        Выполняет RPC запрос. Сообщение живет в очереди не дольше timeout (expiration), а воркер
+        отбрасывает взятое, но просроченное сообщение (заголовок x-deadline): после таймаута
+        запрос досчитывается через фоновую очередь, и повторный инференс по RPC не нужен.
+        """
         await self.ensure_ready()
+        channel, reply_to = self._lane()
 
+        loop = asyncio.get_running_loop()
         correlation_id = str(uuid.uuid4())
-        future = self._loop.create_future()
-        self.futures[correlation_id] = (future, time())
+        future = loop.create_future()
+        self.futures[correlation_id] = future
+        # Таймер отменяется вместе с вызовом; опоздавший ответ просто не найдет future
+        expire_handle = loop.call_later(timeout, self._expire, correlation_id)
 
         try:
-            await self._channel.default_exchange.publish(
-                aio_pika.Message(
-                    payload,
-                    content_type="application/json",
-                    correlation_id=correlation_id,
-                    reply_to=self._callback_queue.name,
-                ),
-                routing_key=routing_key,
-            )
+            # Спан охватывает весь вызов: публикацию, очередь, инференс и ответ воркера
+            with tracing.span(f"rpc {routing_key}", kind=tracing.CLIENT, attributes={
+                "messaging.destination": routing_key,
+                "messaging.message.conversation_id": correlation_id,
+            }):
+                await channel.default_exchange.publish(
+                    aio_pika.Message(
+                        payload,
+                        content_type="application/json",
+                        correlation_id=correlation_id,
+                        reply_to=reply_to,
+                        expiration=timeout,
+                        headers=tracing.inject({RPC_DEADLINE_HEADER: time.time() + timeout}),
+                    ),
+                    routing_key=routing_key,
+                )
 
-            return await asyncio.wait_for(future, timeout=timeout)
+                response = await future
+            RPC_CALLS.labels("ok").inc()
+            return response
         except asyncio.TimeoutError as e:
+            RPC_CALLS.labels("timeout").inc()
             raise MQServiceException(original_exception=e)
+        except Exception:
+            RPC_CALLS.labels("error").inc()
+            raise
         finally:
+            expire_handle.cancel()
             self.futures.pop(correlation_id, None)
 
     async def close(self) -> None:
-        if self._cleanup_task:
-            self._cleanup_task.cancel()
-            try:
-                await self._cleanup_task
-            except asyncio.CancelledError:
-                pass
-
-        if self._channel:
-            await self._channel.close()
+        for channel, _ in self._lanes:
+            if not channel.is_closed:
+                await channel.close()
+        self._lanes = []
+        for future in self.futures.values():
+            if not future.done():
+                future.cancel()
+        self.futures.clear()
 
 def get_mq_service(request: Request) -> MLTaskPublisher:
     """Зависимость для получения сервиса RabbitMQ из состояния приложения."""
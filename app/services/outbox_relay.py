@@ -0,0 +1,159 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import Row, event
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.crud import outbox as outbox_crud
+from app.database.database import session_maker
+from app.models import MLRequest
+from app.schemas.ml_task_schemas import MLResult, MLTask
+from app.services.mq_publisher import MLTaskPublisher
+
+logger = logging.getLogger(__name__)
+
+_SESSION_KEY = "outbox_pending"
+
+
+def enqueue_outbox_task(
+    session: Session,
+    ml_request: MLRequest,
+    task: MLTask,
+    hold_until: Optional[datetime] = None,
+) -> None:
+    """
+    Сохраняет задачу в outbox в транзакции запроса; публикация произойдет после коммита
+    (с hold_until — не раньше этого времени, если задачу до того не снимут или не отпустят).
+    """
+    outbox_crud.enqueue_task(session, ml_request, task, hold_until)
+    if hold_until is None:
+        session.info[_SESSION_KEY] = True
+
+
+def release_outbox_task(session: Session, ml_request_id: int) -> None:
+    """Публикует отложенную задачу запроса сразу после коммита."""
+    outbox_crud.release(session, ml_request_id)
+    session.info[_SESSION_KEY] = True
+
+
+class OutboxRelay:
+    """
+    Фоновая публикация задач из outbox в RabbitMQ пачками с подтверждениями брокера.
+    Задачи удаляются из outbox только после подтверждения, поэтому доставка «как минимум один раз».
+    Аренда пачки и фиксация результата — две короткие транзакции в потоке: на время публикации
+    соединение с БД не удерживается, а event loop не блокируется запросами к БД.
+    """
+
+    def __init__(
+        self,
+        publisher: MLTaskPublisher,
+        session_factory: Callable[[], Session] = session_maker,
+    ) -> None:
+        self.publisher = publisher
+        self.session_factory = session_factory
+        self._wakeup = asyncio.Event()
+        self._stop_event = asyncio.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def wake(self) -> None:
+        """Будит цикл публикации. Безопасно вызывать из любого потока."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def relay_once(self) -> int:
+        """Публикует одну пачку задач. Возвращает количество опубликованных."""
+        messages = await asyncio.to_thread(self._claim)
+        if not messages:
+            return 0
+
+        tasks = [MLTask.model_validate_json(message.payload) for message in messages]
+        results = await self.publisher.send_tasks(tasks)
+
+        published = [m for m, error in zip(messages, results) if error is None]
+        errors: Dict[int, str] = {m.id: str(error) for m, error in zip(messages, results) if error is not None}
+        dead = await asyncio.to_thread(self._complete, published, errors)
+
+        if errors:
+            logger.warning(f"[OutboxRelay] Не удалось опубликовать {len(errors)} задач из {len(messages)}")
+        if dead:
+            logger.error(f"[OutboxRelay] Исчерпаны попытки публикации, запросы завершены ошибкой: {dead}")
+        logger.info(f"[OutboxRelay] Опубликовано задач: {len(published)}")
+        return len(published)
+
+    def _claim(self) -> List[Row]:
+        now = datetime.now(timezone.utc)
+        lease_until = now + timedelta(seconds=settings.mq.OUTBOX_LEASE_SECONDS)
+        with self.session_factory() as session:
+            messages = outbox_crud.claim_batch(session, settings.mq.OUTBOX_BATCH_SIZE, now, lease_until)
+            session.commit()
+        return messages
+
+    def _complete(self, published: List[Row], errors: Dict[int, str]) -> List[int]:
+        """Удаляет опубликованные задачи, учитывает неудачные и завершает запросы из dead letter."""
+        # Импорт здесь: сервис запросов сам импортирует outbox
+        from app.services.ml_service import MLRequestService
+
+        with self.session_factory() as session:
+            outbox_crud.complete(session, [m.id for m in published], [m.ml_request_id for m in published])
+            dead = outbox_crud.record_failures(
+                session, errors, settings.mq.OUTBOX_MAX_ATTEMPTS, datetime.now(timezone.utc)
+            )
+            session.commit()
+            if dead:
+                # Ошибка с возвратом средств — тем же путем, что и ошибка воркера
+                MLRequestService(session).apply_results_batch([
+                    MLResult(
+                        task_id=str(request_id),
+                        status="fail",
+                        worker_id="outbox-relay",
+                        error="Не удалось передать задачу в очередь",
+                    )
+                    for request_id in dead
+                ], queued=False)
+        return dead
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        backoff = settings.mq.RETRY_MIN
+        while not self._stop_event.is_set():
+            try:
+                published = await self.relay_once()
+                backoff = settings.mq.RETRY_MIN
+                if published >= settings.mq.OUTBOX_BATCH_SIZE:
+                    # Очередь не пуста — сразу берем следующую пачку
+                    continue
+                timeout = settings.mq.OUTBOX_POLL_INTERVAL
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"[OutboxRelay] Ошибка публикации пачки: {e}. Повтор через {backoff} сек...")
+                timeout = backoff
+                backoff = min(backoff * 2, settings.mq.RETRY_MAX)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self) -> None:
+        self._stop_event.set()
+        self._wakeup.set()
+
+
+outbox_relays: list[OutboxRelay] = []
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_relays(session: Session) -> None:
+    if session.info.pop(_SESSION_KEY, False):
+        for relay in outbox_relays:
+            relay.wake()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_outbox_flag(session: Session) -> None:
+    session.info.pop(_SESSION_KEY, None)
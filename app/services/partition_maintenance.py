@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select
+from sqlalchemy.engine import Engine
+
+from app.config import settings
+from app.database.database import engine as default_engine
+from app.database.partitions import PARTITION_LOCK_KEY, archive_partitions, ensure_partitions
+
+logger = logging.getLogger(__name__)
+
+
+class PartitionMaintainer:
+    """
+    Фоновое обслуживание помесячных партиций: создание партиций на будущие месяцы
+    и архивация старых. Работает только в PostgreSQL; между репликами API сериализуется
+    advisory-блокировкой, реплика без блокировки пропускает проход.
+    """
+
+    def __init__(self, engine: Engine = default_engine) -> None:
+        self.engine = engine
+        self._stop_event = asyncio.Event()
+
+    def maintain_once(self) -> None:
+        today = datetime.now(timezone.utc).date()
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            if not connection.execute(select(func.pg_try_advisory_lock(PARTITION_LOCK_KEY))).scalar():
+                return
+            try:
+                ensure_partitions(connection, today, settings.db.PARTITION_MONTHS_AHEAD)
+                archive_partitions(
+                    connection,
+                    today,
+                    settings.db.ARCHIVE_AFTER_MONTHS,
+                    settings.db.ARCHIVE_TABLESPACE,
+                )
+            finally:
+                connection.execute(select(func.pg_advisory_unlock(PARTITION_LOCK_KEY)))
+
+    async def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                # Работа с БД синхронная, поэтому выносим её из event loop
+                await asyncio.to_thread(self.maintain_once)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Ошибка обслуживания партиций: {e}")
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=settings.db.PARTITION_MAINTENANCE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self) -> None:
+        self._stop_event.set()
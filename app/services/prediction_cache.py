@@ -0,0 +1,102 @@
+import asyncio
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.schemas.ml_model_schemas import SMLModel
+from app.schemas.ml_request_schemas import SMLFeatureItem
+from app.utils import MQServiceException
+
+logger = logging.getLogger(__name__)
+
+# Поля, которые не влияют на предсказание и не должны попадать в ключ кеша
+_NON_FEATURE_FIELDS = {SMLFeatureItem.model_fields["patient_id"].alias}
+
+
+class PredictionCache:
+    """
+    Кеш результатов инференса с адресацией по содержимому: ключ — хеш признаков
+    и версии модели. Ограничен по размеру (LRU) и по времени жизни записей (TTL).
+    Одинаковые запросы, выполняющиеся одновременно, разделяют один вызов (singleflight).
+    """
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def make_key(rows: List[Dict[str, Any]], model: SMLModel) -> str:
+        """Канонический хеш подготовленных строк признаков и версии модели."""
+        features = [
+            {k: v for k, v in row.items() if k not in _NON_FEATURE_FIELDS}
+            for row in rows
+        ]
+        canonical = json.dumps(
+            {"model": model.code_name, "version": model.version, "rows": features},
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, prediction = entry
+        if expires_at < monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return prediction
+
+    def put(self, key: str, prediction: Any) -> None:
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (monotonic() + self.ttl, prediction)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    async def singleflight(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет call один раз для всех одновременных вызовов с одинаковым ключом.
+        Отмена ведущего вызова (клиент отключился) не отменяет остальных: они получают
+        MQServiceException и переводят свои запросы в фоновую очередь.
+        """
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            logger.info(f"Ожидание уже выполняющегося идентичного запроса ({key[:12]})")
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        # Исключение считается обработанным, даже если других ожидающих не было
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            result = await call()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.set_exception(MQServiceException())
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+
+prediction_cache = PredictionCache(
+    max_size=settings.app.PREDICTION_CACHE_SIZE,
+    ttl=settings.app.PREDICTION_CACHE_TTL,
+)
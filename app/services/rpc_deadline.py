@@ -0,0 +1,71 @@
+import logging
+from contextlib import contextmanager
+from time import monotonic
+from typing import Any, Dict, Iterator, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RPCDeadlineEstimator:
+    """
+    Оценка времени RPC-предсказания по наблюдаемой задержке воркеров.
+    Хранит экспоненциальное среднее задержки на строку и размера вызова, учитывает
+    вызовы этого процесса «в полете» и глубину RPC-очереди (из снимка /health).
+    Если ожидаемое время больше RPC_MAX_DEADLINE, вызов лучше сразу отправить в фоновую очередь.
+    """
+
+    def __init__(self) -> None:
+        self.in_flight_rows: int = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """Сбрасывает накопленную статистику к начальной оценке из настроек."""
+        self.row_latency: float = settings.mq.RPC_ROW_LATENCY
+        self.rows_per_call: float = 1.0
+        self.queued_messages: int = 0
+        self.consumers: int = 1
+
+    def _smooth(self, current: float, observed: float) -> float:
+        alpha = settings.mq.RPC_LATENCY_ALPHA
+        return (1 - alpha) * current + alpha * observed
+
+    def observe(self, num_rows: int, elapsed: float) -> None:
+        """Учитывает длительность вызова (для таймаута — его нижнюю границу)."""
+        num_rows = max(num_rows, 1)
+        self.row_latency = self._smooth(self.row_latency, elapsed / num_rows)
+        self.rows_per_call = self._smooth(self.rows_per_call, num_rows)
+
+    def observe_queue(self, queue_info: Optional[Dict[str, Any]]) -> None:
+        """Обновляет глубину RPC-очереди и число воркеров по данным брокера."""
+        if not queue_info or "error" in queue_info:
+            return
+        self.queued_messages = int(queue_info.get("messages") or 0)
+        self.consumers = max(int(queue_info.get("consumers") or 0), 1)
+
+    def expected(self, num_rows: int) -> float:
+        """Ожидаемое время ответа: своя пачка плюс очередь перед ней, разделенная между воркерами."""
+        backlog_rows = self.in_flight_rows + self.queued_messages * self.rows_per_call
+        return self.row_latency * (max(num_rows, 1) + backlog_rows / self.consumers)
+
+    def deadline(self, num_rows: int) -> float:
+        deadline = self.expected(num_rows) * settings.mq.RPC_DEADLINE_FACTOR
+        return min(max(deadline, settings.mq.RPC_MIN_DEADLINE), settings.mq.RPC_MAX_DEADLINE)
+
+    def should_defer(self, num_rows: int) -> bool:
+        return self.expected(num_rows) > settings.mq.RPC_MAX_DEADLINE
+
+    @contextmanager
+    def track(self, num_rows: int) -> Iterator[None]:
+        """Учитывает вызов как выполняющийся и по завершении записывает его длительность."""
+        started = monotonic()
+        self.in_flight_rows += num_rows
+        try:
+            yield
+        finally:
+            self.in_flight_rows -= num_rows
+            self.observe(num_rows, monotonic() - started)
+
+
+rpc_deadlines = RPCDeadlineEstimator()
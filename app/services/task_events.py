@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import uuid
+from collections import defaultdict
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+import aio_pika
+from aio_pika.pool import Pool
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.schemas.ml_request_schemas import STaskEvent
+
+logger = logging.getLogger(__name__)
+
+_SESSION_KEY = "task_events"
+_QUEUE_SIZE = 100
+
+
+class TaskEventBroker:
+    """
+    Внутрипроцессный pub/sub событий о смене статуса ML-запросов.
+    Подписчики (SSE-соединения) получают события своего пользователя через asyncio.Queue.
+    Если подключен мост в RabbitMQ, события также рассылаются остальным репликам API.
+    """
+
+    def __init__(self) -> None:
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = defaultdict(set)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: Set[asyncio.Task] = set()
+        self.bridge: Optional["TaskEventsBridge"] = None
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=_QUEUE_SIZE)
+        self._subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[user_id]
+
+    def dispatch(self, task_event: STaskEvent) -> None:
+        """Доставляет событие локальным подписчикам (только из потока event loop)."""
+        for queue in self._subscribers.get(task_event.user_id, ()):
+            if queue.full():
+                # Медленный клиент: выбрасываем самое старое событие
+                queue.get_nowait()
+            queue.put_nowait(task_event)
+
+    def publish(self, task_event: STaskEvent) -> None:
+        """Публикует событие локально и в мост. Безопасно вызывать из любого потока."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is loop:
+            self._publish_in_loop(task_event)
+        else:
+            loop.call_soon_threadsafe(self._publish_in_loop, task_event)
+
+    def _publish_in_loop(self, task_event: STaskEvent) -> None:
+        self.dispatch(task_event)
+        if self.bridge is not None:
+            task = asyncio.create_task(self.bridge.publish(task_event))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+
+task_events = TaskEventBroker()
+
+
+def enqueue_task_event(session: Session, task_event: STaskEvent) -> None:
+    """Откладывает публикацию события до успешного коммита сессии."""
+    session.info.setdefault(_SESSION_KEY, []).append(task_event)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed_events(session: Session) -> None:
+    pending: List[STaskEvent] = session.info.pop(_SESSION_KEY, [])
+    for task_event in pending:
+        task_events.publish(task_event)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_events(session: Session) -> None:
+    session.info.pop(_SESSION_KEY, None)
+
+
+class TaskEventsBridge:
+    """
+    Мост событий между репликами API через fanout-обменник RabbitMQ.
+    Каждая реплика слушает собственную эксклюзивную очередь и пропускает свои же сообщения,
+    так как локальным подписчикам они уже доставлены.
+    """
+
+    def __init__(self, connection_pool: Pool[aio_pika.RobustConnection], broker: TaskEventBroker) -> None:
+        self.connection_pool = connection_pool
+        self.broker = broker
+        self.instance_id = uuid.uuid4().hex
+        self._channel: Optional[aio_pika.RobustChannel] = None
+        self._exchange: Optional[aio_pika.abc.AbstractExchange] = None
+
+    async def start(self) -> None:
+        async with self.connection_pool.acquire() as connection:
+            self._channel = await connection.channel()
+        self._exchange = await self._channel.declare_exchange(
+            settings.mq.EVENTS_EXCHANGE_NAME,
+            type=aio_pika.ExchangeType.FANOUT,
+            durable=True,
+        )
+        queue = await self._channel.declare_queue(exclusive=True, auto_delete=True)
+        await queue.bind(self._exchange)
+        await queue.consume(self._on_message, no_ack=True)
+        self.broker.bridge = self
+        logger.info(f"Мост событий задач запущен (экземпляр {self.instance_id})")
+
+    async def publish(self, task_event: STaskEvent) -> None:
+        if self._exchange is None:
+            return
+        try:
+            await self._exchange.publish(
+                aio_pika.Message(
+                    body=task_event.model_dump_json().encode(),
+                    content_type="application/json",
+                    app_id=self.instance_id,
+                    delivery_mode=aio_pika.DeliveryMode.NOT_PERSISTENT,
+                ),
+                routing_key="",
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось разослать событие задачи {task_event.request_id}: {e}")
+
+    async def _on_message(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        if message.app_id == self.instance_id:
+            return
+        try:
+            self.broker.dispatch(STaskEvent.model_validate_json(message.body))
+        except Exception as e:
+            logger.warning(f"Некорректное событие задачи из брокера: {e}")
+
+    async def close(self) -> None:
+        self.broker.bridge = None
+        if self._channel and not self._channel.is_closed:
+            await self._channel.close()
+
+
+def format_sse(task_event: STaskEvent) -> str:
+    return f"event: status\nid: {task_event.request_id}\ndata: {task_event.model_dump_json()}\n\n"
+
+
+async def sse_stream(
+    request: Request,
+    user_id: int,
+    queue: asyncio.Queue,
+    request_id: Optional[int] = None,
+    initial: Optional[STaskEvent] = None,
+) -> AsyncIterator[str]:
+    """
+    Генератор Server-Sent Events для подписчика. При фильтре по request_id поток
+    закрывается после первого события по этому запросу.
+    """
+    try:
+        if initial is not None:
+            yield format_sse(initial)
+            return
+
+        while not await request.is_disconnected():
+            try:
+                task_event = await asyncio.wait_for(queue.get(), timeout=settings.app.EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+
+            if request_id is not None and task_event.request_id != request_id:
+                continue
+            yield format_sse(task_event)
+            if request_id is not None:
+                return
+    finally:
+        task_events.unsubscribe(user_id, queue)
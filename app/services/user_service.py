@@ -2,12 +2,12 @@ from decimal import Decimal
 from typing import Any, Dict, Optional, Union
 
 from pydantic import EmailStr
-from sqlalchemy import func, select
 from sqlalchemy.orm import Session
+from app.crud import analytics as analytics_crud
 from app.crud import user as user_crud
 
 from app.auth.hash_password import HashPassword
-from app.models import MLRequest, User
+from app.models import User
 from app.schemas import SUserRegister, SUserUpdate
 from app.utils import (
     UserAlreadyExistsException,
@@ -123,7 +123,7 @@ class UserService:
 
     def get_user_stats(self, user_id: int) -> Dict[str, Any]:
         """
-        Получить статистику пользователя через SQL агрегацию.
+        Получить статистику пользователя из предагрегированных дневных счетчиков.
 
         Args:
             user_id: ID пользователя
@@ -131,15 +131,8 @@ class UserService:
         Returns:
             Словарь с количеством запросов (request_count) и общими тратами (total_spent)
         """
-        query = (
-            select(
-                func.count(MLRequest.id).label("request_count"),
-                func.coalesce(func.sum(MLRequest.cost), Decimal("0.0")).label("total_spent")
-            )
-            .where(MLRequest.user_id == user_id)
-        )
-        result = self.session.execute(query).mappings().one()
-        return dict(result)
+        totals = analytics_crud.get_totals(self.session, user_id)
+        return {"request_count": totals.requests, "total_spent": Decimal(str(totals.revenue))}
 
     def authenticate_user(self, email: EmailStr, password: str) -> User:
         """
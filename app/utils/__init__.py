@@ -1,15 +1,26 @@
 from app.utils.exceptions import (
     AppException,
     InsufficientFundsException,
+    IdempotencyKeyInProgressException,
+    IdempotencyKeyMismatchException,
+    IngestFileInvalidException,
+    IngestFileTooLargeException,
+    IngestFormatNotSupportedException,
+    IngestJobNotFoundException,
     InternalServerErrorException,
     MLInferenceException,
     MLInvalidDataException,
     MLModelLoadException,
     MLModelNotFoundException,
+    MLRequestNotCompletedException,
     MLRequestNotFoundException,
     TransactionNotFoundException,
     MQServiceException,
+    QueueOverloadedException,
+    RequestRejectedException,
     ServiceUnavailableException,
+    TooManyPendingRequestsException,
+    UnknownResultColumnsException,
     UserAlreadyExistsException,
     UserIsNotPresentException,
     ForbiddenException,
@@ -21,4 +32,6 @@ from app.utils.exceptions import (
 )
 from app.utils.handlers import setup_exception_handlers
 from app.utils.logger import setup_logging
+from app.utils.tracing import TracingMiddleware, instrument_engine, setup_tracing
+from app.utils.metrics import MetricsMiddleware, instrument_engine_metrics, metrics_registry, track_rpc_pending
 from app.utils.decorators import transactional
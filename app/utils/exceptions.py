@@ -31,6 +31,18 @@ class MLRequestNotFoundException(AppException):
     status_code = status.HTTP_404_NOT_FOUND
     detail = "Запрос с таким ID не существует"
 
+class MLRequestNotCompletedException(AppException):
+    status_code = status.HTTP_409_CONFLICT
+    detail = "Запрос еще выполняется, результаты пока недоступны"
+
+class UnknownResultColumnsException(AppException):
+    status_code = status.HTTP_422_UNPROCESSABLE_CONTENT
+    detail = "Неизвестные колонки результатов"
+
+    def __init__(self, columns: list[str], allowed: list[str]) -> None:
+        super().__init__()
+        self.detail = {"message": self.detail, "columns": columns, "allowed": allowed}
+
 class TransactionNotFoundException(AppException):
     status_code = status.HTTP_404_NOT_FOUND
     detail = "Транзакция не найдена"
@@ -39,6 +51,30 @@ class MLModelNotFoundException(AppException):
     status_code = status.HTTP_404_NOT_FOUND
     detail = "ML-модель не найдена"
 
+class IdempotencyKeyInProgressException(AppException):
+    status_code = status.HTTP_409_CONFLICT
+    detail = "Запрос с этим ключом идемпотентности ещё выполняется"
+
+class IdempotencyKeyMismatchException(AppException):
+    status_code = status.HTTP_422_UNPROCESSABLE_CONTENT
+    detail = "Ключ идемпотентности уже использован для другого запроса"
+
+class RequestRejectedException(AppException):
+    """Запрос отклонен контролем допуска; клиенту сообщается, когда повторить попытку."""
+    status_code = status.HTTP_429_TOO_MANY_REQUESTS
+    detail = "Сервис перегружен, повторите запрос позже"
+
+    def __init__(self, retry_after: int) -> None:
+        self.retry_after = retry_after
+        super().__init__()
+        self.headers = {"Retry-After": str(retry_after)}
+
+class QueueOverloadedException(RequestRejectedException):
+    detail = "Очередь задач переполнена: запрос не будет обработан в срок, повторите позже"
+
+class TooManyPendingRequestsException(RequestRejectedException):
+    detail = "Слишком много незавершенных запросов, дождитесь их выполнения"
+
 # Ошибки ML Engine
 class MLModelLoadException(AppException):
     status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -57,6 +93,28 @@ class MLInvalidDataException(AppException):
         if errors:
             self.detail = {"message": self.detail, "errors": errors}
 
+# Ошибки загрузки файлов
+class IngestFormatNotSupportedException(AppException):
+    status_code = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+    detail = "Формат файла не поддерживается (допустимы csv, xlsx, parquet)"
+
+class IngestFileTooLargeException(AppException):
+    status_code = status.HTTP_413_CONTENT_TOO_LARGE
+    detail = "Файл превышает допустимый размер"
+
+class IngestFileInvalidException(AppException):
+    status_code = status.HTTP_422_UNPROCESSABLE_CONTENT
+    detail = "Не удалось прочитать файл"
+
+    def __init__(self, reason: Optional[str] = None) -> None:
+        super().__init__()
+        if reason:
+            self.detail = {"message": self.detail, "reason": reason}
+
+class IngestJobNotFoundException(AppException):
+    status_code = status.HTTP_404_NOT_FOUND
+    detail = "Загрузка с таким ID не существует"
+
 # Исключения для аутентификации
 class UnauthorizedException(AppException):
     status_code = status.HTTP_401_UNAUTHORIZED
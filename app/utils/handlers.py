@@ -24,7 +24,8 @@ async def app_exception_handler(request: Request, exc: AppException) -> JSONResp
 
     return JSONResponse(
         status_code=exc.status_code,
-        content={"status": "error", "message": exc.detail}
+        content={"status": "error", "message": exc.detail},
+        headers=exc.headers
     )
 
 
@@ -1,13 +1,13 @@
-import logging
-import sys
+from app.config import settings
+from common.log_pipeline import setup_logging as setup_log_pipeline
+
 
 def setup_logging() -> None:
-    """Настройка базового логирования для всего приложения."""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(sys.stdout)
-        ]
+    """Настройка логирования для всего приложения (неблокирующий вывод через очередь)."""
+    setup_log_pipeline(
+        level=settings.logging.LEVEL,
+        fmt=settings.logging.FORMAT,
+        sampling=settings.logging.SAMPLING,
+        max_length=settings.logging.MAX_MESSAGE_LENGTH,
+        queue_size=settings.logging.QUEUE_SIZE,
     )
-
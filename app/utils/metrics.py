@@ -0,0 +1,177 @@
+import contextvars
+import time
+from collections import Counter as Tally
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.utils.tracing import route_template, statement_operation
+from common.metrics import Counter, Gauge, Histogram, Registry
+
+metrics_registry = Registry()
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP-запросы по маршруту и коду ответа",
+    ("method", "route", "status"), metrics_registry,
+)
+HTTP_DURATION = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса до отправки ответа целиком",
+    ("method", "route"), metrics_registry,
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "HTTP-запросы, обрабатываемые в момент опроса",
+    ("method", "route"), metrics_registry,
+)
+HTTP_DB_STATEMENTS = Histogram(
+    "http_request_db_statements", "Число SQL-запросов на HTTP-запрос",
+    ("method", "route"), metrics_registry, buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+HTTP_DB_SECONDS = Histogram(
+    "http_request_db_seconds", "Суммарное время SQL-запросов на HTTP-запрос",
+    ("method", "route"), metrics_registry,
+)
+DB_STATEMENT_SECONDS = Histogram(
+    "db_statement_duration_seconds", "Время выполнения SQL-запроса (включая фоновые задачи)",
+    ("operation",), metrics_registry,
+)
+DB_POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Ожидание соединения из пула БД (включая открытие нового)",
+    (), metrics_registry, buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+DB_POOL = Gauge(
+    "db_pool_connections", "Соединения пула БД по состоянию", ("state",), metrics_registry,
+)
+RPC_CALLS = Counter(
+    "rpc_calls_total", "RPC-вызовы воркеров по результату", ("outcome",), metrics_registry,
+)
+RPC_PENDING = Gauge(
+    "rpc_pending_calls", "RPC-вызовы, ожидающие ответа (незавершенные future)", (), metrics_registry,
+)
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "Задержка срабатывания таймера event loop (признак блокирующего кода)",
+    (), metrics_registry, buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+UNMATCHED_ROUTE = "unmatched"
+
+
+class RequestDbUsage:
+    """SQL-запросы текущего HTTP-запроса (общий объект для event loop и потоков обработчика)."""
+
+    __slots__ = ("statements", "seconds")
+
+    def __init__(self) -> None:
+        self.statements = 0
+        self.seconds = 0.0
+
+
+_request_db: contextvars.ContextVar[Optional[RequestDbUsage]] = contextvars.ContextVar("request_db", default=None)
+# Обрабатываемые запросы: маршрут становится известен в scope после маршрутизации
+_in_flight: Dict[int, Dict[str, Any]] = {}
+
+_STARTED_ATTR = "_metrics_started"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if context is not None:
+        setattr(context, _STARTED_ATTR, time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    started = getattr(context, _STARTED_ATTR, None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    DB_STATEMENT_SECONDS.labels(statement_operation(statement)).observe(elapsed)
+    usage = _request_db.get()
+    if usage is not None:
+        usage.statements += 1
+        usage.seconds += elapsed
+
+
+def _collect_pool(engine: Engine) -> None:
+    pool = engine.pool
+    # Счетчики есть только у QueuePool; у StaticPool/NullPool (тесты, SQLite) их нет
+    for state, method in (("size", "size"), ("checked_out", "checkedout"), ("idle", "checkedin"),
+                          ("overflow", "overflow")):
+        if hasattr(pool, method):
+            DB_POOL.labels(state).set(getattr(pool, method)())
+
+
+def instrument_engine_metrics(engine: Engine) -> None:
+    """Время SQL-запросов (общее и на HTTP-запрос), ожидание соединения из пула и состояние пула."""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    # У пула нет события «начало ожидания», поэтому замеряется выдача соединения движку
+    raw_connection = engine.raw_connection
+
+    def timed_raw_connection(*args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return raw_connection(*args, **kwargs)
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - started)
+
+    engine.raw_connection = timed_raw_connection
+    metrics_registry.on_collect(lambda: _collect_pool(engine))
+
+
+def track_rpc_pending(rpc_client: Any) -> None:
+    """Число ожидающих ответа RPC-вызовов обновляется перед каждым опросом и снимком метрик."""
+    metrics_registry.on_collect(lambda: RPC_PENDING.set(len(rpc_client.futures)))
+
+
+def _collect_in_flight() -> None:
+    counts = Tally(
+        (scope["method"], route_template(scope) or UNMATCHED_ROUTE) for scope in list(_in_flight.values())
+    )
+    HTTP_IN_FLIGHT.clear()
+    for (method, route), count in counts.items():
+        HTTP_IN_FLIGHT.labels(method, route).set(count)
+
+
+metrics_registry.on_collect(_collect_in_flight)
+
+
+class MetricsMiddleware:
+    """
+    Время ответа, коды ответа, число обрабатываемых запросов и использование БД по маршрутам.
+    Маршрут — шаблон пути (/api/v1/requests/history/{request_id}); запросы без маршрута (404)
+    учитываются как unmatched, чтобы число временных рядов не зависело от присланных путей.
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        usage = RequestDbUsage()
+        token = _request_db.set(usage)
+        _in_flight[id(scope)] = scope
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_db.reset(token)
+            _in_flight.pop(id(scope), None)
+            method, route = scope["method"], route_template(scope) or UNMATCHED_ROUTE
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+            HTTP_DURATION.labels(method, route).observe(elapsed)
+            HTTP_DB_STATEMENTS.labels(method, route).observe(usage.statements)
+            HTTP_DB_SECONDS.labels(method, route).observe(usage.seconds)
@@ -0,0 +1,121 @@
+from typing import Any, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.config import settings
+from common import tracing
+from common.tracing import setup_tracing as setup_tracer
+
+_SPAN_ATTR = "_trace_span"
+
+
+def statement_operation(statement: str) -> str:
+    """Вид SQL-запроса по первому слову (SELECT, INSERT, ...)."""
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "SQL"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    # Запросы вне трассы (фоновые задачи без родительского спана) не записываются
+    parent = tracing.current_span()
+    if parent is None or not parent.recording or context is None:
+        return
+    operation = statement_operation(statement)
+    span = tracing.start_span(f"SQL {operation}", kind=tracing.CLIENT, attributes={
+        "db.system": conn.engine.dialect.name,
+        "db.operation": operation,
+        "db.statement": statement[:settings.tracing.MAX_STATEMENT_LENGTH],
+        "db.executemany": executemany,
+    })
+    setattr(context, _SPAN_ATTR, span)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    span: Optional[tracing.Span] = getattr(context, _SPAN_ATTR, None)
+    if span is not None:
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            span.set_attribute("db.rowcount", cursor.rowcount)
+        span.end()
+
+
+def _handle_error(exception_context: Any) -> None:
+    span: Optional[tracing.Span] = getattr(exception_context.execution_context, _SPAN_ATTR, None)
+    if span is not None:
+        span.record_error(exception_context.original_exception)
+        span.end()
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Спан на каждый SQL-запрос, выполненный внутри трассы (дочерний к текущему спану)."""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def setup_tracing(engine: Optional[Engine] = None) -> None:
+    """Настройка трассировки процесса API; при переданном engine трассируются и запросы к БД."""
+    setup_tracer(
+        service=settings.tracing.SERVICE_NAME,
+        exporter=settings.tracing.EXPORTER,
+        sample_ratio=settings.tracing.SAMPLE_RATIO,
+        queue_size=settings.tracing.QUEUE_SIZE,
+    )
+    if engine is not None:
+        instrument_engine(engine)
+
+
+def route_template(scope) -> Optional[str]:
+    """Шаблон пути обработанного запроса (/api/v1/requests/history/{request_id}) или None до маршрутизации."""
+    template = getattr(scope.get("route"), "path", None)
+    if template is None:
+        return None
+    # Маршруты подключенных роутеров могут хранить путь без префикса: префикс берется из фактического пути
+    depth = template.rstrip("/").count("/")
+    path = scope["path"].rstrip("/")
+    prefix = path.rsplit("/", depth)[0] if depth else path
+    return prefix + template
+
+
+class TracingMiddleware:
+    """
+    Серверный спан на каждый HTTP-запрос. Входящий traceparent продолжает трассу вызывающей
+    стороны; идентификатор трассы возвращается в заголовке X-Trace-Id, чтобы по медленному
+    ответу можно было найти его трассу.
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        parent = tracing.parse_traceparent(next(
+            (value.decode("latin-1") for key, value in scope["headers"] if key == b"traceparent"), None
+        ))
+        method = scope["method"]
+        with tracing.span(f"{method} {scope['path']}", parent=parent, kind=tracing.SERVER, attributes={
+            "http.method": method,
+            "http.target": scope["path"],
+        }) as span:
+            trace_header = (b"x-trace-id", span.context.trace_id.encode())
+
+            async def send_with_trace(message) -> None:
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                    if message["status"] >= 500:
+                        span.record_error(f"HTTP {message['status']}")
+                    message = {**message, "headers": [*message.get("headers", []), trace_header]}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace)
+            finally:
+                # Шаблон пути известен только после маршрутизации
+                route = route_template(scope)
+                if route is not None:
+                    span.name = f"{method} {route}"
+                    span.set_attribute("http.route", route)
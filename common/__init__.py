@@ -0,0 +1 @@
+"""Код, общий для API (app), воркеров (ml_worker) и интерфейса (webview)."""
@@ -0,0 +1,63 @@
+"""Колонки признаков ML-запроса и правила сопоставления заголовков файлов (общие для API и webview)."""
+from typing import Dict, Iterable, Optional
+
+# Синонимы для умного поиска колонок (в нижнем регистре)
+SYNONYMS_MAP = {
+    "№ Пациента": ["patient_id", "№пациента", "№ Пациента", "номер пациента", "id пациента", "patient", "id"],
+    "Возраст": ["age", "возраст", "лет", "age_years", "пациент_возраст"],
+    "ВНН/ПП": ["vnn_pp", "внн", "пп", "vnn/pp", "vnn", "pp"],
+    "Клозапин": ["clozapine", "клозапин", "clozapin"],
+    "CYP2C19 1/2": ["cyp2c19_1_2", "cyp2c19 1/2", "2c19 1/2", "1/2", "cyp2c19 *1/*2", "*1/*2"],
+    "CYP2C19 1/17": ["cyp2c19_1_17", "cyp2c19 1/17", "2c19 1/17", "1/17", "cyp2c19 *1/*17", "*1/*17"],
+    "CYP2C19 *17/*17": ["cyp2c19_17_17", "cyp2c19 *17/*17", "cyp2c19 17/17", "17/17"],
+    "CYP2D6 1/3": ["cyp2d6_1_3", "cyp2d6 1/3", "2d6 1/3", "1/3", "cyp2d6 *1/*3", "*1/*3"],
+}
+
+REQUIRED_ALIAS_ORDER = [
+    "№ Пациента",
+    "Возраст",
+    "ВНН/ПП",
+    "Клозапин",
+    "CYP2C19 1/2",
+    "CYP2C19 1/17",
+    "CYP2C19 *17/*17",
+    "CYP2D6 1/3",
+]
+
+PATIENT_COLUMN = "№ Пациента"
+AGE_COLUMN = "Возраст"
+BINARY_COLUMNS = REQUIRED_ALIAS_ORDER[2:]
+
+MIN_AGE = 0
+MAX_AGE = 150
+
+# Текстовые статусы бинарных признаков
+POSITIVE_STATUSES = ("есть", "выявлен", "да", "присутствует", "принимает", "1", "1.0", "true", "yes")
+NEGATIVE_STATUSES = ("нет", "не выявлен", "отсутствует", "не принимает", "0", "0.0", "false", "no")
+
+
+def _synonym_index() -> Dict[str, str]:
+    index: Dict[str, str] = {}
+    for canonical, synonyms in SYNONYMS_MAP.items():
+        for synonym in synonyms:
+            index[synonym.lower().strip()] = canonical
+        index[canonical.lower().strip()] = canonical
+    return index
+
+
+_SYNONYM_INDEX = _synonym_index()
+
+
+def canonical_column(name: object) -> Optional[str]:
+    """Канонический алиас колонки по ее заголовку (без учета регистра и пробелов по краям)."""
+    return _SYNONYM_INDEX.get(str(name).lower().strip())
+
+
+def resolve_columns(names: Iterable[object]) -> Dict[object, str]:
+    """Сопоставление заголовков файла каноническим алиасам; при повторах берется первая колонка."""
+    resolved: Dict[object, str] = {}
+    for name in names:
+        canonical = canonical_column(name)
+        if canonical and canonical not in resolved.values():
+            resolved[name] = canonical
+    return resolved
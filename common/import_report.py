@@ -0,0 +1,94 @@
+"""
+Отчет о времени импорта модулей (общий для app и ml_worker).
+
+Модуль импортируется в отдельном интерпретаторе с -X importtime, вывод сводится
+в таблицу: собственное и накопленное время по модулям и суммарное время по пакетам верхнего уровня.
+С --budget-ms команда завершается с кодом 1, если общее время импорта превышает бюджет.
+
+    python -m common.import_report app.main --top 20 --budget-ms 2500
+    python -m common.import_report ml_worker.main
+"""
+import argparse
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, NamedTuple
+
+
+class ImportTiming(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(output: str) -> List[ImportTiming]:
+    """Разбирает строки вида 'import time: self [us] | cumulative | imported package'."""
+    timings: List[ImportTiming] = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            # Заголовок таблицы
+            continue
+        name = parts[2].rstrip()
+        module = name.lstrip()
+        # Вложенность в выводе обозначается отступом по два пробела
+        depth = (len(name) - len(module) - 1) // 2
+        timings.append(ImportTiming(module, int(parts[0]), int(parts[1]), depth))
+    return timings
+
+
+def total_us(timings: List[ImportTiming]) -> int:
+    """Общее время импорта: сумма накопленного времени модулей верхнего уровня."""
+    return sum(t.cumulative_us for t in timings if t.depth == 0)
+
+
+def by_package(timings: List[ImportTiming]) -> Dict[str, int]:
+    """Собственное время модулей, сложенное по пакетам верхнего уровня."""
+    packages: Dict[str, int] = defaultdict(int)
+    for t in timings:
+        packages[t.module.split(".")[0]] += t.self_us
+    return dict(packages)
+
+
+def measure(module: str) -> List[ImportTiming]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Не удалось импортировать {module}:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def render(timings: List[ImportTiming], top: int) -> str:
+    lines = [f"Всего: {total_us(timings) / 1000:.1f} мс, модулей: {len(timings)}", "", "Пакеты (собственное время, мс):"]
+    for package, us in sorted(by_package(timings).items(), key=lambda item: -item[1])[:top]:
+        lines.append(f"  {us / 1000:10.1f}  {package}")
+    lines += ["", "Модули (накопленное / собственное время, мс):"]
+    for t in sorted(timings, key=lambda t: -t.cumulative_us)[:top]:
+        lines.append(f"  {t.cumulative_us / 1000:10.1f} {t.self_us / 1000:10.1f}  {t.module}")
+    return "\n".join(lines)
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Отчет о времени импорта модуля")
+    parser.add_argument("module", help="Импортируемый модуль, например app.main")
+    parser.add_argument("--top", type=int, default=25, help="Сколько строк выводить в таблицах")
+    parser.add_argument("--budget-ms", type=float, default=None, help="Бюджет общего времени импорта (мс)")
+    args = parser.parse_args(argv)
+
+    timings = measure(args.module)
+    print(render(timings, args.top))
+    total_ms = total_us(timings) / 1000
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f"\nБюджет превышен: {total_ms:.1f} мс > {args.budget_ms:.1f} мс", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
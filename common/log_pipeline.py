@@ -0,0 +1,156 @@
+"""
+Неблокирующее структурированное логирование.
+
+Логгеры пишут в ограниченную очередь (QueueHandler), а вывод в stdout и форматирование
+выполняет отдельный поток (QueueListener), поэтому запись логов не блокирует event loop.
+Поддерживаются выборочная запись (sampling) по префиксам логгеров и обрезка длинных сообщений.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Mapping, Optional
+
+# Стандартные атрибуты LogRecord; всё остальное считается extra-полями
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_listener: Optional[QueueListener] = None
+
+
+def truncate(value: str, max_length: int) -> str:
+    if max_length <= 0 or len(value) <= max_length:
+        return value
+    return f"{value[:max_length]}... [обрезано {len(value) - max_length} символов]"
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение, extra-поля и трассировка."""
+
+    def __init__(self, max_length: int = 0) -> None:
+        super().__init__()
+        self.max_length = max_length
+
+    def _field(self, value: Any) -> Any:
+        # Крупные extra-поля (тела запросов, признаки) обрезаются так же, как сообщение
+        if isinstance(value, str):
+            return truncate(value, self.max_length)
+        if isinstance(value, (dict, list, tuple)) and self.max_length > 0:
+            dumped = json.dumps(value, ensure_ascii=False, default=str)
+            return value if len(dumped) <= self.max_length else truncate(dumped, self.max_length)
+        return value
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = self._field(value)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает долю записей уровня ниже WARNING для логгеров с заданным префиксом.
+    Предупреждения и ошибки пропускаются всегда. Выбирается самый длинный совпавший префикс.
+    """
+
+    def __init__(self, rates: Mapping[str, float]) -> None:
+        super().__init__()
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def rate_for(self, name: str) -> float:
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + "."):
+                return rate
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Кладет запись в очередь, не форматируя ее в вызывающем потоке.
+    При переполнении очереди запись отбрасывается (счетчик dropped), а не блокирует вызывающего.
+    """
+
+    def __init__(self, log_queue: queue.Queue, max_length: int) -> None:
+        super().__init__(log_queue)
+        self.max_length = max_length
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Подставляем аргументы сейчас: объекты могут измениться до записи в потоке вывода
+        record.msg = truncate(record.getMessage(), self.max_length)
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(
+    level: str = "INFO",
+    fmt: str = "JSON",
+    sampling: Optional[Mapping[str, float]] = None,
+    max_length: int = 2000,
+    queue_size: int = 10000,
+) -> None:
+    """
+    Настраивает корневой логгер процесса. Повторные вызовы ничего не меняют.
+
+    Args:
+        level: Уровень логирования
+        fmt: "JSON" — структурированный вывод, иначе текстовый
+        sampling: Доля записываемых INFO/DEBUG-записей по префиксу логгера, например {"aio_pika": 0.1}
+        max_length: Максимальная длина сообщения (0 — без ограничения)
+        queue_size: Размер очереди записей между приложением и потоком вывода
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter(max_length) if fmt.upper() == "JSON" else logging.Formatter(_TEXT_FORMAT))
+
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    queue_handler = NonBlockingQueueHandler(log_queue, max_length)
+    queue_handler.addFilter(SamplingFilter(sampling or {}))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Дописывает оставшиеся в очереди записи и останавливает поток вывода."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,292 @@
+"""
+Метрики процесса в текстовом формате Prometheus (exposition format 0.0.4).
+
+Счетчики, измерители и гистограммы с метками хранятся в реестре и отдаются
+целиком при опросе. Значения потокобезопасны: наблюдения приходят и из event loop,
+и из потоков (синхронные обработчики, запросы к БД). Измерители, которые удобнее
+вычислять в момент опроса (размер пула, число ожидающих RPC), обновляются
+функциями, зарегистрированными через Registry.on_collect.
+
+Метрики хранятся в памяти процесса. При нескольких процессах uvicorn опрос попадает в случайный
+процесс, поэтому реестр переводится в многопроцессный режим (Registry.enable_multiprocess): каждый
+процесс периодически и при каждом опросе записывает снимок своих значений в файл {pid}.json общего
+каталога, а опрашиваемый процесс отдает сумму по всем файлам. Счетчики и гистограммы суммируются
+по всем процессам, включая завершившиеся (значения не убывают при перезапуске воркера), измерители —
+только по живым. Значения других процессов отстают не более чем на интервал записи снимков.
+"""
+import json
+import math
+import os
+import threading
+from glob import glob
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+LabelValues = Tuple[str, ...]
+Series = List[Tuple[LabelValues, Any]]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return f"{float(value):.1f}"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, "Metric"] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._directory: Optional[str] = None
+
+    def register(self, metric: "Metric") -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional["Metric"]:
+        return self._metrics.get(name)
+
+    def on_collect(self, collector: Callable[[], None]) -> None:
+        """Функция, обновляющая измерители перед каждым опросом."""
+        self._collectors.append(collector)
+
+    def enable_multiprocess(self, directory: str) -> None:
+        """Сводить при опросе значения всех процессов, записывающих снимки в каталог directory."""
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+
+    @property
+    def multiprocess(self) -> bool:
+        return self._directory is not None
+
+    def _collect(self) -> Dict[str, Series]:
+        for collector in self._collectors:
+            collector()
+        return {name: metric.export() for name, metric in self._metrics.items()}
+
+    def write_snapshot(self) -> None:
+        """Записывает значения процесса в {pid}.json (атомарно: читатели не видят половину файла)."""
+        if self._directory is None:
+            return
+        path = os.path.join(self._directory, f"{os.getpid()}.json")
+        snapshot = {name: [[list(key), data] for key, data in series] for name, series in self._collect().items()}
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(snapshot, file)
+        os.replace(f"{path}.tmp", path)
+
+    def _merge_snapshots(self) -> Dict[str, Series]:
+        merged: Dict[str, Dict[LabelValues, Any]] = {}
+        for path in glob(os.path.join(self._directory, "*.json")):
+            try:
+                pid = int(os.path.basename(path)[:-len(".json")])
+                with open(path, encoding="utf-8") as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+            alive = _process_alive(pid)
+            for name, rows in snapshot.items():
+                metric = self._metrics.get(name)
+                if metric is None or not (alive or metric.cumulative):
+                    continue
+                series = merged.setdefault(name, {})
+                for key, data in rows:
+                    key = tuple(key)
+                    series[key] = metric.add(series[key], data) if key in series else data
+        return {name: sorted(series.items()) for name, series in merged.items()}
+
+    def render(self) -> str:
+        if self._directory is None:
+            values = self._collect()
+        else:
+            self.write_snapshot()
+            values = self._merge_snapshots()
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.samples(values.get(metric.name, [])))
+        return "\n".join(lines) + "\n"
+
+
+class Metric:
+    type_name = "untyped"
+    # Значение накапливается (суммируется и по завершившимся процессам)
+    cumulative = True
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = None) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[LabelValues, object] = {}
+        if registry is not None:
+            registry.register(self)
+
+    def _new_child(self) -> object:
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}, получено {values}")
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def clear(self) -> None:
+        with self._lock:
+            self._children.clear()
+
+    def _items(self) -> Iterator[Tuple[LabelValues, object]]:
+        with self._lock:
+            items = list(self._children.items())
+        return iter(sorted(items))
+
+    def export(self) -> Series:
+        """Значения по меткам в виде, пригодном для JSON и суммирования (add)."""
+        raise NotImplementedError
+
+    def add(self, left: Any, right: Any) -> Any:
+        raise NotImplementedError
+
+    def samples(self, values: Series) -> List[str]:
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = float(value)
+
+
+class Counter(Metric):
+    """Монотонный счетчик; имя принято заканчивать на _total."""
+
+    type_name = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def export(self) -> Series:
+        return [(key, child.value) for key, child in self._items()]
+
+    def add(self, left: float, right: float) -> float:
+        return left + right
+
+    def samples(self, values: Series) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in values]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+    cumulative = False
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = len(self.bounds)
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = None, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(b for b in buckets if b != math.inf))
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def export(self) -> Series:
+        """Значения — число наблюдений по корзинам (без накопления) и сумма последним элементом."""
+        values: Series = []
+        for key, child in self._items():
+            with child._lock:
+                values.append((key, list(child.counts) + [child.sum]))
+        return values
+
+    def add(self, left: List[float], right: List[float]) -> List[float]:
+        return [a + b for a, b in zip(left, right)]
+
+    def samples(self, values: Series) -> List[str]:
+        lines: List[str] = []
+        names = self.labelnames + ("le",)
+        for key, data in values:
+            counts, total = data[:-1], data[-1]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
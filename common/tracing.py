@@ -0,0 +1,552 @@
+"""
+Распределенная трассировка (общая для app и ml_worker).
+
+Контекст трассы передается между сервисами в формате W3C Trace Context (заголовок traceparent):
+в HTTP-запросах и в заголовках AMQP-сообщений. Текущий спан хранится в contextvars, поэтому
+дочерние спаны (запросы к БД, инференс) создаются без явной передачи родителя, в том числе
+в потоках asyncio.to_thread. Завершенные спаны складываются в ограниченную очередь, а экспорт
+выполняет отдельный поток, так что трассировка не блокирует event loop.
+
+Экспортер задается строкой вида "<схема>:<адрес>":
+    file:/var/log/ml_service/spans.jsonl   — JSON-строка на спан
+    otlp:http://collector:4318             — OTLP/HTTP (JSON), совместимо с OpenTelemetry Collector
+Пустая строка отключает экспорт. Новые схемы подключаются через register_exporter.
+
+Локальный приемник OTLP (пишет спаны в файл) и просмотр трассы:
+    python -m common.tracing collect --port 4318 --out spans.jsonl
+    python -m common.tracing show spans.jsonl [--trace <trace_id>]
+"""
+import argparse
+import atexit
+import contextvars
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Mapping, MutableMapping, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT = "traceparent"
+
+# Виды спанов (значения SpanKind из OTLP)
+INTERNAL = "internal"
+SERVER = "server"
+CLIENT = "client"
+PRODUCER = "producer"
+CONSUMER = "consumer"
+_OTLP_KINDS = {INTERNAL: 1, SERVER: 2, CLIENT: 3, PRODUCER: 4, CONSUMER: 5}
+
+
+class SpanContext(NamedTuple):
+    trace_id: str
+    span_id: str
+    sampled: bool = True
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def parse_traceparent(value: Optional[Any]) -> Optional[SpanContext]:
+    """Разбирает заголовок traceparent; некорректное значение игнорируется."""
+    if isinstance(value, bytes):
+        value = value.decode(errors="replace")
+    if not isinstance(value, str):
+        return None
+    parts = value.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3][:2], 16)
+    except ValueError:
+        return None
+    if parts[0] == "ff" or set(parts[1]) == {"0"} or set(parts[2]) == {"0"}:
+        return None
+    return SpanContext(parts[1], parts[2], bool(flags & 1))
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits) or 1:0{bits // 4}x}"
+
+
+class Span:
+    """Спан трассы. Несэмплированный спан не записывается, но его контекст передается дальше."""
+
+    __slots__ = ("tracer", "name", "context", "parent_id", "kind", "attributes",
+                 "start_ns", "end_ns", "error")
+
+    def __init__(self, tracer: "Tracer", name: str, context: SpanContext, parent_id: Optional[str],
+                 kind: str, attributes: Optional[Mapping[str, Any]]) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    @property
+    def recording(self) -> bool:
+        return self.context.sampled and self.tracer.enabled
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_error(self, error: Any) -> None:
+        self.error = error if isinstance(error, str) else f"{type(error).__name__}: {error}"
+
+    def end(self) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.recording:
+            self.tracer.export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        end_ns = self.end_ns or time.time_ns()
+        return {
+            "trace_id": self.context.trace_id,
+            "span_id": self.context.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "service": self.tracer.service,
+            "start_ns": self.start_ns,
+            "end_ns": end_ns,
+            "duration_ms": round((end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Exporter:
+    """Получатель пачек завершенных спанов (вызывается из потока экспорта)."""
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryExporter(Exporter):
+    """Хранит спаны в памяти (тесты и отладка)."""
+
+    def __init__(self) -> None:
+        self.spans: List[Dict[str, Any]] = []
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        self.spans.extend(spans)
+
+
+class FileExporter(Exporter):
+    """Дописывает спаны в файл, по одной JSON-строке на спан."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _from_otlp_value(value: Mapping[str, Any]) -> Any:
+    if "intValue" in value:
+        return int(value["intValue"])
+    return next(iter(value.values()), None)
+
+
+def to_otlp(spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Пачка спанов в формате OTLP/JSON (ExportTraceServiceRequest), сгруппированная по сервисам."""
+    by_service: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for span in spans:
+        otlp_span = {
+            "traceId": span["trace_id"],
+            "spanId": span["span_id"],
+            "name": span["name"],
+            "kind": _OTLP_KINDS.get(span["kind"], 1),
+            "startTimeUnixNano": str(span["start_ns"]),
+            "endTimeUnixNano": str(span["end_ns"]),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span["attributes"].items()],
+            "status": {"code": 2, "message": span["error"]} if span["error"] else {"code": 1},
+        }
+        if span["parent_id"]:
+            otlp_span["parentSpanId"] = span["parent_id"]
+        by_service[span["service"]].append(otlp_span)
+    return {"resourceSpans": [
+        {
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+            "scopeSpans": [{"scope": {"name": "common.tracing"}, "spans": service_spans}],
+        }
+        for service, service_spans in by_service.items()
+    ]}
+
+
+def from_otlp(payload: Mapping[str, Any]) -> List[Dict[str, Any]]:
+    """Обратное преобразование OTLP/JSON в записи формата FileExporter."""
+    kinds = {code: kind for kind, code in _OTLP_KINDS.items()}
+    spans: List[Dict[str, Any]] = []
+    for resource_spans in payload.get("resourceSpans", []):
+        resource = {a["key"]: _from_otlp_value(a["value"])
+                    for a in resource_spans.get("resource", {}).get("attributes", [])}
+        for scope_spans in resource_spans.get("scopeSpans", []):
+            for span in scope_spans.get("spans", []):
+                start_ns, end_ns = int(span["startTimeUnixNano"]), int(span["endTimeUnixNano"])
+                status = span.get("status") or {}
+                spans.append({
+                    "trace_id": span["traceId"],
+                    "span_id": span["spanId"],
+                    "parent_id": span.get("parentSpanId") or None,
+                    "name": span["name"],
+                    "kind": kinds.get(span.get("kind"), INTERNAL),
+                    "service": resource.get("service.name", "unknown"),
+                    "start_ns": start_ns,
+                    "end_ns": end_ns,
+                    "duration_ms": round((end_ns - start_ns) / 1e6, 3),
+                    "attributes": {a["key"]: _from_otlp_value(a["value"])
+                                   for a in span.get("attributes", [])},
+                    "error": status.get("message") or ("error" if status.get("code") == 2 else None),
+                })
+    return spans
+
+
+class OTLPHttpExporter(Exporter):
+    """Отправляет спаны по OTLP/HTTP в JSON-кодировке (POST <endpoint>/v1/traces)."""
+
+    def __init__(self, endpoint: str, timeout: float = 5.0) -> None:
+        endpoint = endpoint.rstrip("/")
+        self.url = endpoint if endpoint.endswith("/v1/traces") else f"{endpoint}/v1/traces"
+        self.timeout = timeout
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(to_otlp(spans), default=str).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+_EXPORTERS: Dict[str, Callable[[str], Exporter]] = {
+    "file": FileExporter,
+    "otlp": OTLPHttpExporter,
+}
+
+
+def register_exporter(scheme: str, factory: Callable[[str], Exporter]) -> None:
+    """Регистрирует экспортер для строк вида "<scheme>:<адрес>"."""
+    _EXPORTERS[scheme] = factory
+
+
+def create_exporter(spec: str) -> Optional[Exporter]:
+    if not spec:
+        return None
+    scheme, _, target = spec.partition(":")
+    factory = _EXPORTERS.get(scheme)
+    if factory is None:
+        raise ValueError(f"Неизвестный экспортер трассировки: {scheme!r} (доступны: {', '.join(_EXPORTERS)})")
+    return factory(target)
+
+
+class BatchExportProcessor:
+    """
+    Очередь завершенных спанов и поток, отправляющий их экспортеру пачками.
+    При переполнении очереди спан отбрасывается (счетчик dropped), а не блокирует вызывающего.
+    """
+
+    def __init__(self, exporter: Exporter, queue_size: int = 10000, batch_size: int = 256,
+                 flush_interval: float = 1.0) -> None:
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+        self._thread.start()
+
+    def submit(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self, first: Optional[Span] = None) -> List[Dict[str, Any]]:
+        batch = [first.to_dict()] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait().to_dict())
+            except queue.Empty:
+                break
+        return batch
+
+    def _export(self, batch: List[Dict[str, Any]]) -> None:
+        if not batch:
+            return
+        try:
+            self.exporter.export(batch)
+        except Exception as e:
+            logger.warning(f"Не удалось экспортировать {len(batch)} спанов: {e}")
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._export(self._drain(first))
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=self.flush_interval + 1)
+        while not self._queue.empty():
+            self._export(self._drain())
+        self.exporter.close()
+
+
+class Tracer:
+    """
+    Создает спаны одного сервиса. Решение о сэмплировании принимается в корневом спане
+    (доля sample_ratio) и наследуется дочерними, в том числе в других сервисах.
+    Без экспортера спаны не записываются, но контекст трассы по-прежнему передается.
+    """
+
+    def __init__(self, service: str, exporter: Optional[Exporter] = None, sample_ratio: float = 1.0,
+                 queue_size: int = 10000) -> None:
+        self.service = service
+        self.sample_ratio = sample_ratio
+        self.processor = BatchExportProcessor(exporter, queue_size) if exporter is not None else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.processor is not None
+
+    def export(self, span: Span) -> None:
+        if self.processor is not None:
+            self.processor.submit(span)
+
+    def start_span(self, name: str, parent: Optional[SpanContext] = None, kind: str = INTERNAL,
+                   attributes: Optional[Mapping[str, Any]] = None) -> Span:
+        """Начинает спан, не делая его текущим. Без parent родителем становится текущий спан."""
+        if parent is None:
+            current = _current_span.get()
+            parent = current.context if current is not None else None
+        if parent is None:
+            context = SpanContext(_new_id(128), _new_id(64), random.random() < self.sample_ratio)
+            return Span(self, name, context, None, kind, attributes)
+        context = SpanContext(parent.trace_id, _new_id(64), parent.sampled)
+        return Span(self, name, context, parent.span_id, kind, attributes)
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[SpanContext] = None, kind: str = INTERNAL,
+             attributes: Optional[Mapping[str, Any]] = None) -> Iterator[Span]:
+        """Спан на время блока; внутри блока он текущий. Исключение отмечается в спане."""
+        span = self.start_span(name, parent, kind, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def shutdown(self) -> None:
+        if self.processor is not None:
+            self.processor.shutdown()
+            self.processor = None
+
+
+_tracer = Tracer("unknown")
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def setup_tracing(service: str, exporter: str = "", sample_ratio: float = 1.0, queue_size: int = 10000) -> Tracer:
+    """
+    Настраивает трассировку процесса. Повторные вызовы заменяют экспортер.
+
+    Args:
+        service: Имя сервиса в спанах (service.name)
+        exporter: Строка экспортера, например "file:/tmp/spans.jsonl"; пустая — без экспорта
+        sample_ratio: Доля записываемых трасс (решение принимается в корневом спане)
+        queue_size: Размер очереди спанов между приложением и потоком экспорта
+    """
+    global _tracer
+    _tracer.shutdown()
+    _tracer = Tracer(service, create_exporter(exporter), sample_ratio, queue_size)
+    return _tracer
+
+
+def shutdown_tracing() -> None:
+    """Экспортирует оставшиеся в очереди спаны и останавливает поток экспорта."""
+    _tracer.shutdown()
+
+
+atexit.register(shutdown_tracing)
+
+
+def span(name: str, parent: Optional[SpanContext] = None, kind: str = INTERNAL,
+         attributes: Optional[Mapping[str, Any]] = None) -> ContextManager[Span]:
+    return _tracer.span(name, parent, kind, attributes)
+
+
+def start_span(name: str, parent: Optional[SpanContext] = None, kind: str = INTERNAL,
+               attributes: Optional[Mapping[str, Any]] = None) -> Span:
+    return _tracer.start_span(name, parent, kind, attributes)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_traceparent() -> Optional[str]:
+    current = _current_span.get()
+    return current.context.traceparent if current is not None else None
+
+
+def inject(headers: MutableMapping[str, Any], span: Optional[Span] = None) -> MutableMapping[str, Any]:
+    """Добавляет traceparent текущего (или заданного) спана в заголовки сообщения."""
+    span = span or _current_span.get()
+    if span is not None:
+        headers[TRACEPARENT] = span.context.traceparent
+    return headers
+
+
+def extract(headers: Optional[Mapping[str, Any]]) -> Optional[SpanContext]:
+    """Контекст трассы из заголовков сообщения или HTTP-запроса."""
+    if not headers:
+        return None
+    return parse_traceparent(headers.get(TRACEPARENT))
+
+
+def load_spans(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def render_trace(spans: List[Dict[str, Any]], width: int = 40) -> str:
+    """Спаны одной трассы деревом с полосами времени относительно начала трассы."""
+    if not spans:
+        return ""
+    ids = {span["span_id"] for span in spans}
+    children: Dict[Optional[str], List[Dict[str, Any]]] = defaultdict(list)
+    for span in spans:
+        # Спаны, родитель которых не попал в выборку, показываются от корня
+        children[span["parent_id"] if span["parent_id"] in ids else None].append(span)
+    start = min(span["start_ns"] for span in spans)
+    total = max(max(span["end_ns"] for span in spans) - start, 1)
+
+    lines = [f"trace {spans[0]['trace_id']}: {total / 1e6:.1f} мс, спанов: {len(spans)}"]
+
+    def walk(parent_id: Optional[str], depth: int) -> None:
+        for span in sorted(children.get(parent_id, []), key=lambda s: s["start_ns"]):
+            offset = int((span["start_ns"] - start) / total * width)
+            length = max(1, int((span["end_ns"] - span["start_ns"]) / total * width))
+            bar = " " * offset + "█" * min(length, width - offset)
+            label = f"{'  ' * depth}{span['name']} [{span['service']}]"
+            error = f"  ! {span['error']}" if span["error"] else ""
+            lines.append(f"{bar:<{width}} {span['duration_ms']:10.1f} мс  {label}{error}")
+            walk(span["span_id"], depth + 1)
+
+    walk(None, 0)
+    return "\n".join(lines)
+
+
+def _collector_handler(out: str) -> type:
+    lock = threading.Lock()
+    exporter = FileExporter(out)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            if self.path.rstrip("/") != "/v1/traces":
+                self.send_error(404)
+                return
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                spans = from_otlp(payload)
+            except Exception as e:
+                self.send_error(400, str(e))
+                return
+            with lock:
+                exporter.export(spans)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return Handler
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Локальный приемник и просмотр трасс")
+    commands = parser.add_subparsers(dest="command", required=True)
+    collect = commands.add_parser("collect", help="Принимать OTLP/HTTP (JSON) и писать спаны в файл")
+    collect.add_argument("--host", default="0.0.0.0")
+    collect.add_argument("--port", type=int, default=4318)
+    collect.add_argument("--out", default="spans.jsonl")
+    show = commands.add_parser("show", help="Показать трассу из файла спанов")
+    show.add_argument("path")
+    show.add_argument("--trace", default=None, help="Идентификатор трассы (по умолчанию — самая долгая)")
+    args = parser.parse_args(argv)
+
+    if args.command == "collect":
+        server = ThreadingHTTPServer((args.host, args.port), _collector_handler(args.out))
+        print(f"Прием спанов на http://{args.host}:{args.port}/v1/traces -> {args.out}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    traces: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for span in load_spans(args.path):
+        traces[span["trace_id"]].append(span)
+    if not traces:
+        print("Спанов нет", file=sys.stderr)
+        return 1
+    trace_id = args.trace or max(
+        traces, key=lambda t: max(s["end_ns"] for s in traces[t]) - min(s["start_ns"] for s in traces[t])
+    )
+    if trace_id not in traces:
+        print(f"Трасса {trace_id} не найдена", file=sys.stderr)
+        return 1
+    print(render_trace(traces[trace_id]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
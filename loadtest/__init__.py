@@ -0,0 +1 @@
+"""Нагрузочный стенд сквозного конвейера send_task/predict → воркеры → результаты → БД."""
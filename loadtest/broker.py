@@ -0,0 +1,331 @@
+"""
+Внутрипроцессный брокер, совместимый с той частью API aio_pika, которой пользуются app и ml_worker.
+
+Поддерживаются direct/fanout-обменники и обменник по умолчанию, долговечные, эксклюзивные
+и анонимные очереди, direct reply-to, prefetch (basic.qos), ack/nack/reject (в том числе
+multiple=True) и возврат неподтвержденных сообщений в очередь при закрытии канала.
+Подтверждения публикации приходят сразу (или после заданной задержки latency).
+
+    broker = InMemoryBroker()
+    with broker.installed():  # aio_pika.connect_robust теперь подключается к брокеру
+        ...
+"""
+import asyncio
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import aio_pika
+
+DIRECT_REPLY_TO = "amq.rabbitmq.reply-to"
+
+Callback = Callable[["IncomingMessage"], Awaitable[Any]]
+
+
+class DeclarationResult:
+    def __init__(self, message_count: int, consumer_count: int) -> None:
+        self.message_count = message_count
+        self.consumer_count = consumer_count
+
+
+class _QueueState:
+    def __init__(self, name: str, exclusive_to: Optional["Channel"] = None) -> None:
+        self.name = name
+        self.messages: asyncio.Queue = asyncio.Queue()
+        self.consumers: List["_Consumer"] = []
+        self.exclusive_to = exclusive_to
+
+
+class _ExchangeState:
+    def __init__(self, name: str, type_: aio_pika.ExchangeType) -> None:
+        self.name = name
+        self.type = type_
+        self.bindings: List[Tuple[str, str]] = []
+
+
+class IncomingMessage:
+    """Доставленное сообщение: поля исходного aio_pika.Message и методы подтверждения."""
+
+    def __init__(self, channel: "Channel", queue: _QueueState, message: aio_pika.Message, delivery_tag: int,
+                 consumer: Optional["_Consumer"]) -> None:
+        self.channel = channel
+        self.queue_name = queue.name
+        self.message = message
+        self.delivery_tag = delivery_tag
+        self.processed = consumer is None or consumer.no_ack
+        self._queue = queue
+        self._consumer = consumer
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.message, name)
+
+    @property
+    def body(self) -> bytes:
+        return self.message.body
+
+    def _settle(self, requeue: bool) -> None:
+        if self.processed:
+            return
+        self.processed = True
+        self.channel._unacked.pop(self.delivery_tag, None)
+        if requeue:
+            self._queue.messages.put_nowait(self.message)
+        if self._consumer is not None:
+            self._consumer.release()
+
+    async def ack(self, multiple: bool = False) -> None:
+        if multiple:
+            for tag, earlier in list(self.channel._unacked.items()):
+                if tag < self.delivery_tag:
+                    earlier._settle(requeue=False)
+        self._settle(requeue=False)
+
+    async def nack(self, multiple: bool = False, requeue: bool = True) -> None:
+        if multiple:
+            for tag, earlier in list(self.channel._unacked.items()):
+                if tag < self.delivery_tag:
+                    earlier._settle(requeue=requeue)
+        self._settle(requeue=requeue)
+
+    async def reject(self, requeue: bool = False) -> None:
+        self._settle(requeue=requeue)
+
+    @asynccontextmanager
+    async def process(self, requeue: bool = False, reject_on_redelivered: bool = False,
+                      ignore_processed: bool = False) -> AsyncIterator["IncomingMessage"]:
+        try:
+            yield self
+        except BaseException:
+            if not self.processed:
+                await self.reject(requeue=requeue)
+            raise
+        else:
+            if not self.processed:
+                await self.ack()
+
+
+class _Consumer:
+    def __init__(self, channel: "Channel", queue: _QueueState, callback: Callback, no_ack: bool) -> None:
+        self.channel = channel
+        self.queue = queue
+        self.callback = callback
+        self.no_ack = no_ack
+        prefetch = channel.prefetch_count
+        self._capacity = asyncio.Semaphore(prefetch) if prefetch and not no_ack else None
+        self._task = asyncio.create_task(self._deliver())
+
+    def release(self) -> None:
+        if self._capacity is not None:
+            self._capacity.release()
+
+    async def _deliver(self) -> None:
+        while True:
+            if self._capacity is not None:
+                await self._capacity.acquire()
+            message = await self.queue.messages.get()
+            incoming = self.channel._register(self.queue, message, self)
+            # Как и aio_pika, каждое сообщение обрабатывается в отдельной задаче
+            asyncio.create_task(self._run(incoming))
+
+    async def _run(self, incoming: IncomingMessage) -> None:
+        try:
+            await self.callback(incoming)
+        except Exception:
+            pass
+
+    def cancel(self) -> None:
+        self._task.cancel()
+        if self in self.queue.consumers:
+            self.queue.consumers.remove(self)
+
+
+class Exchange:
+    def __init__(self, channel: "Channel", state: _ExchangeState) -> None:
+        self.channel = channel
+        self.name = state.name
+        self._state = state
+
+    async def publish(self, message: aio_pika.Message, routing_key: str, *, mandatory: bool = True,
+                      **kwargs: Any) -> None:
+        broker = self.channel.broker
+        if self.channel.is_closed:
+            raise aio_pika.exceptions.ChannelClosed(None, "channel is closed")
+        if broker.latency:
+            await asyncio.sleep(broker.latency)
+        broker._route(self._state, message, routing_key)
+
+
+class Queue:
+    def __init__(self, channel: "Channel", state: _QueueState) -> None:
+        self.channel = channel
+        self.name = state.name
+        self._state = state
+
+    @property
+    def declaration_result(self) -> DeclarationResult:
+        return DeclarationResult(self._state.messages.qsize(), len(self._state.consumers))
+
+    async def bind(self, exchange: Exchange, routing_key: Optional[str] = None, **kwargs: Any) -> None:
+        binding = (self.name, routing_key if routing_key is not None else self.name)
+        if binding not in exchange._state.bindings:
+            exchange._state.bindings.append(binding)
+
+    async def consume(self, callback: Callback, no_ack: bool = False, **kwargs: Any) -> str:
+        consumer = _Consumer(self.channel, self._state, callback, no_ack)
+        self._state.consumers.append(consumer)
+        self.channel._consumers.append(consumer)
+        return uuid.uuid4().hex
+
+
+class Channel:
+    def __init__(self, connection: "Connection") -> None:
+        self.connection = connection
+        self.broker = connection.broker
+        self.prefetch_count = 0
+        self.is_closed = False
+        self._consumers: List[_Consumer] = []
+        self._unacked: "OrderedDict[int, IncomingMessage]" = OrderedDict()
+        self._delivery_tag = 0
+        self._reply_queue: Optional[_QueueState] = None
+
+    def __await__(self):
+        async def opened() -> "Channel":
+            return self
+        return opened().__await__()
+
+    async def __aenter__(self) -> "Channel":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.close()
+
+    def _register(self, queue: _QueueState, message: aio_pika.Message, consumer: _Consumer) -> IncomingMessage:
+        self._delivery_tag += 1
+        incoming = IncomingMessage(self, queue, message, self._delivery_tag, consumer)
+        if not consumer.no_ack:
+            self._unacked[self._delivery_tag] = incoming
+        return incoming
+
+    async def set_qos(self, prefetch_count: int = 0, **kwargs: Any) -> None:
+        self.prefetch_count = prefetch_count
+
+    async def declare_exchange(self, name: str, type: aio_pika.ExchangeType = aio_pika.ExchangeType.DIRECT,
+                               **kwargs: Any) -> Exchange:
+        state = self.broker.exchanges.setdefault(name, _ExchangeState(name, aio_pika.ExchangeType(type)))
+        return Exchange(self, state)
+
+    async def get_exchange(self, name: str, ensure: bool = True) -> Exchange:
+        state = self.broker.exchanges.get(name)
+        if state is None:
+            raise aio_pika.exceptions.ChannelNotFoundEntity(f"exchange {name!r} not found")
+        return Exchange(self, state)
+
+    @property
+    def default_exchange(self) -> Exchange:
+        return Exchange(self, self.broker.exchanges[""])
+
+    async def declare_queue(self, name: Optional[str] = None, *, passive: bool = False, exclusive: bool = False,
+                            **kwargs: Any) -> Queue:
+        if name == DIRECT_REPLY_TO:
+            if self._reply_queue is None:
+                self._reply_queue = self.broker._add_queue(f"{DIRECT_REPLY_TO}.{uuid.uuid4().hex}", self)
+            return Queue(self, self._reply_queue)
+        if not name:
+            return Queue(self, self.broker._add_queue(f"amq.gen-{uuid.uuid4().hex}", self))
+        state = self.broker.queues.get(name)
+        if state is None:
+            if passive:
+                raise aio_pika.exceptions.ChannelNotFoundEntity(f"queue {name!r} not found")
+            state = self.broker._add_queue(name, self if exclusive else None)
+        return Queue(self, state)
+
+    async def close(self) -> None:
+        if self.is_closed:
+            return
+        self.is_closed = True
+        for consumer in self._consumers:
+            consumer.cancel()
+        # Неподтвержденные сообщения возвращаются в очередь, как при закрытии канала в RabbitMQ
+        for incoming in list(self._unacked.values()):
+            incoming._settle(requeue=True)
+        self.broker._drop_exclusive(self)
+
+
+class Connection:
+    def __init__(self, broker: "InMemoryBroker") -> None:
+        self.broker = broker
+        self.is_closed = False
+        self._channels: List[Channel] = []
+
+    def channel(self, publisher_confirms: bool = True, **kwargs: Any) -> Channel:
+        channel = Channel(self)
+        self._channels.append(channel)
+        return channel
+
+    async def close(self) -> None:
+        self.is_closed = True
+        for channel in self._channels:
+            await channel.close()
+
+    async def __aenter__(self) -> "Connection":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.close()
+
+
+class InMemoryBroker:
+    """Брокер в памяти процесса; latency — задержка подтверждения публикации (сек)."""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.queues: Dict[str, _QueueState] = {}
+        self.exchanges: Dict[str, _ExchangeState] = {"": _ExchangeState("", aio_pika.ExchangeType.DIRECT)}
+        self.published = 0
+        self.unroutable = 0
+
+    def _add_queue(self, name: str, exclusive_to: Optional[Channel]) -> _QueueState:
+        state = _QueueState(name, exclusive_to)
+        self.queues[name] = state
+        return state
+
+    def _drop_exclusive(self, channel: Channel) -> None:
+        for name, state in list(self.queues.items()):
+            if state.exclusive_to is channel:
+                del self.queues[name]
+                for exchange in self.exchanges.values():
+                    exchange.bindings = [b for b in exchange.bindings if b[0] != name]
+
+    def _route(self, exchange: _ExchangeState, message: aio_pika.Message, routing_key: str) -> None:
+        self.published += 1
+        if exchange.name == "":
+            targets = [routing_key]
+        elif exchange.type == aio_pika.ExchangeType.FANOUT:
+            targets = [queue for queue, _ in exchange.bindings]
+        else:
+            targets = [queue for queue, key in exchange.bindings if key == routing_key]
+        delivered = False
+        for name in targets:
+            state = self.queues.get(name)
+            if state is not None:
+                state.messages.put_nowait(message)
+                delivered = True
+        if not delivered:
+            self.unroutable += 1
+
+    async def connect_robust(self, url: Any = None, **kwargs: Any) -> Connection:
+        return Connection(self)
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {name: state.messages.qsize() for name, state in self.queues.items()}
+
+    @contextmanager
+    def installed(self) -> Iterator["InMemoryBroker"]:
+        """Подменяет aio_pika.connect_robust и aio_pika.connect на подключение к этому брокеру."""
+        original = aio_pika.connect_robust, aio_pika.connect
+        aio_pika.connect_robust = aio_pika.connect = self.connect_robust
+        try:
+            yield self
+        finally:
+            aio_pika.connect_robust, aio_pika.connect = original
@@ -0,0 +1,341 @@
+"""
+Сквозной нагрузочный прогон: API (через ASGI, без сети), MLWorker, RPCWorker и ResultsConsumer
+в одном процессе поверх InMemoryBroker и SQLite/PostgreSQL.
+
+Трафик открытого цикла: запросы отправляются по пуассоновскому расписанию независимо от того,
+успели ли завершиться предыдущие, а задержка считается от запланированного момента отправки
+(без coordinated omission). Задержка асинхронных запросов — до события о завершении из task_events.
+
+Настройки приложения читаются при импорте app, поэтому окружение (DB__URL и др.) должно быть
+задано до вызова run(); этим занимается python -m loadtest.
+"""
+import asyncio
+import logging
+import random
+import time
+import uuid
+from collections import Counter, defaultdict
+from decimal import Decimal
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from loadtest.broker import InMemoryBroker
+
+FEATURE_FLAGS = ("vnn_pp", "clozapine", "cyp2c19_1_2", "cyp2c19_1_17", "cyp2c19_17_17", "cyp2d6_1_3")
+USER_BALANCE = Decimal("10000000")
+
+
+class LoadOptions(NamedTuple):
+    duration: float = 10.0
+    rate: float = 20.0
+    rpc_share: float = 0.3
+    batch_sizes: str = "1:0.7,10:0.2,100:0.1"
+    users: int = 10
+    ml_workers: int = 2
+    rpc_workers: int = 2
+    broker_latency: float = 0.0
+    timeout: float = 60.0
+    real_model: bool = False
+    seed: int = 0
+
+
+def parse_batch_sizes(spec: str) -> Tuple[List[int], List[float]]:
+    """Распределение размеров пачки: "1:0.7,10:0.2,100:0.1" -> ([1, 10, 100], [0.7, 0.2, 0.1])."""
+    sizes: List[int] = []
+    weights: List[float] = []
+    for part in spec.split(","):
+        size, _, weight = part.partition(":")
+        sizes.append(int(size))
+        weights.append(float(weight or 1))
+    if not sizes or min(sizes) < 1 or sum(weights) <= 0:
+        raise ValueError(f"Некорректное распределение размеров пачки: {spec!r}")
+    return sizes, weights
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу (q от 0 до 100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def latency_summary(values: List[float]) -> Dict[str, float]:
+    ms = [v * 1000 for v in values]
+    return {
+        "count": len(ms),
+        "mean": round(sum(ms) / len(ms), 1) if ms else 0.0,
+        "p50": round(percentile(ms, 50), 1),
+        "p90": round(percentile(ms, 90), 1),
+        "p95": round(percentile(ms, 95), 1),
+        "p99": round(percentile(ms, 99), 1),
+        "max": round(max(ms), 1) if ms else 0.0,
+    }
+
+
+def feature_row(rng: random.Random) -> Dict[str, Any]:
+    row: Dict[str, Any] = {"patient_id": f"LT-{rng.randrange(10 ** 6)}", "age": rng.randint(18, 90)}
+    row.update({flag: rng.randint(0, 1) for flag in FEATURE_FLAGS})
+    return row
+
+
+class PoolUsage:
+    """Использование пула соединений БД: выдачи, текущее и пиковое число занятых, выборки по времени."""
+
+    def __init__(self, engine: Any) -> None:
+        from sqlalchemy import event
+
+        self.engine = engine
+        self.checkouts = 0
+        self.in_use = 0
+        self.peak = 0
+        self.samples: List[int] = []
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+
+    def _on_checkout(self, *args: Any) -> None:
+        self.checkouts += 1
+        self.in_use += 1
+        self.peak = max(self.peak, self.in_use)
+
+    def _on_checkin(self, *args: Any) -> None:
+        self.in_use -= 1
+
+    async def sample(self, interval: float = 0.1) -> None:
+        while True:
+            self.samples.append(self.in_use)
+            await asyncio.sleep(interval)
+
+    def summary(self) -> Dict[str, Any]:
+        pool = self.engine.pool
+        capacity = None
+        if hasattr(pool, "size") and hasattr(pool, "_max_overflow"):
+            capacity = pool.size() + max(pool._max_overflow, 0)
+        saturated = sum(1 for s in self.samples if capacity and s >= capacity)
+        return {
+            "capacity": capacity,
+            "checkouts": self.checkouts,
+            "peak_checked_out": self.peak,
+            "mean_checked_out": round(sum(self.samples) / len(self.samples), 2) if self.samples else 0.0,
+            "saturated_share": round(saturated / len(self.samples), 3) if self.samples else 0.0,
+        }
+
+
+class Completions:
+    """Ожидание завершения запросов по событиям task_events (включая события, пришедшие раньше ответа API)."""
+
+    def __init__(self) -> None:
+        self._waiters: Dict[int, asyncio.Future] = {}
+        self._early: Dict[int, Tuple[float, str]] = {}
+
+    def resolve(self, request_id: int, status: str) -> None:
+        done = (time.perf_counter(), status)
+        future = self._waiters.pop(request_id, None)
+        if future is None:
+            self._early[request_id] = done
+        elif not future.done():
+            future.set_result(done)
+
+    async def wait(self, request_id: int, timeout: float) -> Tuple[float, str]:
+        if request_id in self._early:
+            return self._early.pop(request_id)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[request_id] = future
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._waiters.pop(request_id, None)
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.sent: Counter = Counter()
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.outcomes: Counter = Counter()
+        self.schedule_lag: List[float] = []
+
+
+async def _collect_events(user_id: int, completions: Completions) -> None:
+    from app.models import MLRequestStatus
+    from app.services.task_events import task_events
+
+    queue = task_events.subscribe(user_id)
+    try:
+        while True:
+            event = await queue.get()
+            if event.status != MLRequestStatus.pending:
+                completions.resolve(event.request_id, event.status.value)
+    finally:
+        task_events.unsubscribe(user_id, queue)
+
+
+def _create_users(count: int) -> List[Tuple[int, str]]:
+    from app.auth.jwt_handler import create_access_token
+    from app.database.database import session_maker
+    from app.models import User, UserRole
+
+    run_id = uuid.uuid4().hex[:8]
+    with session_maker() as session:
+        users = [
+            User(
+                email=f"loadtest-{run_id}-{i}@example.com",
+                hashed_password="-",
+                first_name="Load",
+                last_name="Test",
+                phone_number=f"+7999{i:07d}",
+                balance=USER_BALANCE,
+                role=UserRole.user,
+            )
+            for i in range(count)
+        ]
+        session.add_all(users)
+        session.commit()
+        return [(user.id, create_access_token(str(user.id))) for user in users]
+
+
+async def _one_request(client: Any, token: str, kind: str, size: int, intended: float, rng: random.Random,
+                       options: LoadOptions, recorder: Recorder, completions: Completions) -> None:
+    recorder.schedule_lag.append(time.perf_counter() - intended)
+    path = "/api/v1/requests/predict" if kind == "rpc" else "/api/v1/requests/send_task"
+    payload = {"data": [feature_row(rng) for _ in range(size)]}
+    recorder.sent[kind] += 1
+    try:
+        response = await client.post(path, json=payload, headers={"Authorization": f"Bearer {token}"})
+    except Exception:
+        recorder.outcomes["transport_error"] += 1
+        return
+    recorder.statuses[kind][response.status_code] += 1
+
+    if response.status_code == 200:
+        recorder.latencies[kind].append(time.perf_counter() - intended)
+        recorder.outcomes["success"] += 1
+        return
+    if response.status_code != 202:
+        recorder.outcomes["rejected" if response.status_code == 429 else "error"] += 1
+        return
+
+    # Асинхронная задача или RPC, переданный в фоновую очередь: ждем событие о завершении
+    label = "async" if kind == "async" else "rpc_fallback"
+    try:
+        finished, status = await completions.wait(response.json()["request_id"], options.timeout)
+    except asyncio.TimeoutError:
+        recorder.outcomes["timeout"] += 1
+        return
+    recorder.latencies[label].append(finished - intended)
+    recorder.outcomes["success" if status == "success" else "failed"] += 1
+
+
+async def _traffic(client: Any, users: List[Tuple[int, str]], options: LoadOptions, recorder: Recorder,
+                   completions: Completions) -> float:
+    """Генерирует трафик открытого цикла; возвращает фактическую длительность отправки."""
+    rng = random.Random(options.seed)
+    sizes, weights = parse_batch_sizes(options.batch_sizes)
+    started = time.perf_counter()
+    deadline = started + options.duration
+    intended = started
+    pending = set()
+    while True:
+        intended += rng.expovariate(options.rate)
+        if intended >= deadline:
+            break
+        await asyncio.sleep(max(0.0, intended - time.perf_counter()))
+        kind = "rpc" if rng.random() < options.rpc_share else "async"
+        size = rng.choices(sizes, weights)[0]
+        _, token = users[rng.randrange(len(users))]
+        task = asyncio.create_task(
+            _one_request(client, token, kind, size, intended, rng, options, recorder, completions)
+        )
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.gather(*pending)
+    return time.perf_counter() - started
+
+
+async def run(options: LoadOptions) -> Dict[str, Any]:
+    import httpx
+
+    broker = InMemoryBroker(latency=options.broker_latency)
+    with broker.installed():
+        from app.database.database import engine
+        from app.main import app
+        from ml_worker.engine import ml_engine
+        from ml_worker.services.rpc_worker import RPCWorker
+        from ml_worker.services.task_worker import MLWorker
+
+        if not options.real_model:
+            # Заглушка модели: измеряется конвейер, а не инференс (предупреждение о ней пишется на каждую задачу)
+            ml_engine.model_path = ""
+            logging.getLogger("ml_worker.engine").setLevel(logging.ERROR)
+        pool_usage = PoolUsage(engine)
+        recorder = Recorder()
+        completions = Completions()
+
+        async with app.router.lifespan_context(app):
+            workers = [MLWorker(worker_id=f"loadtest-ml-{i}") for i in range(options.ml_workers)]
+            workers += [RPCWorker(worker_id=f"loadtest-rpc-{i}") for i in range(options.rpc_workers)]
+            background = [asyncio.create_task(worker.run()) for worker in workers]
+            background.append(asyncio.create_task(pool_usage.sample()))
+
+            users = await asyncio.to_thread(_create_users, options.users)
+            background += [asyncio.create_task(_collect_events(user_id, completions)) for user_id, _ in users]
+
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+                elapsed = await _traffic(client, users, options, recorder, completions)
+
+            for worker in workers:
+                await worker.stop()
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+
+    completed = recorder.outcomes["success"] + recorder.outcomes["failed"]
+    total = sum(recorder.sent.values())
+    return {
+        "options": options._asdict(),
+        "elapsed_s": round(elapsed, 2),
+        "sent": dict(recorder.sent),
+        "status_codes": {kind: dict(codes) for kind, codes in recorder.statuses.items()},
+        "outcomes": dict(recorder.outcomes),
+        "throughput_rps": round(completed / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round((total - completed) / total, 4) if total else 0.0,
+        "latency_ms": {kind: latency_summary(values) for kind, values in sorted(recorder.latencies.items())},
+        "schedule_lag_ms": latency_summary(recorder.schedule_lag),
+        "db_pool": pool_usage.summary(),
+        "broker": {"published": broker.published, "unroutable": broker.unroutable},
+    }
+
+
+def render(report: Dict[str, Any]) -> str:
+    lines = [
+        f"Длительность: {report['elapsed_s']} с, отправлено: {report['sent']}",
+        f"Коды ответов: {report['status_codes']}",
+        f"Исходы: {report['outcomes']}",
+        f"Пропускная способность: {report['throughput_rps']} завершенных запросов/с, доля ошибок: {report['error_rate']}",
+        "",
+        f"{'Задержка, мс':<16}{'n':>7}{'p50':>10}{'p90':>10}{'p95':>10}{'p99':>10}{'max':>10}",
+    ]
+    rows = list(report["latency_ms"].items()) + [("отставание", report["schedule_lag_ms"])]
+    for kind, s in rows:
+        lines.append(
+            f"{kind:<16}{s['count']:>7}{s['p50']:>10}{s['p90']:>10}{s['p95']:>10}{s['p99']:>10}{s['max']:>10}"
+        )
+    lines += ["", f"Пул БД: {report['db_pool']}", f"Брокер: {report['broker']}"]
+    return "\n".join(lines)
+
+
+def check_thresholds(report: Dict[str, Any], max_p95_ms: Optional[float] = None,
+                     min_throughput: Optional[float] = None, max_error_rate: Optional[float] = None) -> List[str]:
+    """Нарушенные пороги (пустой список — прогон укладывается в бюджет)."""
+    violations = []
+    if max_p95_ms is not None:
+        for kind, summary in report["latency_ms"].items():
+            if summary["p95"] > max_p95_ms:
+                violations.append(f"p95 {kind}: {summary['p95']} мс > {max_p95_ms} мс")
+    if min_throughput is not None and report["throughput_rps"] < min_throughput:
+        violations.append(f"пропускная способность {report['throughput_rps']} < {min_throughput} запросов/с")
+    if max_error_rate is not None and report["error_rate"] > max_error_rate:
+        violations.append(f"доля ошибок {report['error_rate']} > {max_error_rate}")
+    return violations
@@ -34,6 +34,21 @@ class DBSettings(BaseModel):
 class BotSettings(BaseModel):
     API_URL: str = "http://app:8000"
 
+class LoggingSettings(BaseModel):
+    LEVEL: str = "INFO"
+    FORMAT: str = "JSON"
+    # Доля записываемых INFO/DEBUG-записей по префиксу логгера, например {"MLWorker": 0.1}
+    SAMPLING: dict[str, float] = {}
+    MAX_MESSAGE_LENGTH: int = 2000
+    QUEUE_SIZE: int = 10000
+
+class TracingSettings(BaseModel):
+    SERVICE_NAME: str = "ml-worker"
+    # "file:/path/spans.jsonl", "otlp:http://collector:4318" или пусто (без экспорта)
+    EXPORTER: str = ""
+    SAMPLE_RATIO: float = 1.0
+    QUEUE_SIZE: int = 10000
+
 class WorkerInternalSettings(BaseModel):
     PREFETCH_COUNT: int = 1
     MAX_RETRIES: int = 3
@@ -49,6 +64,8 @@ class WorkerConfig(BaseSettings):
     bot: BotSettings = BotSettings()
     db: DBSettings = DBSettings()
     worker: WorkerInternalSettings = WorkerInternalSettings()
+    logging: LoggingSettings = LoggingSettings()
+    tracing: TracingSettings = TracingSettings()
 
     model_config = SettingsConfigDict(
         env_file=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".env"),
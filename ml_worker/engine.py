@@ -1,8 +1,6 @@
 import logging
 import os
 from typing import Any, Dict, List
-import joblib
-import pandas as pd
 from ml_worker.config import settings
 
 class MLModelLoadException(Exception):
@@ -26,10 +24,12 @@ class MLEngine:
 
     @property
     def model(self):
-        """Ленивая загрузка модели."""
+        """Ленивая загрузка модели (joblib и sklearn импортируются вместе с ней)."""
         if self._model is None:
             try:
                 if os.path.exists(self.model_path):
+                    import joblib
+
                     self._model = joblib.load(self.model_path)
                     logger.info(f"ML модель успешно загружена из {self.model_path}")
                 else:
@@ -39,6 +39,18 @@ class MLEngine:
                 raise MLModelLoadException()
         return self._model
 
+    def warm_up(self) -> None:
+        """
+        Загружает модель и pandas заранее. Воркер вызывает это в потоке параллельно
+        с подключением к брокеру, поэтому первая задача не платит за холодный старт.
+        """
+        try:
+            if self.model is not None:
+                import pandas  # noqa: F401
+        except MLModelLoadException:
+            # Ошибка уже залогирована; загрузка повторится при первой задаче
+            pass
+
     def predict(self, items: List[Any]) -> List[str]:
         try:
             # Конвертируем объекты Pydantic в словари, если нужно
@@ -59,6 +71,8 @@ class MLEngine:
             if self.model is None:
                 return ["выраженные побочные эффекты будут с вероятностью 0.15"] * len(items)
 
+            import pandas as pd
+
             # Создаем DataFrame для сохранения правильного порядка и имен колонок
             features_order = settings.worker.FEATURES_ORDER
 
@@ -3,13 +3,26 @@ import logging
 import os
 import signal
 import sys
+from common.log_pipeline import setup_logging
+from common.tracing import setup_tracing
+from ml_worker.config import settings
 from ml_worker.services.task_worker import MLWorker
 from ml_worker.services.rpc_worker import RPCWorker
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Настройка логирования (неблокирующий вывод через очередь)
+setup_logging(
+    level=settings.logging.LEVEL,
+    fmt=settings.logging.FORMAT,
+    sampling=settings.logging.SAMPLING,
+    max_length=settings.logging.MAX_MESSAGE_LENGTH,
+    queue_size=settings.logging.QUEUE_SIZE,
+)
+# Трассировка: контекст приходит в заголовке traceparent сообщения с задачей
+setup_tracing(
+    service=settings.tracing.SERVICE_NAME,
+    exporter=settings.tracing.EXPORTER,
+    sample_ratio=settings.tracing.SAMPLE_RATIO,
+    queue_size=settings.tracing.QUEUE_SIZE,
 )
 logger = logging.getLogger("MLWorkerMain")
 
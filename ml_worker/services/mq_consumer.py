@@ -38,8 +38,11 @@ class BaseWorker:
         """Метод для переопределения в подклассах."""
         raise NotImplementedError
 
+    async def prepare(self) -> None:
+        """Подготовка к обработке сообщений (выполняется параллельно с подключением к брокеру)."""
+
     async def run(self) -> None:
-        await self.connect()
+        await asyncio.gather(self.connect(), self.prepare())
         async with self.connection:
             channel = await self.connection.channel()
             await channel.set_qos(prefetch_count=settings.worker.PREFETCH_COUNT)
@@ -6,6 +6,7 @@ from tenacity import retry, stop_after_attempt, wait_exponential
 
 from ml_worker.config import settings
 from ml_worker.schemas.results import MLResult
+from common import tracing
 
 logger = logging.getLogger("MQPublisher")
 
@@ -40,7 +41,7 @@ class MQResultPublisher:
 
         payload = json.dumps(result.model_dump()).encode()
 
-        logger.info(f"[{self.worker_id}] Публикация результата для {task_id} в MQ..., body {payload}")
+        logger.info(f"[{self.worker_id}] Публикация результата для {task_id} в MQ ({len(payload)} байт)...")
         async with self.connection.channel() as channel:
             await channel.set_qos(prefetch_count=settings.worker.PREFETCH_COUNT)
             exchange = await channel.declare_exchange(
@@ -54,12 +55,17 @@ class MQResultPublisher:
             )
             await queue.bind(exchange, routing_key=settings.mq.RESULTS_ROUTING_KEY)
 
-            message = aio_pika.Message(
-                body=payload,
-                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
-                content_type="application/json",
-            )
-            await exchange.publish(message, routing_key=settings.mq.RESULTS_ROUTING_KEY, mandatory=True)
+            with tracing.span(f"publish {settings.mq.RESULTS_QUEUE_NAME}", kind=tracing.PRODUCER, attributes={
+                "messaging.destination": settings.mq.RESULTS_QUEUE_NAME,
+                "messaging.message.id": task_id,
+            }):
+                message = aio_pika.Message(
+                    body=payload,
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                    content_type="application/json",
+                    headers=tracing.inject({}),
+                )
+                await exchange.publish(message, routing_key=settings.mq.RESULTS_ROUTING_KEY, mandatory=True)
 
         logger.info(f"[{self.worker_id}] Результат для {task_id} опубликован в MQ.")
 
@@ -1,13 +1,19 @@
+import asyncio
 import json
 import logging
+import time
 import aio_pika
 from ml_worker.services.mq_consumer import BaseWorker
 from ml_worker.services.mq_publisher import MQResultPublisher
 from ml_worker.engine import ml_engine
 from ml_worker.config import settings
+from common import tracing
 
 logger = logging.getLogger("RPCWorker")
 
+# Срок ответа, выставленный API (unix time); см. RPCPublisher.call
+RPC_DEADLINE_HEADER = "x-deadline"
+
 class RPCWorker(BaseWorker):
     """Воркер для обработки синхронных RPC-запросов."""
     def __init__(self, worker_id: str):
@@ -24,6 +30,10 @@ class RPCWorker(BaseWorker):
             self._publisher = MQResultPublisher(self.connection, self.worker_id)
         return self._publisher
 
+    async def prepare(self) -> None:
+        # Модель загружается в потоке, пока устанавливается соединение с брокером
+        await asyncio.to_thread(ml_engine.warm_up)
+
     async def process_message(self, message: aio_pika.IncomingMessage) -> None:
         """
         Обработка RPC запроса.
@@ -34,11 +44,21 @@ class RPCWorker(BaseWorker):
                 logger.error(f"[{self.worker_id}] Некорректное RPC-сообщение: нет reply_to или correlation_id")
                 return
 
+            # API перестал ждать ответ и передал запрос в фоновую очередь: инференс не нужен
+            deadline = (message.headers or {}).get(RPC_DEADLINE_HEADER)
+            if deadline is not None and time.time() > float(deadline):
+                logger.warning(f"[{self.worker_id}] Просроченный RPC-запрос отброшен (corr_id: {message.correlation_id})")
+                return
+
             try:
                 payload = json.loads(message.body.decode())
                 logger.info(f"[{self.worker_id}] Получен RPC запрос (corr_id: {message.correlation_id})")
 
-                predictions = ml_engine.predict(payload)
+                # Продолжаем трассу RPC-вызова из API (заголовок traceparent)
+                with tracing.span(f"process {self.queue_name}", parent=tracing.extract(message.headers),
+                                  kind=tracing.CONSUMER, attributes={"worker.id": self.worker_id}):
+                    with tracing.span("ml.inference", attributes={"ml.rows": len(payload)}):
+                        predictions = ml_engine.predict(payload)
                 logger.info(f"[{self.worker_id}] Получено {len(payload)} объектов, предсказано {len(predictions)}")
 
                 # response_obj = {"predictions": predictions}
@@ -10,6 +10,7 @@ from ml_worker.services.mq_consumer import BaseWorker
 from ml_worker.schemas.tasks import MLTask
 from ml_worker.services.mq_publisher import MQResultPublisher
 from ml_worker.engine import ml_engine
+from common import tracing
 
 logger = logging.getLogger("MLWorker")
 
@@ -31,36 +32,49 @@ class MLWorker(BaseWorker):
             self._publisher = MQResultPublisher(self.connection, self.worker_id)
         return self._publisher
 
+    async def prepare(self) -> None:
+        # Модель загружается в потоке, пока устанавливается соединение с брокером
+        await asyncio.to_thread(ml_engine.warm_up)
+
     async def process_message(self, message: aio_pika.IncomingMessage) -> None:
         """Обработка входящего сообщения с задачей."""
         async with message.process():
-            body = message.body.decode()
-            data = json.loads(body)
-            task = MLTask(**data)
-            logger.info(f"[{self.worker_id}] Получена задача: {task.task_id}")
+            # Продолжаем трассу, начатую в API (заголовок traceparent)
+            with tracing.span(f"process {self.queue_name}", parent=tracing.extract(message.headers),
+                              kind=tracing.CONSUMER, attributes={
+                                  "messaging.message.id": message.message_id,
+                                  "worker.id": self.worker_id,
+                              }) as span:
+                body = message.body.decode()
+                data = json.loads(body)
+                task = MLTask(**data)
+                logger.info(f"[{self.worker_id}] Получена задача: {task.task_id}")
 
-            prediction = None
-            status = "success"
-            error_msg = None
+                prediction = None
+                status = "success"
+                error_msg = None
 
-            # 1. Выполнение инференса
-            try:
-                logger.info(f"[{self.worker_id}] Выполнение инференса для задачи {task.task_id} с признаками {task.features}...")
-                if isinstance(task.features, list):
-                    prediction = ml_engine.predict(task.features)
-                    num_items = len(task.features)
-                else:
-                    prediction = ml_engine.predict([task.features])
-                    num_items = 1
+                # 1. Выполнение инференса
+                try:
+                    num_rows = len(task.features) if isinstance(task.features, list) else 1
+                    logger.info(f"[{self.worker_id}] Выполнение инференса для задачи {task.task_id} ({num_rows} объектов)...")
+                    with tracing.span("ml.inference", attributes={"ml.model": task.model, "ml.rows": num_rows}):
+                        if isinstance(task.features, list):
+                            prediction = ml_engine.predict(task.features)
+                            num_items = len(task.features)
+                        else:
+                            prediction = ml_engine.predict([task.features])
+                            num_items = 1
 
-                # logger.info(f"[{self.worker_id}] Обработано {num_items} объектов. Результат: {len(prediction) if isinstance(prediction, list) else '1'} предсказаний")
-            except Exception as e:
-                logger.error(f"[{self.worker_id}] Ошибка инференса для задачи {task.task_id}: {e}")
-                status = "fail"
-                error_msg = str(e)
+                    # logger.info(f"[{self.worker_id}] Обработано {num_items} объектов. Результат: {len(prediction) if isinstance(prediction, list) else '1'} предсказаний")
+                except Exception as e:
+                    logger.error(f"[{self.worker_id}] Ошибка инференса для задачи {task.task_id}: {e}")
+                    status = "fail"
+                    error_msg = str(e)
+                    span.record_error(e)
 
-            # 2. Отправка результата
-            await self.publisher.publish_result(task.task_id, prediction, status, error_msg)
+                # 2. Отправка результата
+                await self.publisher.publish_result(task.task_id, prediction, status, error_msg)
 
 
 #    async def save_result_to_db(self, task_id: str, prediction: Optional[Any], status: str, error: Optional[str]) -> None:
@@ -7,7 +7,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 from app.models import Base
-from app.database import get_session
+from app.database import get_session, get_session_factory
 from fastapi.testclient import TestClient
 from app.main import app
 
@@ -40,6 +40,26 @@ def session(engine):
         transaction.rollback()
         connection.close()
 
+@pytest.fixture(autouse=True)
+def clear_prediction_cache():
+    """Кеш предсказаний общий для процесса, поэтому очищается перед каждым тестом."""
+    from app.services.prediction_cache import prediction_cache
+
+    prediction_cache.clear()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def reset_load_estimates():
+    """Оценки нагрузки (задержки RPC, состояние очереди) общие для процесса, поэтому сбрасываются перед каждым тестом."""
+    from app.services.admission import admission_control
+    from app.services.rpc_deadline import rpc_deadlines
+
+    rpc_deadlines.reset()
+    admission_control.reset()
+    yield
+
+
 @pytest.fixture(scope="function")
 def active_model(session):
     """Создаёт активную ML модель для тестирования."""
@@ -86,11 +106,17 @@ def client(session, active_model, mock_mq_service, mock_rpc_client):
     def override_get_session():
         yield session
 
+    from contextlib import nullcontext
+    from app.services.health_service import HealthCollector, get_health_collector
     from app.services.mq_publisher import get_mq_service, get_rpc_client
 
+    health_collector = HealthCollector(session_factory=lambda: nullcontext(session), mq_service=mock_mq_service)
+
     app.dependency_overrides[get_session] = override_get_session
+    app.dependency_overrides[get_session_factory] = lambda: lambda: nullcontext(session)
     app.dependency_overrides[get_mq_service] = lambda: mock_mq_service
     app.dependency_overrides[get_rpc_client] = lambda: mock_rpc_client
+    app.dependency_overrides[get_health_collector] = lambda: health_collector
 
     try:
         with TestClient(app) as c:
@@ -31,6 +31,141 @@ def test_admin_get_all_transactions(admin_client):
     assert response.status_code == status.HTTP_200_OK
     assert isinstance(response.json(), list)
 
+def test_admin_export_transactions(admin_client, test_user):
+    import csv
+    admin_client.post(f"/api/v1/admin/transactions/replenish/{test_user.id}", json={"amount": 100})
+
+    response = admin_client.get("/api/v1/admin/transactions/export", params={"format": "csv"})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/csv")
+    assert 'filename="transactions.csv"' in response.headers["content-disposition"]
+    rows = list(csv.DictReader(response.text.splitlines()))
+    assert any(row["user_id"] == str(test_user.id) and row["type"] == "replenish" for row in rows)
+
+def test_admin_export_ml_requests_ndjson(session, admin_client, test_user, active_model):
+    import json
+    from app.models import MLRequest, MLRequestStatus
+    db_request = MLRequest(
+        user_id=test_user.id,
+        model_id=active_model.id,
+        input_data=[{"Возраст": 35}],
+        status=MLRequestStatus.pending,
+        cost=active_model.cost,
+    )
+    session.add(db_request)
+    session.flush()
+
+    response = admin_client.get("/api/v1/admin/ml-requests/export")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    exported = next(row for row in rows if row["id"] == db_request.id)
+    assert exported["status"] == "pending"
+    assert exported["model"] == "test_model"
+    assert exported["input_data"] == [{"Возраст": 35}]
+
+def test_admin_analytics_rebuild_matches_incremental(session, admin_client, test_user, active_model):
+    from decimal import Decimal
+    from app.services.ml_service_helpers import create_pending_request, update_request_result
+    from app.services import BillingService
+    from app.models import MLRequestStatus
+
+    billing = BillingService(session)
+    test_user.balance = Decimal("1000")
+    first = create_pending_request(session, billing, test_user, [{"Возраст": 30}, {"Возраст": 40}])
+    create_pending_request(session, billing, test_user, [{"Возраст": 50}])
+    update_request_result(session, billing, first.id, MLRequestStatus.success, prediction=["ok"])
+
+    incremental = admin_client.get("/api/v1/admin/analytics", params={"group_by": "user"}).json()
+    assert [(b["user_id"], b["requests"], b["rows_scored"], b["succeeded"]) for b in incremental] == [
+        (test_user.id, 2, 3, 1)
+    ]
+
+    assert admin_client.post("/api/v1/admin/analytics/rebuild").status_code == status.HTTP_200_OK
+    rebuilt = admin_client.get("/api/v1/admin/analytics", params={"group_by": "user"}).json()
+    assert rebuilt == incremental
+    summary = admin_client.get("/api/v1/admin/analytics/summary").json()
+    assert summary["requests"] == 2 and summary["failure_rate"] == 0.0
+
+
+def test_rollup_shards_are_summed(session, admin_client, test_user, active_model, monkeypatch):
+    """Запросы одного пользователя пишут в разные шарды интервала, статистика их суммирует."""
+    from decimal import Decimal
+    from itertools import count
+    from app.services import analytics_service
+    from app.services.ml_service_helpers import create_pending_request
+    from app.services import BillingService
+    from app.models import RequestRollup
+
+    shards = count()
+    monkeypatch.setattr(analytics_service.random, "randrange", lambda stop: next(shards) % stop)
+    billing = BillingService(session)
+    test_user.balance = Decimal("1000")
+    create_pending_request(session, billing, test_user, [{"Возраст": 30}])
+    create_pending_request(session, billing, test_user, [{"Возраст": 40}])
+
+    hourly = session.query(RequestRollup).filter_by(granularity="hour", user_id=test_user.id).all()
+    assert sorted(row.shard for row in hourly) == [0, 1]
+    buckets = admin_client.get("/api/v1/admin/analytics", params={"group_by": "user"}).json()
+    assert [(b["user_id"], b["requests"], b["rows_scored"]) for b in buckets] == [(test_user.id, 2, 2)]
+
+    assert admin_client.post("/api/v1/admin/analytics/rebuild").status_code == status.HTTP_200_OK
+    assert admin_client.get("/api/v1/admin/analytics", params={"group_by": "user"}).json() == buckets
+
+
+def test_rebuild_replaces_only_closed_buckets(session, admin_client, test_user, active_model):
+    """Пересчет исправляет агрегаты закрытых интервалов и не трогает текущие, куда пишутся приращения."""
+    from datetime import datetime, timedelta, timezone
+    from decimal import Decimal
+    from app.models import MLRequest, MLRequestStatus, RequestRollup, RollupGranularity
+    from app.services import BillingService
+    from app.services.analytics_service import bucket_start
+    from app.services.ml_service_helpers import create_pending_request
+
+    billing = BillingService(session)
+    test_user.balance = Decimal("1000")
+    create_pending_request(session, billing, test_user, [{"Возраст": 30}])
+    old = datetime.now(timezone.utc) - timedelta(days=2)
+    # История без агрегатов: входные данные-список считаются по строкам, иначе — одной строкой
+    for input_data in ([{"Возраст": 40}, {"Возраст": 50}, {"Возраст": 60}], {"Возраст": 70}):
+        session.add(MLRequest(
+            user_id=test_user.id, model_id=active_model.id, input_data=input_data, status=MLRequestStatus.success,
+            cost=active_model.cost, created_at=old, completed_at=old,
+        ))
+    # Текущий интервал расходится с историей запросов, но пересчет его не заменяет
+    current = session.query(RequestRollup).filter_by(granularity=RollupGranularity.day, user_id=test_user.id).one()
+    current.requests += 5
+    session.flush()
+
+    assert admin_client.post("/api/v1/admin/analytics/rebuild").json() == {"rows": 2}
+    session.expire_all()
+    rows = {
+        row.bucket_start: (row.requests, row.rows_scored, row.succeeded)
+        for row in session.query(RequestRollup).filter_by(granularity=RollupGranularity.day, user_id=test_user.id)
+    }
+    assert rows == {
+        bucket_start(old, RollupGranularity.day): (2, 4, 2),
+        current.bucket_start: (6, 1, 0),
+    }
+
+
+def test_rollups_backfilled_by_migration(session, test_user, active_model):
+    """История, накопленная до появления агрегатов, попадает в статистику без ручного пересчета."""
+    from app.database.migrations import backfill_rollups
+    from app.models import MLRequest, MLRequestStatus, RequestRollup
+    from app.services import AnalyticsService
+
+    session.add(MLRequest(
+        user_id=test_user.id, model_id=active_model.id, input_data=[{"Возраст": 30}],
+        status=MLRequestStatus.fail, cost=active_model.cost,
+    ))
+    session.flush()
+    assert session.query(RequestRollup).count() == 0
+
+    backfill_rollups(session.connection())
+    totals = AnalyticsService(session).get_totals(test_user.id)
+    assert (totals["requests"], totals["failed"], totals["refunds"]) == (1, 1, active_model.cost)
+
 def test_admin_update_user_full(admin_client, test_user):
     update_data = {
         "first_name": "AdminUpdated",
@@ -75,6 +210,10 @@ def test_admin_update_user_invalid_data(admin_client, test_user):
     ("GET", "/api/v1/admin/users", None),
     ("PATCH", "/api/v1/admin/users/1", {}),
     ("GET", "/api/v1/admin/transactions", None),
+    ("GET", "/api/v1/admin/transactions/export", None),
+    ("GET", "/api/v1/admin/ml-requests/export", None),
+    ("GET", "/api/v1/admin/analytics", None),
+    ("POST", "/api/v1/admin/analytics/rebuild", None),
     ("POST", "/api/v1/admin/transactions/replenish/1", {"amount": 100}),
     ("POST", "/api/v1/admin/transactions/approve/1", None),
     ("POST", "/api/v1/admin/transactions/reject/1", None),
@@ -94,6 +233,10 @@ def test_admin_endpoints_unauthorized(client, method, url, payload):
     ("GET", "/api/v1/admin/users", None),
     ("PATCH", "/api/v1/admin/users/1", {}),
     ("GET", "/api/v1/admin/transactions", None),
+    ("GET", "/api/v1/admin/transactions/export", None),
+    ("GET", "/api/v1/admin/ml-requests/export", None),
+    ("GET", "/api/v1/admin/analytics", None),
+    ("POST", "/api/v1/admin/analytics/rebuild", None),
     ("POST", "/api/v1/admin/transactions/replenish/1", {"amount": 100}),
     ("POST", "/api/v1/admin/transactions/approve/1", None),
     ("POST", "/api/v1/admin/transactions/reject/1", None),
@@ -2,9 +2,12 @@ import pytest
 from fastapi import status
 from app.config import settings
 from tests.helpers import (
+    create_ml_request,
     get_user_balance,
+    get_valid_feature_data,
     replenish_user_balance,
-    DEFAULT_REPLENISH_AMOUNT
+    DEFAULT_REPLENISH_AMOUNT,
+    TEST_MODEL_COST
 )
 
 # Позитивные сценарии
@@ -62,10 +65,62 @@ def test_replenish_amount_too_large(auth_client):
     assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
 
 
+def test_hold_pays_for_requests_without_touching_balance(funded_client):
+    """Оплата запроса списывается из шарда, баланс не меняется, запись об оплате остается в журнале."""
+    response = funded_client.post("/api/v1/balance/holds", json={"amount": 50, "shards": 5})
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert float(data["held"]) == 50.0 and data["shards"] == 5
+    assert float(data["balance"]) == DEFAULT_REPLENISH_AMOUNT - 50
+
+    assert create_ml_request(funded_client, get_valid_feature_data()).status_code == status.HTTP_202_ACCEPTED
+    assert get_user_balance(funded_client) == DEFAULT_REPLENISH_AMOUNT - 50
+    holds = funded_client.get("/api/v1/balance/holds").json()
+    assert float(holds["held"]) == 50.0 - float(TEST_MODEL_COST)
+    history = funded_client.get("/api/v1/balance/history").json()
+    assert any(t["type"] == "payment" and float(t["amount"]) == -float(TEST_MODEL_COST) for t in history)
+
+
+def test_hold_split_across_shards_when_none_covers_cost(funded_client):
+    """Весь баланс перенесен в шарды, ни в одном не хватает суммы: оплата собирается из нескольких шардов."""
+    response = funded_client.post("/api/v1/balance/holds", json={"amount": DEFAULT_REPLENISH_AMOUNT, "shards": 20})
+    assert float(response.json()["balance"]) == 0.0
+
+    assert create_ml_request(funded_client, get_valid_feature_data()).status_code == status.HTTP_202_ACCEPTED
+    holds = funded_client.get("/api/v1/balance/holds").json()
+    assert float(holds["held"]) == DEFAULT_REPLENISH_AMOUNT - float(TEST_MODEL_COST)
+    assert get_user_balance(funded_client) == 0.0
+
+
+def test_hold_release_and_settlement(funded_client, funded_user, session):
+    from datetime import datetime
+    from app.models import BalanceHold
+    from app.services import BillingService
+
+    funded_client.post("/api/v1/balance/holds", json={"amount": 40, "shards": 4})
+    response = funded_client.delete("/api/v1/balance/holds")
+    assert float(response.json()["held"]) == 0.0
+    assert get_user_balance(funded_client) == DEFAULT_REPLENISH_AMOUNT
+
+    # Истекшие шарды возвращаются на баланс фоновой сверкой
+    funded_client.post("/api/v1/balance/holds", json={"amount": 30, "shards": 3})
+    session.query(BalanceHold).update({"expires_at": datetime(2000, 1, 1)})
+    assert BillingService(session).settle_expired_holds() == 3
+    session.expire_all()
+    assert get_user_balance(funded_client) == DEFAULT_REPLENISH_AMOUNT
+
+
+def test_hold_insufficient_funds(funded_client):
+    response = funded_client.post("/api/v1/balance/holds", json={"amount": DEFAULT_REPLENISH_AMOUNT + 1})
+    assert response.status_code == status.HTTP_402_PAYMENT_REQUIRED
+
+
 @pytest.mark.parametrize("method,url,payload", [
     ("GET", "/api/v1/balance/check_balance", None),
     ("POST", "/api/v1/balance/replenish", {"amount": 100}),
     ("GET", "/api/v1/balance/history", None),
+    ("GET", "/api/v1/balance/holds", None),
+    ("POST", "/api/v1/balance/holds", {"amount": 10}),
 ])
 def test_billing_unauthorized(client, method, url, payload):
     """Проверка всех биллинговых эндпоинтов без авторизации (401)."""
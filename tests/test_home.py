@@ -30,3 +30,35 @@ def test_health_check_response_structure(client):
     assert "rabbitmq" in data
     assert response.status_code in [status.HTTP_200_OK, status.HTTP_503_SERVICE_UNAVAILABLE]
 
+
+def test_health_check_serves_cached_snapshot(client, mock_mq_service):
+    first = client.get("/health").json()
+    second = client.get("/health").json()
+    assert second["timestamp"] == first["timestamp"]
+    assert "age_seconds" in second
+    # Проверки выполнялись один раз: канал брокера берется только при сборе снимка
+    assert mock_mq_service.channel_pool.acquire.call_count == 1
+
+
+def test_health_check_forced_refresh(client, mock_mq_service, monkeypatch):
+    from app.config import settings
+    monkeypatch.setattr(settings.app, "HEALTH_MIN_REFRESH", 0.0)
+    client.get("/health")
+    client.get("/health", params={"max_age": 0})
+    assert mock_mq_service.channel_pool.acquire.call_count == 2
+
+
+def test_liveness_check(client, mock_mq_service):
+    response = client.get("/health/live")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"status": "alive"}
+    mock_mq_service.channel_pool.acquire.assert_not_called()
+
+
+def test_health_check_external_results_consumer(client, monkeypatch):
+    """В режиме API без consumer'а его состояние определяется по подписчикам очереди результатов."""
+    from app.config import settings
+    monkeypatch.setattr(settings.app, "RESULTS_CONSUMER_ENABLED", False)
+    data = client.get("/health").json()
+    assert data["results_consumer"] == "external"
+    assert "results_consumer_down" not in data["details"].get("degraded_reasons", [])
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import aio_pika
+import pytest
+
+from loadtest.broker import DIRECT_REPLY_TO, InMemoryBroker
+from loadtest.harness import check_thresholds, parse_batch_sizes, percentile
+
+
+async def test_broker_routes_and_acknowledges():
+    broker = InMemoryBroker()
+    with broker.installed():
+        connection = await aio_pika.connect_robust("amqp://loadtest")
+    channel = await connection.channel()
+    await channel.set_qos(prefetch_count=2)
+    exchange = await channel.declare_exchange("tasks", type=aio_pika.ExchangeType.DIRECT)
+    queue = await channel.declare_queue("task_queue", durable=True)
+    await queue.bind(exchange, routing_key="task_queue")
+
+    received = []
+
+    async def collect(message):
+        received.append(message)
+
+    await queue.consume(collect)
+    for i in range(3):
+        await exchange.publish(aio_pika.Message(str(i).encode()), routing_key="task_queue")
+    await asyncio.sleep(0.01)
+    # prefetch ограничивает число неподтвержденных сообщений у consumer'а
+    assert [m.body for m in received] == [b"0", b"1"]
+
+    await received[1].ack(multiple=True)
+    await asyncio.sleep(0.01)
+    assert [m.body for m in received] == [b"0", b"1", b"2"]
+    assert queue.declaration_result.message_count == 0
+
+    # Неподтвержденное сообщение возвращается в очередь при закрытии канала
+    await channel.close()
+    assert broker.queue_depths()["task_queue"] == 1
+
+
+async def test_broker_direct_reply_to():
+    broker = InMemoryBroker()
+    connection = await broker.connect_robust()
+    client, server = await connection.channel(), await connection.channel()
+    reply_queue = await client.declare_queue(DIRECT_REPLY_TO, passive=True)
+    replies = asyncio.Queue()
+    await reply_queue.consume(replies.put, no_ack=True)
+
+    requests = await server.declare_queue("rpc_queue")
+
+    async def respond(message):
+        async with message.process():
+            await server.default_exchange.publish(
+                aio_pika.Message(message.body.upper(), correlation_id=message.correlation_id),
+                routing_key=message.reply_to,
+            )
+
+    await requests.consume(respond)
+    await client.default_exchange.publish(
+        aio_pika.Message(b"ping", correlation_id="1", reply_to=reply_queue.name), routing_key="rpc_queue"
+    )
+    reply = await asyncio.wait_for(replies.get(), 1)
+    assert (reply.body, reply.correlation_id) == (b"PING", "1")
+
+
+def test_harness_helpers():
+    assert parse_batch_sizes("1:0.7,10:0.3") == ([1, 10], [0.7, 0.3])
+    with pytest.raises(ValueError):
+        parse_batch_sizes("0:1")
+    assert percentile([5, 1, 3, 2, 4], 50) == 3
+    assert percentile([5, 1, 3, 2, 4], 99) == 5
+
+    report = {"latency_ms": {"rpc": {"p95": 120.0}}, "throughput_rps": 4.0, "error_rate": 0.0}
+    assert check_thresholds(report, max_p95_ms=200, min_throughput=1, max_error_rate=0) == []
+    assert len(check_thresholds(report, max_p95_ms=100, min_throughput=5)) == 2
+
+
+def test_load_run_end_to_end(tmp_path):
+    """Короткий прогон через API, воркеры и consumer результатов на SQLite укладывается в пороги."""
+    env = {k: v for k, v in os.environ.items() if k != "APP__MODE"}
+    report_path = tmp_path / "report.json"
+    result = subprocess.run(
+        [sys.executable, "-m", "loadtest", "--duration", "1", "--rate", "10", "--users", "2",
+         "--db-url", f"sqlite:///{tmp_path}/loadtest.db", "--json", str(report_path), "--max-error-rate", "0"],
+        capture_output=True, text=True, env=env, timeout=120,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert report_path.exists()
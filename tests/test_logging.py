@@ -0,0 +1,42 @@
+import json
+import logging
+import queue
+
+from common.log_pipeline import JsonFormatter, NonBlockingQueueHandler, SamplingFilter
+
+
+def _record(name: str, level: int, msg: str, *args, **extra) -> logging.LogRecord:
+    record = logging.makeLogRecord({"name": name, "levelno": level, "levelname": logging.getLevelName(level),
+                                    "msg": msg, "args": args})
+    record.__dict__.update(extra)
+    return record
+
+
+def test_sampling_filter_keeps_warnings_and_uses_longest_prefix():
+    sampling = SamplingFilter({"app": 1.0, "app.services.mq_consumer": 0.0})
+    assert sampling.filter(_record("app.routes", logging.INFO, "ok"))
+    assert not sampling.filter(_record("app.services.mq_consumer", logging.INFO, "batch"))
+    assert sampling.filter(_record("app.services.mq_consumer", logging.WARNING, "slow"))
+    assert sampling.rate_for("app.services.mq_consumer_other") == 1.0
+
+
+def test_queue_handler_truncates_and_drops_when_full():
+    log_queue = queue.Queue(maxsize=1)
+    handler = NonBlockingQueueHandler(log_queue, max_length=10)
+    handler.handle(_record("app", logging.INFO, "payload %s", "x" * 100))
+    handler.handle(_record("app", logging.INFO, "second"))
+
+    queued = log_queue.get_nowait()
+    assert queued.getMessage().startswith("payload xx")
+    assert "обрезано" in queued.getMessage()
+    assert handler.dropped == 1
+
+
+def test_json_formatter_includes_extra_fields():
+    formatter = JsonFormatter(max_length=20)
+    entry = json.loads(formatter.format(_record("app.api", logging.ERROR, "boom", request_id=7, body="y" * 50)))
+    assert entry["level"] == "ERROR"
+    assert entry["logger"] == "app.api"
+    assert entry["message"] == "boom"
+    assert entry["request_id"] == 7
+    assert entry["body"].startswith("y" * 20) and len(entry["body"]) < 50
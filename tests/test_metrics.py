@@ -0,0 +1,123 @@
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from app.utils.metrics import MetricsMiddleware, instrument_engine_metrics, metrics_registry
+from common.metrics import Counter, Gauge, Histogram, Registry
+
+
+def sample(text: str, name: str, **labels: str) -> float:
+    """Значение временного ряда из ответа в формате Prometheus (0, если ряда нет)."""
+    rendered = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    pattern = re.escape(f"{name}{{{rendered}}}" if labels else name) + r" (\S+)$"
+    match = re.search(pattern, text, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+@pytest.fixture
+def metrics_client(auth_client, engine):
+    instrument_engine_metrics(engine)
+    return auth_client
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    requests = Counter("requests_total", "Запросы", ("path",), registry)
+    in_use = Gauge("in_use", "Занято", (), registry)
+    latency = Histogram("latency_seconds", "Задержка", ("path",), registry, buckets=(0.1, 1))
+    requests.labels('/a"b').inc()
+    requests.labels('/a"b').inc(2)
+    in_use.set(3)
+    for value in (0.05, 0.5, 5):
+        latency.labels("/x").observe(value)
+    registry.on_collect(lambda: in_use.set(4))
+
+    text = registry.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{path="/a\\"b"} 3.0' in text
+    assert "in_use 4.0" in text
+    assert "# TYPE latency_seconds histogram" in text
+    assert 'latency_seconds_bucket{path="/x",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{path="/x",le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{path="/x",le="+Inf"} 3' in text
+    assert 'latency_seconds_sum{path="/x"} 5.55' in text
+    assert 'latency_seconds_count{path="/x"} 3' in text
+    with pytest.raises(ValueError):
+        requests.labels()
+
+
+def test_multiprocess_registry_sums_process_snapshots(tmp_path):
+    """Опрос отдает сумму снимков процессов: счетчики — всех, измерители — только живых."""
+    import json
+    import os
+
+    registry = Registry()
+    requests = Counter("requests_total", "Запросы", ("path",), registry)
+    in_use = Gauge("in_use", "Занято", (), registry)
+    latency = Histogram("latency_seconds", "Задержка", (), registry, buckets=(0.1, 1))
+    registry.enable_multiprocess(str(tmp_path))
+    requests.labels("/a").inc()
+    in_use.set(1)
+    latency.observe(0.05)
+
+    # Живой процесс (родительский) и завершившийся (pid больше максимально возможного)
+    for pid, value in ((os.getppid(), 2), (2 ** 22 + 1, 10)):
+        (tmp_path / f"{pid}.json").write_text(json.dumps({
+            "requests_total": [[["/a"], value], [["/b"], 1]],
+            "in_use": [[[], value]],
+            "latency_seconds": [[[], [0, value, 0, value * 0.5]]],
+        }))
+
+    text = registry.render()
+    assert 'requests_total{path="/a"} 13.0' in text
+    assert 'requests_total{path="/b"} 2.0' in text
+    assert "in_use 3.0" in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 13' in text
+    assert "latency_seconds_sum 6.05" in text
+    assert (tmp_path / f"{os.getpid()}.json").exists()
+
+
+def test_route_metrics_include_db_usage(metrics_client):
+    route = "/api/v1/requests/history"
+    before = metrics_client.get("/internal/metrics").text
+
+    assert metrics_client.get(route).status_code == 200
+    assert metrics_client.get("/no/such/path").status_code == 404
+
+    response = metrics_client.get("/internal/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    after = response.text
+
+    def delta(name: str, **labels: str) -> float:
+        return sample(after, name, **labels) - sample(before, name, **labels)
+
+    assert delta("http_requests_total", method="GET", route=route, status="200") == 1
+    assert delta("http_requests_total", method="GET", route="unmatched", status="404") == 1
+    assert delta("http_request_duration_seconds_count", method="GET", route=route) == 1
+    assert delta("http_request_db_statements_count", method="GET", route=route) == 1
+    assert delta("http_request_db_statements_sum", method="GET", route=route) >= 1
+    assert delta("http_request_db_seconds_sum", method="GET", route=route) > 0
+    assert delta("db_statement_duration_seconds_count", operation="SELECT") >= 1
+    assert "rpc_pending_calls 0.0" in after
+
+
+async def test_in_flight_requests_are_counted_by_route():
+    scraped = {}
+
+    async def app(scope, receive, send):
+        scope["route"] = SimpleNamespace(path="/slow/{item_id}")
+        scraped["text"] = metrics_registry.render()
+        await send({"type": "http.response.start", "status": 204, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        pass
+
+    await MetricsMiddleware(app)({"type": "http", "method": "GET", "path": "/slow/1", "headers": []}, None, send)
+
+    assert sample(scraped["text"], "http_requests_in_flight", method="GET", route="/slow/{item_id}") == 1
+    after = metrics_registry.render()
+    assert sample(after, "http_requests_in_flight", method="GET", route="/slow/{item_id}") == 0
+    assert sample(after, "http_requests_total", method="GET", route="/slow/{item_id}", status="204") == 1
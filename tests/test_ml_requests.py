@@ -1,5 +1,6 @@
 import pytest
 from fastapi import status
+from app.models import OutboxMessage
 from tests.helpers import (
     get_valid_feature_data,
     replenish_user_balance,
@@ -44,6 +45,62 @@ def test_send_result_success(client, funded_client):
     assert resp_details.json()["status"] == "success"
     assert resp_details.json()["prediction"] == "выраженные побочные эффекты будут с вероятностью 0.15"
 
+def _complete_request(client, funded_client, rows, prediction):
+    request_id = funded_client.post("/api/v1/requests/send_task", json={"data": rows}).json()["request_id"]
+    client.post("/api/v1/requests/post_result", json={
+        "task_id": str(request_id),
+        "prediction": prediction,
+        "status": "success",
+        "worker_id": "test-worker-01"
+    })
+    return request_id
+
+
+def test_results_download_csv(client, funded_client):
+    """Выгрузка результатов: по строке на каждую входную строку, предсказание сопоставлено строке."""
+    rows = [get_valid_feature_data(patient_id="P-1", age=30), get_valid_feature_data(patient_id="P-2", age=41.5)]
+    request_id = _complete_request(client, funded_client, rows, ["низкий риск", "высокий риск"])
+
+    response = funded_client.get(
+        f"/api/v1/requests/history/{request_id}/results",
+        params={"columns": ["row,№ Пациента", "Возраст", "Результат"]},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/csv")
+    assert f"request_{request_id}_results.csv" in response.headers["content-disposition"]
+    assert response.text.splitlines() == [
+        "row,№ Пациента,Возраст,Результат",
+        "1,P-1,30.0,низкий риск",
+        "2,P-2,41.5,высокий риск",
+    ]
+
+
+def test_results_download_parquet(client, funded_client):
+    pq = pytest.importorskip("pyarrow.parquet")
+    import io
+
+    rows = [get_valid_feature_data(patient_id="P-1"), get_valid_feature_data(patient_id="P-2")]
+    request_id = _complete_request(client, funded_client, rows, "выраженных побочных ответов не будет")
+
+    response = funded_client.get(f"/api/v1/requests/history/{request_id}/results", params={"format": "parquet"})
+    assert response.status_code == status.HTTP_200_OK
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.num_rows == 2
+    assert table.column("№ Пациента").to_pylist() == ["P-1", "P-2"]
+    assert table.column("Результат").to_pylist() == ["выраженных побочных ответов не будет"] * 2
+    assert table.column("status").to_pylist() == ["success", "success"]
+
+
+def test_results_download_rejects_pending_and_unknown_columns(funded_client):
+    request_id = create_ml_request(funded_client, get_valid_feature_data()).json()["request_id"]
+    response = funded_client.get(f"/api/v1/requests/history/{request_id}/results")
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+    response = funded_client.get(f"/api/v1/requests/history/{request_id}/results", params={"columns": "age"})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+    assert response.json()["message"]["columns"] == ["age"]
+
+
 def test_get_ml_history_empty(auth_client):
     """Получение пустой истории для нового пользователя."""
     response = auth_client.get("/api/v1/requests/history")
@@ -61,6 +118,152 @@ def test_get_history_with_data(funded_client):
     assert len(history) >= 1
     assert any(item["id"] == request_id for item in history)
 
+    # Фильтр since ограничивает выборку недавними запросами (и партициями)
+    response = funded_client.get("/api/v1/requests/history", params={"since": "2100-01-01T00:00:00"})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == []
+
+
+def test_partitioned_tables_ddl():
+    """В PostgreSQL ml_request и transaction партиционируются по месяцам, в остальных СУБД — обычные таблицы."""
+    from sqlalchemy.dialects import postgresql, sqlite
+    from sqlalchemy.schema import CreateTable
+    from app.models import IdempotencyKey, MLRequest, Transaction
+
+    pg_request = str(CreateTable(MLRequest.__table__).compile(dialect=postgresql.dialect()))
+    assert "PARTITION BY RANGE (created_at)" in pg_request
+    assert "PRIMARY KEY" not in pg_request
+    assert "UNIQUE (id, created_at)" in pg_request
+    # Ссылки на партиционированную ml_request — составными ключами с ключом партиции
+    pg_transaction = str(CreateTable(Transaction.__table__).compile(dialect=postgresql.dialect()))
+    assert "REFERENCES ml_request (id)" not in pg_transaction
+    assert "FOREIGN KEY(ml_request_id, ml_request_created_at) REFERENCES ml_request (id, created_at)" in pg_transaction
+    for model in (OutboxMessage, IdempotencyKey):
+        pg_ddl = str(CreateTable(model.__table__).compile(dialect=postgresql.dialect()))
+        assert "FOREIGN KEY(ml_request_id, ml_request_created_at) REFERENCES ml_request (id, created_at) " \
+               "ON DELETE CASCADE" in pg_ddl
+        assert "REFERENCES ml_request (id) " not in pg_ddl
+
+    sqlite_request = str(CreateTable(MLRequest.__table__).compile(dialect=sqlite.dialect()))
+    assert "PRIMARY KEY (id)" in sqlite_request
+    assert "PARTITION" not in sqlite_request
+    sqlite_transaction = str(CreateTable(Transaction.__table__).compile(dialect=sqlite.dialect()))
+    assert "REFERENCES ml_request (id)" in sqlite_transaction
+    assert "created_at)" not in sqlite_transaction
+
+
+def test_request_references_carry_partition_key(session, funded_client):
+    """Ссылки на запрос хранят его created_at; у строк до миграции он заполняется миграцией."""
+    from app.database.migrations import reference_partitioned_requests
+    from app.models import IdempotencyKey, MLRequest, Transaction
+
+    response = funded_client.post(
+        "/api/v1/requests/send_task",
+        json={"data": [get_valid_feature_data()]},
+        headers={"Idempotency-Key": "partition-key"},
+    )
+    db_request = session.get(MLRequest, response.json()["request_id"])
+    for model in (Transaction, OutboxMessage, IdempotencyKey):
+        row = session.query(model).filter_by(ml_request_id=db_request.id).one()
+        assert row.ml_request_created_at == db_request.created_at
+        row.ml_request_created_at = None
+    session.flush()
+
+    reference_partitioned_requests(session.connection())
+    session.expire_all()
+    for model in (Transaction, OutboxMessage, IdempotencyKey):
+        assert session.query(model).filter_by(ml_request_id=db_request.id).one().ml_request_created_at is not None
+
+
+class PartitionConnection:
+    """Соединение PostgreSQL для проверки DDL партиций: записывает инструкции и отвечает на запросы каталога."""
+
+    def __init__(self, partitioned=("ml_request", "transaction"), existing=(), catalog=None):
+        self.partitioned = {f'"{table}"' for table in partitioned}
+        self.existing = {f'"{name}"' for name in existing}
+        self.catalog = catalog or {}
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        from types import SimpleNamespace
+
+        sql = str(statement)
+        self.statements.append(sql)
+        params = params or {}
+        if "pg_partitioned_table" in sql:
+            return SimpleNamespace(first=lambda: (1,) if params["table"] in self.partitioned else None)
+        rows = next((rows for key, rows in self.catalog.items() if key in sql), [])
+        scalar = "oid" if params.get("name") in self.existing else (rows[0][0] if rows else None)
+        return SimpleNamespace(all=lambda: rows, scalar=lambda: scalar)
+
+
+def test_ensure_partitions_sql():
+    """DEFAULT-партиция и помесячные партиции создаются на месяцы вперед; непартиционированная таблица — ошибка."""
+    from datetime import date
+    from app.database.partitions import ensure_partitions
+
+    # Партиции текущего месяца уже созданы
+    connection = PartitionConnection(existing=("ml_request_p2025_12", "transaction_p2025_12"))
+    assert ensure_partitions(connection, date(2025, 12, 15), 1) == ["ml_request_p2026_01", "transaction_p2026_01"]
+    ddl = [sql for sql in connection.statements if sql.startswith("CREATE")]
+    assert ddl[:2] == [
+        'CREATE TABLE IF NOT EXISTS "ml_request_default" PARTITION OF "ml_request" DEFAULT',
+        'CREATE TABLE "ml_request_p2026_01" PARTITION OF "ml_request" '
+        "FOR VALUES FROM ('2026-01-01') TO ('2026-02-01')",
+    ]
+
+    with pytest.raises(RuntimeError, match="transaction не партиционирована"):
+        ensure_partitions(PartitionConnection(partitioned=("ml_request",)), date(2025, 12, 15), 1)
+
+
+def test_partition_existing_table_sql():
+    """Обычная таблица прежней схемы становится исторической партицией новой родительской таблицы."""
+    from datetime import date
+    from app.database.partitions import partition_existing_table
+
+    connection = PartitionConnection(partitioned=(), catalog={
+        "confrelid": [('"transaction"', "transaction_ml_request_id_fkey")],
+        "pg_get_indexdef": [(
+            "ix_ml_request_user_id_created_at",
+            "CREATE INDEX ix_ml_request_user_id_created_at ON public.ml_request USING btree (user_id, created_at)",
+        )],
+        "pg_get_constraintdef": [("ml_request_user_id_fkey", 'FOREIGN KEY (user_id) REFERENCES "user"(id)')],
+        "pg_get_serial_sequence": [("public.ml_request_id_seq",)],
+    })
+    assert partition_existing_table(connection, "ml_request", date(2025, 12, 15))
+    ddl = [sql for sql in connection.statements if not sql.startswith("SELECT")]
+    assert ddl == [
+        'LOCK TABLE "ml_request" IN ACCESS EXCLUSIVE MODE',
+        'ALTER TABLE "transaction" DROP CONSTRAINT "transaction_ml_request_id_fkey"',
+        'ALTER TABLE "ml_request" RENAME TO "ml_request_p0000_history"',
+        'ALTER INDEX "ix_ml_request_user_id_created_at" '
+        'RENAME TO "ix_ml_request_user_id_created_at_ml_request_p0000_history"',
+        'CREATE TABLE "ml_request" (LIKE "ml_request_p0000_history" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        "PARTITION BY RANGE (created_at)",
+        'ALTER TABLE "ml_request" ADD CONSTRAINT "uq_ml_request_id_created_at" UNIQUE (id, created_at)',
+        'CREATE INDEX ix_ml_request_user_id_created_at ON "ml_request" USING btree (user_id, created_at)',
+        'ALTER TABLE "ml_request" ADD CONSTRAINT "ml_request_user_id_fkey" FOREIGN KEY (user_id) REFERENCES "user"(id)',
+        'ALTER SEQUENCE public.ml_request_id_seq OWNED BY "ml_request".id',
+        'CREATE TABLE IF NOT EXISTS "ml_request_default" PARTITION OF "ml_request" DEFAULT',
+        'CREATE TABLE "ml_request_p2025_12" PARTITION OF "ml_request" '
+        "FOR VALUES FROM ('2025-12-01') TO ('2026-01-01')",
+        'INSERT INTO "ml_request" SELECT * FROM "ml_request_p0000_history" WHERE created_at >= :bound',
+        'DELETE FROM "ml_request_p0000_history" WHERE created_at >= :bound',
+        'ALTER TABLE "ml_request" ATTACH PARTITION "ml_request_p0000_history" '
+        "FOR VALUES FROM (MINVALUE) TO ('2025-12-01')",
+    ]
+    # Уже партиционированная таблица не трогается
+    assert not partition_existing_table(PartitionConnection(), "ml_request", date(2025, 12, 15))
+
+
+def test_partition_names():
+    from datetime import date
+    from app.database.partitions import month_start, partition_name
+
+    assert month_start(date(2025, 11, 17), 2) == date(2026, 1, 1)
+    assert month_start(date(2025, 1, 31), -1) == date(2024, 12, 1)
+    assert partition_name("ml_request", date(2026, 1, 1)) == "ml_request_p2026_01"
+
 
 def test_get_request_details_success(funded_client):
     feature_data = get_valid_feature_data()
@@ -70,6 +273,386 @@ def test_get_request_details_success(funded_client):
     assert response.status_code == status.HTTP_200_OK
     assert response.json()["id"] == request_id
 
+def test_export_history_only_own_requests(session, funded_client, admin_user, active_model):
+    from app.models import MLRequest, MLRequestStatus
+    session.add(MLRequest(
+        user_id=admin_user.id, model_id=active_model.id, input_data=[],
+        status=MLRequestStatus.pending, cost=active_model.cost,
+    ))
+    request_id = create_ml_request(funded_client, get_valid_feature_data()).json()["request_id"]
+    response = funded_client.get("/api/v1/requests/history/export", params={"format": "csv"})
+    assert response.status_code == status.HTTP_200_OK
+    lines = response.text.splitlines()
+    assert lines[0].startswith("id,user_id,model")
+    assert [line.split(",")[0] for line in lines[1:]] == [str(request_id)]
+
+
+def test_export_streams_from_own_session(session, funded_client):
+    """Выгрузка читается в сессии генератора: сессия обработчика к началу отправки уже может быть закрыта."""
+    from contextlib import contextmanager
+    from app.models import MLRequest
+    from app.services import MLRequestService
+    from app.services.export_service import ExportFormat
+
+    request_id = create_ml_request(funded_client, get_valid_feature_data()).json()["request_id"]
+    user_id = session.get(MLRequest, request_id).user_id
+    opened = []
+
+    @contextmanager
+    def session_factory():
+        opened.append(True)
+        yield session
+
+    handler_session = session.__class__(bind=session.get_bind())
+    chunks = MLRequestService(handler_session, session_factory).export_history(user_id, ExportFormat.csv)
+    handler_session.close()
+    assert not opened
+    lines = "".join(chunks).splitlines()
+    assert opened == [True]
+    assert [line.split(",")[0] for line in lines[1:]] == [str(request_id)]
+
+
+def test_stats_track_requests_and_refunds(client, funded_client):
+    first = create_ml_request(funded_client, get_valid_feature_data()).json()["request_id"]
+    create_ml_request(funded_client, get_valid_feature_data(patient_id="P-2"))
+    client.post("/api/v1/requests/post_result", json={
+        "task_id": str(first), "status": "fail", "error": "boom", "worker_id": "w-1"
+    })
+
+    stats = funded_client.get("/api/v1/requests/stats").json()
+    assert stats["requests"] == 2
+    assert stats["rows_scored"] == 2
+    assert float(stats["revenue"]) == 2 * float(TEST_MODEL_COST)
+    assert stats["failed"] == 1 and stats["succeeded"] == 0
+    assert float(stats["refunds"]) == float(TEST_MODEL_COST)
+    assert stats["failure_rate"] == 1.0
+
+    buckets = funded_client.get("/api/v1/requests/analytics", params={"granularity": "hour"}).json()
+    assert len(buckets) == 1
+    assert buckets[0]["requests"] == 2 and buckets[0]["model_id"] is not None
+
+
+def test_send_task_uses_redeployed_model(session, funded_client, active_model):
+    """После смены активной модели кеш сбрасывается и запрос уходит в новую модель."""
+    from app.models import MLModel
+
+    create_ml_request(funded_client, get_valid_feature_data())
+    active_model.is_active = False
+    new_model = MLModel(name="Test Model v2", code_name="test_model_v2", version="2.0.0", is_active=True)
+    session.add(new_model)
+    session.flush()
+
+    resp_send = create_ml_request(funded_client, get_valid_feature_data())
+    request_id = resp_send.json()["request_id"]
+    details = funded_client.get(f"/api/v1/requests/history/{request_id}").json()
+    assert details["model_id"] == new_model.id
+
+def test_events_stream_completed_request(client, funded_client):
+    """Поток событий по уже завершенному запросу сразу отдаёт итоговый статус и закрывается."""
+    resp_send = create_ml_request(funded_client, get_valid_feature_data())
+    request_id = resp_send.json()["request_id"]
+    client.post("/api/v1/requests/post_result", json={
+        "task_id": str(request_id),
+        "prediction": ["ok"],
+        "status": "success",
+        "worker_id": "test-worker-01"
+    })
+
+    response = funded_client.get(f"/api/v1/requests/events?request_id={request_id}")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert "event: status" in response.text
+    assert '"status":"success"' in response.text
+
+
+async def test_task_event_published_after_commit(session, test_user):
+    """Событие доставляется подписчику только после коммита сессии."""
+    import asyncio
+    from app.models import MLRequestStatus
+    from app.schemas import STaskEvent
+    from app.services.task_events import task_events, enqueue_task_event
+
+    task_events.bind_loop(asyncio.get_running_loop())
+    queue = task_events.subscribe(test_user.id)
+    try:
+        enqueue_task_event(session, STaskEvent(request_id=1, user_id=test_user.id, status=MLRequestStatus.success))
+        assert queue.empty()
+        session.commit()
+        task_event = queue.get_nowait()
+        assert task_event.request_id == 1
+        assert task_event.status == MLRequestStatus.success
+    finally:
+        task_events.unsubscribe(test_user.id, queue)
+
+def test_apply_results_batch(session, funded_client):
+    """Пачка результатов: успех, ошибка с возвратом, дубликат и неизвестный запрос."""
+    from app.schemas.ml_task_schemas import MLResult
+    from app.services import MLRequestService
+
+    ok_id = create_ml_request(funded_client, get_valid_feature_data()).json()["request_id"]
+    fail_id = create_ml_request(funded_client, get_valid_feature_data()).json()["request_id"]
+    balance_before = get_user_balance(funded_client)
+
+    results = [
+        MLResult(task_id=str(ok_id), prediction=["ok"], status="success", worker_id="w"),
+        MLResult(task_id=str(fail_id), status="fail", error="boom", worker_id="w"),
+        MLResult(task_id=str(ok_id), prediction=["dup"], status="success", worker_id="w"),
+        MLResult(task_id="9999", prediction=["x"], status="success", worker_id="w"),
+    ]
+    updated = MLRequestService(session).apply_results_batch(results)
+    assert updated == 2
+    # Балансы обновляются пакетным UPDATE в обход identity map
+    session.expire_all()
+
+    ok_details = funded_client.get(f"/api/v1/requests/history/{ok_id}").json()
+    assert ok_details["status"] == "success"
+    assert ok_details["prediction"] == ["ok"]
+    assert funded_client.get(f"/api/v1/requests/history/{fail_id}").json()["status"] == "fail"
+    assert get_user_balance(funded_client) == balance_before + float(TEST_MODEL_COST)
+
+    # Повторная доставка уже обработанных результатов ничего не меняет
+    assert MLRequestService(session).apply_results_batch(results) == 0
+    assert get_user_balance(funded_client) == balance_before + float(TEST_MODEL_COST)
+
+
+def test_send_task_idempotent_replay(session, funded_client):
+    """Повтор с тем же Idempotency-Key возвращает исходный запрос без повторного списания."""
+    headers = {"Idempotency-Key": "send-key-1"}
+    payload = {"data": [get_valid_feature_data()]}
+    initial_balance = get_user_balance(funded_client)
+
+    first = funded_client.post("/api/v1/requests/send_task", json=payload, headers=headers)
+    second = funded_client.post("/api/v1/requests/send_task", json=payload, headers=headers)
+    assert first.status_code == second.status_code == status.HTTP_202_ACCEPTED
+    assert second.json()["request_id"] == first.json()["request_id"]
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert session.query(OutboxMessage).count() == 1
+    assert get_user_balance(funded_client) == initial_balance - float(TEST_MODEL_COST)
+
+
+def test_predict_idempotent_replay(funded_client, mock_rpc_client):
+    headers = {"Idempotency-Key": "predict-key-1"}
+    payload = {"data": [get_valid_feature_data()]}
+    initial_balance = get_user_balance(funded_client)
+
+    first = funded_client.post("/api/v1/requests/predict", json=payload, headers=headers)
+    second = funded_client.post("/api/v1/requests/predict", json=payload, headers=headers)
+    assert first.status_code == second.status_code == status.HTTP_200_OK
+    assert second.json() == first.json()
+    assert mock_rpc_client.call.await_count == 1
+    assert get_user_balance(funded_client) == initial_balance - float(TEST_MODEL_COST)
+
+
+def test_idempotency_key_reused_for_other_endpoint(funded_client):
+    headers = {"Idempotency-Key": "shared-key"}
+    payload = {"data": [get_valid_feature_data()]}
+    funded_client.post("/api/v1/requests/send_task", json=payload, headers=headers)
+    response = funded_client.post("/api/v1/requests/predict", json=payload, headers=headers)
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_idempotency_key_reused_with_other_payload(session, funded_client):
+    """Тот же ключ с другим телом запроса не возвращает чужой результат."""
+    headers = {"Idempotency-Key": "payload-key"}
+    first = funded_client.post(
+        "/api/v1/requests/send_task", json={"data": [get_valid_feature_data()]}, headers=headers
+    )
+    assert first.status_code == status.HTTP_202_ACCEPTED
+    response = funded_client.post(
+        "/api/v1/requests/send_task", json={"data": [get_valid_feature_data(patient_id="P-2")]}, headers=headers
+    )
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert session.query(OutboxMessage).count() == 1
+
+def test_predict_cache_hit_skips_broker(funded_client, mock_rpc_client):
+    """Повторный идентичный запрос не идёт в брокер, но оплачивается и попадает в историю."""
+    initial_balance = get_user_balance(funded_client)
+    first = create_ml_predict(funded_client, get_valid_feature_data(patient_id="P-1"))
+    second = create_ml_predict(funded_client, get_valid_feature_data(patient_id="P-2"))
+    assert second.json() == first.json()
+    assert mock_rpc_client.call.await_count == 1
+    assert get_user_balance(funded_client) == initial_balance - 2 * float(TEST_MODEL_COST)
+    assert len(funded_client.get("/api/v1/requests/history").json()) == 2
+
+
+def test_send_task_cache_hit_completes_immediately(session, funded_client):
+    create_ml_predict(funded_client, get_valid_feature_data())
+    response = create_ml_request(funded_client, get_valid_feature_data())
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.json()["status"] == "success"
+    assert session.query(OutboxMessage).count() == 0
+
+
+async def test_outbox_relay_publishes_batch(session, funded_client):
+    """Relay публикует задачи из outbox и удаляет только подтвержденные брокером."""
+    from contextlib import nullcontext
+    from unittest.mock import AsyncMock
+    from app.models import MLRequest
+    from app.services.outbox_relay import OutboxRelay
+
+    first = create_ml_request(funded_client, get_valid_feature_data(patient_id="P-1")).json()["request_id"]
+    second = create_ml_request(funded_client, get_valid_feature_data(patient_id="P-2")).json()["request_id"]
+    assert session.query(OutboxMessage).count() == 2
+
+    publisher = AsyncMock()
+    publisher.send_tasks.return_value = [None, ConnectionError("channel closed")]
+    relay = OutboxRelay(publisher, session_factory=lambda: nullcontext(session))
+
+    assert await relay.relay_once() == 1
+    tasks = publisher.send_tasks.await_args.args[0]
+    assert [task.task_id for task in tasks] == [str(first), str(second)]
+
+    session.expire_all()
+    assert session.get(MLRequest, first).is_published is True
+    assert session.get(MLRequest, second).is_published is False
+    remaining = session.query(OutboxMessage).one()
+    assert remaining.ml_request_id == second
+    assert remaining.attempts == 1
+    assert remaining.claimed_until is None
+
+
+async def test_outbox_relay_dead_letters_after_max_attempts(session, funded_client, monkeypatch):
+    """Задача, исчерпавшая попытки, не публикуется повторно, а запрос завершается с возвратом."""
+    from contextlib import nullcontext
+    from unittest.mock import AsyncMock
+    from app.config import settings
+    from app.models import MLRequest, MLRequestStatus
+    from app.services.outbox_relay import OutboxRelay
+
+    monkeypatch.setattr(settings.mq, "OUTBOX_MAX_ATTEMPTS", 2)
+    initial_balance = get_user_balance(funded_client)
+    request_id = create_ml_request(funded_client, get_valid_feature_data()).json()["request_id"]
+
+    publisher = AsyncMock()
+    publisher.send_tasks.return_value = [ValueError("poison")]
+    relay = OutboxRelay(publisher, session_factory=lambda: nullcontext(session))
+    assert await relay.relay_once() == 0
+    assert await relay.relay_once() == 0
+    assert await relay.relay_once() == 0
+    assert publisher.send_tasks.await_count == 2
+
+    session.expire_all()
+    assert session.get(MLRequest, request_id).status == MLRequestStatus.fail
+    assert session.query(OutboxMessage).one().dead_at is not None
+    assert get_user_balance(funded_client) == initial_balance
+
+
+async def test_prediction_singleflight_shares_call():
+    """Одновременные идентичные вызовы выполняют инференс один раз."""
+    import asyncio
+    from app.services.prediction_cache import PredictionCache
+
+    cache = PredictionCache(max_size=10, ttl=60)
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return ["ok"]
+
+    results = await asyncio.gather(*(cache.singleflight("key", call) for _ in range(5)))
+    assert results == [["ok"]] * 5
+    assert calls == 1
+
+
+async def test_prediction_singleflight_leader_cancel_spares_followers():
+    """Отмена ведущего вызова не отменяет ожидающих: они получают ошибку брокера и уходят в очередь."""
+    import asyncio
+    from app.services.prediction_cache import PredictionCache
+    from app.utils import MQServiceException
+
+    cache = PredictionCache(max_size=10, ttl=60)
+    started = asyncio.Event()
+
+    async def call():
+        started.set()
+        await asyncio.sleep(10)
+
+    leader = asyncio.create_task(cache.singleflight("key", call))
+    await started.wait()
+    follower = asyncio.create_task(cache.singleflight("key", call))
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    with pytest.raises(MQServiceException):
+        await follower
+    assert leader.cancelled()
+
+async def test_send_tasks_caches_exchange_and_reports_failures():
+    """Пачка публикуется параллельно, обменник запрашивается один раз на канал."""
+    from contextlib import asynccontextmanager
+    from unittest.mock import AsyncMock, MagicMock
+    from app.schemas.ml_task_schemas import MLTask
+    from app.services.mq_publisher import MLTaskPublisher
+
+    exchange = MagicMock()
+    exchange.publish = AsyncMock(side_effect=[None, ConnectionError("nack"), None])
+    channel = MagicMock()
+    channel.get_exchange = AsyncMock(return_value=exchange)
+
+    @asynccontextmanager
+    async def acquire():
+        yield channel
+
+    publisher = MLTaskPublisher(MagicMock())
+    publisher.channel_pool = MagicMock(acquire=acquire)
+    publisher._infrastructure_ready = True
+
+    tasks = [MLTask(task_id=str(i), features=[{}], model="test_model", user_id=1) for i in range(3)]
+    results = await publisher.send_tasks(tasks)
+
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], ConnectionError)
+    assert exchange.publish.await_count == 3
+    channel.get_exchange.assert_awaited_once()
+
+
+
+async def test_rpc_client_direct_reply_to_and_per_call_timeout():
+    """Вызовы распределяются по каналам, ответ приходит через direct reply-to, таймаут — у каждого вызова."""
+    import time
+    from contextlib import asynccontextmanager
+    from unittest.mock import AsyncMock, MagicMock
+    from app.services.mq_publisher import DIRECT_REPLY_TO, RPCPublisher
+    from app.utils import MQServiceException
+
+    def make_channel():
+        channel = MagicMock(is_closed=False)
+        channel.declare_queue = AsyncMock(return_value=MagicMock(consume=AsyncMock()))
+        channel.declare_queue.return_value.name = DIRECT_REPLY_TO
+        channel.default_exchange.publish = AsyncMock()
+        return channel
+
+    channels = [make_channel() for _ in range(4)]
+    connection = MagicMock()
+    connection.channel = AsyncMock(side_effect=channels)
+
+    @asynccontextmanager
+    async def acquire():
+        yield connection
+
+    rpc = RPCPublisher(MagicMock(acquire=acquire))
+
+    async def reply(message, routing_key):
+        assert message.reply_to == DIRECT_REPLY_TO
+        await rpc.on_response(MagicMock(correlation_id=message.correlation_id, body=b"ok"))
+
+    channels[0].default_exchange.publish.side_effect = reply
+    assert await rpc.call(b"[]", "rpc_queue", timeout=1) == b"ok"
+    # Сообщение не переживает дедлайн ни в очереди, ни у воркера
+    message = channels[0].default_exchange.publish.await_args.args[0]
+    assert message.expiration == 1
+    assert message.headers["x-deadline"] > time.time()
+
+    # Второй вызов уходит в другой канал, ответа нет — срабатывает таймаут этого вызова
+    with pytest.raises(MQServiceException):
+        await rpc.call(b"[]", "rpc_queue", timeout=0.05)
+    channels[1].default_exchange.publish.assert_awaited_once()
+    channels[0].declare_queue.assert_awaited_once_with(DIRECT_REPLY_TO, passive=True)
+    assert rpc.futures == {}
+
+
 # Негативные сценарии
 
 def test_send_task_insufficient_funds(auth_client):
@@ -133,11 +716,311 @@ def test_send_result_fail_refund(client, funded_client):
     balance_after_refund = get_user_balance(funded_client)
     assert balance_after_refund == initial_balance
 
+def test_predict_timeout_falls_back_to_queue(funded_client, mock_rpc_client, session):
+    """Истекший дедлайн RPC не проваливает запрос: он передается фоновому воркеру через outbox."""
+    from app.models import OutboxMessage
+    from app.utils import MQServiceException
+
+    initial_balance = get_user_balance(funded_client)
+    mock_rpc_client.call.side_effect = MQServiceException()
+    response = create_ml_predict(funded_client, get_valid_feature_data())
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    data = response.json()
+    assert data["status"] == "pending"
+    assert get_user_balance(funded_client) == initial_balance - float(TEST_MODEL_COST)
+    outbox = session.query(OutboxMessage).filter_by(ml_request_id=data["request_id"]).count()
+    assert outbox == 1
+
+
+async def test_predict_cancelled_rpc_goes_to_queue(session, funded_user, active_model, mock_rpc_client):
+    """Резерв пишет отложенную задачу в outbox; отмена вызова отпускает ее в очередь, а не бросает запрос."""
+    import asyncio
+    from app.models import MLRequest, MLRequestStatus
+    from app.services import MLRequestService
+
+    reserved = {}
+
+    async def cancelled_call(*args, **kwargs):
+        reserved["outbox"] = session.query(OutboxMessage).one()
+        assert reserved["outbox"].claimed_until is not None
+        raise asyncio.CancelledError
+
+    mock_rpc_client.call.side_effect = cancelled_call
+    with pytest.raises(asyncio.CancelledError):
+        await MLRequestService(session).execute_rpc_predict(funded_user, [get_valid_feature_data()], mock_rpc_client)
+
+    session.expire_all()
+    outbox = session.query(OutboxMessage).one()
+    assert outbox.claimed_until is None
+    assert session.get(MLRequest, outbox.ml_request_id).status == MLRequestStatus.pending
+
+
+def test_predict_deferred_when_deadline_unreachable(funded_client, mock_rpc_client):
+    """При глубокой очереди вызов сразу уходит в фоновый режим, не дожидаясь таймаута."""
+    from app.services.rpc_deadline import rpc_deadlines
+
+    rpc_deadlines.observe_queue({"messages": 10_000, "consumers": 1})
+    response = create_ml_predict(funded_client, get_valid_feature_data())
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert "request_id" in response.json()
+    mock_rpc_client.call.assert_not_called()
+
+
+def test_rpc_deadline_adapts_to_observed_latency():
+    from app.config import settings
+    from app.services.rpc_deadline import RPCDeadlineEstimator
+
+    estimator = RPCDeadlineEstimator()
+    for _ in range(50):
+        estimator.observe(100, 0.5)
+    assert estimator.row_latency == pytest.approx(0.005, rel=0.05)
+    assert estimator.deadline(100) == settings.mq.RPC_MIN_DEADLINE
+    estimator.observe_queue({"messages": 100_000, "consumers": 2})
+    assert estimator.should_defer(100)
+
+
+def observe_drain_samples(monkeypatch, samples):
+    """Замеры (время, глубина очереди, завершено с начала окна) для контроля допуска."""
+    from datetime import datetime
+    from app.services import admission
+    from app.services.admission import admission_control
+
+    since = datetime(2026, 1, 1)
+    for at, depth, completed in samples:
+        monkeypatch.setattr(admission, "monotonic", lambda: at)
+        admission_control.observe_queue({"messages": depth, "consumers": 2})
+        admission_control.observe_drain(since, completed)
+    return admission_control
+
+
+def test_send_task_shed_when_queue_misses_sla(funded_client, session, monkeypatch):
+    """Перегруженная растущая очередь: 429 с Retry-After до списания средств и записей в БД."""
+    from app.config import settings
+    from app.models import MLRequest
+
+    initial_balance = get_user_balance(funded_client)
+    # Воркеры разбирают 1 задачу в секунду, очередь выросла с 1000 до 2000
+    admission_control = observe_drain_samples(monkeypatch, [(0.0, 1000, 0), (60.0, 2000, 60)])
+    assert admission_control.drain_rate == 1.0
+    response = create_ml_request(funded_client, get_valid_feature_data())
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert int(response.headers["Retry-After"]) == 2000 - int(settings.app.QUEUE_SLA_SECONDS)
+    assert get_user_balance(funded_client) == initial_balance
+    assert session.query(MLRequest).count() == 0
+
+
+def test_send_task_admitted_after_quiet_period_or_shrinking_queue(funded_client, monkeypatch):
+    """
+    Оценка идет по пропускной способности, а не по недавнему спросу: после простоя (пустая очередь)
+    первый всплеск принимается, и очередь, которая сокращается, тоже не приводит к отказам.
+    """
+    from app.services.admission import admission_control
+
+    observe_drain_samples(monkeypatch, [(0.0, 0, 40), (60.0, 0, 40), (120.0, 7, 40)])
+    assert admission_control.drain_rate == 0.0
+    assert create_ml_request(funded_client, get_valid_feature_data()).status_code == status.HTTP_202_ACCEPTED
+
+    admission_control.reset()
+    observe_drain_samples(monkeypatch, [(0.0, 3000, 0), (60.0, 2000, 60)])
+    assert admission_control.expected_wait() > 900
+    assert create_ml_request(funded_client, get_valid_feature_data()).status_code == status.HTTP_202_ACCEPTED
+
+
+def test_send_task_per_user_pending_limit(funded_client, monkeypatch):
+    from app.config import settings
+    monkeypatch.setattr(settings.app, "MAX_PENDING_PER_USER", 1)
+
+    assert create_ml_request(funded_client, get_valid_feature_data()).status_code == status.HTTP_202_ACCEPTED
+    response = create_ml_request(funded_client, get_valid_feature_data())
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert response.headers["Retry-After"] == str(settings.app.ADMISSION_RETRY_AFTER)
+
+
+def test_drain_rate_counts_only_queue_completions(session, client, funded_client, monkeypatch):
+    """RPC-ответы обслуживают отдельные воркеры и не ускоряют оценку разбора очереди задач."""
+    from contextlib import nullcontext
+    from app.services import admission
+    from app.services.admission import admission_control
+    from app.services.health_service import HealthCollector
+
+    collector = HealthCollector(session_factory=lambda: nullcontext(session))
+    request_id = create_ml_request(funded_client, get_valid_feature_data()).json()["request_id"]
+    admission_control.observe_queue({"messages": 1, "consumers": 1})
+    monkeypatch.setattr(admission, "monotonic", lambda: 0.0)
+    collector._sample_drain()
+    client.post("/api/v1/requests/post_result", json={
+        "task_id": str(request_id), "status": "success", "prediction": "ok", "worker_id": "w-1"
+    })
+    for patient in ("P-2", "P-3"):
+        assert create_ml_predict(funded_client, get_valid_feature_data(patient_id=patient)).status_code == 200
+
+    monkeypatch.setattr(admission, "monotonic", lambda: 10.0)
+    collector._sample_drain()
+    stats = funded_client.get("/api/v1/requests/stats").json()
+    assert (stats["succeeded"], stats["queue_completed"]) == (3, 1)
+    # За 10 секунд с непустой очередью учтено только одно завершение из очереди
+    assert admission_control.drain_rate == pytest.approx(0.1)
+
+
+def test_ingest_admitted_once_against_pending_limit(funded_client, monkeypatch):
+    """Загрузка допускается целиком: ее собственные части не упираются в лимит незавершенных запросов."""
+    pytest.importorskip("pandas")
+    from app.config import settings
+    monkeypatch.setattr(settings.app, "INGEST_CHUNK_ROWS", 2)
+    monkeypatch.setattr(settings.app, "MAX_PENDING_PER_USER", 2)
+
+    rows = "".join(f"P-{i},30\n" for i in range(6))
+    job = funded_client.post(
+        "/api/v1/requests/ingest", params={"format": "csv"}, content=("patient_id,age\n" + rows).encode()
+    ).json()
+    assert (job["rows_accepted"], job["rows_rejected"], job["requests_created"]) == (6, 0, 3)
+
+
+def test_pending_limit_counts_ingest_job_once(session, test_user, active_model):
+    """Незавершенные части одной загрузки считаются в лимите пользователя одним запросом."""
+    from app.crud import ingest as ingest_crud
+    from app.crud import ml as ml_crud
+    from app.models import MLRequest, MLRequestStatus
+
+    job = ingest_crud.create_job(session, test_user.id, "patients.csv", "csv")
+    for ingest_job_id in (job.id, job.id, job.id, None):
+        session.add(MLRequest(
+            user_id=test_user.id, model_id=active_model.id, input_data=[], status=MLRequestStatus.pending,
+            cost=active_model.cost, ingest_job_id=ingest_job_id,
+        ))
+    session.flush()
+    assert ml_crud.count_pending_requests(session, test_user.id) == 2
+
+
+def test_predict_worker_error_refund(funded_client, mock_rpc_client):
+    """Ответ воркера с ошибкой не считается предсказанием и возвращает средства."""
+    initial_balance = get_user_balance(funded_client)
+    mock_rpc_client.call.return_value = b'{"error": "bad input"}'
+    response = create_ml_predict(funded_client, get_valid_feature_data())
+    assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+    assert get_user_balance(funded_client) == initial_balance
+
+INGEST_CSV = (
+    "id;age;Клозапин;1/17;CYP2D6 1/3\n"
+    "P-1;35,5;да;0;\n"
+    "P-2;;нет;1;0\n"
+    "P-3;200;0;0;0\n"
+    "P-4;40;может быть;1;1\n"
+    "P-5;18;1;нет;0\n"
+)
+
+
+def test_ingest_csv_queues_chunks_and_reports_rejects(session, funded_client, monkeypatch):
+    """Файл разбирается частями: по части — ML-запрос с задачей в outbox, ошибочные строки — в файл отклоненных."""
+    pytest.importorskip("pandas")
+    from app.config import settings
+    from app.models import MLRequest
+    monkeypatch.setattr(settings.app, "INGEST_CHUNK_ROWS", 2)
+
+    initial_balance = get_user_balance(funded_client)
+    response = funded_client.post(
+        "/api/v1/requests/ingest",
+        params={"filename": "patients.csv"},
+        content=INGEST_CSV.encode("utf-8-sig"),
+    )
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    job = response.json()
+    assert job["status"] == "completed"
+    assert (job["rows_total"], job["rows_accepted"], job["rows_rejected"]) == (5, 2, 3)
+    # Части [P-1, P-2], [P-3, P-4], [P-5]: во второй части нет ни одной корректной строки
+    assert job["requests_created"] == 2
+    assert get_user_balance(funded_client) == initial_balance - 2 * float(TEST_MODEL_COST)
+
+    requests = session.query(MLRequest).filter(MLRequest.ingest_job_id == job["id"]).order_by(MLRequest.id).all()
+    assert [row.input_data[0]["№ Пациента"] for row in requests] == ["P-1", "P-5"]
+    assert requests[0].input_data[0]["Возраст"] == 35.5
+    assert requests[0].input_data[0]["Клозапин"] == 1
+    assert requests[0].input_data[0]["CYP2D6 1/3"] == 0
+    assert session.query(OutboxMessage).count() == 2
+
+    rejects = funded_client.get(f"/api/v1/requests/ingest/{job['id']}/rejects")
+    assert rejects.status_code == status.HTTP_200_OK
+    assert "attachment" in rejects.headers["content-disposition"]
+    lines = rejects.text.strip().splitlines()
+    assert lines[0].startswith("row,errors,")
+    assert [line.split(",", 1)[0] for line in lines[1:]] == ["2", "3", "4"]
+    assert "Клозапин" in lines[3]
+
+    assert funded_client.get(f"/api/v1/requests/ingest/{job['id']}").json()["rows_rejected"] == 3
+
+    results = funded_client.get(f"/api/v1/requests/ingest/{job['id']}/results", params={"columns": "№ Пациента,status"})
+    assert results.text.splitlines() == ["№ Пациента,status", "P-1,pending", "P-5,pending"]
+
+
+def test_ingest_rejects_rows_when_funds_run_out(funded_client, monkeypatch):
+    """Когда средств не хватает на очередную часть, оставшиеся строки попадают в отклоненные без списания."""
+    pytest.importorskip("pandas")
+    from app.config import settings
+    monkeypatch.setattr(settings.app, "INGEST_CHUNK_ROWS", 4)
+
+    rows = "".join(f"P-{i},30\n" for i in range(12))
+    response = funded_client.post(
+        "/api/v1/requests/ingest",
+        params={"format": "csv"},
+        content=("patient_id,age\n" + rows).encode(),
+    )
+    job = response.json()
+    # Баланса хватает на 10 строк: две части по 4 строки оплачены, третья отклонена целиком
+    assert (job["rows_accepted"], job["rows_rejected"], job["requests_created"]) == (8, 4, 2)
+    assert get_user_balance(funded_client) == DEFAULT_REPLENISH_AMOUNT - 8 * float(TEST_MODEL_COST)
+    rejects = funded_client.get(f"/api/v1/requests/ingest/{job['id']}/rejects").text
+    assert rejects.count("Недостаточно средств") == 4
+
+
+def test_ingest_unsupported_format(funded_client):
+    response = funded_client.post(
+        "/api/v1/requests/ingest", params={"filename": "patients.txt"}, content=b"age\n30\n"
+    )
+    assert response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+
+def test_ingest_file_too_large(funded_client, monkeypatch):
+    from app.config import settings
+    monkeypatch.setattr(settings.app, "INGEST_MAX_BYTES", 8)
+
+    response = funded_client.post("/api/v1/requests/ingest", params={"format": "csv"}, content=b"age\n30\n31\n32\n")
+    assert response.status_code == status.HTTP_413_CONTENT_TOO_LARGE
+
+
+def test_ingest_rejects_streamed_from_table(session, auth_client, test_user):
+    """Отклоненные строки читаются из ingest_reject в порядке строк файла, без сборки CSV в памяти."""
+    from app.crud import ingest as ingest_crud
+    from common.feature_columns import AGE_COLUMN, REQUIRED_ALIAS_ORDER
+
+    job = ingest_crud.create_job(session, test_user.id, "patients.csv", "csv")
+    empty = auth_client.get(f"/api/v1/requests/ingest/{job.id}/rejects")
+    assert empty.text.splitlines() == [",".join(["row", "errors", *REQUIRED_ALIAS_ORDER])]
+
+    features = dict.fromkeys(REQUIRED_ALIAS_ORDER, "")
+    ingest_crud.add_rejects(session, [
+        {"ingest_job_id": job.id, "row_number": row, "errors": f"{AGE_COLUMN}: ожидается число",
+         "features": {**features, AGE_COLUMN: f"x{row}"}}
+        for row in (7, 2)
+    ])
+    lines = auth_client.get(f"/api/v1/requests/ingest/{job.id}/rejects").text.splitlines()
+    assert [line.split(",", 1)[0] for line in lines[1:]] == ["2", "7"]
+    assert "x2" in lines[1]
+
+
+def test_ingest_job_not_found(auth_client):
+    response = auth_client.get("/api/v1/requests/ingest/999")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
 @pytest.mark.parametrize("method,url,json_data", [
     ("POST", "/api/v1/requests/send_task", {"data": []}),
     ("POST", "/api/v1/requests/predict", {"data": []}),
     ("GET", "/api/v1/requests/history", None),
+    ("GET", "/api/v1/requests/history/export", None),
     ("GET", "/api/v1/requests/history/1", None),
+    ("GET", "/api/v1/requests/history/1/results", None),
+    ("GET", "/api/v1/requests/events", None),
+    ("POST", "/api/v1/requests/ingest", None),
+    ("GET", "/api/v1/requests/ingest/1", None),
 ])
 def test_ml_endpoints_unauthorized(client, method, url, json_data):
     """Проверка всех ML эндпоинтов без авторизации (401)."""
@@ -150,3 +1033,19 @@ def test_ml_endpoints_unauthorized(client, method, url, json_data):
 
 
 
+
+
+def test_model_cache_invalidated_after_commit(session, active_model):
+    from app.services.model_cache import active_model_cache
+
+    active_model_cache.invalidate()
+    try:
+        assert active_model_cache.get_active(session).version == "1.0.0"
+        active_model.version = "2.0.0"
+        session.flush()
+        # До коммита изменение не видно другим транзакциям, кеш не сбрасывается
+        assert active_model_cache.get_active(session).version == "1.0.0"
+        session.commit()
+        assert active_model_cache.get_active(session).version == "2.0.0"
+    finally:
+        active_model_cache.invalidate()
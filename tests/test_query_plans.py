@@ -0,0 +1,192 @@
+"""
+Регрессионные тесты планов горячих запросов: crud-запросы выполняются на наполненной базе,
+перехваченный SQL прогоняется через EXPLAIN, и тест падает, если большая таблица читается
+полным проходом или сортирует результат вместо чтения индекса по порядку. В тестах вместо PostgreSQL используется SQLite (EXPLAIN QUERY PLAN).
+"""
+import re
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Iterator, List, Tuple
+
+import pytest
+from sqlalchemy import event, insert, select, text
+
+from app.crud import billing as billing_crud
+from app.crud import ml as ml_crud
+from app.models import MLRequest, MLRequestStatus, Transaction, TransactionStatus, TransactionType, User, UserRole
+
+# Таблицы больше порога не должны читаться полным проходом
+SEQ_SCAN_ROW_THRESHOLD = 1000
+USERS = 20
+REQUESTS_PER_USER = 100
+
+
+@pytest.fixture
+def seeded(session, active_model):
+    """Наполняет ml_request и transaction (USERS * REQUESTS_PER_USER строк) и собирает статистику."""
+    now = datetime.now(timezone.utc)
+    session.execute(insert(User), [
+        {
+            "email": f"plan_{i}@example.com",
+            "hashed_password": "x",
+            "first_name": "Plan",
+            "last_name": "User",
+            "phone_number": f"+7000000{i:04d}",
+            "balance": Decimal("0"),
+            "role": UserRole.user,
+        }
+        for i in range(USERS)
+    ])
+    user_ids = session.execute(select(User.id).where(User.email.like("plan_%"))).scalars().all()
+    session.execute(insert(MLRequest), [
+        {
+            "user_id": user_id,
+            "model_id": active_model.id,
+            "cost": Decimal("1"),
+            "input_data": [],
+            "status": MLRequestStatus.pending if i % 20 == 0 else MLRequestStatus.success,
+            "created_at": now - timedelta(minutes=i),
+        }
+        for user_id in user_ids
+        for i in range(REQUESTS_PER_USER)
+    ])
+    request_ids = session.execute(select(MLRequest.id, MLRequest.user_id)).all()
+    session.execute(insert(Transaction), [
+        {
+            "user_id": user_id,
+            "amount": Decimal("1"),
+            "type": TransactionType.payment,
+            "status": TransactionStatus.approved,
+            "ml_request_id": request_id,
+            "created_at": now,
+        }
+        for request_id, user_id in request_ids
+    ])
+    session.execute(text("ANALYZE"))
+    return user_ids
+
+
+@contextmanager
+def captured_statements(session) -> Iterator[List[Tuple[str, tuple]]]:
+    statements: List[Tuple[str, tuple]] = []
+    connection = session.connection()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(connection, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(connection, "before_cursor_execute", before_cursor_execute)
+
+
+def plan_violations(session, statements: List[Tuple[str, tuple]]) -> List[str]:
+    """
+    Шаги планов, читающие полным проходом таблицы больше SEQ_SCAN_ROW_THRESHOLD строк,
+    и отдельные сортировки для ORDER BY.
+    """
+    connection = session.connection()
+    found = []
+    for statement, parameters in statements:
+        # В плане таблицы называются псевдонимами из запроса (ml_model AS ml_model_1)
+        aliases = dict((alias, table) for table, alias in re.findall(r'"?(\w+)"? AS (\w+)', statement))
+        plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+        for row in plan:
+            detail = row[-1]
+            if detail.startswith("USE TEMP B-TREE FOR ORDER BY"):
+                found.append(f"{detail}: {statement}")
+                continue
+            if not detail.startswith("SCAN "):
+                continue
+            table = aliases.get(detail.split()[1], detail.split()[1])
+            rows = connection.exec_driver_sql(f'SELECT count(*) FROM "{table}"').scalar()
+            if rows > SEQ_SCAN_ROW_THRESHOLD:
+                found.append(f"{detail} ({rows} строк): {statement}")
+    return found
+
+
+def test_history_uses_index(session, seeded):
+    with captured_statements(session) as statements:
+        history = ml_crud.get_history(session, seeded[0])
+    assert len(history) == REQUESTS_PER_USER
+    assert plan_violations(session, statements) == []
+
+
+def test_pending_count_uses_index(session, seeded):
+    with captured_statements(session) as statements:
+        assert ml_crud.count_pending_requests(session, seeded[0]) == REQUESTS_PER_USER // 20
+    assert plan_violations(session, statements) == []
+
+
+def test_transactions_lookups_use_index(session, seeded):
+    request_id = session.execute(select(MLRequest.id).where(MLRequest.user_id == seeded[0])).scalars().first()
+    with captured_statements(session) as statements:
+        assert len(billing_crud.get_by_user_id(session, seeded[0])) == REQUESTS_PER_USER
+        session.execute(select(Transaction).where(Transaction.ml_request_id == request_id)).scalars().one()
+    assert plan_violations(session, statements) == []
+
+
+def test_full_scan_is_detected(session, seeded):
+    """Проверка самого детектора: фильтр без индекса дает полный проход."""
+    with captured_statements(session) as statements:
+        session.execute(select(MLRequest.id).where(MLRequest.cost > 0)).all()
+    assert len(plan_violations(session, statements)) == 1
+
+
+def test_migrations_are_recorded_and_idempotent(engine):
+    from app.database.migrations import MIGRATIONS, applied_versions, apply_migrations
+
+    apply_migrations(engine)
+    assert set(applied_versions(engine)) == {m.version for m in MIGRATIONS}
+    assert apply_migrations(engine) == []
+
+
+def test_index_migration_upgrades_old_schema():
+    """0001 на таблицах старой схемы: новые индексы создаются, старые удаляются, индекс без условия пересоздается."""
+    from sqlalchemy import create_engine, inspect
+
+    from app.database.migrations import MIGRATIONS, apply_migrations
+
+    old = create_engine("sqlite://")
+    with old.begin() as connection:
+        connection.execute(text("CREATE TABLE ml_request (id INTEGER PRIMARY KEY, user_id INTEGER, status VARCHAR, created_at TIMESTAMP)"))
+        connection.execute(text("CREATE INDEX ix_ml_request_user_id ON ml_request (user_id)"))
+        connection.execute(text('CREATE TABLE "transaction" (id INTEGER PRIMARY KEY, user_id INTEGER, ml_request_id INTEGER, created_at TIMESTAMP)'))
+        connection.execute(text('CREATE INDEX ix_transaction_user_id ON "transaction" (user_id)'))
+        connection.execute(text('CREATE INDEX ix_transaction_ml_request_id ON "transaction" (ml_request_id)'))
+
+    assert apply_migrations(old, MIGRATIONS[:1]) == [1]
+    indexes = {
+        table: {index["name"] for index in inspect(old).get_indexes(table)} for table in ("ml_request", "transaction")
+    }
+    assert indexes == {
+        "ml_request": {"ix_ml_request_user_id_created_at", "ix_ml_request_pending_user_id"},
+        "transaction": {"ix_transaction_user_id_created_at", "ix_transaction_ml_request_id"},
+    }
+    with old.connect() as connection:
+        definition = connection.execute(
+            text("SELECT sql FROM sqlite_master WHERE name = 'ix_transaction_ml_request_id'")
+        ).scalar()
+    assert "WHERE ml_request_id IS NOT NULL" in definition
+
+
+def test_index_migration_keeps_current_indexes(engine):
+    """На схеме последней версии 0001 не пересоздает индексы."""
+    from app.database.migrations import MIGRATIONS
+
+    statements: List[str] = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        with engine.connect() as connection:
+            for statement in MIGRATIONS[0].statements:
+                statement(connection)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    assert not [s for s in statements if s.startswith(("CREATE INDEX", "DROP INDEX IF EXISTS ix_transaction_ml"))]
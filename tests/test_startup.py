@@ -0,0 +1,29 @@
+import subprocess
+import sys
+
+from common.import_report import by_package, parse_importtime, total_us
+
+IMPORTTIME_OUTPUT = """\
+import time: self [us] | cumulative | imported package
+import time:       100 |        100 |   _io
+import time:       200 |        900 | app.main
+import time:       300 |        300 |   fastapi.routing
+import time:       400 |        400 |   app.routes
+other stderr line
+"""
+
+
+def test_import_report_parsing():
+    timings = parse_importtime(IMPORTTIME_OUTPUT)
+    assert [t.module for t in timings] == ["_io", "app.main", "fastapi.routing", "app.routes"]
+    assert timings[0].depth == 1 and timings[1].depth == 0
+    assert total_us(timings) == 900
+    assert by_package(timings) == {"_io": 100, "app": 600, "fastapi": 300}
+
+
+def test_heavy_dependencies_are_not_imported_at_startup():
+    """python-jose загружается при первой работе с токенами, а не при импорте приложения."""
+    code = "import sys, app.main; print(','.join(m for m in ('jose', 'pandas', 'pyarrow') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ""
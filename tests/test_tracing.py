@@ -0,0 +1,174 @@
+import json
+
+import pytest
+
+from common import tracing
+from common.tracing import (
+    FileExporter,
+    MemoryExporter,
+    SpanContext,
+    Tracer,
+    from_otlp,
+    load_spans,
+    parse_traceparent,
+    render_trace,
+    to_otlp,
+)
+
+REMOTE = SpanContext("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7")
+
+
+@pytest.fixture
+def exported(monkeypatch, engine):
+    """Подменяет трассировщик процесса на запись в память; спаны доступны после вызова flush()."""
+    from app.utils import instrument_engine
+
+    exporter = MemoryExporter()
+    tracer = Tracer("test", exporter)
+    monkeypatch.setattr(tracing, "_tracer", tracer)
+    instrument_engine(engine)
+
+    def flush():
+        tracer.shutdown()
+        return exporter.spans
+
+    yield flush
+    tracer.shutdown()
+
+
+def test_traceparent_roundtrip():
+    assert parse_traceparent(REMOTE.traceparent) == REMOTE
+    assert parse_traceparent(b"00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-00").sampled is False
+    for invalid in (None, "", "garbage", "00-" + "0" * 32 + "-00f067aa0ba902b7-01", "00-xyz-00f067aa0ba902b7-01"):
+        assert parse_traceparent(invalid) is None
+
+
+def test_spans_nest_and_inherit_sampling():
+    exporter = MemoryExporter()
+    tracer = Tracer("svc", exporter, sample_ratio=0.0)
+
+    with tracer.span("root") as root:
+        with tracer.span("child"):
+            pass
+    # Корень не попал в выборку: контекст создан, но ничего не записано
+    assert root.context.sampled is False
+
+    with pytest.raises(ValueError):
+        with tracer.span("remote", parent=REMOTE) as remote:
+            with tracer.span("inner") as inner:
+                raise ValueError("boom")
+    tracer.shutdown()
+
+    by_name = {span["name"]: span for span in exporter.spans}
+    assert set(by_name) == {"remote", "inner"}
+    assert remote.context.trace_id == inner.context.trace_id == REMOTE.trace_id
+    assert by_name["remote"]["parent_id"] == REMOTE.span_id
+    assert by_name["inner"]["parent_id"] == remote.context.span_id
+    assert by_name["inner"]["error"] == "ValueError: boom"
+
+
+def test_file_exporter_otlp_roundtrip_and_render(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    tracer = Tracer("api", FileExporter(str(path)))
+    with tracer.span("GET /history", kind=tracing.SERVER, attributes={"http.status_code": 200}):
+        with tracer.span("SQL SELECT", kind=tracing.CLIENT):
+            pass
+    tracer.shutdown()
+
+    spans = load_spans(str(path))
+    assert [span["name"] for span in spans] == ["SQL SELECT", "GET /history"]
+    payload = json.loads(json.dumps(to_otlp(spans)))
+    assert from_otlp(payload) == spans
+
+    rendered = render_trace(spans).splitlines()
+    assert rendered[1].endswith("GET /history [api]")
+    assert rendered[2].endswith("  SQL SELECT [api]")
+
+
+def test_otlp_exporter_to_local_collector(tmp_path):
+    import threading
+    from http.server import ThreadingHTTPServer
+
+    out = tmp_path / "collected.jsonl"
+    server = ThreadingHTTPServer(("127.0.0.1", 0), tracing._collector_handler(str(out)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        tracer = Tracer("worker", tracing.create_exporter(f"otlp:http://127.0.0.1:{server.server_port}"))
+        with tracer.span("ml.inference", parent=REMOTE, attributes={"ml.rows": 3}):
+            pass
+        tracer.shutdown()
+    finally:
+        server.shutdown()
+
+    (span,) = load_spans(str(out))
+    assert span["service"] == "worker" and span["parent_id"] == REMOTE.span_id
+    assert span["attributes"] == {"ml.rows": 3}
+
+
+def test_create_exporter_rejects_unknown_scheme():
+    assert tracing.create_exporter("") is None
+    assert isinstance(tracing.create_exporter("otlp:http://collector:4318"), tracing.OTLPHttpExporter)
+    with pytest.raises(ValueError):
+        tracing.create_exporter("jaeger:localhost")
+
+
+def test_http_request_span_with_db_queries(auth_client, exported):
+    response = auth_client.get("/api/v1/requests/history", headers={"traceparent": REMOTE.traceparent})
+    assert response.status_code == 200
+    assert response.headers["X-Trace-Id"] == REMOTE.trace_id
+
+    spans = exported()
+    server = next(span for span in spans if span["kind"] == tracing.SERVER)
+    assert server["name"] == "GET /api/v1/requests/history"
+    assert server["parent_id"] == REMOTE.span_id
+    assert server["attributes"]["http.status_code"] == 200
+    queries = [span for span in spans if span["name"].startswith("SQL ")]
+    assert queries and all(span["trace_id"] == REMOTE.trace_id for span in queries)
+    assert all(span["attributes"]["db.system"] == "sqlite" for span in queries)
+
+
+async def test_task_message_carries_request_trace(exported):
+    from app.config import settings
+    from app.schemas.ml_task_schemas import MLTask
+    from app.services.mq_publisher import MLTaskPublisher, create_connection_pool
+    from loadtest.broker import InMemoryBroker
+
+    broker = InMemoryBroker()
+    with broker.installed():
+        publisher = MLTaskPublisher(create_connection_pool())
+        task = MLTask(task_id="7", features={}, model="m", user_id=1, trace_context=REMOTE.traceparent)
+        assert await publisher.send_tasks([task]) == [None]
+        message = broker.queues[settings.mq.QUEUE_NAME].messages.get_nowait()
+        await publisher.close()
+
+    assert "trace_context" not in json.loads(message.body)
+    assert message.headers["user_id"] == 1
+    context = parse_traceparent(message.headers["traceparent"])
+    (publish,) = exported()
+    assert publish["name"] == f"publish {settings.mq.QUEUE_NAME}"
+    assert publish["parent_id"] == REMOTE.span_id
+    assert context == SpanContext(REMOTE.trace_id, publish["span_id"])
+
+
+async def test_results_batch_spans_join_task_traces(exported, monkeypatch):
+    from app.services.mq_consumer import ResultsConsumer
+
+    class Message:
+        def __init__(self, task_id, headers):
+            self.body = json.dumps({"task_id": task_id, "worker_id": "w", "status": "success"}).encode()
+            self.headers = headers
+            self.acked = False
+
+        async def ack(self, multiple=False):
+            self.acked = True
+
+    monkeypatch.setattr(ResultsConsumer, "_apply", staticmethod(lambda results: len(results)))
+    messages = [Message("1", {"traceparent": REMOTE.traceparent}), Message("2", {})]
+    await ResultsConsumer()._process_batch(messages)
+
+    spans = exported()
+    batch = next(span for span in spans if span["name"] == "results.batch")
+    saves = {span["attributes"]["messaging.message.id"]: span for span in spans if span["name"] == "results.save"}
+    assert saves["1"]["trace_id"] == REMOTE.trace_id and saves["1"]["parent_id"] == REMOTE.span_id
+    assert saves["2"]["parent_id"] is None
+    assert {span["attributes"]["results.batch_trace_id"] for span in saves.values()} == {batch["trace_id"]}
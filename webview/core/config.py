@@ -5,13 +5,14 @@ from decimal import Decimal
 DEFAULT_API = os.getenv("API_BASE_URL", "http://localhost")
 API_TIMEOUT = int(os.getenv("API_TIMEOUT", "30"))  # seconds
 API_HEALTH_TIMEOUT = int(os.getenv("API_HEALTH_TIMEOUT", "5"))  # seconds
+# Ожидание /predict: дедлайн RPC ограничен на сервере (MQ__RPC_MAX_DEADLINE), плюс запас на резервирование
+API_PREDICT_TIMEOUT = int(os.getenv("API_PREDICT_TIMEOUT", "45"))  # seconds
 
 # Cost Configuration
 EXPECTED_REQUEST_COST = Decimal("10.0")
 
 # Validation Configuration
-MAX_AGE = 150
-MIN_AGE = 0
+from common.feature_columns import MAX_AGE, MIN_AGE  # noqa: E402
 
 # Mapping для русских названий полей
 ALIAS_MAP = {
@@ -25,28 +26,8 @@ ALIAS_MAP = {
     "cyp2d6_1_3": "CYP2D6 1/3",
 }
 
-# Синонимы для умного поиска колонок (в нижнем регистре)
-SYNONYMS_MAP = {
-    "№ Пациента": ["patient_id", "№пациента", "№ Пациента", "номер пациента", "id пациента", "patient", "id"],
-    "Возраст": ["age", "возраст", "лет", "age_years", "пациент_возраст"],
-    "ВНН/ПП": ["vnn_pp", "внн", "пп", "vnn/pp", "vnn", "pp"],
-    "Клозапин": ["clozapine", "клозапин", "clozapin"],
-    "CYP2C19 1/2": ["cyp2c19_1_2", "cyp2c19 1/2", "2c19 1/2", "1/2", "cyp2c19 *1/*2", "*1/*2"],
-    "CYP2C19 1/17": ["cyp2c19_1_17", "cyp2c19 1/17", "2c19 1/17", "1/17", "cyp2c19 *1/*17", "*1/*17"],
-    "CYP2C19 *17/*17": ["cyp2c19_17_17", "cyp2c19 *17/*17", "cyp2c19 17/17", "17/17"],
-    "CYP2D6 1/3": ["cyp2d6_1_3", "cyp2d6 1/3", "2d6 1/3", "1/3", "cyp2d6 *1/*3", "*1/*3"],
-}
-
-REQUIRED_ALIAS_ORDER = [
-    "№ Пациента",
-    "Возраст",
-    "ВНН/ПП",
-    "Клозапин",
-    "CYP2C19 1/2",
-    "CYP2C19 1/17",
-    "CYP2C19 *17/*17",
-    "CYP2D6 1/3",
-]
+# Синонимы колонок и порядок признаков общие с API (загрузка файлов на сервер)
+from common.feature_columns import REQUIRED_ALIAS_ORDER, SYNONYMS_MAP  # noqa: E402
 
 # UI Configuration
 ICONS = {
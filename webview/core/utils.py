@@ -5,6 +5,7 @@ import re
 from typing import Dict, Any, List, Tuple
 import pandas as pd
 import streamlit as st
+from common.feature_columns import NEGATIVE_STATUSES, POSITIVE_STATUSES
 from webview.core.config import ALIAS_MAP, REQUIRED_ALIAS_ORDER, STATUS_MAP, SYNONYMS_MAP, MAX_AGE, MIN_AGE
 
 
@@ -71,10 +72,10 @@ def coerce_number(val) -> Tuple[bool, float | int | None]:
             return False, None
 
         # Положительные статусы
-        if s in ("есть", "выявлен", "да", "присутствует", "принимает", "1", "1.0", "true", "yes"):
+        if s in POSITIVE_STATUSES:
             return True, 1
         # Отрицательные статусы
-        if s in ("нет", "не выявлен", "отсутствует", "не принимает", "0", "0.0", "false", "no"):
+        if s in NEGATIVE_STATUSES:
             return True, 0
 
         try:
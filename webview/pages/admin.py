@@ -217,6 +217,13 @@ def render_admin(api):
     with admin_tabs[1]:
         st.markdown("#### Все предсказания в системе")
         try:
+            summary = api.get_analytics_summary()
+            cols = st.columns(4)
+            cols[0].metric("Запросов", summary["requests"])
+            cols[1].metric("Строк обработано", summary["rows_scored"])
+            cols[2].metric("Выручка", f"{float(summary['revenue']) - float(summary['refunds']):.2f}")
+            cols[3].metric("Доля ошибок", f"{summary['failure_rate'] * 100:.1f}%")
+
             with st.spinner("Загрузка всех ML-запросов..."):
                 all_reqs = api.get_all_ml_requests()
             if all_reqs:
@@ -48,6 +48,25 @@ def render_history(api):
                     use_container_width=True,
                     columns_auto_size_mode=ColumnsAutoSizeMode.FIT_ALL_COLUMNS_TO_VIEW
                 )
+
+                # Результаты формирует сервер потоково, без пересборки таблицы в браузере
+                c_rid, c_fmt, c_btn = st.columns([2, 1, 1])
+                with c_rid:
+                    rid = st.selectbox("Запрос", [r["id"] for r in requests if r.get("status") != "pending"], key="results_rid")
+                with c_fmt:
+                    fmt = st.selectbox("Формат", ["csv", "parquet"], key="results_fmt")
+                with c_btn:
+                    if rid is not None and st.button("📥 Подготовить файл", key="results_fetch"):
+                        st.session_state.results_file = (rid, fmt, api.download_results(rid, fmt))
+                if st.session_state.get("results_file"):
+                    f_rid, f_fmt, content = st.session_state.results_file
+                    st.download_button(
+                        f"💾 Скачать результаты запроса №{f_rid}",
+                        data=content,
+                        file_name=f"request_{f_rid}_results.{f_fmt}",
+                        mime="text/csv" if f_fmt == "csv" else "application/vnd.apache.parquet",
+                        key="results_download"
+                    )
             else:
                 st.info("История пуста")
         except Exception as e:
@@ -80,7 +80,12 @@ def render_ml_requests(api):
                         st.success(f"✅ {len(to_send)} строк успешно отправлены в очередь на обработку!")
                     else:
                         result = api.predict(to_send)
-                        st.success(f"⚡ Обработка {len(to_send)} строк завершена успешно!")
+                        if "prediction" in result:
+                            st.success(f"⚡ Обработка {len(to_send)} строк завершена успешно!")
+                        else:
+                            # Сервер не успевал ответить в срок и передал запрос в очередь
+                            st.session_state.last_bg_task_id = result.get("request_id")
+                            st.info(f"⏱️ {len(to_send)} строк переданы в очередь: результат появится в истории")
 
                 st.session_state.last_result = result
                 st.session_state.last_input = to_send
@@ -185,6 +190,29 @@ def render_ml_requests(api):
                 st.success(f"{ICONS['success']} Загружено записей: {len(batch)} из {file_count} файл(ов)")
             except Exception as e:
                 st.error(f"{ICONS['error']} Ошибка: {e}")
+
+            # Крупные таблицы разбираются и ставятся в очередь частями на сервере
+            server_files = [f for f in file if f.name.lower().endswith((".csv", ".xlsx", ".parquet"))]
+            if server_files and st.button("📤 Обработать файл(ы) на сервере", key="ingest_upload"):
+                for f in server_files:
+                    try:
+                        job = api.ingest_file(f.getvalue(), f.name)
+                        st.success(
+                            f"{f.name}: принято строк {job['rows_accepted']} из {job['rows_total']}, "
+                            f"создано запросов {job['requests_created']}"
+                        )
+                        if job.get("error"):
+                            st.warning(f"{f.name}: обработка прервана: {job['error']}")
+                        if job["rows_rejected"]:
+                            st.download_button(
+                                label=f"📥 Отклоненные строки ({job['rows_rejected']})",
+                                data=api.get_ingest_rejects(job["id"]),
+                                file_name=f"{f.name}.rejects.csv",
+                                mime="text/csv",
+                                key=f"ingest_rejects_{job['id']}"
+                            )
+                    except Exception as e:
+                        handle_api_error(e)
     elif mode == "📋 Вставка из буфера":
         paste_text = st.text_area(
             "Вставьте данные из Excel или Google Таблиц",
@@ -391,7 +419,12 @@ def render_ml_requests(api):
                         st.success(f"✅ {len(to_send)} строк успешно отправлены в очередь на обработку!")
                     else:
                         result = api.predict(to_send)
-                        st.success(f"⚡ Обработка {len(to_send)} строк завершена успешно!")
+                        if "prediction" in result:
+                            st.success(f"⚡ Обработка {len(to_send)} строк завершена успешно!")
+                        else:
+                            # Сервер не успевал ответить в срок и передал запрос в очередь
+                            st.session_state.last_bg_task_id = result.get("request_id")
+                            st.info(f"⏱️ {len(to_send)} строк переданы в очередь: результат появится в истории")
 
                     st.session_state.last_result = result
                     st.session_state.last_input = to_send
@@ -510,9 +543,8 @@ def render_task_monitoring(api):
                 if st.button("🔄 Обновить сейчас", key="manual_refresh_task"):
                     st.rerun()
 
-                # Автоматическое обновление
-                import time
-                time.sleep(5)
+                # Ждём push-события о завершении вместо периодического опроса
+                api.wait_for_task_event(rid)
                 st.rerun()
 
         except Exception as e:
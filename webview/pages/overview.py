@@ -6,6 +6,18 @@ from webview.services.state import handle_api_error
 
 def render_overview(api):
     try:
+        # Сводка по запросам (считается на сервере, не зависит от длины истории)
+        stats = api.get_request_stats()
+        cols = st.columns(4)
+        with cols[0]:
+            metric_card("Запросов", str(stats["requests"]), icon="📨")
+        with cols[1]:
+            metric_card("Строк обработано", str(stats["rows_scored"]), icon="🧬")
+        with cols[2]:
+            metric_card("Потрачено", f"{float(stats['revenue']) - float(stats['refunds']):.2f}", icon="💳")
+        with cols[3]:
+            metric_card("Доля ошибок", f"{stats['failure_rate'] * 100:.1f}%", icon="⚠️")
+
         # Последние результаты
         st.markdown(f"#### {ICONS['history']} Последние результаты")
         requests = api.get_request_history()
@@ -1,9 +1,12 @@
+import json
+import time
+import uuid
 from typing import Dict, Any
 
 import requests
 import streamlit as st
 from webview.services.logger import logger
-from webview.core.config import API_TIMEOUT, API_HEALTH_TIMEOUT
+from webview.core.config import API_TIMEOUT, API_HEALTH_TIMEOUT, API_PREDICT_TIMEOUT
 
 
 class APIError(Exception):
@@ -60,12 +63,12 @@ class APIClient:
             raise UnauthorizedError(message, status_code=status, data=data)
         raise APIError(message, status_code=status, data=data)
 
-    def post(self, path: str, payload: dict, timeout: int | None = None) -> dict:
+    def post(self, path: str, payload: dict, timeout: int | None = None, headers: Dict[str, str] | None = None) -> dict:
         """Выполняет POST запрос."""
         url = self.base_url + path
         logger.debug(f"API POST Request: {url}", payload=payload)
         t = timeout or API_TIMEOUT
-        resp = requests.post(url, json=payload, headers=self._headers(), timeout=t)
+        resp = requests.post(url, json=payload, headers={**self._headers(), **(headers or {})}, timeout=t)
         logger.debug(f"API POST Response: {resp.status_code}")
         self._handle_error(resp)
         return resp.json()
@@ -124,25 +127,96 @@ class APIClient:
         return self.get("/api/v1/balance/history")
 
     # === ML Request endpoints ===
+    def _post_idempotent(self, path: str, payload: dict, timeout: int | None = None) -> dict:
+        """
+        POST с заголовком Idempotency-Key: при обрыве соединения или таймауте запрос
+        повторяется один раз с тем же ключом, поэтому сервер не спишет средства дважды.
+        """
+        headers = {"Idempotency-Key": str(uuid.uuid4())}
+        try:
+            return self.post(path, payload, timeout=timeout, headers=headers)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            logger.warning(f"Повтор запроса {path} с тем же ключом идемпотентности: {e}")
+            return self.post(path, payload, timeout=timeout, headers=headers)
+
     def send_task(self, data: list) -> dict:
         """Отправляет задачу в очередь (асинхронно)."""
-        return self.post("/api/v1/requests/send_task", {"data": data})
+        return self._post_idempotent("/api/v1/requests/send_task", {"data": data})
 
     def predict(self, data: list) -> dict:
-        """Отправляет задачу через RPC (синхронно)."""
-        # Динамический таймаут для RPC: базовые 20с + 0.3с на строку (чуть больше, чем в бэкенде)
-        num_rows = len(data) if isinstance(data, list) else 1
-        dynamic_timeout = max(30, 20 + int(num_rows * 0.3))
-        return self.post("/api/v1/requests/predict", {"data": data}, timeout=dynamic_timeout)
+        """
+        Отправляет задачу через RPC (синхронно). Дедлайн выбирает API: если ответ не успевает,
+        запрос передается в очередь и возвращается request_id без поля prediction.
+        """
+        return self._post_idempotent("/api/v1/requests/predict", {"data": data}, timeout=API_PREDICT_TIMEOUT)
+
+    def ingest_file(self, content: bytes, filename: str) -> dict:
+        """
+        Загружает файл с признаками целиком на сервер: разбор, проверка и постановка частей
+        в очередь выполняются в API. Возвращает статус загрузки со счетчиками строк.
+        """
+        url = self.base_url + "/api/v1/requests/ingest"
+        logger.debug(f"API POST Request: {url}", filename=filename, size=len(content))
+        headers = {**self._headers(), "Content-Type": "application/octet-stream"}
+        resp = requests.post(url, params={"filename": filename}, data=content, headers=headers, timeout=API_PREDICT_TIMEOUT)
+        logger.debug(f"API POST Response: {resp.status_code}")
+        self._handle_error(resp)
+        return resp.json()
+
+    def get_ingest_rejects(self, job_id: int) -> bytes:
+        """Получает CSV с отклоненными строками загрузки."""
+        url = self.base_url + f"/api/v1/requests/ingest/{job_id}/rejects"
+        resp = requests.get(url, headers=self._headers(), timeout=API_TIMEOUT)
+        self._handle_error(resp)
+        return resp.content
+
+    def download_results(self, request_id: int, fmt: str = "csv") -> bytes:
+        """Скачивает входные строки запроса вместе с предсказаниями (CSV или Parquet)."""
+        url = self.base_url + f"/api/v1/requests/history/{request_id}/results"
+        resp = requests.get(url, params={"format": fmt}, headers=self._headers(), timeout=API_TIMEOUT)
+        self._handle_error(resp)
+        return resp.content
 
     def get_request_history(self) -> list:
         """Получает историю ML-запросов."""
         return self.get("/api/v1/requests/history")
 
+    def get_request_stats(self) -> dict:
+        """Получает итоговую статистику ML-запросов (предагрегированную на сервере)."""
+        return self.get("/api/v1/requests/stats")
+
     def get_request_details(self, request_id: int) -> dict:
         """Получает детали конкретного запроса."""
         return self.get(f"/api/v1/requests/history/{request_id}")
 
+    def wait_for_task_event(self, request_id: int, timeout: int = 25) -> dict | None:
+        """
+        Ожидает событие о завершении запроса через SSE-поток API.
+        Возвращает событие или None, если за timeout секунд статус не изменился.
+        Таймаут чтения requests срабатывает только при паузе между строками, а сервер
+        шлет keepalive чаще, поэтому общий срок ожидания проверяется отдельно.
+        """
+        url = self.base_url + "/api/v1/requests/events"
+        deadline = time.monotonic() + timeout
+        try:
+            with requests.get(
+                url,
+                params={"request_id": request_id},
+                headers=self._headers(),
+                stream=True,
+                timeout=(API_HEALTH_TIMEOUT, timeout),
+            ) as resp:
+                self._handle_error(resp)
+                for line in resp.iter_lines(decode_unicode=True):
+                    if line and line.startswith("data:"):
+                        return json.loads(line[len("data:"):])
+                    if time.monotonic() >= deadline:
+                        resp.close()
+                        return None
+        except requests.exceptions.ReadTimeout:
+            return None
+        return None
+
     # === Admin endpoints ===
     def get_all_users(self) -> list:
         """Получает список всех пользователей (только для админа)."""
@@ -160,6 +234,10 @@ class APIClient:
         """Получает список всех ML-запросов в системе (только для админа)."""
         return self.get("/api/v1/admin/ml-requests")
 
+    def get_analytics_summary(self) -> dict:
+        """Получает итоговую статистику по всей системе (только для админа)."""
+        return self.get("/api/v1/admin/analytics/summary")
+
     def get_user_ml_requests(self, user_id: int) -> list:
         """Получает историю ML-запросов конкретного пользователя (только для админа)."""
         return self.get(f"/api/v1/admin/users/{user_id}/ml-requests")
@@ -1,8 +1,19 @@
+import json
 import logging
-import sys
-from datetime import datetime
+import os
 import streamlit as st
 
+from common.log_pipeline import setup_logging
+
+# Общий неблокирующий конвейер логов (как в API и воркерах)
+setup_logging(
+    level=os.getenv("LOGGING__LEVEL", "INFO"),
+    fmt=os.getenv("LOGGING__FORMAT", "JSON"),
+    sampling=json.loads(os.getenv("LOGGING__SAMPLING", "{}")),
+    max_length=int(os.getenv("LOGGING__MAX_MESSAGE_LENGTH", "2000")),
+)
+
+
 class CustomLogger:
     """Централизованный логгер для webview."""
 
@@ -10,25 +21,9 @@ class CustomLogger:
         self.logger = logging.getLogger(name)
         self.logger.setLevel(level)
 
-        if not self.logger.handlers:
-            # Формат логов
-            formatter = logging.Formatter(
-                '%(asctime)s | %(levelname)-8s | %(name)s | %(message)s',
-                datefmt='%Y-%m-%d %H:%M:%S'
-            )
-
-            # Вывод в консоль
-            handler = logging.StreamHandler(sys.stdout)
-            handler.setFormatter(formatter)
-            self.logger.addHandler(handler)
-
     def _log(self, level, message, show_toast=False, **kwargs):
-        """Внутренний метод для логирования."""
-        msg = str(message)
-        if kwargs:
-            msg += f" | {kwargs}"
-
-        self.logger.log(level, msg)
+        """Внутренний метод для логирования. Дополнительные поля уходят в структурированную запись."""
+        self.logger.log(level, str(message), extra={"context": kwargs} if kwargs else None)
 
         if show_toast:
             if level >= logging.ERROR: